@@ -49,6 +49,22 @@ def create_app(test_config=None):
         # 這會使用已設定好的連線池來建立表格
         database.enhanced_init_db()
         print("資料庫準備就緒。")
+
+        # 向量模型登記表還是空的時登記預設模型（請求路徑只讀取登記表）
+        from .services import embedding_service
+        embedding_service.register_default_model()
+
+        # 知識點內容被修改後，在背景重新生成向量與關聯
+        from .services import embedding_refresh
+        embedding_refresh.start_refresh_worker()
+
+        # 向量化統計計數器的增量彙整與定期校正
+        from .services import stats_service
+        stats_service.start_stats_worker()
+
+        # 即將到期的知識點在背景預先生成複習題
+        from .services import review_question_store
+        review_question_store.start_variant_worker()
     except Exception as e:
         print(f"資料庫初始化失敗: {e}")
         # 在生產環境中，您可能會希望在此處停止應用程式或採取其他措施
@@ -4,6 +4,13 @@ from flask import Blueprint, render_template, request, jsonify, redirect, url_fo
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.services import embedding_service as embedding
 from app.services import database as db
+from app.services import clustering_service
+from app.services import graph_analytics
+from app.services import graph_layout
+from app.services import job_runner
+from app.services import review_question_store
+from app.services import session_prefetch
+from app.services.embedding_pipeline import count_pending_points
 import logging
 
 # 設定日誌
@@ -99,19 +106,13 @@ def knowledge_points_list():
 def batch_processing():
     """批次處理管理界面"""
     try:
-        # 獲取待處理的知識點數量
-        conn = db.get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT COUNT(*) FROM knowledge_points 
-                WHERE embedding_vector IS NULL AND is_archived = FALSE
-            """)
-            pending_count = cursor.fetchone()[0]
-        
-        conn.close()
+        # 獲取待處理的知識點數量與最近一次回填工作（頁面重新開啟時接續顯示進度）
+        pending_count = count_pending_points()
+        recent_jobs = job_runner.list_jobs(job_type='embedding_backfill', limit=1)
         
         return render_template('admin/batch_processing.html',
                              pending_count=pending_count,
+                             latest_job=recent_jobs[0] if recent_jobs else None,
                              page_title="批次處理")
                              
     except Exception as e:
@@ -134,23 +135,81 @@ def network_visualization():
         logger.error(f"載入網絡視覺化頁面時發生錯誤: {e}")
         return render_template('admin/error.html', error=str(e)), 500
 
+def _submit_job_response(job_type, params):
+    """提交背景工作並轉成 API 回應"""
+    try:
+        job = job_runner.submit_job(job_type, params, user_id=get_jwt_identity())
+        return jsonify({"status": "accepted", "job": job}), 202
+    except job_runner.JobConflictError as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"提交背景工作時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @admin_bp.route('/admin/api/batch-process', methods=['POST'])
 @jwt_required()
 def api_batch_process():
-    """啟動批次處理API"""
-    try:
+    """啟動批次處理API（提交背景工作，立即回傳工作ID）"""
+    data = request.get_json() or {}
+    return _submit_job_response('embedding_backfill', {'limit': data.get('limit')})
+
+@admin_bp.route('/admin/api/jobs', methods=['GET', 'POST'])
+@jwt_required()
+def api_jobs():
+    """列出最近的背景工作，或提交新工作（body: {"job_type", "params"}）"""
+    if request.method == 'POST':
         data = request.get_json() or {}
-        limit = data.get('limit', 100)
-        
-        result = embedding.batch_process_knowledge_points(limit=limit)
-        
-        return jsonify({
-            "status": "success",
-            "result": result
-        })
-        
+        return _submit_job_response(data.get('job_type'), data.get('params') or {})
+    try:
+        jobs = job_runner.list_jobs(
+            job_type=request.args.get('job_type'),
+            limit=min(request.args.get('limit', 20, type=int), 100)
+        )
+        return jsonify({"jobs": jobs})
+    except Exception as e:
+        logger.error(f"列出背景工作時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@admin_bp.route('/admin/api/jobs/<int:job_id>')
+@jwt_required()
+def api_job_status(job_id):
+    """背景工作的進度（processed/succeeded/failed、items_per_second、eta_seconds）"""
+    try:
+        job = job_runner.get_job(job_id)
+        if not job:
+            return jsonify({"error": "工作不存在"}), 404
+        return jsonify({"job": job})
+    except Exception as e:
+        logger.error(f"獲取背景工作 {job_id} 時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@admin_bp.route('/admin/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@jwt_required()
+def api_cancel_job(job_id):
+    """取消背景工作"""
+    try:
+        job = job_runner.cancel_job(job_id)
+        if not job:
+            return jsonify({"error": "工作不存在或已結束"}), 409
+        return jsonify({"job": job})
+    except Exception as e:
+        logger.error(f"取消背景工作 {job_id} 時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@admin_bp.route('/admin/api/jobs/<int:job_id>/resume', methods=['POST'])
+@jwt_required()
+def api_resume_job(job_id):
+    """從檢查點續跑已取消、失敗或中斷的背景工作"""
+    try:
+        return jsonify({"job": job_runner.resume_job(job_id)}), 202
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except job_runner.JobConflictError as e:
+        return jsonify({"error": str(e)}), 409
     except Exception as e:
-        logger.error(f"批次處理API錯誤: {e}")
+        logger.error(f"續跑背景工作 {job_id} 時發生錯誤: {e}")
         return jsonify({"error": str(e)}), 500
 
 @admin_bp.route('/admin/api/regenerate-point/<int:point_id>', methods=['POST'])
@@ -185,75 +244,94 @@ def api_regenerate_point(point_id):
 @admin_bp.route('/admin/api/network-data')
 @jwt_required()
 def api_network_data():
-    """獲取網絡視覺化資料API"""
+    """
+    獲取網絡視覺化資料API
+    
+    節點座標由伺服器端預先計算（graph_layout），依 x_min/y_min/x_max/y_max 視窗範圍查詢，
+    範圍內超過 limit 個節點時只回傳加權度數最高的節點。
+    圖有變化時布局在背景工作中更新，期間 stats.stale 為 True，回傳上一版的座標。
+    """
     try:
-        limit = request.args.get('limit', 50, type=int)
+        limit = min(request.args.get('limit', 300, type=int), 2000)
         min_similarity = request.args.get('min_similarity', 0.8, type=float)
         
-        conn = db.get_db_connection()
-        with conn.cursor() as cursor:
-            # 獲取節點資料
-            cursor.execute("""
-                SELECT id, correct_phrase, key_point_summary, category, subcategory
-                FROM knowledge_points 
-                WHERE embedding_vector IS NOT NULL AND is_archived = FALSE
-                ORDER BY id DESC
-                LIMIT %s
-            """, (limit,))
-            
-            nodes_data = cursor.fetchall()
-            
-            # 獲取關聯資料
-            if nodes_data:
-                node_ids = [str(node[0]) for node in nodes_data]
-                placeholders = ','.join(['%s'] * len(node_ids))
-                
-                cursor.execute(f"""
-                    SELECT kl.source_point_id, kl.target_point_id, kl.similarity_score
-                    FROM knowledge_links kl
-                    WHERE kl.source_point_id IN ({placeholders})
-                        AND kl.target_point_id IN ({placeholders})
-                        AND kl.similarity_score >= %s
-                        AND kl.is_active = TRUE
-                    ORDER BY kl.similarity_score DESC
-                """, node_ids + node_ids + [min_similarity])
-                
-                links_data = cursor.fetchall()
-            else:
-                links_data = []
-        
-        conn.close()
-        
-        # 格式化節點資料
-        nodes = []
-        for node in nodes_data:
-            nodes.append({
-                'id': node[0],
-                'label': node[1] or f"Point {node[0]}",
-                'title': node[2] or "無摘要",
-                'group': node[3] or "未分類",
-                'subcategory': node[4] or "未分類"
-            })
-        
-        # 格式化連結資料
-        links = []
-        for link in links_data:
-            links.append({
-                'source': link[0],
-                'target': link[1],
-                'weight': float(link[2])
-            })
-        
-        return jsonify({
-            "nodes": nodes,
-            "links": links,
-            "stats": {
-                "node_count": len(nodes),
-                "link_count": len(links),
-                "min_similarity": min_similarity
-            }
-        })
+        data = graph_layout.query_viewport(
+            x_min=request.args.get('x_min', type=float),
+            y_min=request.args.get('y_min', type=float),
+            x_max=request.args.get('x_max', type=float),
+            y_max=request.args.get('y_max', type=float),
+            max_nodes=limit,
+            min_similarity=min_similarity
+        )
+        return jsonify(data)
         
     except Exception as e:
         logger.error(f"獲取網絡資料時發生錯誤: {e}")
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+@admin_bp.route('/admin/api/clusters')
+@jwt_required()
+def api_clusters():
+    """所有用戶知識點的主題群組摘要"""
+    try:
+        clusters = clustering_service.get_cluster_summaries()
+        return jsonify({"cluster_count": len(clusters), "clusters": clusters})
+    except Exception as e:
+        logger.error(f"獲取主題群組時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@admin_bp.route('/admin/api/clusters/<int:cluster_id>/points')
+@jwt_required()
+def api_cluster_points(cluster_id):
+    """列出主題群組中所有用戶的知識點"""
+    try:
+        limit = request.args.get('limit', 50, type=int)
+        return jsonify({"cluster_id": cluster_id, "points": clustering_service.get_cluster_points(cluster_id, limit=limit)})
+    except Exception as e:
+        logger.error(f"獲取群組 {cluster_id} 的知識點時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@admin_bp.route('/admin/api/graph/hubs')
+@jwt_required()
+def api_graph_hubs():
+    """所有用戶知識點網絡中的樞紐（weak=1 改列出熟練度低的弱點樞紐）"""
+    try:
+        hubs = graph_analytics.get_hub_points(
+            limit=min(request.args.get('limit', 20, type=int), 200),
+            weak_only=request.args.get('weak') in ('1', 'true')
+        )
+        return jsonify({"count": len(hubs), "hubs": hubs})
+    except Exception as e:
+        logger.error(f"獲取網絡樞紐時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@admin_bp.route('/admin/api/graph/metrics/<int:point_id>')
+@jwt_required()
+def api_graph_metrics(point_id):
+    """任一知識點的圖指標"""
+    try:
+        metrics = graph_analytics.get_point_metrics(point_id)
+        if metrics is None:
+            return jsonify({"error": f"知識點 {point_id} 沒有圖指標"}), 404
+        return jsonify({"metrics": metrics})
+    except Exception as e:
+        logger.error(f"獲取知識點 {point_id} 的圖指標時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@admin_bp.route('/admin/api/review-questions/metrics')
+@jwt_required()
+def api_review_question_metrics():
+    """預先生成複習題的使用統計（本程序的快取命中率、即時生成與淘汰的題數）"""
+    return jsonify({"metrics": review_question_store.get_metrics()})
+
+@admin_bp.route('/admin/api/session-prefetch/metrics')
+@jwt_required()
+def api_session_prefetch_metrics():
+    """下一回合題目預先生成的統計（本程序的命中率與浪費的生成數）"""
+    return jsonify({"metrics": session_prefetch.get_metrics()})
+
+@admin_bp.route('/admin/api/network-layout/rebuild', methods=['POST'])
+@jwt_required()
+def api_rebuild_network_layout():
+    """完整重新計算網絡布局（提交背景工作，立即回傳工作ID）"""
+    return _submit_job_response('network_layout_rebuild', {'force_full': True})
\ No newline at end of file
@@ -3,6 +3,14 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request, jwt_required
 from app.services import embedding_service as embedding
+from app.services import hybrid_search
+from app.services import clustering_service
+from app.services import graph_analytics
+from app.services import neighborhood_service
+from app.services import dedup_service
+from app.services import embedding_migration
+from app.services import job_runner
+from app.services.embedding_cache import get_embedding_cache
 from app.services import database as db
 import logging
 
@@ -22,12 +30,20 @@ embedding_bp = Blueprint('embedding_bp', __name__)
 
 @embedding_bp.route("/embedding/statistics", methods=['GET'])
 def get_embedding_statistics_endpoint():
-    """獲取向量化功能的統計資訊"""
+    """
+    獲取向量化功能的統計資訊
+    
+    參數 scope=user 時另外回傳目前登入用戶自己的統計（user_statistics）。
+    """
     try:
         stats = embedding.get_embedding_statistics()
+        user_id = get_current_user_id() if request.args.get('scope') == 'user' else None
         return jsonify({
             "status": "success",
-            "statistics": stats
+            "statistics": stats,
+            "user_statistics": embedding.get_embedding_statistics(user_id) if user_id else None,
+            "query_cache": get_embedding_cache().stats(),
+            "model": embedding_migration.get_migration_status()
         })
     except Exception as e:
         logger.error(f"獲取向量統計資訊時發生錯誤: {e}")
@@ -36,23 +52,42 @@ def get_embedding_statistics_endpoint():
 @embedding_bp.route("/embedding/batch_process", methods=['POST'])
 @jwt_required()
 def batch_process_embeddings_endpoint():
-    """批次處理知識點向量生成（需要認證）"""
+    """
+    批次處理知識點向量生成（需要認證）
+    
+    提交背景工作後立即回傳 202 與工作ID，進度以 GET /embedding/batch_process/<job_id> 查詢。
+    """
     try:
         request_data = request.get_json() or {}
         limit = request_data.get('limit', 100)  # 預設處理100個
         
-        logger.info(f"開始批次處理向量，限制: {limit}")
+        logger.info(f"提交批次處理向量工作，限制: {limit}")
         
-        result = embedding.batch_process_knowledge_points(limit=limit)
+        job = job_runner.submit_job('embedding_backfill', {'limit': limit}, user_id=get_jwt_identity())
         
         return jsonify({
-            "status": "success",
-            "message": f"批次處理完成",
-            "result": result
-        })
+            "status": "accepted",
+            "message": "批次處理已在背景開始",
+            "job": job
+        }), 202
         
+    except job_runner.JobConflictError as e:
+        return jsonify({"error": str(e)}), 409
     except Exception as e:
-        logger.error(f"批次處理向量時發生錯誤: {e}")
+        logger.error(f"提交批次處理工作時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@embedding_bp.route("/embedding/batch_process/<int:job_id>", methods=['GET'])
+@jwt_required()
+def batch_process_status_endpoint(job_id):
+    """查詢批次處理工作的進度"""
+    try:
+        job = job_runner.get_job(job_id)
+        if not job or job['job_type'] != 'embedding_backfill':
+            return jsonify({"error": "工作不存在"}), 404
+        return jsonify({"status": "success", "job": job})
+    except Exception as e:
+        logger.error(f"查詢批次處理工作時發生錯誤: {e}")
         return jsonify({"error": str(e)}), 500
 
 @embedding_bp.route("/embedding/regenerate_point/<int:point_id>", methods=['POST'])
@@ -85,8 +120,9 @@ def regenerate_point_embedding_endpoint(point_id):
         return jsonify({"error": str(e)}), 500
 
 @embedding_bp.route("/embedding/find_similar/<int:point_id>", methods=['GET'])
+@jwt_required()
 def find_similar_points_endpoint(point_id):
-    """尋找與指定知識點相似的其他知識點"""
+    """尋找與指定知識點相似的其他知識點（只限目前用戶自己的知識點）"""
     try:
         threshold = float(request.args.get('threshold', 0.75))
         max_results = int(request.args.get('max_results', 10))
@@ -94,7 +130,8 @@ def find_similar_points_endpoint(point_id):
         similar_points = embedding.find_similar_knowledge_points(
             point_id, 
             similarity_threshold=threshold,
-            max_results=max_results
+            max_results=max_results,
+            user_id=get_jwt_identity()
         )
         
         return jsonify({
@@ -142,23 +179,23 @@ def get_knowledge_links_endpoint(point_id):
         outbound_formatted = []
         for link in outbound_links:
             outbound_formatted.append({
-                'linked_point_id': link[0],
-                'similarity_score': float(link[1]),
-                'link_type': link[2],
-                'created_at': link[3].isoformat() if link[3] else None,
-                'correct_phrase': link[4],
-                'key_point_summary': link[5]
+                'linked_point_id': link['target_point_id'],
+                'similarity_score': float(link['similarity_score']),
+                'link_type': link['link_type'],
+                'created_at': link['created_at'].isoformat() if link['created_at'] else None,
+                'correct_phrase': link['correct_phrase'],
+                'key_point_summary': link['key_point_summary']
             })
         
         inbound_formatted = []
         for link in inbound_links:
             inbound_formatted.append({
-                'linked_point_id': link[0],
-                'similarity_score': float(link[1]),
-                'link_type': link[2],
-                'created_at': link[3].isoformat() if link[3] else None,
-                'correct_phrase': link[4],
-                'key_point_summary': link[5]
+                'linked_point_id': link['source_point_id'],
+                'similarity_score': float(link['similarity_score']),
+                'link_type': link['link_type'],
+                'created_at': link['created_at'].isoformat() if link['created_at'] else None,
+                'correct_phrase': link['correct_phrase'],
+                'key_point_summary': link['key_point_summary']
             })
         
         return jsonify({
@@ -173,6 +210,41 @@ def get_knowledge_links_endpoint(point_id):
         logger.error(f"獲取知識點關聯時發生錯誤: {e}")
         return jsonify({"error": str(e)}), 500
 
+@embedding_bp.route("/embedding/neighborhood", methods=['GET'])
+@jwt_required()
+def get_neighborhood_endpoint():
+    """
+    獲取目前用戶一個或多個知識點周圍 k 跳內的知識點與關聯（只擴展到自己的知識點）
+    
+    參數: seeds（逗號分隔的知識點ID）、k（預設 2）、threshold、decay、max_nodes。
+    """
+    try:
+        seeds = [int(value) for value in request.args.get('seeds', '').split(',') if value.strip()]
+        if not seeds:
+            return jsonify({"error": "需要提供 seeds（逗號分隔的知識點ID）"}), 400
+        
+        neighborhood = neighborhood_service.get_neighborhood(
+            seeds,
+            k=int(request.args.get('k', 2)),
+            threshold=float(request.args.get('threshold', 0.0)),
+            decay=float(request.args.get('decay', neighborhood_service.DEFAULT_DECAY)),
+            max_nodes=min(int(request.args.get('max_nodes', 100)), 500),
+            user_id=get_jwt_identity()
+        )
+        return jsonify({
+            "status": "success",
+            "seeds": seeds,
+            "nodes": neighborhood['nodes'],
+            "links": neighborhood['links'],
+            "cached": neighborhood['cached']
+        })
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"獲取知識點鄰域時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @embedding_bp.route("/embedding/create_manual_link", methods=['POST'])
 @jwt_required()
 def create_manual_link_endpoint():
@@ -263,9 +335,35 @@ def cleanup_links_endpoint():
         logger.error(f"清理關聯時發生錯誤: {e}")
         return jsonify({"error": str(e)}), 500
 
+@embedding_bp.route("/embedding/merge_duplicates", methods=['POST'])
+@jwt_required()
+def merge_duplicates_endpoint():
+    """合併目前用戶重複的知識點（預設 dry_run=true，只列出重複群組；傳入 dry_run=false 才會合併並刪除）"""
+    try:
+        request_data = request.get_json() or {}
+        result = dedup_service.merge_duplicate_points(
+            user_id=int(get_jwt_identity()),
+            similarity_threshold=float(request_data.get('threshold', dedup_service.DEDUP_SIMILARITY_THRESHOLD)),
+            dry_run=request_data.get('dry_run', True) not in (False, 'false', '0', 0)
+        )
+        
+        return jsonify({
+            "status": "success",
+            "message": f"找到 {result['groups']} 組重複知識點，合併了 {result['merged']} 個",
+            "result": result
+        })
+        
+    except Exception as e:
+        logger.error(f"合併重複知識點時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @embedding_bp.route("/embedding/search_by_text", methods=['POST'])
 def search_knowledge_by_text_endpoint():
     """使用文本搜尋相似的知識點"""
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({"error": "訪客模式無法搜尋知識點，請先登入。"}), 403
+    
     try:
         data = request.get_json()
         if not data or 'text' not in data:
@@ -274,47 +372,156 @@ def search_knowledge_by_text_endpoint():
         search_text = data['text']
         threshold = data.get('threshold', 0.7)
         max_results = data.get('max_results', 10)
+        mode = data.get('mode', 'hybrid')
         
-        # 生成搜尋文本的向量
-        search_embedding = embedding.generate_embedding(search_text)
-        
-        # 在資料庫中搜尋相似向量
-        conn = db.get_db_connection()
-        with conn.cursor() as cursor:
-            search_vector_str = '[' + ','.join(map(str, search_embedding.tolist())) + ']'
-            
-            cursor.execute("""
-                SELECT id, correct_phrase, key_point_summary, 
-                       1 - (embedding_vector <=> %s::vector) AS similarity
-                FROM knowledge_points 
-                WHERE embedding_vector IS NOT NULL 
-                  AND is_archived = FALSE
-                  AND (1 - (embedding_vector <=> %s::vector)) >= %s
-                ORDER BY embedding_vector <=> %s::vector
-                LIMIT %s
-            """, (search_vector_str, search_vector_str, threshold, search_vector_str, max_results))
-            
-            results = cursor.fetchall()
-        
-        conn.close()
-        
-        # 格式化結果
-        formatted_results = []
-        for result in results:
-            formatted_results.append({
-                'point_id': result[0],
-                'correct_phrase': result[1],
-                'key_point_summary': result[2],
-                'similarity_score': float(result[3])
-            })
+        if mode == 'vector':
+            # 只搜尋目前用戶的知識點（沒有 pgvector 時自動改用程序內索引）
+            search_embedding = embedding.generate_embedding(search_text)
+            strategy = 'vector'
+            formatted_results = embedding.search_knowledge_points_by_vector(
+                search_embedding,
+                similarity_threshold=threshold,
+                max_results=max_results,
+                user_id=user_id
+            )
+        else:
+            # 文字索引 + 向量搜尋；片語完全相符時不需要模型推論
+            search_result = hybrid_search.hybrid_search(
+                search_text,
+                user_id,
+                similarity_threshold=threshold,
+                max_results=max_results
+            )
+            strategy = search_result['strategy']
+            formatted_results = search_result['results']
         
         return jsonify({
             "status": "success",
             "search_text": search_text,
             "threshold": threshold,
+            "strategy": strategy,
             "results": formatted_results
         })
         
     except Exception as e:
         logger.error(f"文本搜尋時發生錯誤: {e}")
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+@embedding_bp.route("/embedding/clusters", methods=['GET'])
+@jwt_required()
+def get_clusters_endpoint():
+    """獲取目前用戶知識點的主題群組摘要（所有用戶的統計見 /admin/api/clusters）"""
+    try:
+        clusters = clustering_service.get_cluster_summaries(user_id=get_jwt_identity())
+        return jsonify({
+            "status": "success",
+            "cluster_count": len(clusters),
+            "clusters": clusters
+        })
+        
+    except Exception as e:
+        logger.error(f"獲取主題群組時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@embedding_bp.route("/embedding/clusters/<int:cluster_id>/points", methods=['GET'])
+@jwt_required()
+def get_cluster_points_endpoint(cluster_id):
+    """列出主題群組中目前用戶的知識點"""
+    try:
+        limit = int(request.args.get('limit', 50))
+        points = clustering_service.get_cluster_points(
+            cluster_id, user_id=get_jwt_identity(), limit=limit
+        )
+        return jsonify({
+            "status": "success",
+            "cluster_id": cluster_id,
+            "points": points
+        })
+        
+    except Exception as e:
+        logger.error(f"獲取群組 {cluster_id} 的知識點時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@embedding_bp.route("/embedding/clusters/rebuild", methods=['POST'])
+@jwt_required()
+def rebuild_clusters_endpoint():
+    """重新對所有知識點分群（提交背景工作，立即回傳工作ID；進度見 /admin/api/jobs/<id>）"""
+    try:
+        request_data = request.get_json() or {}
+        n_clusters = request_data.get('n_clusters')
+        params = {'n_clusters': int(n_clusters)} if n_clusters else {}
+        job = job_runner.submit_job('knowledge_clustering', params, user_id=get_jwt_identity())
+        
+        return jsonify({
+            "status": "accepted",
+            "message": "分群已在背景開始",
+            "job": job
+        }), 202
+        
+    except (TypeError, ValueError):
+        return jsonify({"error": "n_clusters 必須是整數"}), 400
+    except job_runner.JobConflictError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        logger.error(f"提交分群工作時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@embedding_bp.route("/embedding/graph/hubs", methods=['GET'])
+@jwt_required()
+def get_graph_hubs_endpoint():
+    """
+    目前用戶知識點網絡中的樞紐（依預先計算的 PageRank 排序）
+    
+    參數 weak=1 時改列出 PageRank 高但熟練度低的弱點樞紐。
+    """
+    try:
+        hubs = graph_analytics.get_hub_points(
+            user_id=get_jwt_identity(),
+            limit=min(int(request.args.get('limit', 20)), 200),
+            weak_only=request.args.get('weak') in ('1', 'true')
+        )
+        return jsonify({
+            "status": "success",
+            "count": len(hubs),
+            "hubs": hubs
+        })
+        
+    except Exception as e:
+        logger.error(f"獲取網絡樞紐時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@embedding_bp.route("/embedding/graph/metrics/<int:point_id>", methods=['GET'])
+@jwt_required()
+def get_graph_metrics_endpoint(point_id):
+    """目前用戶單一知識點的圖指標（連通分量、度數、PageRank、介數中心性）"""
+    try:
+        metrics = graph_analytics.get_point_metrics(point_id, user_id=get_jwt_identity())
+        if metrics is None:
+            return jsonify({"error": f"知識點 {point_id} 沒有圖指標（不存在、沒有有效關聯或尚未分析）"}), 404
+        return jsonify({
+            "status": "success",
+            "metrics": metrics
+        })
+        
+    except Exception as e:
+        logger.error(f"獲取知識點 {point_id} 的圖指標時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@embedding_bp.route("/embedding/graph/analyze", methods=['POST'])
+@jwt_required()
+def analyze_graph_endpoint():
+    """重新計算知識點網絡的圖指標（提交背景工作，立即回傳工作ID；進度見 /admin/api/jobs/<id>）"""
+    try:
+        job = job_runner.submit_job('graph_analytics', {}, user_id=get_jwt_identity())
+        
+        return jsonify({
+            "status": "accepted",
+            "message": "網絡分析已在背景開始",
+            "job": job
+        }), 202
+        
+    except job_runner.JobConflictError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        logger.error(f"提交網絡分析工作時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
@@ -4,6 +4,9 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
 from app.services import database as db
 from app.services import ai_service as ai
+from app.services import review_question_store
+from app.services import session_prefetch
+from app.services import session_store
 import random
 
 session_bp = Blueprint('session_bp', __name__)
@@ -41,6 +44,7 @@ def start_session_endpoint():
     print(f"[API] App 請求參數: 複習={desired_review_count}, 全新={desired_new_count}, 難度={difficulty}, 長度={length}, 出題模型={generation_model}")
     
     questions_to_ask = []
+    review_phrases = {}
 
     if desired_review_count > 0 and user_id:  # 只有已認證用戶才有複習題
         due_knowledge_points = db.get_due_knowledge_points_for_user(user_id, desired_review_count)
@@ -48,22 +52,25 @@ def start_session_endpoint():
         print(f"[API] 從資料庫中找到 {actual_num_review} 題到期的複習題。")
         
         if actual_num_review > 0:
-            weak_points_for_prompt = [
-                f"- 錯誤分類: {p['category']} -> {p['subcategory']}\n  正確用法: \"{p['correct_phrase']}\"\n  核心觀念: {p['explanation']}"
-                for p in due_knowledge_points
-            ]
-            weak_points_str = "\n\n".join(weak_points_for_prompt)
-            # 【修改】傳入模型名稱
-            review_questions = ai.generate_question_batch(weak_points_str, actual_num_review, model_name=generation_model)
-            if review_questions:
-                for q, point in zip(review_questions, due_knowledge_points):
-                    if isinstance(q, dict):
-                        q['type'] = 'review'
-                        q['knowledge_point_id'] = point['id']
-                        q['mastery_level'] = point['mastery_level']
-                questions_to_ask.extend(review_questions)
-
-    if desired_new_count > 0:
+            # 優先使用預先生成的題目（輪流出題），只有沒有題目的知識點才即時生成
+            review_questions = review_question_store.get_review_questions(due_knowledge_points, model_name=generation_model)
+            questions_to_ask.extend(review_questions)
+            review_phrases = {point['id']: point['correct_phrase'] for point in due_knowledge_points}
+
+    # 上一回合結束時可能已在背景生成好相同參數的全新挑戰題
+    prefetched_questions = None
+    if user_id:
+        prefetched_questions = session_prefetch.take_prefetched(
+            user_id, session_prefetch.session_params(desired_new_count, difficulty, length, generation_model)
+        )
+
+    if prefetched_questions is not None:
+        print(f"[API] 使用預先生成的 {len(prefetched_questions)} 個全新挑戰。")
+        for q in prefetched_questions:
+            if isinstance(q, dict):
+                q['type'] = 'new'
+        questions_to_ask.extend(prefetched_questions)
+    elif desired_new_count > 0:
         print(f"[API] 準備生成 {desired_new_count} 個全新挑戰...")
         # 【修改】傳入模型名稱
         new_questions = ai.generate_new_question_batch(desired_new_count, difficulty, length, model_name=generation_model)
@@ -78,8 +85,16 @@ def start_session_endpoint():
         return jsonify({"questions": []})
         
     random.shuffle(questions_to_ask)
+
+    # 題目、知識點與片語保存在伺服器端，作答時以 session_id + question_id 對應
+    session_id = None
+    try:
+        session_id = session_store.create_session(user_id, questions_to_ask, review_phrases)
+    except Exception as e:
+        print(f"[API] 建立學習回合失敗，改用舊版作答流程: {e}")
+
     print(f"[API] 已成功生成 {len(questions_to_ask)} 題，準備回傳給 App。")
-    return jsonify({"questions": questions_to_ask})
+    return jsonify({"questions": questions_to_ask, "session_id": session_id})
 
 @session_bp.route("/submit_answer", methods=['POST'])
 def submit_answer_endpoint():
@@ -104,35 +119,129 @@ def submit_answer_endpoint():
     if not question_data or user_answer is None:
         return jsonify({"error": "請求資料不完整，需要 'question_data' 和 'user_answer'。"}), 400
 
-    sentence = question_data.get('new_sentence', '（題目獲取失敗）')
-    hint_text = question_data.get('hint_text') 
-
-    review_concept_to_check = None
-    if question_data.get('type') == 'review':
+    # 新版客戶端：題目、知識點與片語以伺服器保存的為準，不需要額外查詢，也不信任客戶端回傳的欄位
+    session_id = data.get('session_id')
+    question_id = data.get('question_id', question_data.get('question_id'))
+    stored_question = None
+    if session_id:
+        if question_id is None:
+            return jsonify({"error": "帶有 session_id 時需要 'question_id'。"}), 400
         try:
-            point_id_to_check = int(question_data.get('knowledge_point_id'))
-            review_concept_to_check = db.get_knowledge_point_phrase(point_id_to_check)
-        except (TypeError, ValueError):
-            print(f"[API] 警告：收到的 knowledge_point_id 無效。")
-            pass
+            stored_question = session_store.get_question(session_id, question_id, user_id)
+        except Exception as e:
+            print(f"[API] 讀取學習回合失敗: {e}")
+            return jsonify({"error": "讀取學習回合失敗，請稍後再試。"}), 500
+        if stored_question is None:
+            # 帶了回合卻找不到（過期、不屬於目前用戶或題號無效）時不改用舊版流程，避免以客戶端的資料計算熟練度
+            print(f"[API] 學習回合 {session_id} 不存在或已過期。")
+            return jsonify({"error": "學習回合不存在或已過期，請重新開始學習。"}), 410
+
+    if stored_question is not None:
+        sentence = stored_question.get('new_sentence') or '（題目獲取失敗）'
+        hint_text = stored_question.get('hint_text')
+        review_concept_to_check = stored_question.get('phrase') if stored_question.get('type') == 'review' else None
+    else:
+        sentence = question_data.get('new_sentence', '（題目獲取失敗）')
+        hint_text = question_data.get('hint_text') 
+
+        # 舊版客戶端：只有登入的用戶能以自己的知識點作為複習題（訪客只批改，不更新熟練度）
+        review_concept_to_check = None
+        if question_data.get('type') == 'review' and user_id:
+            try:
+                point_id_to_check = int(question_data.get('knowledge_point_id'))
+                review_concept_to_check = db.get_knowledge_point_phrase(point_id_to_check, user_id=user_id)
+            except (TypeError, ValueError):
+                print(f"[API] 警告：收到的 knowledge_point_id 無效。")
+                pass
 
     # 將 hint_text 和模型名稱傳遞給批改函式
     feedback_data = ai.get_tutor_feedback(sentence, user_answer, review_context=review_concept_to_check, hint_text=hint_text, model_name=grading_model)
+    mastered = bool(review_concept_to_check and feedback_data.get('did_master_review_concept'))
+    event = {'question_type': 'review', 'chinese_sentence': sentence, 'user_answer': user_answer}
 
     # 對於複習題，如果答對了核心觀念，我們仍然立即更新其熟練度。
     # 這與「是否要將新錯誤加入知識庫」是兩件獨立的事。
-    if review_concept_to_check and feedback_data.get('did_master_review_concept'):
+    is_last_question = bool(data.get('is_last_question'))
+    if stored_question is not None:
+        # 標記作答與更新熟練度在同一個交易中完成；同一題只計算一次
+        try:
+            progress = session_store.record_answer(session_id, question_id, user_id, mastered, event=event)
+            if mastered:
+                print(f"[API] 核心觀念 '{review_concept_to_check}' 複習成功！")
+            is_last_question = is_last_question or progress['completed']
+        except Exception as e:
+            print(f"[API] 記錄作答失敗: {e}")
+    elif mastered:
         print(f"[API] 核心觀念 '{review_concept_to_check}' 複習成功！")
-        point_id = question_data.get('knowledge_point_id')
-        mastery = question_data.get('mastery_level')
-        if point_id is not None and mastery is not None:
-            db.update_knowledge_point_mastery(point_id, mastery)
+        # 只會是登入用戶自己的知識點；熟練度依資料庫目前的狀態計算，不使用客戶端回傳的 mastery_level
+        db.update_knowledge_point_mastery(point_id_to_check, user_id=user_id, event=event)
     
     # 【核心修改】：移除 db.add_mistake(...) 這一行，不再自動儲存錯誤。
     # 完整的 feedback_data 將直接回傳給前端，由使用者決定如何處理。
     
+    # 回合的最後一題：在背景預先生成下一回合的題目
+    if user_id and is_last_question:
+        try:
+            status = session_prefetch.start_prefetch(user_id)
+            print(f"[API] 下一回合題目預先生成: {status}")
+        except Exception as e:
+            print(f"[API] 預先生成下一回合題目失敗: {e}")
+    
     return jsonify(feedback_data)
 
+@session_bp.route("/prefetch", methods=['POST'])
+@jwt_required()
+def prefetch_next_session_endpoint():
+    """
+    客戶端提示即將開始下一回合：在背景預先生成題目。
+    body（可省略，省略時沿用最近一次 start_session 的參數）: {"num_new", "difficulty", "length", "generation_model"}
+    """
+    user_id = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    params = None
+    if data:
+        try:
+            params = session_prefetch.session_params(
+                data.get('num_new', 2), data.get('difficulty', 3), data.get('length', 'medium'), data.get('generation_model')
+            )
+        except (TypeError, ValueError):
+            return jsonify({"error": "num_new 與 difficulty 必須是整數。"}), 400
+
+    try:
+        status = session_prefetch.start_prefetch(user_id, params)
+        return jsonify({"status": status}), 202 if status == 'started' else 200
+    except Exception as e:
+        print(f"[API] 預先生成下一回合題目時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@session_bp.route("/rebalance_backlog", methods=['POST'])
+@jwt_required()
+def rebalance_backlog_endpoint():
+    """
+    把目前用戶積壓的到期知識點分散到接下來的幾天（每天最多 daily_cap 個，逾期越久的越先複習）。
+    body（可省略）: {"daily_cap": 30, "dry_run": false}
+    """
+    from app.services import backlog_rebalancer
+
+    user_id = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    try:
+        daily_cap = int(data.get('daily_cap') or backlog_rebalancer.REVIEW_DAILY_CAP)
+        if daily_cap <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({"error": "daily_cap 必須是正整數。"}), 400
+
+    print(f"\n[API] 收到請求：重新排程用戶 {user_id} 的複習積壓（每天最多 {daily_cap} 個）...")
+    try:
+        result = backlog_rebalancer.rebalance_user_backlog(
+            int(user_id), daily_cap=daily_cap, dry_run=bool(data.get('dry_run'))
+        )
+        return jsonify(result)
+    except Exception as e:
+        print(f"[API] 重新排程複習積壓時發生錯誤: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @session_bp.route("/get_smart_hint", methods=['POST'])
 def get_smart_hint_endpoint():
     """
@@ -192,6 +192,66 @@ def generate_question_batch(weak_points_str, num_questions, model_name=None):
         print(f"生成複習題時發生錯誤: {e}")
         return []
 
+def generate_review_question_variants(points, variants_per_point=1, model_name=None):
+    """
+    為多個知識點各生成數題不同的複習題，依知識點 ID 對應（不依回傳順序）。
+
+    Args:
+        points (list): 知識點字典，需要 id、category、subcategory、correct_phrase、explanation
+        variants_per_point (int): 每個知識點的題數
+        model_name (str): 使用的模型名稱
+
+    Returns:
+        dict: {知識點ID: [{'new_sentence', 'hint_text'}, ...]}；失敗時為空字典
+    """
+    if not points:
+        return {}
+
+    weak_points_str = "\n\n".join(
+        f"- ID {p['id']}｜錯誤分類: {p.get('category')} -> {p.get('subcategory')}\n"
+        f"  正確用法: \"{p.get('correct_phrase')}\"\n  核心觀念: {p.get('explanation') or p.get('key_point_summary') or '無'}"
+        for p in points
+    )
+    system_prompt = f"""
+    你是一位專業的英文教學 AI，專門為學生的弱點設計「複習題」。
+
+    以下是學生需要複習的弱點知識（每個都有 ID）：
+    {weak_points_str}
+
+    請為「每個」弱點各設計 {variants_per_point} 題中文翻譯題目，用來測試學生是否已掌握該知識點。
+    同一個弱點的題目必須使用不同的情境與句子，翻譯成英文時都必須用到該弱點的正確用法，
+    但題目與提示中「不可以」直接寫出正確用法的英文。
+
+    輸出格式要求：
+    回傳一個 JSON 物件，只有一個 key `questions`，值為陣列，每個元素包含：
+    - knowledge_point_id: (integer) 該題對應的弱點 ID
+    - new_sentence: (string) 中文翻譯題目
+    - hint_text: (string) 考點提示（簡潔描述該知識點）
+    """
+    user_prompt = f"請為這 {len(points)} 個弱點知識各設計 {variants_per_point} 題複習題目。"
+
+    try:
+        response_data = _call_llm_api(system_prompt, user_prompt, model_name, DEFAULT_GENERATION_MODEL)
+    except Exception as e:
+        print(f"生成複習題變體時發生錯誤: {e}")
+        return {}
+
+    requested_ids = {p['id'] for p in points}
+    variants = {}
+    for question in _normalize_questions_output(response_data):
+        if not isinstance(question, dict):
+            continue
+        try:
+            point_id = int(question.get('knowledge_point_id'))
+        except (TypeError, ValueError):
+            continue
+        if point_id in requested_ids and isinstance(question.get('new_sentence'), str):
+            variants.setdefault(point_id, []).append({
+                'new_sentence': question['new_sentence'],
+                'hint_text': question.get('hint_text') if isinstance(question.get('hint_text'), str) else None
+            })
+    return variants
+
 def get_tutor_feedback(chinese_sentence, user_translation, review_context=None, hint_text=None, model_name=None):
     """批改使用者答案並提供回饋。"""
     
@@ -0,0 +1,361 @@
+# app/services/backlog_rebalancer.py
+"""
+複習積壓的重新排程
+
+用戶隔一段時間沒有學習後，數百個知識點（與單字）會在同一天到期，
+start_session 只會一直挑熟練度最低的那幾個，其餘的積壓不會消化。
+這裡把整批積壓一次重新分配到接下來的幾天：
+
+- 優先順序：以記憶模型估計「現在已經忘記的機率」1 - R(經過天數, 穩定度)，
+  相對於穩定度逾期越久的越優先（同分時逾期天數多的優先）。
+  沒有記憶狀態的舊知識點以 2^熟練度 當作穩定度，單字同樣以 2^熟練度（其複習間隔）估計。
+- 每日上限：今天起每天最多 daily_cap 個，已經排在未來某天的項目會佔用那天的名額。
+  依優先順序排名後，以每日剩餘名額的累積和 searchsorted 一次算出所有項目的日期（向量化）。
+- 寫回：只更新日期有變動（延後）的項目，一次 UPDATE ... FROM unnest(...)；
+  條件包含原本的日期，重新排程期間剛被複習過的項目不會被覆蓋。
+
+rebalance_user_backlog 供單一用戶的 API 使用；rebalance_all_backlogs 供每晚的排程工作
+（rebalance_review_backlog.py 或管理介面的背景工作）處理所有積壓超過上限的用戶與單字庫。
+"""
+
+import os
+import logging
+import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from app.services.database import get_db_connection
+from app.services import due_queue
+from app.services.review_scheduler import retrievability
+
+logger = logging.getLogger(__name__)
+
+REVIEW_DAILY_CAP = int(os.environ.get('REVIEW_DAILY_CAP', 30))
+VOCABULARY_DAILY_CAP = int(os.environ.get('VOCABULARY_DAILY_CAP', 50))
+
+# ---------------------------------------------------------------------------
+# 排程計算
+# ---------------------------------------------------------------------------
+
+def backlog_priority(elapsed_days: np.ndarray, stability: np.ndarray, overdue_days: np.ndarray) -> np.ndarray:
+    """
+    依優先順序排列的索引（最優先的在前）
+
+    主要依忘記的機率 1 - R 由高到低，其次依逾期天數由多到少。
+    """
+    forgotten = 1.0 - retrievability(np.maximum(elapsed_days, 0.0), np.maximum(stability, 0.01))
+    return np.lexsort((-overdue_days, -forgotten))
+
+def assign_days(order: np.ndarray, future_load: np.ndarray, daily_cap: int) -> np.ndarray:
+    """
+    把依 order 排好的項目分配到今天起的各天
+
+    Args:
+        order: backlog_priority 的結果
+        future_load: future_load[d] 為第 d 天（0 = 今天）已經排定、不屬於這批積壓的項目數
+        daily_cap: 每天的上限
+
+    Returns:
+        每個項目（原始順序）距今天的天數
+    """
+    count = len(order)
+    horizon = len(future_load) + count // max(daily_cap, 1) + 2
+    load = np.zeros(horizon)
+    load[:len(future_load)] = future_load
+    remaining = np.cumsum(np.maximum(daily_cap - load, 0))
+
+    offsets = np.empty(count, dtype=np.int64)
+    offsets[order] = np.searchsorted(remaining, np.arange(count), side='right')
+    return offsets
+
+def _future_load(rows: List[Dict], today: datetime.date) -> np.ndarray:
+    """把 (day, count) 的統計轉成以今天為 0 的陣列"""
+    if not rows:
+        return np.zeros(1)
+    load = np.zeros((max(row['day'] for row in rows) - today).days + 1)
+    for row in rows:
+        load[(row['day'] - today).days] += row['count']
+    return load
+
+def _summarize(offsets: np.ndarray, today: datetime.date) -> Dict[str, int]:
+    days, counts = np.unique(offsets, return_counts=True)
+    return {
+        (today + datetime.timedelta(days=int(day))).isoformat(): int(count)
+        for day, count in zip(days, counts)
+    }
+
+# ---------------------------------------------------------------------------
+# 知識點
+# ---------------------------------------------------------------------------
+
+def rebalance_user_backlog(
+    user_id: int,
+    daily_cap: int = REVIEW_DAILY_CAP,
+    dry_run: bool = False,
+    today: Optional[datetime.date] = None
+) -> Dict:
+    """
+    重新分配用戶到期（含逾期）知識點的複習日期
+
+    Returns:
+        {'user_id', 'backlog', 'rescheduled', 'daily_cap', 'last_day', 'schedule': {日期: 數量}}
+    """
+    if daily_cap <= 0:
+        raise ValueError("daily_cap 必須大於 0")
+    today = today or due_queue.taipei_today()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    result = {
+        'user_id': user_id, 'backlog': 0, 'rescheduled': 0, 'daily_cap': daily_cap,
+        'last_day': None, 'schedule': {}
+    }
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT id, mastery_level, memory_stability, last_reviewed_on, next_review_date
+                FROM knowledge_points
+                WHERE user_id = %s AND is_archived = FALSE AND next_review_date <= %s
+                """,
+                (user_id, today)
+            )
+            rows = cursor.fetchall()
+            result['backlog'] = len(rows)
+            if len(rows) <= daily_cap:
+                conn.rollback()
+                return result
+
+            cursor.execute(
+                """
+                SELECT next_review_date AS day, COUNT(*) AS count
+                FROM knowledge_points
+                WHERE user_id = %s AND is_archived = FALSE AND next_review_date > %s
+                GROUP BY next_review_date
+                """,
+                (user_id, today)
+            )
+            future_load = _future_load(cursor.fetchall(), today)
+
+            ids = np.array([row['id'] for row in rows], dtype=np.int64)
+            due_dates = np.array([row['next_review_date'] for row in rows], dtype='datetime64[D]')
+            overdue = (np.datetime64(today, 'D') - due_dates).astype(np.float64)
+            mastery = np.array([row['mastery_level'] or 0.0 for row in rows], dtype=np.float64)
+            stability = np.array(
+                [row['memory_stability'] if row['memory_stability'] else np.nan for row in rows], dtype=np.float64
+            )
+            stability = np.where(np.isnan(stability), np.power(2.0, mastery), stability)
+            elapsed = np.array([
+                (now - row['last_reviewed_on']).total_seconds() / 86400.0 if row['last_reviewed_on'] else np.nan
+                for row in rows
+            ], dtype=np.float64)
+            # 沒有複習時間時，視為在到期日當天剛好經過一個穩定度
+            elapsed = np.where(np.isnan(elapsed), stability + overdue, elapsed)
+
+            offsets = assign_days(backlog_priority(elapsed, stability, overdue), future_load, daily_cap)
+            result['schedule'] = _summarize(offsets, today)
+            result['last_day'] = (today + datetime.timedelta(days=int(offsets.max()))).isoformat()
+
+            moved = offsets > 0
+            if dry_run or not moved.any():
+                conn.rollback()
+                return result
+
+            new_dates = [today + datetime.timedelta(days=int(offset)) for offset in offsets[moved]]
+            cursor.execute(
+                """
+                UPDATE knowledge_points AS k
+                SET next_review_date = u.new_date
+                FROM unnest(%s::int[], %s::date[], %s::date[]) AS u(id, old_date, new_date)
+                WHERE k.id = u.id AND k.user_id = %s AND k.next_review_date = u.old_date
+                """,
+                (
+                    ids[moved].tolist(),
+                    [row['next_review_date'] for row, flag in zip(rows, moved) if flag],
+                    new_dates, user_id
+                )
+            )
+            result['rescheduled'] = cursor.rowcount
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"重新排程用戶 {user_id} 的複習積壓失敗: {e}")
+        raise
+    finally:
+        conn.close()
+
+    due_queue.invalidate(user_id)
+    logger.info(
+        f"用戶 {user_id} 的 {result['backlog']} 個到期知識點中有 {result['rescheduled']} 個延後，"
+        f"每天最多 {daily_cap} 個，排到 {result['last_day']}"
+    )
+    return result
+
+# ---------------------------------------------------------------------------
+# 單字
+# ---------------------------------------------------------------------------
+
+def rebalance_vocabulary_backlog(
+    daily_cap: int = VOCABULARY_DAILY_CAP,
+    dry_run: bool = False,
+    today: Optional[datetime.date] = None
+) -> Dict:
+    """
+    重新分配到期單字的複習時間（單字庫不分用戶；尚未排程的新單字不列入積壓）
+
+    Returns:
+        {'backlog', 'rescheduled', 'daily_cap', 'last_day', 'schedule': {日期: 數量}}
+    """
+    if daily_cap <= 0:
+        raise ValueError("daily_cap 必須大於 0")
+    today = today or due_queue.taipei_today()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cutoff = due_queue.due_cutoff(today)
+    result = {'backlog': 0, 'rescheduled': 0, 'daily_cap': daily_cap, 'last_day': None, 'schedule': {}}
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT id, mastery_level, last_reviewed_at, next_review_at
+                FROM vocabulary_words
+                WHERE is_archived = FALSE AND next_review_at < %s
+                """,
+                (cutoff,)
+            )
+            rows = cursor.fetchall()
+            result['backlog'] = len(rows)
+            if len(rows) <= daily_cap:
+                conn.rollback()
+                return result
+
+            cursor.execute(
+                """
+                SELECT ((next_review_at AT TIME ZONE 'UTC') + INTERVAL '8 hours')::date AS day, COUNT(*) AS count
+                FROM vocabulary_words
+                WHERE is_archived = FALSE AND next_review_at >= %s
+                GROUP BY 1
+                """,
+                (cutoff,)
+            )
+            future_load = _future_load(cursor.fetchall(), today)
+
+            ids = np.array([row['id'] for row in rows], dtype=np.int64)
+            stability = np.power(2.0, np.array([row['mastery_level'] or 0.0 for row in rows], dtype=np.float64))
+            overdue = np.array(
+                [(now - row['next_review_at']).total_seconds() / 86400.0 for row in rows], dtype=np.float64
+            )
+            elapsed = np.array([
+                (now - row['last_reviewed_at']).total_seconds() / 86400.0 if row['last_reviewed_at'] else np.nan
+                for row in rows
+            ], dtype=np.float64)
+            elapsed = np.where(np.isnan(elapsed), stability + overdue, elapsed)
+
+            offsets = assign_days(backlog_priority(elapsed, stability, overdue), future_load, daily_cap)
+            result['schedule'] = _summarize(offsets, today)
+            result['last_day'] = (today + datetime.timedelta(days=int(offsets.max()))).isoformat()
+
+            moved = offsets > 0
+            if dry_run or not moved.any():
+                conn.rollback()
+                return result
+
+            new_times = [
+                due_queue.taipei_day_start(today + datetime.timedelta(days=int(offset)))
+                for offset in offsets[moved]
+            ]
+            cursor.execute(
+                """
+                UPDATE vocabulary_words AS w
+                SET next_review_at = u.new_time, updated_at = NOW()
+                FROM unnest(%s::int[], %s::timestamptz[], %s::timestamptz[]) AS u(id, old_time, new_time)
+                WHERE w.id = u.id AND w.next_review_at = u.old_time
+                """,
+                (
+                    ids[moved].tolist(),
+                    [row['next_review_at'] for row, flag in zip(rows, moved) if flag],
+                    new_times
+                )
+            )
+            result['rescheduled'] = cursor.rowcount
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"重新排程單字複習積壓失敗: {e}")
+        raise
+    finally:
+        conn.close()
+
+    logger.info(
+        f"{result['backlog']} 個到期單字中有 {result['rescheduled']} 個延後，"
+        f"每天最多 {daily_cap} 個，排到 {result['last_day']}"
+    )
+    return result
+
+# ---------------------------------------------------------------------------
+# 所有用戶（每晚的排程工作）
+# ---------------------------------------------------------------------------
+
+def find_backlogged_users(daily_cap: int = REVIEW_DAILY_CAP, today: Optional[datetime.date] = None) -> List[int]:
+    """到期知識點超過每日上限的用戶"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT user_id FROM knowledge_points
+                WHERE is_archived = FALSE AND next_review_date <= %s AND user_id IS NOT NULL
+                GROUP BY user_id
+                HAVING COUNT(*) > %s
+                ORDER BY user_id
+                """,
+                (today or due_queue.taipei_today(), daily_cap)
+            )
+            return [row['user_id'] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def rebalance_all_backlogs(
+    daily_cap: int = REVIEW_DAILY_CAP,
+    vocabulary_daily_cap: Optional[int] = VOCABULARY_DAILY_CAP,
+    dry_run: bool = False,
+    progress_callback: Optional[Callable[[int, int, int], None]] = None
+) -> Dict:
+    """
+    重新排程所有積壓超過上限的用戶，以及單字庫（vocabulary_daily_cap 為 None 時略過單字）
+
+    Args:
+        progress_callback: 每處理完一位用戶呼叫 (processed, succeeded, failed)
+
+    Returns:
+        {'processed', 'success', 'failed', 'rescheduled', 'users': [...], 'vocabulary': {...}}
+    """
+    today = due_queue.taipei_today()
+    user_ids = find_backlogged_users(daily_cap, today)
+    summary = {'processed': 0, 'success': 0, 'failed': 0, 'rescheduled': 0, 'users': [], 'vocabulary': None}
+
+    for user_id in user_ids:
+        try:
+            result = rebalance_user_backlog(user_id, daily_cap, dry_run=dry_run, today=today)
+            summary['success'] += 1
+            summary['rescheduled'] += result['rescheduled']
+            summary['users'].append({
+                key: result[key] for key in ('user_id', 'backlog', 'rescheduled', 'last_day')
+            })
+        except Exception as e:
+            logger.error(f"用戶 {user_id} 的複習積壓重新排程失敗: {e}")
+            summary['failed'] += 1
+        summary['processed'] += 1
+        if progress_callback:
+            progress_callback(summary['processed'], summary['success'], summary['failed'])
+
+    if vocabulary_daily_cap:
+        summary['vocabulary'] = rebalance_vocabulary_backlog(vocabulary_daily_cap, dry_run=dry_run, today=today)
+
+    logger.info(
+        f"✅ 複習積壓重新排程完成：{summary['success']} 位用戶、延後 {summary['rescheduled']} 個知識點"
+        f"（失敗 {summary['failed']}）"
+    )
+    return summary
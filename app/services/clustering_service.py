@@ -0,0 +1,298 @@
+# app/services/clustering_service.py
+"""
+知識點的主題分群
+
+以 mini-batch k-means（球面版本：向量與中心都正規化，距離為餘弦）對所有知識點向量分群，
+中心存入 knowledge_clusters，各知識點的群組寫入 knowledge_points.cluster_id。
+之後新寫入或重新生成的向量會直接指派到最近的中心，不需要重新分群；
+中心本身只在重新執行分群工作時更新。
+"""
+
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from app.services.database import get_db_connection
+from app.services.embedding_service import load_knowledge_point_embeddings
+
+logger = logging.getLogger(__name__)
+
+MAX_CLUSTERS = 50
+MINI_BATCH_SIZE = 1024
+MAX_ITERATIONS = 200
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def default_cluster_count(point_count: int) -> int:
+    """約 sqrt(n/2) 個群組，介於 2 與 MAX_CLUSTERS 之間"""
+    return int(min(MAX_CLUSTERS, max(2, np.sqrt(point_count / 2))))
+
+def _kmeans_plus_plus(matrix: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """k-means++ 初始化（以 1 - 餘弦相似度作為距離）"""
+    centroids = [matrix[rng.integers(len(matrix))]]
+    closest = 1.0 - matrix @ centroids[0]
+    for _ in range(1, k):
+        weights = np.clip(closest, 0, None) ** 2
+        total = weights.sum()
+        index = rng.choice(len(matrix), p=weights / total) if total > 0 else rng.integers(len(matrix))
+        centroids.append(matrix[index])
+        closest = np.minimum(closest, 1.0 - matrix @ matrix[index])
+    return np.array(centroids, dtype=np.float32)
+
+def assign_to_centroids(
+    vectors: np.ndarray,
+    centroids: np.ndarray,
+    block_size: int = 8192
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    將每個向量指派到最相似的中心
+
+    Returns:
+        (群組編號, 與中心的餘弦相似度)
+    """
+    matrix = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+    labels = np.empty(len(matrix), dtype=np.int64)
+    scores = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), block_size):
+        similarities = matrix[start:start + block_size] @ centroids.T
+        labels[start:start + block_size] = similarities.argmax(axis=1)
+        scores[start:start + block_size] = similarities.max(axis=1)
+    return labels, scores
+
+def minibatch_kmeans(
+    vectors: np.ndarray,
+    n_clusters: int,
+    batch_size: int = MINI_BATCH_SIZE,
+    max_iterations: int = MAX_ITERATIONS,
+    tolerance: float = 1e-4,
+    seed: int = 0
+) -> np.ndarray:
+    """
+    球面 mini-batch k-means
+
+    每輪抽一個小批次，指派到最近的中心後，以各中心累計樣本數的倒數為學習率
+    把中心往批次平均移動（Sculley, 2010），最後重新正規化。
+
+    Returns:
+        正規化後的中心矩陣 (n_clusters, 維度)
+    """
+    rng = np.random.default_rng(seed)
+    matrix = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+    n_clusters = min(n_clusters, len(matrix))
+
+    init_sample = matrix[rng.choice(len(matrix), min(len(matrix), max(batch_size, n_clusters * 20)), replace=False)]
+    centroids = _kmeans_plus_plus(init_sample, n_clusters, rng)
+    counts = np.zeros(n_clusters, dtype=np.float64)
+
+    for _ in range(max_iterations):
+        batch = matrix[rng.choice(len(matrix), min(batch_size, len(matrix)), replace=False)]
+        labels = (batch @ centroids.T).argmax(axis=1)
+
+        batch_counts = np.bincount(labels, minlength=n_clusters).astype(np.float64)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, batch)
+
+        active = batch_counts > 0
+        counts[active] += batch_counts[active]
+        learning_rate = (batch_counts[active] / counts[active])[:, None]
+        means = sums[active] / batch_counts[active][:, None]
+
+        previous = centroids.copy()
+        centroids[active] = _normalize_rows((1 - learning_rate) * centroids[active] + learning_rate * means)
+        if np.max(np.linalg.norm(centroids - previous, axis=1)) < tolerance:
+            break
+
+    return centroids
+
+def load_centroids(cursor) -> Tuple[np.ndarray, np.ndarray]:
+    """讀取目前的中心，回傳 (群組ID, 中心矩陣)；尚未分群時為空陣列"""
+    cursor.execute("SELECT id, centroid FROM knowledge_clusters ORDER BY id")
+    rows = cursor.fetchall()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+    return (
+        np.array([row['id'] for row in rows], dtype=np.int64),
+        np.array([row['centroid'] for row in rows], dtype=np.float32)
+    )
+
+def assign_knowledge_points(cursor, point_ids: List[int], vectors) -> int:
+    """
+    把新寫入的向量指派到最近的現有中心（由呼叫端負責交易）
+
+    Returns:
+        指派的知識點數量；尚未分群時為 0
+    """
+    if len(point_ids) == 0:
+        return 0
+    cluster_ids, centroids = load_centroids(cursor)
+    if len(cluster_ids) == 0:
+        return 0
+
+    labels, _ = assign_to_centroids(np.asarray(vectors, dtype=np.float32), centroids)
+    cursor.execute(
+        """
+        UPDATE knowledge_points kp
+        SET cluster_id = a.cluster_id
+        FROM unnest(%s::integer[], %s::integer[]) AS a(id, cluster_id)
+        WHERE kp.id = a.id
+        """,
+        ([int(pid) for pid in point_ids], cluster_ids[labels].tolist())
+    )
+    return cursor.rowcount
+
+def run_clustering(n_clusters: Optional[int] = None, seed: int = 0) -> Dict:
+    """
+    重新對所有知識點分群並寫入結果
+
+    Args:
+        n_clusters: 群組數量（None = 依知識點數量自動決定）
+
+    Returns:
+        {'points', 'clusters', 'fit_seconds', 'mean_similarity'}
+    """
+    conn = get_db_connection()
+    try:
+        point_ids, vectors = load_knowledge_point_embeddings(conn)
+        if len(point_ids) < 2:
+            logger.warning("有向量的知識點不足，無法分群")
+            return {'points': len(point_ids), 'clusters': 0, 'fit_seconds': 0.0, 'mean_similarity': 0.0}
+
+        n_clusters = n_clusters or default_cluster_count(len(point_ids))
+        started = time.perf_counter()
+        centroids = minibatch_kmeans(vectors, n_clusters, seed=seed)
+        labels, scores = assign_to_centroids(vectors, centroids)
+        fit_seconds = time.perf_counter() - started
+
+        # 最接近中心的知識點作為代表：依 (群組, 相似度由高到低) 排序後取每組第一筆
+        order = np.lexsort((-scores, labels))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = labels[order][1:] != labels[order][:-1]
+        representatives = np.full(len(centroids), -1, dtype=np.int64)
+        representatives[labels[order][first]] = point_ids[order][first]
+
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE knowledge_points SET cluster_id = NULL WHERE cluster_id IS NOT NULL")
+            cursor.execute("DELETE FROM knowledge_clusters")
+            cursor.execute(
+                """
+                INSERT INTO knowledge_clusters (id, centroid, representative_point_id, updated_at)
+                SELECT c.id, c.centroid::real[], NULLIF(c.representative, -1), NOW()
+                FROM unnest(%s::integer[], %s::text[], %s::integer[]) AS c(id, centroid, representative)
+                """,
+                (
+                    list(range(len(centroids))),
+                    ['{' + ','.join(map(str, centroid.tolist())) + '}' for centroid in centroids],
+                    representatives.tolist()
+                )
+            )
+            cursor.execute(
+                """
+                UPDATE knowledge_points kp
+                SET cluster_id = a.cluster_id
+                FROM unnest(%s::integer[], %s::integer[]) AS a(id, cluster_id)
+                WHERE kp.id = a.id
+                """,
+                (point_ids.tolist(), labels.tolist())
+            )
+        conn.commit()
+    except Exception as e:
+        logger.error(f"知識點分群時發生錯誤: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    result = {
+        'points': len(point_ids),
+        'clusters': len(centroids),
+        'fit_seconds': round(fit_seconds, 3),
+        'mean_similarity': round(float(scores.mean()), 4)
+    }
+    logger.info(f"✅ 分群完成: {result}")
+    return result
+
+def get_cluster_summaries(user_id: Optional[int] = None, top_categories: int = 3) -> List[Dict]:
+    """
+    各群組的摘要：知識點數量、平均熟練度、主要分類與代表片語
+
+    Args:
+        user_id: 只統計該用戶的知識點（None = 全部，僅供管理介面使用）；
+                 群組的代表知識點屬於其他用戶時，代表片語改用該用戶在群組中熟練度最高的知識點
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH members AS (
+                    SELECT id, cluster_id, category, subcategory, mastery_level, correct_phrase
+                    FROM knowledge_points
+                    WHERE cluster_id IS NOT NULL AND is_archived = FALSE
+                      AND (%(user_id)s::integer IS NULL OR user_id = %(user_id)s::integer)
+                ),
+                category_ranks AS (
+                    SELECT cluster_id, category || ' / ' || subcategory AS label, COUNT(*) AS cnt,
+                           ROW_NUMBER() OVER (PARTITION BY cluster_id ORDER BY COUNT(*) DESC) AS rn
+                    FROM members
+                    GROUP BY cluster_id, category, subcategory
+                )
+                SELECT c.id, c.updated_at,
+                       COALESCE(rep.correct_phrase, (
+                           SELECT m.correct_phrase FROM members m
+                           WHERE m.cluster_id = c.id ORDER BY m.mastery_level DESC, m.id LIMIT 1
+                       )) AS representative_phrase,
+                       s.size, s.avg_mastery,
+                       ARRAY(
+                           SELECT label FROM category_ranks r
+                           WHERE r.cluster_id = c.id AND r.rn <= %(top)s ORDER BY r.rn
+                       ) AS top_categories
+                FROM knowledge_clusters c
+                JOIN (
+                    SELECT cluster_id, COUNT(*) AS size, AVG(mastery_level) AS avg_mastery
+                    FROM members GROUP BY cluster_id
+                ) s ON s.cluster_id = c.id
+                LEFT JOIN knowledge_points rep ON rep.id = c.representative_point_id
+                    AND (%(user_id)s::integer IS NULL OR rep.user_id = %(user_id)s::integer)
+                ORDER BY s.size DESC
+                """,
+                {'user_id': user_id, 'top': top_categories}
+            )
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    return [
+        {
+            'cluster_id': row['id'],
+            'size': row['size'],
+            'avg_mastery': round(float(row['avg_mastery'] or 0.0), 3),
+            'top_categories': row['top_categories'],
+            'representative_phrase': row['representative_phrase'],
+            'updated_at': row['updated_at'].isoformat() if row['updated_at'] else None
+        }
+        for row in rows
+    ]
+
+def get_cluster_points(cluster_id: int, user_id: Optional[int] = None, limit: int = 50) -> List[Dict]:
+    """列出群組內的知識點（user_id 為 None 時列出所有用戶的知識點，僅供管理介面使用）"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT id, correct_phrase, key_point_summary, category, subcategory, mastery_level
+                FROM knowledge_points
+                WHERE cluster_id = %(cluster_id)s AND is_archived = FALSE
+                  AND (%(user_id)s::integer IS NULL OR user_id = %(user_id)s::integer)
+                ORDER BY mastery_level ASC, id
+                LIMIT %(limit)s
+                """,
+                {'cluster_id': cluster_id, 'user_id': user_id, 'limit': limit}
+            )
+            return cursor.fetchall()
+    finally:
+        conn.close()
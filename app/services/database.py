@@ -7,6 +7,15 @@ import json
 # 全域資料庫連接池
 db_pool = None
 
+# 知識點文字搜尋使用的 tsvector 運算式（建立索引與查詢時必須完全一致）
+KNOWLEDGE_SEARCH_TSV = (
+    "to_tsvector('simple', coalesce(correct_phrase, '') || ' ' || "
+    "coalesce(key_point_summary, '') || ' ' || coalesce(incorrect_phrase_in_context, ''))"
+)
+
+# 知識點片語的正規化運算式：小寫、標點與連續空白合併為單一空白（建立索引與查詢時必須完全一致）
+NORMALIZED_PHRASE_SQL = "btrim(regexp_replace(lower({}), '[[:punct:][:space:]]+', ' ', 'g'))"
+
 def init_app(app):
     """初始化資料庫連接池。"""
     global db_pool
@@ -173,6 +182,358 @@ def init_db():
             END IF;
         END $$;
         """)
+        
+        # 向量文本被修改後等待重新向量化的時間（NULL = 向量為最新）
+        cursor.execute("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns 
+                WHERE table_name='knowledge_points' AND column_name='embedding_dirty_at'
+            ) THEN
+                ALTER TABLE knowledge_points ADD COLUMN embedding_dirty_at TIMESTAMPTZ;
+                RAISE NOTICE '欄位 embedding_dirty_at 已成功加入 knowledge_points 表格。';
+            END IF;
+        END $$;
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_knowledge_points_embedding_dirty
+        ON knowledge_points(embedding_dirty_at)
+        WHERE embedding_dirty_at IS NOT NULL;
+        """)
+        
+        # 向量回填管線的檢查點（不依賴 pgvector，程序內索引模式也會使用）
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_backfill_checkpoints (
+            job_name TEXT PRIMARY KEY,
+            last_point_id INTEGER NOT NULL,
+            updated_at TIMESTAMPTZ DEFAULT NOW()
+        );
+        """)
+        
+        # 向量模型登記表：同一時間最多一個使用中 (active) 與一個遷移中 (migrating) 的模型
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_models (
+            model_name TEXT PRIMARY KEY,
+            dimension INTEGER NOT NULL,
+            status TEXT NOT NULL CHECK (status IN ('active', 'migrating', 'retired')),
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            activated_at TIMESTAMPTZ
+        );
+        """)
+        cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_embedding_models_status
+        ON embedding_models(status)
+        WHERE status IN ('active', 'migrating');
+        """)
+        
+        # 每個向量記錄產生它的模型；程序內索引模式也使用 embedding_updated_at
+        cursor.execute("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns 
+                WHERE table_name='knowledge_points' AND column_name='embedding_model'
+            ) THEN
+                ALTER TABLE knowledge_points ADD COLUMN embedding_model TEXT;
+                RAISE NOTICE '欄位 embedding_model 已成功加入 knowledge_points 表格。';
+            END IF;
+            
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns 
+                WHERE table_name='knowledge_points' AND column_name='embedding_updated_at'
+            ) THEN
+                ALTER TABLE knowledge_points ADD COLUMN embedding_updated_at TIMESTAMPTZ;
+                RAISE NOTICE '欄位 embedding_updated_at 已成功加入 knowledge_points 表格。';
+            END IF;
+        END $$;
+        """)
+        
+        # 模型遷移期間的新模型向量（REAL[]，維度不受 embedding_vector 欄位限制）
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS knowledge_point_embeddings_next (
+            point_id INTEGER PRIMARY KEY REFERENCES knowledge_points(id) ON DELETE CASCADE,
+            model_name TEXT NOT NULL,
+            embedding REAL[] NOT NULL,
+            text_hash TEXT NOT NULL,
+            updated_at TIMESTAMPTZ DEFAULT NOW()
+        );
+        """)
+        
+        # 新增知識點時以正規化片語檢查重複
+        cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_knowledge_points_user_phrase_normalized
+        ON knowledge_points(user_id, ({NORMALIZED_PHRASE_SQL.format('correct_phrase')}));
+        """)
+        
+        # 知識點主題分群：中心以 REAL[] 儲存，不依賴 pgvector
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS knowledge_clusters (
+            id INTEGER PRIMARY KEY,
+            centroid REAL[] NOT NULL,
+            representative_point_id INTEGER REFERENCES knowledge_points(id) ON DELETE SET NULL,
+            updated_at TIMESTAMPTZ DEFAULT NOW()
+        );
+        """)
+        cursor.execute("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns 
+                WHERE table_name='knowledge_points' AND column_name='cluster_id'
+            ) THEN
+                ALTER TABLE knowledge_points ADD COLUMN cluster_id INTEGER;
+                RAISE NOTICE '欄位 cluster_id 已成功加入 knowledge_points 表格。';
+            END IF;
+        END $$;
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_knowledge_points_cluster
+        ON knowledge_points(cluster_id)
+        WHERE cluster_id IS NOT NULL;
+        """)
+
+        # 複習排程的記憶模型狀態（見 review_scheduler）：知識點的穩定度與難度、學習事件對應的知識點與評分
+        cursor.execute("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name='knowledge_points' AND column_name='memory_stability'
+            ) THEN
+                ALTER TABLE knowledge_points ADD COLUMN memory_stability REAL;
+                RAISE NOTICE '欄位 memory_stability 已成功加入 knowledge_points 表格。';
+            END IF;
+
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name='knowledge_points' AND column_name='memory_difficulty'
+            ) THEN
+                ALTER TABLE knowledge_points ADD COLUMN memory_difficulty REAL;
+                RAISE NOTICE '欄位 memory_difficulty 已成功加入 knowledge_points 表格。';
+            END IF;
+
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name='learning_events' AND column_name='knowledge_point_id'
+            ) THEN
+                ALTER TABLE learning_events ADD COLUMN knowledge_point_id INTEGER REFERENCES knowledge_points(id) ON DELETE SET NULL;
+                RAISE NOTICE '欄位 knowledge_point_id 已成功加入 learning_events 表格。';
+            END IF;
+
+            IF NOT EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name='learning_events' AND column_name='review_grade'
+            ) THEN
+                ALTER TABLE learning_events ADD COLUMN review_grade SMALLINT;
+                RAISE NOTICE '欄位 review_grade 已成功加入 learning_events 表格。';
+            END IF;
+        END $$;
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_learning_events_point_reviews
+        ON learning_events(user_id, knowledge_point_id, timestamp)
+        WHERE knowledge_point_id IS NOT NULL;
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS review_scheduler_params (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+            weights REAL[] NOT NULL,
+            review_count INTEGER NOT NULL,
+            log_loss REAL,
+            default_log_loss REAL,
+            fitted_at TIMESTAMPTZ DEFAULT NOW()
+        );
+        """)
+
+        # 每個知識點預先生成的複習題（見 review_question_store），依 times_served 輪流出題；
+        # source_phrase 與知識點目前的 correct_phrase 不同時視為過期
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS review_question_variants (
+            id SERIAL PRIMARY KEY,
+            knowledge_point_id INTEGER NOT NULL REFERENCES knowledge_points(id) ON DELETE CASCADE,
+            source_phrase TEXT NOT NULL,
+            new_sentence TEXT NOT NULL,
+            hint_text TEXT,
+            model_name TEXT,
+            times_served INTEGER NOT NULL DEFAULT 0,
+            last_served_at TIMESTAMPTZ,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            UNIQUE (knowledge_point_id, new_sentence)
+        );
+        """)
+
+        # 預先生成的下一回合題目（見 session_prefetch），每位用戶一列；
+        # 內容可以隨時重新生成，使用 UNLOGGED 表格省去 WAL 寫入（當機後清空）
+        cursor.execute("""
+        CREATE UNLOGGED TABLE IF NOT EXISTS session_prefetch (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+            params JSONB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'idle' CHECK (status IN ('idle', 'generating', 'ready')),
+            generation_id INTEGER NOT NULL DEFAULT 0,
+            questions JSONB,
+            expires_at TIMESTAMPTZ,
+            updated_at TIMESTAMPTZ DEFAULT NOW()
+        );
+        """)
+
+        # 進行中的學習回合（見 session_store）：題目、知識點與片語保存在伺服器端，作答時不必信任客戶端回傳的欄位；
+        # 回合是短期資料，同樣使用 UNLOGGED 表格
+        cursor.execute("""
+        CREATE UNLOGGED TABLE IF NOT EXISTS learning_sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            questions JSONB NOT NULL,
+            answered SMALLINT[] NOT NULL DEFAULT '{}',
+            credited SMALLINT[] NOT NULL DEFAULT '{}',
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_learning_sessions_expires ON learning_sessions(expires_at);")
+
+        # 知識點網絡的伺服器端布局（見 graph_layout），state 只有一列，記錄布局對應的圖版本
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS knowledge_graph_layout (
+            point_id INTEGER PRIMARY KEY REFERENCES knowledge_points(id) ON DELETE CASCADE,
+            x REAL NOT NULL,
+            y REAL NOT NULL,
+            weight REAL NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ DEFAULT NOW()
+        );
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS knowledge_graph_layout_state (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            graph_version TEXT NOT NULL,
+            node_count INTEGER NOT NULL,
+            mode TEXT NOT NULL,
+            computed_at TIMESTAMPTZ DEFAULT NOW()
+        );
+        """)
+        
+        # 管理介面的背景工作（見 job_runner）
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS admin_jobs (
+            id SERIAL PRIMARY KEY,
+            job_type TEXT NOT NULL,
+            params JSONB NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL CHECK (status IN (
+                'queued', 'running', 'cancelling', 'cancelled', 'succeeded', 'failed', 'interrupted'
+            )),
+            total INTEGER,
+            processed INTEGER NOT NULL DEFAULT 0,
+            succeeded INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            items_per_second REAL,
+            result JSONB,
+            error TEXT,
+            created_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            started_at TIMESTAMPTZ,
+            updated_at TIMESTAMPTZ DEFAULT NOW(),
+            finished_at TIMESTAMPTZ
+        );
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_admin_jobs_active
+        ON admin_jobs(job_type)
+        WHERE status IN ('queued', 'running', 'cancelling');
+        """)
+
+        # 知識點網絡的圖指標（由 graph_analytics 批次計算）
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS knowledge_point_graph_metrics (
+            point_id INTEGER PRIMARY KEY REFERENCES knowledge_points(id) ON DELETE CASCADE,
+            component_id INTEGER NOT NULL,
+            component_size INTEGER NOT NULL,
+            degree INTEGER NOT NULL,
+            weighted_degree REAL NOT NULL,
+            pagerank DOUBLE PRECISION NOT NULL,
+            betweenness DOUBLE PRECISION NOT NULL,
+            computed_at TIMESTAMPTZ DEFAULT NOW()
+        );
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_graph_metrics_pagerank
+        ON knowledge_point_graph_metrics(pagerank DESC);
+        """)
+
+        # 知識點網絡的變動紀錄（由觸發器寫入，鄰域快取依此失效）
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS knowledge_graph_changes (
+            id BIGSERIAL PRIMARY KEY,
+            point_id INTEGER NOT NULL,
+            changed_at TIMESTAMPTZ DEFAULT NOW()
+        );
+        """)
+
+        # 向量化統計計數器：user_id = 0 為全部用戶；增量由觸發器寫入，背景執行緒併入計數器
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_stat_counters (
+            user_id INTEGER PRIMARY KEY,
+            points_with_vectors BIGINT NOT NULL DEFAULT 0,
+            points_without_vectors BIGINT NOT NULL DEFAULT 0,
+            active_links BIGINT NOT NULL DEFAULT 0,
+            similarity_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+            last_embedding_update TIMESTAMPTZ,
+            updated_at TIMESTAMPTZ DEFAULT NOW(),
+            reconciled_at TIMESTAMPTZ
+        );
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_stat_deltas (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER,
+            points_with_vectors BIGINT NOT NULL DEFAULT 0,
+            points_without_vectors BIGINT NOT NULL DEFAULT 0,
+            active_links BIGINT NOT NULL DEFAULT 0,
+            similarity_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+            last_embedding_update TIMESTAMPTZ
+        );
+        """)
+
+        # 知識點文字搜尋索引：片語完全比對、全文檢索，以及 pg_trgm 的模糊比對
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_knowledge_points_user_phrase_lower
+        ON knowledge_points(user_id, lower(correct_phrase));
+        """)
+        cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_knowledge_points_search_tsv
+        ON knowledge_points USING gin ({KNOWLEDGE_SEARCH_TSV});
+        """)
+        cursor.execute("""
+        DO $$
+        BEGIN
+            BEGIN
+                CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            EXCEPTION WHEN OTHERS THEN
+                RAISE NOTICE '無法啟用 pg_trgm，文字搜尋不使用三元組索引: %', SQLERRM;
+            END;
+            
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX IF NOT EXISTS idx_knowledge_points_phrase_trgm
+                ON knowledge_points USING gin (correct_phrase gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS idx_knowledge_points_summary_trgm
+                ON knowledge_points USING gin (key_point_summary gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS idx_knowledge_points_incorrect_trgm
+                ON knowledge_points USING gin (incorrect_phrase_in_context gin_trgm_ops);
+            END IF;
+        END $$;
+        """)
+
+        # 到期複習佇列：只索引未封存的知識點，包含排序欄位以便只掃描索引
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_knowledge_points_user_due
+        ON knowledge_points(user_id, next_review_date) INCLUDE (mastery_level, last_reviewed_on)
+        WHERE is_archived = FALSE;
+        """)
+        # 跨用戶依到期日挑選知識點（複習題背景補題）
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_knowledge_points_next_review
+        ON knowledge_points(next_review_date)
+        WHERE is_archived = FALSE;
+        """)
 
     conn.commit()
     conn.close()
@@ -180,112 +541,152 @@ def init_db():
 
 def add_mistake(question_data, user_answer, feedback_data, exclude_phrase=None, user_id=None, enable_auto_linking=True):
     """將學習事件和知識點弱點存入 PostgreSQL，並自動生成向量與關聯。"""
+    from app.services.dedup_service import find_duplicate_point, find_vector_duplicates
+    from app.services import review_scheduler
+    
+    is_correct = feedback_data.get('is_generally_correct', False)
+    feedback_json = json.dumps(feedback_data, ensure_ascii=False, indent=2)
+    chinese = question_data.get('new_sentence', '（題目文字遺失）')
+    q_type = question_data.get('type', 'new')
+    source_id = question_data.get('original_mistake_id')
+    
+    # 建立一個從 code 到中文名稱的對照表
+    ERROR_CODE_MAP = {
+        "A": "詞彙與片語錯誤",
+        "B": "語法結構錯誤",
+        "C": "語意與語用錯誤",
+        "D": "拼寫與格式錯誤",
+        "E": "系統錯誤"
+    }
+
+    primary_error_category = "翻譯正確"
+    primary_error_subcategory = "無"
+    error_analysis = feedback_data.get('error_analysis', [])
+    
+    if error_analysis:
+        major_errors = [e for e in error_analysis if e.get('severity') == 'major']
+        first_error = major_errors[0] if major_errors else error_analysis[0]
+        
+        primary_error_code = first_error.get('error_type_code')
+        primary_error_category = ERROR_CODE_MAP.get(primary_error_code, '分類錯誤')
+        primary_error_subcategory = first_error.get('key_point_summary', '子分類錯誤')
+
+    # 要新增或合併的知識點（只有已認證用戶才處理知識點）
+    new_points = []
+    if not is_correct and error_analysis and user_id:
+        for error in error_analysis:
+            correct_phrase = error.get('correction')
+            if exclude_phrase and correct_phrase == exclude_phrase:
+                print(f"  - (忽略已處理的複習點: {exclude_phrase})")
+                continue
+            
+            category = ERROR_CODE_MAP.get(error.get('error_type_code'), '分類錯誤')
+            subcategory = error.get('key_point_summary', '核心觀念')
+            if not category or not subcategory or not correct_phrase:
+                continue
+            new_points.append({
+                'category': category, 'subcategory': subcategory, 'correct_phrase': correct_phrase,
+                'explanation': error.get('explanation'), 'user_context_sentence': user_answer,
+                'incorrect_phrase_in_context': error.get('original_phrase'),
+                'key_point_summary': error.get('key_point_summary', '核心觀念')
+            })
+
+    # 向量比對需要模型推論，在開啟交易之前完成，避免推論期間持有資料列鎖
+    vector_matches = [None] * len(new_points)
+    if new_points and enable_auto_linking:
+        vector_matches = find_vector_duplicates(user_id, new_points)
+
     conn = get_db_connection()
     with conn.cursor() as cursor:
-        is_correct = feedback_data.get('is_generally_correct', False)
-        feedback_json = json.dumps(feedback_data, ensure_ascii=False, indent=2)
-        chinese = question_data.get('new_sentence', '（題目文字遺失）')
-        q_type = question_data.get('type', 'new')
-        source_id = question_data.get('original_mistake_id')
+        # 收集新增或更新的知識點ID，用於後續向量處理
+        processed_point_ids = []
+        # 第一個知識點的複習結果，記錄在學習事件上供排程參數擬合使用
+        reviewed_point = None
         
-        # 建立一個從 code 到中文名稱的對照表
-        ERROR_CODE_MAP = {
-            "A": "詞彙與片語錯誤",
-            "B": "語法結構錯誤",
-            "C": "語意與語用錯誤",
-            "D": "拼寫與格式錯誤",
-            "E": "系統錯誤"
-        }
+        if new_points:
+            print("\n正在更新您的具體知識點弱點分析...")
+        for index, new_point in enumerate(new_points):
+            category, subcategory = new_point['category'], new_point['subcategory']
+            correct_phrase, explanation = new_point['correct_phrase'], new_point['explanation']
+            incorrect_phrase, summary = new_point['incorrect_phrase_in_context'], new_point['key_point_summary']
 
-        primary_error_category = "翻譯正確"
-        primary_error_subcategory = "無"
-        error_analysis = feedback_data.get('error_analysis', [])
-        
-        if error_analysis:
-            major_errors = [e for e in error_analysis if e.get('severity') == 'major']
-            first_error = major_errors[0] if major_errors else error_analysis[0]
-            
-            primary_error_code = first_error.get('error_type_code')
-            primary_error_category = ERROR_CODE_MAP.get(primary_error_code, '分類錯誤')
-            primary_error_subcategory = first_error.get('key_point_summary', '子分類錯誤')
+            # 與同一批中較前面的知識點相似時，合併到該知識點（已新增或合併後的ID）
+            vector_match = vector_matches[index]
+            if vector_match and 'batch_index' in vector_match:
+                vector_match = {
+                    'point_id': processed_point_ids[vector_match['batch_index']],
+                    'similarity': vector_match['similarity']
+                }
+
+            # 正規化片語相同或向量高度相似時，合併到既有的知識點
+            point = find_duplicate_point(cursor, user_id, new_point, vector_match=vector_match)
+            # 再次出錯即視為忘記（不論嚴重程度），穩定度依記憶模型下降
+            grade = review_scheduler.GRADE_AGAIN
 
+            if point:
+                cursor.execute(
+                    """
+                    UPDATE knowledge_points 
+                    SET mistake_count = mistake_count + 1, user_context_sentence = %s, incorrect_phrase_in_context = %s, key_point_summary = %s,
+                    category = %s, subcategory = %s
+                    WHERE id = %s
+                    """,
+                    (user_answer, incorrect_phrase, summary, category, subcategory, point['id'])
+                )
+                state = review_scheduler.apply_review(cursor, point['id'], grade, user_id=user_id)
+                processed_point_ids.append(point['id'])
+                if point['match'] == 'vector':
+                    print(f"  - 與既有知識點 {point['id']} 高度相似（{point['similarity']:.2f}），已合併。")
+                print(f"  - 已更新弱點：[{summary}]，{state['interval_days']} 天後複習。")
+            else:
+                state = review_scheduler.schedule_review({}, grade, weights=review_scheduler.get_user_weights(user_id))
+                cursor.execute(
+                    """
+                    INSERT INTO knowledge_points (user_id, category, subcategory, correct_phrase, explanation, user_context_sentence, incorrect_phrase_in_context, key_point_summary, mistake_count, mastery_level, last_reviewed_on, next_review_date, memory_stability, memory_difficulty)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 1, %s, %s, %s, %s, %s)
+                    RETURNING id
+                    """,
+                    (user_id, category, subcategory, correct_phrase, explanation, user_answer, incorrect_phrase, summary, state['mastery_level'], datetime.datetime.now(datetime.timezone.utc), state['next_review_date'], state['memory_stability'], state['memory_difficulty'])
+                )
+                new_point_id = cursor.fetchone()['id']
+                processed_point_ids.append(new_point_id)
+                print(f"  - 已發現新弱點：[{summary}]，已加入複習計畫。")
+            
+            if reviewed_point is None:
+                reviewed_point = (processed_point_ids[-1], grade, state)
+    
         # 只有已認證用戶才記錄學習事件
         if user_id:
+            point_id, grade, state = reviewed_point or (None, None, {})
             cursor.execute(
                 """
                 INSERT INTO learning_events 
                 (user_id, question_type, source_mistake_id, chinese_sentence, user_answer, is_correct, 
-                error_category, error_subcategory, ai_feedback_json, timestamp) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                error_category, error_subcategory, ai_feedback_json, knowledge_point_id, review_grade,
+                difficulty, stability, next_review_date, timestamp) 
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                 """,
                 (user_id, q_type, source_id, chinese, user_answer, is_correct, 
                 primary_error_category, primary_error_subcategory, 
-                feedback_json, datetime.datetime.now(datetime.timezone.utc))
+                feedback_json, point_id, grade, state.get('memory_difficulty'), state.get('memory_stability'),
+                state.get('next_review_date'), datetime.datetime.now(datetime.timezone.utc))
             )
-        
-        # 收集新增或更新的知識點ID，用於後續向量處理
-        processed_point_ids = []
-        
-        # 只有已認證用戶才處理知識點
-        if not is_correct and error_analysis and user_id:
-            print("\n正在更新您的具體知識點弱點分析...")
-            for error in error_analysis:
-                correct_phrase = error.get('correction')
-                if exclude_phrase and correct_phrase == exclude_phrase:
-                    print(f"  - (忽略已處理的複習點: {exclude_phrase})")
-                    continue
-                
-                error_code = error.get('error_type_code')
-                category = ERROR_CODE_MAP.get(error_code, '分類錯誤')
-                subcategory = error.get('key_point_summary', '核心觀念')
-                
-                explanation = error.get('explanation')
-                incorrect_phrase = error.get('original_phrase')
-                summary = error.get('key_point_summary', '核心觀念')
-                
-                if not category or not subcategory or not correct_phrase:
-                    continue
-
-                cursor.execute("SELECT id, mastery_level FROM knowledge_points WHERE user_id = %s AND correct_phrase = %s", (user_id, correct_phrase))
-                point = cursor.fetchone()
-                severity_penalty = 0.5 if error.get('severity') == 'major' else 0.2
-
-                if point:
-                    new_mastery_level = max(0, point['mastery_level'] - severity_penalty)
-                    cursor.execute(
-                        """
-                        UPDATE knowledge_points 
-                        SET mistake_count = mistake_count + 1, mastery_level = %s, user_context_sentence = %s, incorrect_phrase_in_context = %s, key_point_summary = %s, last_reviewed_on = %s, next_review_date = %s,
-                        category = %s, subcategory = %s
-                        WHERE id = %s
-                        """,
-                        (new_mastery_level, user_answer, incorrect_phrase, summary, datetime.datetime.now(datetime.timezone.utc), datetime.date.today() + datetime.timedelta(days=1), category, subcategory, point['id'])
-                    )
-                    processed_point_ids.append(point['id'])
-                    print(f"  - 已更新弱點：[{summary}]，熟練度下降。")
-                else:
-                    cursor.execute(
-                        """
-                        INSERT INTO knowledge_points (user_id, category, subcategory, correct_phrase, explanation, user_context_sentence, incorrect_phrase_in_context, key_point_summary, mistake_count, mastery_level, last_reviewed_on, next_review_date)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 1, 0.0, %s, %s)
-                        RETURNING id
-                        """,
-                        (user_id, category, subcategory, correct_phrase, explanation, user_answer, incorrect_phrase, summary, datetime.datetime.now(datetime.timezone.utc), datetime.date.today() + datetime.timedelta(days=1))
-                    )
-                    new_point_id = cursor.fetchone()['id']
-                    processed_point_ids.append(new_point_id)
-                    print(f"  - 已發現新弱點：[{summary}]，已加入複習計畫。")
     
     conn.commit()
     conn.close()
     
+    if processed_point_ids:
+        from app.services import due_queue
+        due_queue.refresh_points(processed_point_ids)
+    
     # 處理向量生成與自動關聯（在資料庫事務外執行，避免阻塞）
     if enable_auto_linking and processed_point_ids:
         print("\n正在為知識點生成語義向量與建立關聯...")
         try:
             from app.services.embedding_service import generate_and_store_embedding_for_point, auto_link_knowledge_point
             
-            for point_id in processed_point_ids:
+            # 同一批中合併到同一個知識點時只處理一次
+            for point_id in dict.fromkeys(processed_point_ids):
                 try:
                     # 獲取知識點完整資料
                     point_data = get_knowledge_point_by_id(point_id)
@@ -309,32 +710,26 @@ def add_mistake(question_data, user_answer, feedback_data, exclude_phrase=None,
     if not is_correct:
         print(f"\n(本句主要錯誤已歸檔：{primary_error_category} - {primary_error_subcategory})")
 
-def update_knowledge_point_mastery(point_id, current_mastery):
-    """更新答對的知識點熟練度。"""
-    print(f"[DEBUG] update_knowledge_point_mastery 函式被呼叫。")
-    print(f"[DEBUG] 準備更新知識點 ID: {point_id} (類型: {type(point_id)}), 目前熟練度: {current_mastery}")
+def update_knowledge_point_mastery(point_id, current_mastery=None, user_id=None, event=None):
+    """
+    記錄一次答對的複習，依記憶模型更新知識點的穩定度、難度與下次複習日期。
+    
+    current_mastery 僅為相容舊呼叫而保留，實際狀態從資料庫讀取；
+    event（題目與作答內容）提供時同時寫入 learning_events，作為排程參數擬合的複習紀錄。
+    """
+    from app.services import review_scheduler
     
     if point_id is None:
         print(f"⚠️ 嚴重警告：傳入的 point_id 為 None，無法執行更新。請檢查前端回傳的資料。")
-        return
+        return None
 
-    new_mastery_level = min(5.0, current_mastery + 0.25)
-    interval_days = max(1, round(2 ** new_mastery_level))
-    next_review_date = datetime.date.today() + datetime.timedelta(days=interval_days)
-    
-    updated_rows = execute_query(
-        """
-        UPDATE knowledge_points 
-        SET mastery_level = %s, correct_count = correct_count + 1, next_review_date = %s 
-        WHERE id = %s
-        """,
-        (new_mastery_level, next_review_date, int(point_id))
-    )
+    state = review_scheduler.record_review(int(point_id), review_scheduler.GRADE_GOOD, user_id=user_id, event=event)
 
-    if updated_rows > 0:
-        print(f"✅ 知識點 ID: {point_id} 已成功更新！影響行數: {updated_rows}。安排在 {interval_days} 天後複習。")
+    if state:
+        print(f"✅ 知識點 ID: {point_id} 已成功更新！穩定度 {state['memory_stability']:.1f} 天，安排在 {state['interval_days']} 天後複習。")
     else:
-        print(f"⚠️ 警告：更新知識點 ID: {point_id} 時，資料庫中沒有找到對應的紀錄，更新失敗！影響行數: {updated_rows}。")
+        print(f"⚠️ 警告：更新知識點 ID: {point_id} 時，資料庫中沒有找到對應的紀錄，更新失敗！")
+    return state
 
 def get_due_knowledge_points(limit):
     """根據台灣時區 (UTC+8) 來獲取當天到期的知識點。(舊版本，保持向後兼容)"""
@@ -356,23 +751,13 @@ def get_due_knowledge_points(limit):
     )
 
 def get_due_knowledge_points_for_user(user_id, limit):
-    """根據用戶ID和台灣時區 (UTC+8) 來獲取當天到期的知識點。"""
+    """根據用戶ID和台灣時區 (UTC+8) 來獲取當天到期的知識點（經由到期複習佇列）。"""
+    from app.services import due_queue
+    
     utc_now = datetime.datetime.now(datetime.timezone.utc)
-    taipei_offset = datetime.timedelta(hours=8)
-    taipei_now = utc_now + taipei_offset
-    today_in_taipei = taipei_now.date()
-    print(f"[API] 用戶 {user_id} 伺服器UTC日期: {utc_now.date()} | 校準後台北日期: {today_in_taipei}")
+    print(f"[API] 用戶 {user_id} 伺服器UTC日期: {utc_now.date()} | 校準後台北日期: {due_queue.taipei_today(utc_now)}")
     
-    return execute_query(
-        """
-        SELECT * FROM knowledge_points 
-        WHERE user_id = %s AND next_review_date <= %s AND is_archived = FALSE
-        ORDER BY mastery_level ASC, last_reviewed_on ASC
-        LIMIT %s
-        """,
-        (user_id, today_in_taipei, limit),
-        fetch='all'
-    )
+    return due_queue.get_due_points(user_id, limit)
 
 def get_daily_activity(year, month):
     """查詢特定月份的每日學習活動數量。"""
@@ -433,17 +818,31 @@ def update_knowledge_point_details(point_id, details):
         'category', 'subcategory', 'user_context_sentence', 
         'incorrect_phrase_in_context', 'ai_review_notes'
     ]
+    from app.services.embedding_service import EMBEDDING_TEXT_FIELDS
+    
     update_fields = []
     update_values = []
+    changed_checks = []
+    changed_values = []
     
     for key, value in details.items():
         if key in allowed_fields:
             update_fields.append(f"{key} = %s")
             update_values.append(value)
+            # 右側的欄位參照是更新前的值，只有實際改變了向量文本才標記為待重新向量化
+            if key in EMBEDDING_TEXT_FIELDS:
+                changed_checks.append(f"{key} IS DISTINCT FROM %s")
+                changed_values.append(value)
     
     if not update_fields:
         return False, "沒有任何允許更新的欄位。"
 
+    if changed_checks:
+        update_fields.append(
+            f"embedding_dirty_at = CASE WHEN {' OR '.join(changed_checks)} THEN NOW() ELSE embedding_dirty_at END"
+        )
+        update_values.extend(changed_values)
+
     update_values.append(point_id)
     query = f"UPDATE knowledge_points SET {', '.join(update_fields)} WHERE id = %s"
     
@@ -464,33 +863,42 @@ def update_knowledge_point_ai_review(point_id, ai_review_notes):
 
 def set_knowledge_point_archived_status(point_id, is_archived):
     """設定知識點的封存狀態。"""
+    from app.services import due_queue
+    
     updated_rows = execute_query(
         "UPDATE knowledge_points SET is_archived = %s WHERE id = %s", 
         (is_archived, point_id)
     )
+    due_queue.refresh_points([point_id])
     return updated_rows > 0
 
 def delete_knowledge_point(point_id):
     """根據 ID 刪除一個知識點。"""
+    from app.services import due_queue
+    
     deleted_rows = execute_query(
         "DELETE FROM knowledge_points WHERE id = %s", 
         (point_id,)
     )
+    due_queue.refresh_points([point_id])
     return deleted_rows > 0
 
 def batch_update_knowledge_points_archived_status(point_ids, is_archived):
     """批次更新知識點的封存狀態。"""
+    from app.services import due_queue
+    
     updated_rows = execute_query(
         "UPDATE knowledge_points SET is_archived = %s WHERE id = ANY(%s)",
         (is_archived, point_ids)
     )
+    due_queue.refresh_points(point_ids)
     return updated_rows
 
-def get_knowledge_point_phrase(point_id):
-    """根據 ID 獲取單一知識點的 correct_phrase。"""
+def get_knowledge_point_phrase(point_id, user_id=None):
+    """根據 ID 獲取單一知識點的 correct_phrase（提供 user_id 時只查詢該用戶的知識點）。"""
     result = execute_query(
-        "SELECT correct_phrase FROM knowledge_points WHERE id = %s", 
-        (point_id,), 
+        "SELECT correct_phrase FROM knowledge_points WHERE id = %s AND (%s::integer IS NULL OR user_id = %s)", 
+        (point_id, user_id, user_id), 
         fetch='one'
     )
     return result['correct_phrase'] if result else None
@@ -733,6 +1141,8 @@ def init_vocabulary_tables():
         
         # 建立索引以提升查詢效能
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_vocabulary_words_next_review ON vocabulary_words(next_review_at);")
+        # 到期查詢只看未封存的單字（next_review_at 為 NULL 的新單字也在索引中）
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_vocabulary_words_due ON vocabulary_words(next_review_at) WHERE is_archived = FALSE;")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_vocabulary_words_mastery ON vocabulary_words(mastery_level);")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_vocabulary_words_source ON vocabulary_words(source_type, source_reference_id);")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_vocabulary_review_logs_word_timestamp ON vocabulary_review_logs(word_id, timestamp);")
@@ -807,21 +1217,18 @@ def get_vocabulary_word_by_id(word_id):
 
 def get_due_vocabulary_words(limit=20):
     """獲取今日需要複習的單字"""
-    # 使用台灣時區
-    utc_now = datetime.datetime.now(datetime.timezone.utc)
-    taipei_offset = datetime.timedelta(hours=8)
-    taipei_now = utc_now + taipei_offset
-    today_in_taipei = taipei_now.date()
+    from app.services.due_queue import due_cutoff
     
+    # 台灣時區的今天結束時間，直接與欄位比較才能使用索引
     words = execute_query(
         """
         SELECT * FROM vocabulary_words 
-        WHERE (next_review_at IS NULL OR DATE(next_review_at AT TIME ZONE 'UTC' + INTERVAL '8 hours') <= %s)
+        WHERE (next_review_at IS NULL OR next_review_at < %s)
         AND is_archived = FALSE
         ORDER BY mastery_level ASC, last_reviewed_at ASC NULLS FIRST
         LIMIT %s
         """, 
-        (today_in_taipei, limit),
+        (due_cutoff(), limit),
         fetch='all'
     )
     
@@ -896,48 +1303,31 @@ def update_vocabulary_mastery(word_id, is_correct, response_time=None, review_ty
 
 def get_vocabulary_statistics():
     """獲取單字庫統計資訊"""
-    # 總單字數
-    total_words = execute_query(
-        "SELECT COUNT(*) as count FROM vocabulary_words WHERE is_archived = FALSE",
-        fetch='one'
-    )['count']
-    
-    # 已掌握單字（掌握度 >= 4.0）
-    mastered_words = execute_query(
-        "SELECT COUNT(*) as count FROM vocabulary_words WHERE mastery_level >= 4.0 AND is_archived = FALSE",
-        fetch='one'
-    )['count']
-    
-    # 學習中單字（0 < 掌握度 < 4.0）
-    learning_words = execute_query(
-        "SELECT COUNT(*) as count FROM vocabulary_words WHERE mastery_level > 0 AND mastery_level < 4.0 AND is_archived = FALSE",
-        fetch='one'
-    )['count']
+    from app.services.due_queue import due_cutoff
     
-    # 新單字（掌握度 = 0）
-    new_words = execute_query(
-        "SELECT COUNT(*) as count FROM vocabulary_words WHERE mastery_level = 0 AND is_archived = FALSE",
-        fetch='one'
-    )['count']
-    
-    # 今日複習數
-    today = datetime.date.today()
-    due_today = execute_query(
+    # 一次掃描計算所有分組：已掌握（>= 4.0）、學習中（0 < 掌握度 < 4.0）、新單字（= 0）、
+    # 今日複習數（台灣時區今天結束前到期）
+    stats = execute_query(
         """
-        SELECT COUNT(*) as count FROM vocabulary_words 
-        WHERE DATE(next_review_at AT TIME ZONE 'UTC' + INTERVAL '8 hours') <= %s 
-        AND is_archived = FALSE
-        """, 
-        (today,),
+        SELECT
+            COUNT(*) AS total_words,
+            COUNT(*) FILTER (WHERE mastery_level >= 4.0) AS mastered_words,
+            COUNT(*) FILTER (WHERE mastery_level > 0 AND mastery_level < 4.0) AS learning_words,
+            COUNT(*) FILTER (WHERE mastery_level = 0) AS new_words,
+            COUNT(*) FILTER (WHERE next_review_at < %s) AS due_today
+        FROM vocabulary_words
+        WHERE is_archived = FALSE
+        """,
+        (due_cutoff(),),
         fetch='one'
-    )['count']
+    )
     
     return {
-        'total_words': total_words,
-        'mastered_words': mastered_words,
-        'learning_words': learning_words,
-        'new_words': new_words,
-        'due_today': due_today
+        'total_words': stats['total_words'],
+        'mastered_words': stats['mastered_words'],
+        'learning_words': stats['learning_words'],
+        'new_words': stats['new_words'],
+        'due_today': stats['due_today']
     }
 
 def search_vocabulary_words(query, limit=50):
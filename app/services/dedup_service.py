@@ -0,0 +1,375 @@
+# app/services/dedup_service.py
+"""
+知識點的近似重複偵測與合併
+
+新增知識點前分兩階段檢查用戶既有的知識點：
+1. 正規化片語比對：忽略大小寫、標點與多餘空白（"On the other hand," = "on the other hand"），走運算式索引。
+2. 向量比對：只比較核心片語與觀念總結（dedup_text）的向量，餘弦相似度達 DEDUP_SIMILARITY_THRESHOLD 以上。
+   說明、分類與語境不列入比對，避免觀念不同、但說明相近的知識點被合併。
+   候選先以已儲存的知識點向量找出（門檻 DEDUP_CANDIDATE_THRESHOLD），再以 dedup_text 的向量確認。
+符合任一條件就合併到既有的知識點，而不是另外建立一個。
+
+向量比對需要模型推論，add_mistake 在開啟交易之前以 find_vector_duplicates 完成，
+交易中只做片語比對與確認知識點仍然存在。
+
+merge_duplicate_points 則以相同規則找出資料庫中已存在的重複群組並合併。
+"""
+
+import os
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.services.database import get_db_connection, NORMALIZED_PHRASE_SQL
+from app.services.embedding_service import (
+    generate_embedding, batch_generate_embeddings, search_knowledge_points_by_vector,
+    load_knowledge_point_embeddings, is_pgvector_available, get_vector_dimension
+)
+from app.services.link_builder import iter_topk_neighbours, _load_point_owners
+from app.services.vector_index import locked_vector_index
+from app.services import due_queue
+
+logger = logging.getLogger(__name__)
+
+DEDUP_SIMILARITY_THRESHOLD = float(os.environ.get('KNOWLEDGE_DEDUP_THRESHOLD', 0.92))   # >= 1 停用向量比對
+DEDUP_CANDIDATE_THRESHOLD = 0.6   # 以已儲存的知識點向量找候選的門檻（候選再以 dedup_text 確認）
+DEDUP_NEIGHBOURS = 5   # 每個知識點檢查的最相似鄰居數量
+
+def dedup_text(knowledge_point: Dict) -> str:
+    """重複比對使用的文本：核心片語與觀念總結"""
+    parts = [knowledge_point.get('correct_phrase'), knowledge_point.get('key_point_summary')]
+    return " | ".join(part for part in parts if part)
+
+def _unit_vectors(texts: List[str]) -> np.ndarray:
+    """dedup_text 的單位向量（一次批次推論）"""
+    vectors = np.asarray(batch_generate_embeddings(texts), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def find_vector_duplicates(
+    user_id: int,
+    knowledge_points: List[Dict],
+    similarity_threshold: float = DEDUP_SIMILARITY_THRESHOLD
+) -> List[Optional[Dict]]:
+    """
+    以向量找出一批新知識點的重複對象（需要模型推論，請在開啟交易之前呼叫）
+
+    同一批中較後面的知識點也會與較前面的比對（兩者都還沒有儲存的向量）。
+
+    Returns:
+        與 knowledge_points 對應的列表，每項為
+        {'point_id', 'similarity'}（用戶既有的知識點）、{'batch_index', 'similarity'}（同一批中較前面的知識點）或 None
+    """
+    matches: List[Optional[Dict]] = [None] * len(knowledge_points)
+    if not knowledge_points or similarity_threshold >= 1:
+        return matches
+
+    texts = [dedup_text(point) for point in knowledge_points]
+    candidates: List[List[Dict]] = []
+    try:
+        for text in texts:
+            candidates.append(search_knowledge_points_by_vector(
+                generate_embedding(text, use_cache=False),
+                similarity_threshold=DEDUP_CANDIDATE_THRESHOLD,
+                max_results=DEDUP_NEIGHBOURS,
+                user_id=user_id
+            ))
+        candidate_texts = [dedup_text(candidate) for found in candidates for candidate in found]
+        vectors = _unit_vectors(texts + candidate_texts)
+    except Exception as e:
+        logger.warning(f"向量重複檢查失敗，僅使用片語比對: {e}")
+        return matches
+
+    new_vectors, offset = vectors[:len(texts)], len(texts)
+    for index, found in enumerate(candidates):
+        best = None
+        if found:
+            scores = vectors[offset:offset + len(found)] @ new_vectors[index]
+            offset += len(found)
+            top = int(np.argmax(scores))
+            if scores[top] >= similarity_threshold:
+                best = {'point_id': found[top]['point_id'], 'similarity': float(scores[top])}
+        if index:
+            scores = new_vectors[:index] @ new_vectors[index]
+            top = int(np.argmax(scores))
+            if scores[top] >= similarity_threshold and (best is None or scores[top] > best['similarity']):
+                best = {'batch_index': top, 'similarity': float(scores[top])}
+        matches[index] = best
+    return matches
+
+def find_duplicate_point(
+    cursor,
+    user_id: int,
+    knowledge_point: Dict,
+    vector_match: Optional[Dict] = None
+) -> Optional[Dict]:
+    """
+    在用戶既有的知識點中尋找與新知識點重複者（在 add_mistake 的交易中呼叫，不進行模型推論）
+
+    Args:
+        cursor: add_mistake 交易中的 cursor（片語比對可看到同一交易中剛建立的知識點）
+        knowledge_point: 新知識點的欄位（至少要有 correct_phrase）
+        vector_match: find_vector_duplicates 事先找到的 {'point_id', 'similarity'}
+
+    Returns:
+        {'id', 'mastery_level', 'match': 'phrase' | 'vector', 'similarity'}；沒有重複時為 None
+    """
+    cursor.execute(
+        f"""
+        SELECT id, mastery_level
+        FROM knowledge_points
+        WHERE user_id = %s AND {NORMALIZED_PHRASE_SQL.format('correct_phrase')} = {NORMALIZED_PHRASE_SQL.format('%s')}
+        ORDER BY (correct_phrase = %s) DESC, id
+        LIMIT 1
+        """,
+        (user_id, knowledge_point['correct_phrase'], knowledge_point['correct_phrase'])
+    )
+    point = cursor.fetchone()
+    if point:
+        return {**point, 'match': 'phrase', 'similarity': 1.0}
+
+    if not vector_match or vector_match.get('point_id') is None:
+        return None
+
+    # 推論期間知識點可能已被刪除或合併
+    cursor.execute(
+        "SELECT id, mastery_level FROM knowledge_points WHERE id = %s AND user_id = %s",
+        (vector_match['point_id'], user_id)
+    )
+    point = cursor.fetchone()
+    if not point:
+        return None
+    return {**point, 'match': 'vector', 'similarity': vector_match['similarity']}
+
+def _find_root(parents: Dict[int, int], point_id: int) -> int:
+    root = point_id
+    while parents.get(root, root) != root:
+        root = parents[root]
+    while parents.get(point_id, point_id) != root:
+        parents[point_id], point_id = root, parents[point_id]
+    return root
+
+def _union(parents: Dict[int, int], a: int, b: int):
+    root_a, root_b = _find_root(parents, a), _find_root(parents, b)
+    if root_a != root_b:
+        parents[max(root_a, root_b)] = min(root_a, root_b)
+
+def _confirm_pairs(conn, pairs: List, similarity_threshold: float) -> List:
+    """候選知識點對中，dedup_text 的向量相似度達閾值者"""
+    if not pairs:
+        return []
+    candidate_ids = sorted({point_id for pair in pairs for point_id in pair})
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT id, correct_phrase, key_point_summary FROM knowledge_points WHERE id = ANY(%s)",
+            (candidate_ids,)
+        )
+        rows = cursor.fetchall()
+    positions = {row['id']: position for position, row in enumerate(rows)}
+    pairs = [(source, target) for source, target in pairs if source in positions and target in positions]
+    if not pairs:
+        return []
+
+    vectors = _unit_vectors([dedup_text(row) for row in rows])
+    sources = np.array([positions[source] for source, _ in pairs])
+    targets = np.array([positions[target] for _, target in pairs])
+    scores = np.einsum('ij,ij->i', vectors[sources], vectors[targets])
+    return [pair for pair, score in zip(pairs, scores) if score >= similarity_threshold]
+
+def find_duplicate_groups(
+    conn,
+    user_id: Optional[int] = None,
+    similarity_threshold: float = DEDUP_SIMILARITY_THRESHOLD,
+    use_vectors: bool = True
+) -> List[List[int]]:
+    """
+    找出重複的知識點群組（同一用戶內，正規化片語相同或 dedup_text 的向量相似度達閾值，可遞移）
+
+    Returns:
+        每個群組的知識點ID列表（至少兩個），依 ID 排序
+    """
+    # JWT identity 可能是字串，統一轉成整數再與 numpy 陣列或 SQL 參數比較
+    user_id = int(user_id) if user_id is not None else None
+    parents: Dict[int, int] = {}
+
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT array_agg(id ORDER BY id) AS ids
+            FROM knowledge_points
+            WHERE (%(user_id)s::integer IS NULL OR user_id = %(user_id)s::integer)
+            GROUP BY user_id, {NORMALIZED_PHRASE_SQL.format('correct_phrase')}
+            HAVING COUNT(*) > 1
+            """,
+            {'user_id': user_id}
+        )
+        for row in cursor.fetchall():
+            for other in row['ids'][1:]:
+                _union(parents, row['ids'][0], other)
+
+    if use_vectors and similarity_threshold < 1:
+        # 只處理單一用戶時只載入該用戶的向量，不讀取整個資料表
+        point_ids, vectors = load_knowledge_point_embeddings(conn, user_id=user_id)
+        if len(point_ids) > 1:
+            owners = _load_point_owners(conn, point_ids) if user_id is None \
+                else np.full(len(point_ids), user_id, dtype=np.int64)
+            # 已儲存的向量只用來找候選，是否重複以 dedup_text 的向量確認
+            pairs = []
+            for sources, targets, _ in iter_topk_neighbours(
+                vectors, DEDUP_NEIGHBOURS, DEDUP_CANDIDATE_THRESHOLD, groups=owners
+            ):
+                pairs.extend(zip(point_ids[sources].tolist(), point_ids[targets].tolist()))
+            for source, target in _confirm_pairs(conn, pairs, similarity_threshold):
+                _union(parents, source, target)
+
+    groups: Dict[int, List[int]] = {}
+    for point_id in set(parents) | set(parents.values()):
+        groups.setdefault(_find_root(parents, point_id), []).append(point_id)
+    return [sorted(members) for members in groups.values() if len(members) > 1]
+
+def merge_duplicate_points(
+    user_id: Optional[int] = None,
+    similarity_threshold: float = DEDUP_SIMILARITY_THRESHOLD,
+    use_vectors: bool = True,
+    dry_run: bool = False
+) -> Dict:
+    """
+    合併資料庫中已存在的重複知識點
+
+    每個群組保留錯誤與答對次數最多的知識點（相同時保留最早建立的），
+    累加其他知識點的次數、取最低的熟練度與最早的複習日期，
+    把關聯與學習紀錄改指向保留的知識點後刪除其餘知識點。
+
+    Args:
+        user_id: 只處理該用戶（None = 全部用戶）
+        dry_run: 只回傳找到的群組，不修改資料
+
+    Returns:
+        {'groups', 'merged', 'details': [{'keep', 'merged', 'phrases'}]}
+    """
+    user_id = int(user_id) if user_id is not None else None
+    conn = get_db_connection()
+    try:
+        groups = find_duplicate_groups(conn, user_id, similarity_threshold, use_vectors)
+        if not groups:
+            return {'groups': 0, 'merged': 0, 'details': []}
+
+        with conn.cursor() as cursor:
+            all_ids = [point_id for group in groups for point_id in group]
+            cursor.execute(
+                """
+                SELECT id, correct_phrase, mistake_count, correct_count
+                FROM knowledge_points WHERE id = ANY(%s)
+                """,
+                (all_ids,)
+            )
+            points = {row['id']: row for row in cursor.fetchall()}
+
+            duplicate_ids, canonical_ids, details = [], [], []
+            for group in groups:
+                members = [point_id for point_id in group if point_id in points]
+                if len(members) < 2:
+                    continue
+                keep = max(members, key=lambda pid: (
+                    (points[pid]['mistake_count'] or 0) + (points[pid]['correct_count'] or 0), -pid
+                ))
+                merged = [pid for pid in members if pid != keep]
+                duplicate_ids.extend(merged)
+                canonical_ids.extend([keep] * len(merged))
+                details.append({
+                    'keep': keep,
+                    'merged': merged,
+                    'phrases': [points[pid]['correct_phrase'] for pid in members]
+                })
+
+            if dry_run or not duplicate_ids:
+                conn.rollback()
+                return {'groups': len(details), 'merged': len(duplicate_ids), 'details': details}
+
+            def mapping(alias: str = 'm') -> str:
+                return f"unnest(%(dups)s::integer[], %(keeps)s::integer[]) AS {alias}(dup_id, keep_id)"
+            params = {'dups': duplicate_ids, 'keeps': canonical_ids}
+
+            cursor.execute(
+                f"""
+                UPDATE knowledge_points kp
+                SET mistake_count = kp.mistake_count + agg.mistakes,
+                    correct_count = kp.correct_count + agg.corrects,
+                    mastery_level = LEAST(kp.mastery_level, agg.mastery),
+                    last_reviewed_on = GREATEST(kp.last_reviewed_on, agg.last_reviewed),
+                    next_review_date = LEAST(kp.next_review_date, agg.next_review),
+                    memory_stability = LEAST(kp.memory_stability, agg.stability),
+                    memory_difficulty = GREATEST(kp.memory_difficulty, agg.difficulty)
+                FROM (
+                    SELECT m.keep_id,
+                           SUM(COALESCE(d.mistake_count, 0)) AS mistakes,
+                           SUM(COALESCE(d.correct_count, 0)) AS corrects,
+                           MIN(d.mastery_level) AS mastery,
+                           MAX(d.last_reviewed_on) AS last_reviewed,
+                           MIN(d.next_review_date) AS next_review,
+                           MIN(d.memory_stability) AS stability,
+                           MAX(d.memory_difficulty) AS difficulty
+                    FROM {mapping()}
+                    JOIN knowledge_points d ON d.id = m.dup_id
+                    GROUP BY m.keep_id
+                ) agg
+                WHERE kp.id = agg.keep_id
+                """,
+                params
+            )
+            cursor.execute(
+                f"""
+                UPDATE learning_events le
+                SET source_mistake_id = m.keep_id
+                FROM {mapping()}
+                WHERE le.source_mistake_id = m.dup_id
+                """,
+                params
+            )
+            cursor.execute(
+                f"""
+                UPDATE learning_events le
+                SET knowledge_point_id = m.keep_id
+                FROM {mapping()}
+                WHERE le.knowledge_point_id = m.dup_id
+                """,
+                params
+            )
+
+            cursor.execute("SELECT to_regclass('knowledge_links') IS NOT NULL AS has_links")
+            if cursor.fetchone()['has_links']:
+                # 關聯改指向保留的知識點；自我關聯與重複關聯會隨刪除的知識點一起移除
+                cursor.execute(
+                    f"""
+                    INSERT INTO knowledge_links
+                        (source_point_id, target_point_id, similarity_score, link_type, created_at, is_active)
+                    SELECT COALESCE(ms.keep_id, l.source_point_id), COALESCE(mt.keep_id, l.target_point_id),
+                           l.similarity_score, l.link_type, l.created_at, l.is_active
+                    FROM knowledge_links l
+                    LEFT JOIN {mapping('ms')} ON ms.dup_id = l.source_point_id
+                    LEFT JOIN {mapping('mt')} ON mt.dup_id = l.target_point_id
+                    WHERE (ms.dup_id IS NOT NULL OR mt.dup_id IS NOT NULL)
+                      AND COALESCE(ms.keep_id, l.source_point_id) <> COALESCE(mt.keep_id, l.target_point_id)
+                    ON CONFLICT (source_point_id, target_point_id) DO NOTHING
+                    """,
+                    params
+                )
+
+            cursor.execute("DELETE FROM knowledge_points WHERE id = ANY(%s)", (duplicate_ids,))
+            merged_count = cursor.rowcount
+        conn.commit()
+    except Exception as e:
+        logger.error(f"合併重複知識點時發生錯誤: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if not is_pgvector_available():
+        with locked_vector_index(get_vector_dimension()) as index:
+            index.remove(duplicate_ids)
+    due_queue.refresh_points(duplicate_ids + canonical_ids)
+
+    logger.info(f"✅ 合併了 {len(details)} 組重複知識點，移除 {merged_count} 個")
+    return {'groups': len(details), 'merged': merged_count, 'details': details}
@@ -0,0 +1,272 @@
+# app/services/due_queue.py
+"""
+到期複習佇列
+
+每次開始學習都要找出用戶「今天（台北時間）到期」的知識點並依熟練度排序。
+這裡把到期判斷與排序集中起來：
+
+- 到期範圍：在 Python 中計算一次台北日期與對應的 UTC 時間界線，
+  查詢條件只比較欄位本身（next_review_date <= 今天、next_review_at < 明天 00:00 台北），
+  不在欄位上套 DATE(... AT TIME ZONE ...)，才能使用索引。
+- 索引：init_db 建立部分索引 idx_knowledge_points_user_due (user_id, next_review_date) WHERE NOT is_archived，
+  並包含排序欄位，載入一位用戶的到期知識點只需要掃描索引。
+- 記憶體佇列（DUE_QUEUE_ENABLED，預設開啟）：每位用戶的到期知識點以
+  (熟練度, 最後複習時間) 為鍵放入最小堆，取題時直接取前 N 個，
+  只向資料庫讀取這 N 個知識點的完整資料並確認仍然到期。
+  本程序內的複習、新增錯誤、封存與刪除會呼叫 refresh_points 逐筆更新佇列；
+  其他程序造成的變動在取題時的確認步驟中修正，或在 DUE_QUEUE_TTL 秒後整個重新載入。
+  台北日期換日時佇列也會重新載入。
+"""
+
+import os
+import time
+import heapq
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.services.database import execute_query
+
+logger = logging.getLogger(__name__)
+
+TAIPEI_OFFSET = datetime.timedelta(hours=8)
+DUE_QUEUE_ENABLED = os.environ.get('DUE_QUEUE_ENABLED', 'true').lower() == 'true'
+DUE_QUEUE_TTL = int(os.environ.get('DUE_QUEUE_TTL', 300))
+MAX_CACHED_USERS = 256
+MAX_VALIDATION_ROUNDS = 3
+
+# ---------------------------------------------------------------------------
+# 到期範圍
+# ---------------------------------------------------------------------------
+
+def taipei_today(now: Optional[datetime.datetime] = None) -> datetime.date:
+    """目前的台北日期"""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return (now.astimezone(datetime.timezone.utc) + TAIPEI_OFFSET).date()
+
+def taipei_day_start(day: datetime.date) -> datetime.datetime:
+    """台北日期 day 的 00:00 對應的 UTC 時間"""
+    midnight = datetime.datetime.combine(day, datetime.time.min)
+    return (midnight - TAIPEI_OFFSET).replace(tzinfo=datetime.timezone.utc)
+
+def due_cutoff(day: Optional[datetime.date] = None) -> datetime.datetime:
+    """
+    台北日期 day 的隔天 00:00 對應的 UTC 時間
+
+    next_review_at < due_cutoff(day) 與舊寫法 DATE(next_review_at AT TIME ZONE 'UTC' + INTERVAL '8 hours') <= day 等價。
+    """
+    return taipei_day_start((day or taipei_today()) + datetime.timedelta(days=1))
+
+# ---------------------------------------------------------------------------
+# 資料庫查詢
+# ---------------------------------------------------------------------------
+
+def _priority(row: Dict) -> Tuple:
+    """與 ORDER BY mastery_level ASC, last_reviewed_on ASC（NULL 在後）, id ASC 相同的排序鍵"""
+    reviewed = row['last_reviewed_on']
+    return (
+        row['mastery_level'] or 0.0,
+        reviewed is None,
+        reviewed.timestamp() if reviewed else 0.0,
+        row['id'],
+    )
+
+def query_due_points(user_id: int, limit: int, day: Optional[datetime.date] = None) -> List[Dict]:
+    """直接以 SQL 取得到期的知識點（不使用記憶體佇列）"""
+    return execute_query(
+        """
+        SELECT * FROM knowledge_points
+        WHERE user_id = %s AND is_archived = FALSE AND next_review_date <= %s
+        ORDER BY mastery_level ASC, last_reviewed_on ASC, id ASC
+        LIMIT %s
+        """,
+        (user_id, day or taipei_today(), limit),
+        fetch='all'
+    )
+
+def count_due_points(user_id: int, day: Optional[datetime.date] = None) -> int:
+    """用戶今天到期的知識點數量"""
+    queue = _get_queue(user_id, day or taipei_today()) if DUE_QUEUE_ENABLED else None
+    if queue is not None:
+        with _lock:
+            return len(queue.entries)
+    return execute_query(
+        """
+        SELECT COUNT(*) AS count FROM knowledge_points
+        WHERE user_id = %s AND is_archived = FALSE AND next_review_date <= %s
+        """,
+        (user_id, day or taipei_today()),
+        fetch='one'
+    )['count']
+
+# ---------------------------------------------------------------------------
+# 記憶體佇列
+# ---------------------------------------------------------------------------
+
+class _UserQueue:
+    """單一用戶的到期佇列：最小堆 + 目前有效的鍵（堆中過期的項目延遲刪除）"""
+
+    __slots__ = ('day', 'loaded_at', 'heap', 'entries')
+
+    def __init__(self, day: datetime.date, rows: Iterable[Dict]):
+        self.day = day
+        self.loaded_at = time.monotonic()
+        self.entries = {row['id']: _priority(row) for row in rows}
+        self.heap = [(key, point_id) for point_id, key in self.entries.items()]
+        heapq.heapify(self.heap)
+
+    def put(self, point_id: int, key: Tuple):
+        if self.entries.get(point_id) == key:
+            return
+        self.entries[point_id] = key
+        heapq.heappush(self.heap, (key, point_id))
+        self._compact()
+
+    def discard(self, point_id: int):
+        if self.entries.pop(point_id, None) is not None:
+            self._compact()
+
+    def peek(self, limit: int) -> List[int]:
+        """依優先順序取前 limit 個知識點 ID（不移出佇列）"""
+        taken = []
+        while self.heap and len(taken) < limit:
+            key, point_id = heapq.heappop(self.heap)
+            if self.entries.get(point_id) == key:
+                taken.append((key, point_id))
+        for item in taken:
+            heapq.heappush(self.heap, item)
+        return [point_id for _, point_id in taken]
+
+    def _compact(self):
+        # 過期項目太多時重建堆，避免頻繁更新的用戶佔用過多記憶體
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [(key, point_id) for point_id, key in self.entries.items()]
+            heapq.heapify(self.heap)
+
+_queues: "OrderedDict[int, _UserQueue]" = OrderedDict()
+_lock = threading.Lock()
+
+def _load_queue(user_id: int, day: datetime.date) -> _UserQueue:
+    rows = execute_query(
+        """
+        SELECT id, mastery_level, last_reviewed_on FROM knowledge_points
+        WHERE user_id = %s AND is_archived = FALSE AND next_review_date <= %s
+        """,
+        (user_id, day),
+        fetch='all'
+    )
+    return _UserQueue(day, rows)
+
+def _get_queue(user_id: int, day: datetime.date) -> _UserQueue:
+    with _lock:
+        queue = _queues.get(user_id)
+        if queue is not None and queue.day == day and time.monotonic() - queue.loaded_at < DUE_QUEUE_TTL:
+            _queues.move_to_end(user_id)
+            return queue
+
+    queue = _load_queue(user_id, day)
+    with _lock:
+        _queues[user_id] = queue
+        _queues.move_to_end(user_id)
+        while len(_queues) > MAX_CACHED_USERS:
+            _queues.popitem(last=False)
+    return queue
+
+def get_due_points(user_id: int, limit: int) -> List[Dict]:
+    """
+    取得用戶今天到期、優先順序最高的 limit 個知識點（完整欄位）
+
+    順序與 query_due_points 相同：熟練度低的優先，同熟練度時最久沒複習的優先。
+    """
+    day = taipei_today()
+    if not DUE_QUEUE_ENABLED or limit <= 0:
+        return query_due_points(user_id, limit, day) if limit > 0 else []
+
+    queue = _get_queue(user_id, day)
+    for _ in range(MAX_VALIDATION_ROUNDS):
+        with _lock:
+            point_ids = queue.peek(limit)
+        if not point_ids:
+            return []
+
+        # 只讀取選中的知識點並確認仍然到期（其他程序可能已經複習、封存或刪除）
+        rows = execute_query(
+            """
+            SELECT * FROM knowledge_points
+            WHERE id = ANY(%s) AND user_id = %s AND is_archived = FALSE AND next_review_date <= %s
+            """,
+            (point_ids, user_id, day),
+            fetch='all'
+        )
+        stale = False
+        found = {row['id']: row for row in rows}
+        with _lock:
+            for point_id in point_ids:
+                row = found.get(point_id)
+                if row is None:
+                    queue.discard(point_id)
+                    stale = True
+                elif queue.entries.get(point_id) != _priority(row):
+                    queue.put(point_id, _priority(row))
+                    stale = True
+        if not stale:
+            return [found[point_id] for point_id in point_ids]
+
+    logger.info(f"用戶 {user_id} 的到期佇列多次與資料庫不一致，重新載入")
+    invalidate(user_id)
+    return query_due_points(user_id, limit, day)
+
+def refresh_points(point_ids: Iterable[int]):
+    """
+    知識點的熟練度、複習日期、封存狀態變動或被刪除後呼叫（交易提交之後），逐筆更新已載入的佇列
+
+    沒有任何已載入的佇列時不查詢資料庫。
+    """
+    point_ids = sorted({int(point_id) for point_id in point_ids if point_id is not None})
+    if not point_ids or not DUE_QUEUE_ENABLED:
+        return
+    with _lock:
+        if not _queues:
+            return
+
+    try:
+        rows = execute_query(
+            """
+            SELECT id, user_id, mastery_level, last_reviewed_on, next_review_date, is_archived
+            FROM knowledge_points WHERE id = ANY(%s)
+            """,
+            (point_ids,),
+            fetch='all'
+        )
+    except Exception as e:
+        logger.warning(f"更新到期佇列失敗，清空所有佇列: {e}")
+        invalidate()
+        return
+
+    found = {row['id']: row for row in rows}
+    with _lock:
+        for point_id in point_ids:
+            row = found.get(point_id)
+            if row is None:
+                # 已刪除：不知道屬於哪位用戶，從所有佇列移除
+                for queue in _queues.values():
+                    queue.discard(point_id)
+                continue
+            queue = _queues.get(row['user_id'])
+            if queue is None:
+                continue
+            due = row['next_review_date'] is not None and row['next_review_date'] <= queue.day
+            if due and not row['is_archived']:
+                queue.put(point_id, _priority(row))
+            else:
+                queue.discard(point_id)
+
+def invalidate(user_id: Optional[int] = None):
+    """清除單一用戶（或所有用戶）的佇列，下次取題時重新載入"""
+    with _lock:
+        if user_id is None:
+            _queues.clear()
+        else:
+            _queues.pop(user_id, None)
@@ -0,0 +1,207 @@
+# app/services/embedding_autotune.py
+"""
+SentenceTransformer 推論設定的自動調校
+
+在 CPU 上，批次大小、是否依文本長度排序（減少 padding）與 torch 的 intra-op 執行緒數
+對吞吐量影響很大，而最佳值取決於主機的核心數與同時運行的 worker 數。
+autotune 以實際的知識點文本逐一測試各組合，最佳設定依「主機名稱 + 模型」存入
+EMBEDDING_TUNING_PATH；之後載入模型時自動套用，沒有調校結果時使用預設值。
+
+調校可以離線執行（python autotune_embeddings.py），或設定 EMBEDDING_AUTOTUNE=startup
+讓向量服務在啟動時、找不到本機的調校結果時先執行一次。
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import datetime
+import threading
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TUNING_PATH = os.path.join('instance', 'embedding_tuning.json')
+DEFAULT_ENCODE_CONFIG = {'batch_size': 32, 'sort_by_length': True, 'threads': None}
+
+BATCH_SIZE_CANDIDATES = (8, 16, 32, 64, 128)
+SAMPLE_SIZE = 256
+
+_file_lock = threading.Lock()
+
+def get_tuning_path() -> str:
+    return os.environ.get('EMBEDDING_TUNING_PATH', DEFAULT_TUNING_PATH)
+
+def _host_key(model_name: str) -> str:
+    return f"{socket.gethostname()}|{os.cpu_count()}|{model_name}"
+
+def show_progress_bar() -> bool:
+    """只在互動式終端顯示進度條；服務程序與背景執行緒不輸出進度條"""
+    return sys.stderr.isatty() and threading.current_thread() is threading.main_thread()
+
+def _read_tuning_file() -> Dict:
+    try:
+        with open(get_tuning_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def has_encode_config(model_name: str) -> bool:
+    return _host_key(model_name) in _read_tuning_file()
+
+def load_encode_config(model_name: str) -> Dict:
+    """讀取本機與該模型的調校結果，沒有時回傳預設設定"""
+    tuned = _read_tuning_file().get(_host_key(model_name))
+    config = dict(DEFAULT_ENCODE_CONFIG)
+    if tuned:
+        config.update({key: tuned[key] for key in DEFAULT_ENCODE_CONFIG if key in tuned})
+    return config
+
+def save_encode_config(model_name: str, config: Dict):
+    """寫入本機的調校結果（先寫暫存檔再替換）"""
+    path = get_tuning_path()
+    with _file_lock:
+        data = _read_tuning_file()
+        data[_host_key(model_name)] = config
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+def apply_thread_config(threads: Optional[int]):
+    """設定 torch 的 intra-op 執行緒數（整個程序共用；None = 保留 torch 預設）"""
+    if not threads:
+        return
+    try:
+        import torch
+        torch.set_num_threads(int(threads))
+    except Exception as e:
+        logger.warning(f"無法設定 torch 執行緒數: {e}")
+
+def encode_texts(model, texts: List[str], batch_size: int, sort_by_length: bool = True) -> np.ndarray:
+    """
+    分批推論並依原順序回傳向量
+
+    sort_by_length 時先依文本長度排序再分批，同一批的文本長度相近，padding 較少。
+    """
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+
+    order = np.argsort([len(text) for text in texts], kind='stable') if sort_by_length else np.arange(len(texts))
+    progress = show_progress_bar()
+    chunks = []
+    for start in range(0, len(texts), batch_size):
+        batch = [texts[i] for i in order[start:start + batch_size]]
+        chunks.append(model.encode(
+            batch, batch_size=len(batch), convert_to_numpy=True, show_progress_bar=progress
+        ).astype(np.float32))
+
+    vectors = np.concatenate(chunks)
+    result = np.empty_like(vectors)
+    result[order] = vectors
+    return result
+
+def _thread_candidates() -> List[int]:
+    """1, 2, 4, ... 直到核心數（含核心數本身）"""
+    cores = os.cpu_count() or 1
+    candidates, threads = [], 1
+    while threads < cores:
+        candidates.append(threads)
+        threads *= 2
+    candidates.append(cores)
+    return candidates
+
+def load_sample_texts(limit: int = SAMPLE_SIZE) -> List[str]:
+    """從資料庫隨機取出知識點文本作為調校樣本"""
+    from app.services.database import get_db_connection
+    from app.services.embedding_service import create_knowledge_text
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT category, subcategory, correct_phrase, explanation,
+                       user_context_sentence, incorrect_phrase_in_context, key_point_summary
+                FROM knowledge_points
+                ORDER BY random()
+                LIMIT %s
+                """,
+                (limit,)
+            )
+            return [create_knowledge_text(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+def autotune(
+    model_name: Optional[str] = None,
+    texts: Optional[Sequence[str]] = None,
+    batch_sizes: Sequence[int] = BATCH_SIZE_CANDIDATES,
+    thread_options: Optional[Sequence[int]] = None,
+    repeats: int = 2,
+    save: bool = True
+) -> Dict:
+    """
+    測試批次大小、長度排序與執行緒數的組合，回傳（並儲存）吞吐量最高的設定
+
+    每個組合執行 repeats 次取最快的一次，降低其他程序干擾的影響。
+
+    Args:
+        model_name: 模型名稱（None = 目前使用中的模型）
+        texts: 調校樣本（None = 從資料庫取樣）
+        thread_options: 要測試的執行緒數（None = 1, 2, 4, ... 核心數）
+
+    Returns:
+        {'batch_size', 'sort_by_length', 'threads', 'texts_per_second', 'results', ...}
+    """
+    from app.services.embedding_service import get_embedding_model, get_active_model
+
+    model_name = model_name or get_active_model()[0]
+    model = get_embedding_model(model_name)
+    texts = list(texts) if texts else load_sample_texts()
+    if not texts:
+        raise ValueError("沒有可用的調校樣本")
+    thread_options = list(thread_options or _thread_candidates())
+
+    # 預熱，排除第一次推論的初始化時間
+    encode_texts(model, texts[:8], batch_size=8)
+
+    results = []
+    for threads in thread_options:
+        apply_thread_config(threads)
+        for sort_by_length in (True, False):
+            for batch_size in batch_sizes:
+                best = min(
+                    _timed(lambda: encode_texts(model, texts, batch_size, sort_by_length))
+                    for _ in range(repeats)
+                )
+                results.append({
+                    'batch_size': batch_size,
+                    'sort_by_length': sort_by_length,
+                    'threads': threads,
+                    'texts_per_second': round(len(texts) / best, 1)
+                })
+                logger.info(f"調校 {results[-1]}")
+
+    best = max(results, key=lambda result: result['texts_per_second'])
+    apply_thread_config(best['threads'])
+    config = {
+        **best,
+        'sample_size': len(texts),
+        'tuned_at': datetime.datetime.now(datetime.timezone.utc).isoformat()
+    }
+    if save:
+        save_encode_config(model_name, config)
+    logger.info(f"✅ 最佳推論設定 ({model_name}): {best}")
+    return {**config, 'results': results}
+
+def _timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
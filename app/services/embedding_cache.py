@@ -0,0 +1,91 @@
+# app/services/embedding_cache.py
+"""
+查詢向量的 LRU 快取
+
+generate_embedding 的結果以 float32 原始位元組保存，總量受位元組預算限制，
+超過時淘汰最久未使用的項目。鍵為 (模型名稱, 正規化後的文本)。
+"""
+
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import numpy as np
+
+DEFAULT_MAX_BYTES = int(os.environ.get('EMBEDDING_CACHE_BYTES', 8 * 1024 * 1024))
+
+# 每個項目除了向量與鍵以外的估計額外開銷（OrderedDict 節點、tuple、bytes 物件標頭）
+_ENTRY_OVERHEAD = 200
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC 正規化並合併空白；不改變大小寫，因為模型區分大小寫"""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+class EmbeddingCache:
+    """以位元組預算限制大小的 LRU 快取（執行緒安全）"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Tuple[str, str], bytes]' = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entry_size(key: Tuple[str, str], data: bytes) -> int:
+        return len(data) + len(key[1].encode('utf-8')) + _ENTRY_OVERHEAD
+
+    def get(self, model_name: str, text: str) -> Optional[np.ndarray]:
+        key = (model_name, text)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+        return np.frombuffer(data, dtype='<f4').copy()
+
+    def put(self, model_name: str, text: str, vector: np.ndarray):
+        key = (model_name, text)
+        data = np.ascontiguousarray(vector, dtype='<f4').tobytes()
+        size = self._entry_size(key, data)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= self._entry_size(key, previous)
+            self._entries[key] = data
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key, old_data = self._entries.popitem(last=False)
+                self._bytes -= self._entry_size(old_key, old_data)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_ratio': round(self._hits / lookups, 4) if lookups else 0.0
+            }
+
+_cache = EmbeddingCache()
+
+def get_embedding_cache() -> EmbeddingCache:
+    return _cache
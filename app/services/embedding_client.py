@@ -0,0 +1,205 @@
+# app/services/embedding_client.py
+"""
+本地向量服務（embedding_server）的客戶端
+
+Web worker 透過 Unix socket 將文本送往獨立的向量服務程序，
+因此不需要在 worker 內載入 torch 與 Sentence-BERT 模型。
+
+協定格式（標頭皆為 network byte order）:
+    連線建立時服務端先送出: [uint32 模型名稱長度][uint32 維度] + UTF-8 模型名稱
+    客戶端據此確認服務載入的是預期的模型；切換向量模型後、服務尚未重新啟動前，
+    兩者不一致，呼叫端應改用程序內的模型，避免混用兩個模型的向量
+    請求: [uint32 文本數量] + 每個文本 [uint32 位元組長度][UTF-8 內容]
+    回應: [int32 向量數量][uint32 維度] + 數量 x 維度 個 little-endian float32
+          向量數量為 -1 時代表錯誤，維度欄位改為錯誤訊息長度，後接 UTF-8 錯誤訊息
+"""
+
+import os
+import socket
+import struct
+import threading
+import logging
+from typing import List, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = '/tmp/ai_tutor_embedding.sock'
+
+COUNT_HEADER = struct.Struct('!I')
+HELLO_HEADER = struct.Struct('!II')
+RESPONSE_HEADER = struct.Struct('!iI')
+VECTOR_DTYPE = np.dtype('<f4')
+
+# 防止異常請求耗盡服務端記憶體
+MAX_TEXTS_PER_REQUEST = 4096
+MAX_TEXT_BYTES = 64 * 1024
+
+class EmbeddingServerError(RuntimeError):
+    """向量服務回傳的錯誤（例如模型推論失敗）"""
+
+class EmbeddingModelMismatch(EmbeddingServerError):
+    """向量服務載入的模型（或維度）與呼叫端預期的不同"""
+
+def get_socket_path() -> Optional[str]:
+    """讀取向量服務的 socket 路徑；未設定代表在本程序內直接載入模型"""
+    return os.environ.get('EMBEDDING_SERVER_SOCKET') or None
+
+def recv_exact_into(sock: socket.socket, view: memoryview) -> bool:
+    """
+    將 socket 資料直接讀入緩衝區，直到填滿為止
+
+    Returns:
+        True 表示已填滿；在尚未讀到任何位元組前遇到 EOF 則回傳 False
+    """
+    received = 0
+    total = len(view)
+    while received < total:
+        n = sock.recv_into(view[received:], total - received)
+        if n == 0:
+            if received == 0:
+                return False
+            raise ConnectionError("向量服務連線在傳輸途中被關閉")
+        received += n
+    return True
+
+def recv_exact(sock: socket.socket, size: int) -> Optional[bytearray]:
+    """讀取固定長度的資料，連線已關閉則回傳 None"""
+    buffer = bytearray(size)
+    if size and not recv_exact_into(sock, memoryview(buffer)):
+        return None
+    return buffer
+
+def encode_hello(model_name: str, dimension: int) -> bytes:
+    """服務端在連線建立時送出的模型資訊"""
+    data = model_name.encode('utf-8')
+    return HELLO_HEADER.pack(len(data), dimension) + data
+
+def encode_request(texts: List[str]) -> bytes:
+    """將文本列表打包成請求封包"""
+    parts = [COUNT_HEADER.pack(len(texts))]
+    for text in texts:
+        data = text.encode('utf-8')
+        parts.append(COUNT_HEADER.pack(len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+class EmbeddingClient:
+    """
+    向量服務客戶端
+
+    每個執行緒維持一條長連線，避免每次請求都重新建立 socket。
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _get_socket(self) -> socket.socket:
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+                header = recv_exact(sock, HELLO_HEADER.size)
+                if header is None:
+                    raise ConnectionError("向量服務已關閉連線")
+                name_length, dimension = HELLO_HEADER.unpack(header)
+                name = recv_exact(sock, name_length)
+                if name is None:
+                    raise ConnectionError("向量服務已關閉連線")
+            except Exception:
+                sock.close()
+                raise
+            self._local.sock = sock
+            self._local.model = (bytes(name).decode('utf-8'), dimension)
+        return sock
+
+    def _reset_socket(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
+        self._local.model = None
+
+    def _request(self, payload: bytes, model_name: Optional[str], dimension: Optional[int]) -> np.ndarray:
+        sock = self._get_socket()
+        served_name, served_dimension = self._local.model
+        if (model_name is not None and served_name != model_name) or \
+                (dimension is not None and served_dimension != dimension):
+            raise EmbeddingModelMismatch(
+                f"向量服務載入的是 {served_name} ({served_dimension} 維)，預期 {model_name} ({dimension} 維)"
+            )
+        sock.sendall(payload)
+
+        header = recv_exact(sock, RESPONSE_HEADER.size)
+        if header is None:
+            raise ConnectionError("向量服務已關閉連線")
+        count, size = RESPONSE_HEADER.unpack(header)
+
+        if count < 0:
+            message = recv_exact(sock, size) or b''
+            raise EmbeddingServerError(bytes(message).decode('utf-8', errors='replace'))
+        if count and size != served_dimension:
+            raise EmbeddingModelMismatch(f"向量服務回傳 {size} 維的向量，與連線時宣告的 {served_dimension} 維不同")
+
+        # 直接讀入預先配置好的緩衝區，再以 frombuffer 建立陣列，不額外複製
+        buffer = bytearray(count * size * VECTOR_DTYPE.itemsize)
+        if buffer and not recv_exact_into(sock, memoryview(buffer)):
+            raise ConnectionError("向量服務已關閉連線")
+        return np.frombuffer(buffer, dtype=VECTOR_DTYPE).reshape(count, size)
+
+    def encode(self, texts: List[str], model_name: Optional[str] = None, dimension: Optional[int] = None) -> np.ndarray:
+        """
+        向服務請求多個文本的向量
+
+        Args:
+            texts: 文本列表
+            model_name, dimension: 預期的模型與維度；與服務載入的不同時拋出 EmbeddingModelMismatch
+
+        Returns:
+            形狀為 (len(texts), 維度) 的 float32 陣列
+        """
+        if len(texts) > MAX_TEXTS_PER_REQUEST:
+            chunks = [
+                self.encode(texts[i:i + MAX_TEXTS_PER_REQUEST], model_name, dimension)
+                for i in range(0, len(texts), MAX_TEXTS_PER_REQUEST)
+            ]
+            return np.concatenate(chunks)
+
+        payload = encode_request(texts)
+        try:
+            return self._request(payload, model_name, dimension)
+        except EmbeddingModelMismatch:
+            # 服務重新啟動後可能已載入新模型，下次請求重新連線確認
+            self._reset_socket()
+            raise
+        except OSError as e:
+            # 服務重啟後舊連線會失效，重新連線後再試一次
+            logger.warning(f"向量服務連線異常，重新連線: {e}")
+            self._reset_socket()
+            try:
+                return self._request(payload, model_name, dimension)
+            except Exception:
+                self._reset_socket()
+                raise
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_embedding_client() -> Optional[EmbeddingClient]:
+    """取得共用的客戶端實例；未設定 EMBEDDING_SERVER_SOCKET 時回傳 None"""
+    global _client
+    socket_path = get_socket_path()
+    if not socket_path:
+        return None
+    if _client is None or _client.socket_path != socket_path:
+        with _client_lock:
+            if _client is None or _client.socket_path != socket_path:
+                _client = EmbeddingClient(socket_path)
+    return _client
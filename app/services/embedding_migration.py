@@ -0,0 +1,510 @@
+# app/services/embedding_migration.py
+"""
+向量模型的背景遷移
+
+更換模型的流程：
+1. start_migration 在 embedding_models 登記新模型為 migrating。
+2. 遷移期間所有寫入向量的路徑（新增知識點、回填管線、增量重新向量化）照常寫入舊模型的
+   embedding_vector，並以 dual_write_embeddings 同時把新模型的向量寫入
+   knowledge_point_embeddings_next；查詢仍然只讀舊向量。
+3. run_migration 依ID順序分批掃描，為缺少新向量或文本已改變（text_hash 不符）的知識點
+   重新向量化，以批次大小、每秒上限與每輪時間預算控制速度，不會搶走線上流量的資源。
+4. 新向量涵蓋所有知識點後，cutover 在單一交易中鎖住寫入、再次確認全部為最新，
+   把新向量搬進 embedding_vector 並切換使用中的模型；讀取端不會看到新舊向量混雜的狀態。
+   其他程序在 MODEL_REGISTRY_TTL_SECONDS 內改用新模型生成查詢向量。
+"""
+
+import os
+import time
+import hashlib
+import logging
+from typing import Dict, List, Optional
+import numpy as np
+
+from app.services.database import get_db_connection
+from app.services.embedding_service import (
+    create_knowledge_text, batch_generate_embeddings, get_embedding_model, get_active_model,
+    get_migration_target, refresh_model_registry, register_default_model, is_pgvector_available,
+    _pack_copy_binary_rows, _COPY_BINARY_HEADER, _COPY_BINARY_TRAILER
+)
+from app.services.vector_index import VectorIndex, locked_vector_index, replace_vector_index
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = int(os.environ.get('EMBEDDING_MIGRATION_BATCH_SIZE', 64))
+MIGRATION_MAX_RATE = float(os.environ.get('EMBEDDING_MIGRATION_MAX_RATE', 20))   # 每秒最多重新向量化的知識點數（0 = 不限制）
+MIGRATION_TIME_BUDGET_SECONDS = float(os.environ.get('EMBEDDING_MIGRATION_TIME_BUDGET', 20))   # 背景執行緒每輪的時間上限
+
+_CHECKPOINT_JOB = 'embedding_model_migration'
+_MIGRATION_LOCK_KEY = 72038001
+
+_TEXT_FIELDS_SQL = """kp.id, kp.category, kp.subcategory, kp.correct_phrase, kp.explanation,
+       kp.user_context_sentence, kp.incorrect_phrase_in_context, kp.key_point_summary"""
+
+def _text_hash(knowledge_point: Dict) -> str:
+    return hashlib.md5(create_knowledge_text(knowledge_point).encode('utf-8')).hexdigest()
+
+def _is_stale(row: Dict, model_name: str) -> bool:
+    return row['next_model'] != model_name or row['text_hash'] != _text_hash(row)
+
+def _write_next_embeddings(cursor, model_name: str, point_ids: List[int], vectors: np.ndarray, hashes: List[str]) -> int:
+    """以 COPY BINARY 寫入新模型的向量（與 bulk_update_knowledge_point_embeddings 相同的資料列格式）"""
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS embedding_next_staging (
+            id INTEGER NOT NULL,
+            embedding REAL[] NOT NULL
+        ) ON COMMIT DROP
+    """)
+    cursor.execute("TRUNCATE embedding_next_staging")
+    with cursor.copy("COPY embedding_next_staging (id, embedding) FROM STDIN (FORMAT BINARY)") as copy:
+        copy.write(_COPY_BINARY_HEADER)
+        copy.write(memoryview(_pack_copy_binary_rows(point_ids, vectors)).cast('B'))
+        copy.write(_COPY_BINARY_TRAILER)
+
+    cursor.execute(
+        """
+        INSERT INTO knowledge_point_embeddings_next (point_id, model_name, embedding, text_hash, updated_at)
+        SELECT s.id, %s, s.embedding, h.text_hash, NOW()
+        FROM embedding_next_staging s
+        JOIN unnest(%s::integer[], %s::text[]) AS h(id, text_hash) ON h.id = s.id
+        JOIN knowledge_points kp ON kp.id = s.id
+        ON CONFLICT (point_id) DO UPDATE
+        SET model_name = EXCLUDED.model_name, embedding = EXCLUDED.embedding,
+            text_hash = EXCLUDED.text_hash, updated_at = NOW()
+        """,
+        (model_name, list(point_ids), hashes)
+    )
+    return cursor.rowcount
+
+def _embed_and_write(conn, model_name: str, rows: List[Dict]) -> int:
+    vectors = np.asarray(
+        batch_generate_embeddings([create_knowledge_text(row) for row in rows], model_name=model_name),
+        dtype=np.float32
+    )
+    with conn.cursor() as cursor:
+        return _write_next_embeddings(
+            cursor, model_name, [row['id'] for row in rows], vectors, [_text_hash(row) for row in rows]
+        )
+
+def dual_write_embeddings(knowledge_points: List[Dict]) -> int:
+    """
+    遷移期間為剛寫入舊向量的知識點同時寫入新模型的向量
+
+    失敗時只記錄警告：run_migration 會以 text_hash 找出遺漏的知識點並補上。
+
+    Args:
+        knowledge_points: 含 id 與向量文本欄位的知識點
+
+    Returns:
+        寫入的新向量數量；沒有進行中的遷移時為 0
+    """
+    target = get_migration_target()
+    if not target or not knowledge_points:
+        return 0
+
+    conn = get_db_connection()
+    try:
+        written = _embed_and_write(conn, target[0], knowledge_points)
+        conn.commit()
+        return written
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"同時寫入新模型 {target[0]} 的向量失敗，留待背景遷移補上: {e}")
+        return 0
+    finally:
+        conn.close()
+
+def _save_checkpoint(cursor, last_point_id: int):
+    cursor.execute(
+        """
+        INSERT INTO embedding_backfill_checkpoints (job_name, last_point_id, updated_at)
+        VALUES (%s, %s, NOW())
+        ON CONFLICT (job_name) DO UPDATE
+        SET last_point_id = EXCLUDED.last_point_id, updated_at = NOW()
+        """,
+        (_CHECKPOINT_JOB, last_point_id)
+    )
+
+def start_migration(model_name: str, dimension: Optional[int] = None) -> Dict:
+    """
+    開始遷移到新的向量模型
+
+    Args:
+        model_name: 新模型名稱
+        dimension: 新模型的向量維度（None = 載入模型後自動判斷）
+    """
+    # 先確定登記表有使用中的模型，切換時才會把它標記為 retired
+    register_default_model()
+    active_model, _ = get_active_model()
+    if model_name == active_model:
+        raise ValueError(f"{model_name} 已經是使用中的模型")
+    if dimension is None:
+        dimension = int(get_embedding_model(model_name).get_sentence_embedding_dimension())
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT model_name FROM embedding_models WHERE status = 'migrating' FOR UPDATE")
+            current = cursor.fetchone()
+            if current and current['model_name'] != model_name:
+                raise ValueError(f"已有進行中的遷移: {current['model_name']}，請先取消")
+
+            cursor.execute(
+                """
+                INSERT INTO embedding_models (model_name, dimension, status)
+                VALUES (%s, %s, 'migrating')
+                ON CONFLICT (model_name) DO UPDATE SET dimension = EXCLUDED.dimension, status = 'migrating'
+                """,
+                (model_name, dimension)
+            )
+            cursor.execute("DELETE FROM knowledge_point_embeddings_next WHERE model_name <> %s", (model_name,))
+            _save_checkpoint(cursor, 0)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    refresh_model_registry(force=True)
+    logger.info(f"✅ 開始遷移向量模型: {active_model} → {model_name} ({dimension} 維)")
+    return get_migration_status()
+
+def abort_migration() -> bool:
+    """取消進行中的遷移並刪除已生成的新向量"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE embedding_models SET status = 'retired' WHERE status = 'migrating'")
+            aborted = cursor.rowcount > 0
+            cursor.execute("DELETE FROM knowledge_point_embeddings_next")
+            cursor.execute("DELETE FROM embedding_backfill_checkpoints WHERE job_name = %s", (_CHECKPOINT_JOB,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    refresh_model_registry(force=True)
+    if aborted:
+        logger.info("已取消向量模型遷移")
+    return aborted
+
+def get_migration_status() -> Dict:
+    """
+    遷移進度
+
+    coverage 為已有新向量的知識點比例；文本在生成新向量後又被修改的知識點
+    會在下一輪掃描時重新處理，切換前也會再確認一次。
+    """
+    active_model, active_dimension = get_active_model()
+    target = get_migration_target()
+    status = {
+        'active_model': active_model,
+        'active_dimension': active_dimension,
+        'target_model': target[0] if target else None,
+        'target_dimension': target[1] if target else None
+    }
+    if not target:
+        return status
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT
+                    (SELECT COUNT(*) FROM knowledge_points) AS total,
+                    (SELECT COUNT(*) FROM knowledge_point_embeddings_next WHERE model_name = %s) AS migrated,
+                    (SELECT last_point_id FROM embedding_backfill_checkpoints WHERE job_name = %s) AS checkpoint
+                """,
+                (target[0], _CHECKPOINT_JOB)
+            )
+            row = cursor.fetchone()
+    finally:
+        conn.close()
+
+    status.update({
+        'total': row['total'],
+        'migrated': row['migrated'],
+        'coverage': round(row['migrated'] / row['total'], 4) if row['total'] else 1.0,
+        'checkpoint': row['checkpoint'] or 0
+    })
+    return status
+
+def run_migration(
+    batch_size: int = MIGRATION_BATCH_SIZE,
+    max_rate: float = MIGRATION_MAX_RATE,
+    time_budget: Optional[float] = None,
+    auto_cutover: bool = True
+) -> Dict:
+    """
+    推進遷移：從檢查點繼續依ID順序掃描，只為缺少或過期的新向量重新向量化
+
+    Args:
+        batch_size: 每批掃描的知識點數量
+        max_rate: 每秒最多重新向量化的知識點數（0 = 不限制）
+        time_budget: 本次最多執行的秒數（None = 直到掃描完成）
+        auto_cutover: 掃描完一輪且新向量涵蓋所有知識點時自動切換
+
+    Returns:
+        {'scanned', 'embedded', 'completed_pass', 'cutover', 'skipped'}
+    """
+    result = {'scanned': 0, 'embedded': 0, 'completed_pass': False, 'cutover': False, 'skipped': False}
+    target = get_migration_target()
+    if not target:
+        return result
+    model_name = target[0]
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s) AS locked", (_MIGRATION_LOCK_KEY,))
+            locked = cursor.fetchone()['locked']
+            cursor.execute(
+                "SELECT last_point_id FROM embedding_backfill_checkpoints WHERE job_name = %s",
+                (_CHECKPOINT_JOB,)
+            )
+            checkpoint = cursor.fetchone()
+        conn.commit()
+        if not locked:
+            result['skipped'] = True
+            return result
+
+        try:
+            last_point_id = checkpoint['last_point_id'] if checkpoint else 0
+            started = time.monotonic()
+            while time_budget is None or time.monotonic() - started < time_budget:
+                batch_started = time.monotonic()
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        f"""
+                        SELECT {_TEXT_FIELDS_SQL}, n.model_name AS next_model, n.text_hash
+                        FROM knowledge_points kp
+                        LEFT JOIN knowledge_point_embeddings_next n ON n.point_id = kp.id
+                        WHERE kp.id > %s
+                        ORDER BY kp.id
+                        LIMIT %s
+                        """,
+                        (last_point_id, batch_size)
+                    )
+                    rows = cursor.fetchall()
+                conn.commit()
+
+                if not rows:
+                    result['completed_pass'] = True
+                    last_point_id = 0
+                    with conn.cursor() as cursor:
+                        _save_checkpoint(cursor, last_point_id)
+                    conn.commit()
+                    break
+
+                stale = [row for row in rows if _is_stale(row, model_name)]
+                if stale:
+                    result['embedded'] += _embed_and_write(conn, model_name, stale)
+                last_point_id = rows[-1]['id']
+                with conn.cursor() as cursor:
+                    _save_checkpoint(cursor, last_point_id)
+                conn.commit()
+                result['scanned'] += len(rows)
+
+                # 限速：本批重新向量化的數量在 max_rate 下至少需要的時間
+                if max_rate and stale:
+                    time.sleep(max(0.0, len(stale) / max_rate - (time.monotonic() - batch_started)))
+        finally:
+            conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (_MIGRATION_LOCK_KEY,))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"向量模型遷移時發生錯誤: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if result['completed_pass'] and auto_cutover:
+        status = get_migration_status()
+        if status.get('migrated', 0) >= status.get('total', 0):
+            result['cutover'] = cutover()['cutover']
+
+    if result['embedded']:
+        logger.info(f"向量模型遷移: 掃描 {result['scanned']} 個、重新向量化 {result['embedded']} 個知識點")
+    return result
+
+def _column_type(cursor, column: str) -> Optional[str]:
+    cursor.execute(
+        """
+        SELECT format_type(atttypid, atttypmod) AS column_type
+        FROM pg_attribute
+        WHERE attrelid = 'knowledge_points'::regclass AND attname = %s AND NOT attisdropped
+        """,
+        (column,)
+    )
+    row = cursor.fetchone()
+    return row['column_type'] if row else None
+
+_VECTOR_COLUMNS = {'embedding_vector': 'vector', 'embedding_halfvec': 'halfvec', 'embedding_binary': 'bit'}
+
+def _resize_vector_columns(cursor, dimension: int) -> List[str]:
+    """
+    把向量欄位改為新維度（舊向量清空），回傳需要在搬入新向量後執行的重建語句
+
+    先移除向量索引，搬入新向量後再一次建立，比逐列更新 HNSW 索引快得多。
+    引用這些欄位的檢視表（例如 knowledge_linking_stats）必須先移除才能改變型別，之後依原定義重建。
+    """
+    columns = [column for column in _VECTOR_COLUMNS if _column_type(cursor, column)]
+
+    cursor.execute(
+        """
+        SELECT DISTINCT v.oid::regclass::text AS view_name, pg_get_viewdef(v.oid) AS definition
+        FROM pg_depend d
+        JOIN pg_rewrite r ON r.oid = d.objid
+        JOIN pg_class v ON v.oid = r.ev_class
+        JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+        WHERE d.refobjid = 'knowledge_points'::regclass
+          AND a.attname = ANY(%s)
+          AND v.oid <> 'knowledge_points'::regclass
+        """,
+        (columns,)
+    )
+    views = cursor.fetchall()
+    for view in views:
+        cursor.execute(f"DROP VIEW {view['view_name']}")
+
+    cursor.execute(
+        """
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE tablename = 'knowledge_points' AND indexdef LIKE '%%USING hnsw%%'
+        """
+    )
+    indexes = cursor.fetchall()
+    for index in indexes:
+        cursor.execute(f"DROP INDEX {index['indexname']}")
+
+    for column in columns:
+        cursor.execute(
+            f"ALTER TABLE knowledge_points ALTER COLUMN {column} TYPE {_VECTOR_COLUMNS[column]}({dimension}) USING NULL"
+        )
+
+    return (
+        [index['indexdef'] for index in indexes]
+        + [f"CREATE VIEW {view['view_name']} AS {view['definition']}" for view in views]
+    )
+
+def cutover() -> Dict:
+    """
+    切換到遷移中的模型（單一交易）
+
+    鎖住 knowledge_points 的寫入（讀取不受影響）後確認每個知識點都有與目前文本一致的新向量，
+    否則放棄切換、留待下一輪遷移補上。確認後把新向量搬進 embedding_vector、
+    更新模型登記表並清除以舊模型計算的主題群組。維度改變時需要改變欄位型別，
+    期間會短暫阻擋讀取。
+
+    Returns:
+        {'cutover': bool, 'model', 'stale', 'points'}
+    """
+    target = get_migration_target()
+    if not target:
+        return {'cutover': False, 'model': None, 'stale': 0, 'points': 0}
+    model_name, dimension = target
+    use_pgvector = is_pgvector_available()
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT model_name FROM embedding_models WHERE status IN ('active', 'migrating') FOR UPDATE")
+            cursor.execute("LOCK TABLE knowledge_points IN SHARE ROW EXCLUSIVE MODE")
+
+            stale = 0
+            points = 0
+            with conn.cursor(name='embedding_cutover_verify') as verify:
+                verify.execute(
+                    f"""
+                    SELECT {_TEXT_FIELDS_SQL}, n.model_name AS next_model, n.text_hash
+                    FROM knowledge_points kp
+                    LEFT JOIN knowledge_point_embeddings_next n ON n.point_id = kp.id
+                    """
+                )
+                for row in verify:
+                    points += 1
+                    if _is_stale(row, model_name):
+                        stale += 1
+            if stale:
+                conn.rollback()
+                logger.warning(f"仍有 {stale} 個知識點沒有最新的 {model_name} 向量，暫不切換")
+                return {'cutover': False, 'model': model_name, 'stale': stale, 'points': points}
+
+            if use_pgvector:
+                rebuild_statements = []
+                if _column_type(cursor, 'embedding_vector') != f"vector({dimension})":
+                    rebuild_statements = _resize_vector_columns(cursor, dimension)
+                cursor.execute(
+                    """
+                    UPDATE knowledge_points kp
+                    SET embedding_vector = n.embedding::vector, embedding_model = n.model_name,
+                        embedding_updated_at = NOW()
+                    FROM knowledge_point_embeddings_next n
+                    WHERE kp.id = n.point_id
+                    """
+                )
+                for statement in rebuild_statements:
+                    cursor.execute(statement)
+            else:
+                cursor.execute(
+                    """
+                    SELECT n.point_id, n.embedding, kp.user_id
+                    FROM knowledge_point_embeddings_next n
+                    JOIN knowledge_points kp ON kp.id = n.point_id
+                    """
+                )
+                rows = cursor.fetchall()
+                cursor.execute(
+                    """
+                    UPDATE knowledge_points kp
+                    SET embedding_model = n.model_name, embedding_updated_at = NOW()
+                    FROM knowledge_point_embeddings_next n
+                    WHERE kp.id = n.point_id
+                    """
+                )
+
+            # 主題群組的中心是舊模型的向量，切換後需要重新分群
+            cursor.execute("UPDATE knowledge_points SET cluster_id = NULL WHERE cluster_id IS NOT NULL")
+            cursor.execute("DELETE FROM knowledge_clusters")
+
+            cursor.execute(
+                "UPDATE embedding_models SET status = 'retired' WHERE status = 'active'"
+            )
+            cursor.execute(
+                "UPDATE embedding_models SET status = 'active', activated_at = NOW() WHERE model_name = %s",
+                (model_name,)
+            )
+            cursor.execute("DELETE FROM knowledge_point_embeddings_next")
+            cursor.execute("DELETE FROM embedding_backfill_checkpoints WHERE job_name = %s", (_CHECKPOINT_JOB,))
+
+        if use_pgvector:
+            conn.commit()
+        else:
+            index = VectorIndex(dimension=dimension, capacity=max(len(rows), 1))
+            if rows:
+                index.add(
+                    [row['point_id'] for row in rows],
+                    np.array([row['embedding'] for row in rows], dtype=np.float32),
+                    [row['user_id'] for row in rows]
+                )
+            # 交易提交後才替換並寫回索引快照（提交失敗時保留舊索引）；
+            # 提交與替換都在檔案鎖內，其他 worker 不會在兩者之間寫入舊索引
+            with locked_vector_index(dimension):
+                conn.commit()
+                replace_vector_index(index)
+    except Exception as e:
+        logger.error(f"切換向量模型時發生錯誤: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    refresh_model_registry(force=True)
+    logger.info(
+        f"✅ 已切換到向量模型 {model_name}（{points} 個知識點）。"
+        f"請重新啟動向量服務，並重建語義關聯與主題群組。"
+    )
+    return {'cutover': True, 'model': model_name, 'stale': 0, 'points': points}
@@ -0,0 +1,290 @@
+# app/services/embedding_pipeline.py
+"""
+串流式向量回填管線
+
+讀取、向量化、寫入三個階段各自在獨立執行緒中運行，以有界佇列相連：
+    讀取: 伺服器端游標分段讀出待處理的知識點
+    向量化: 將每段知識點組成文本並批次生成向量
+    寫入: 以 COPY BINARY 批次寫入，並在同一個交易中更新檢查點
+
+記憶體用量只與佇列深度與分段大小有關，不會隨待處理數量成長；
+資料庫 I/O 與模型推論可以同時進行。中斷後再次執行會從檢查點繼續。
+"""
+
+import time
+import queue
+import threading
+import logging
+from typing import Callable, Dict, List, Optional
+import numpy as np
+
+from app.services.database import get_db_connection
+from app.services.embedding_service import (
+    create_knowledge_text, batch_generate_embeddings, bulk_update_knowledge_point_embeddings,
+    is_pgvector_available, get_vector_dimension
+)
+from app.services.embedding_migration import dual_write_embeddings
+from app.services.vector_index import get_vector_index
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_NAME = 'embedding_backfill'
+FETCH_CHUNK_SIZE = 500   # 每段讀取與寫入的知識點數量
+QUEUE_DEPTH = 4          # 每個佇列最多暫存的段數
+
+_END = object()
+
+class StageStats:
+    """單一階段的處理量與忙碌時間"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+
+    def add(self, items: int, seconds: float):
+        self.items += items
+        self.busy_seconds += seconds
+
+    def to_dict(self) -> Dict:
+        return {
+            'items': self.items,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'items_per_second': round(self.items / self.busy_seconds, 1) if self.busy_seconds else 0.0
+        }
+
+def get_checkpoint(job_name: str = DEFAULT_JOB_NAME) -> int:
+    """讀取上次處理到的知識點ID，沒有檢查點時回傳 0"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT last_point_id FROM embedding_backfill_checkpoints WHERE job_name = %s",
+                (job_name,)
+            )
+            row = cursor.fetchone()
+        return row['last_point_id'] if row else 0
+    finally:
+        conn.close()
+
+def clear_checkpoint(job_name: str = DEFAULT_JOB_NAME):
+    """清除檢查點，下次從頭掃描"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM embedding_backfill_checkpoints WHERE job_name = %s", (job_name,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _save_checkpoint(cursor, job_name: str, last_point_id: int):
+    cursor.execute(
+        """
+        INSERT INTO embedding_backfill_checkpoints (job_name, last_point_id, updated_at)
+        VALUES (%s, %s, NOW())
+        ON CONFLICT (job_name) DO UPDATE
+        SET last_point_id = EXCLUDED.last_point_id, updated_at = NOW()
+        """,
+        (job_name, last_point_id)
+    )
+
+def _put(target: queue.Queue, item, stop_event: threading.Event) -> bool:
+    """放入有界佇列；下游已停止時放棄並回傳 False"""
+    while not stop_event.is_set():
+        try:
+            target.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _pending_clause():
+    """待處理（沒有向量）知識點的 WHERE 條件與參數"""
+    if is_pgvector_available():
+        return "embedding_vector IS NULL", ()
+    # 沒有 pgvector 時，以程序內索引中已有的ID判斷是否待處理
+    indexed_ids = get_vector_index(get_vector_dimension()).ids.tolist()
+    return "NOT (id = ANY(%s))", (indexed_ids,)
+
+def count_pending_points() -> int:
+    """沒有向量且未封存的知識點數量"""
+    pending_clause, params = _pending_clause()
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*) AS pending FROM knowledge_points WHERE {pending_clause} AND is_archived = FALSE",
+                params
+            )
+            return cursor.fetchone()['pending']
+    finally:
+        conn.close()
+
+def _fetch_stage(start_after_id: int, limit: Optional[int], out_queue: queue.Queue,
+                 stop_event: threading.Event, stats: StageStats, errors: List[Exception]):
+    conn = None
+    try:
+        pending_clause, params = _pending_clause()
+
+        conn = get_db_connection()
+        # 具名游標即伺服器端游標，每次只把一段資料傳到客戶端
+        with conn.cursor(name='embedding_backfill_cursor') as cursor:
+            cursor.execute(
+                f"""
+                SELECT id, category, subcategory, correct_phrase, explanation,
+                       user_context_sentence, incorrect_phrase_in_context, key_point_summary
+                FROM knowledge_points
+                WHERE {pending_clause} AND is_archived = FALSE AND id > %s
+                ORDER BY id
+                LIMIT %s
+                """,
+                params + (start_after_id, limit)
+            )
+            while not stop_event.is_set():
+                started = time.perf_counter()
+                rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+                stats.add(len(rows), time.perf_counter() - started)
+                if not rows or not _put(out_queue, rows, stop_event):
+                    break
+    except Exception as e:
+        logger.error(f"讀取待處理知識點時發生錯誤: {e}")
+        errors.append(e)
+        stop_event.set()
+    finally:
+        if conn:
+            conn.close()
+        _put(out_queue, _END, stop_event)
+
+def _encode_stage(in_queue: queue.Queue, out_queue: queue.Queue,
+                  stop_event: threading.Event, stats: StageStats):
+    while True:
+        try:
+            rows = in_queue.get(timeout=0.5)
+        except queue.Empty:
+            if stop_event.is_set():
+                break
+            continue
+        if rows is _END:
+            break
+        point_ids = [row['id'] for row in rows]
+        started = time.perf_counter()
+        try:
+            texts = [create_knowledge_text(row) for row in rows]
+            vectors = np.asarray(batch_generate_embeddings(texts), dtype=np.float32)
+            # 模型遷移期間同時寫入新模型的向量
+            dual_write_embeddings(rows)
+        except Exception as e:
+            # 單段失敗不影響後續段落，交給寫入階段記錄失敗數
+            logger.error(f"知識點 {point_ids[0]}~{point_ids[-1]} 向量生成失敗: {e}")
+            vectors = None
+        stats.add(len(point_ids), time.perf_counter() - started)
+        if not _put(out_queue, (point_ids, vectors), stop_event):
+            break
+    _put(out_queue, _END, stop_event)
+
+def run_backfill(
+    limit: Optional[int] = None,
+    job_name: str = DEFAULT_JOB_NAME,
+    resume: bool = True,
+    progress_callback: Optional[Callable[[Dict], None]] = None
+) -> Dict:
+    """
+    以串流管線為缺少向量的知識點生成並寫入向量
+
+    Args:
+        limit: 處理數量限制（None = 全部處理）
+        job_name: 檢查點名稱
+        resume: 是否從上次的檢查點繼續
+        progress_callback: 每寫入一段後以目前統計呼叫
+
+    Returns:
+        處理結果統計，包含各階段的吞吐量
+    """
+    start_after_id = get_checkpoint(job_name) if resume else 0
+    if start_after_id:
+        logger.info(f"從檢查點繼續處理（ID > {start_after_id}）")
+
+    fetch_stats = StageStats('fetch')
+    encode_stats = StageStats('encode')
+    write_stats = StageStats('write')
+    fetch_queue = queue.Queue(maxsize=QUEUE_DEPTH)
+    write_queue = queue.Queue(maxsize=QUEUE_DEPTH)
+    stop_event = threading.Event()
+    fetch_errors: List[Exception] = []
+
+    fetcher = threading.Thread(
+        target=_fetch_stage, name='backfill-fetch',
+        args=(start_after_id, limit, fetch_queue, stop_event, fetch_stats, fetch_errors),
+        daemon=True
+    )
+    encoder = threading.Thread(
+        target=_encode_stage, name='backfill-encode',
+        args=(fetch_queue, write_queue, stop_event, encode_stats),
+        daemon=True
+    )
+
+    result = {"processed": 0, "success": 0, "failed": 0, "last_point_id": start_after_id}
+    started = time.perf_counter()
+    fetcher.start()
+    encoder.start()
+
+    conn = get_db_connection()
+    try:
+        while True:
+            try:
+                item = write_queue.get(timeout=0.5)
+            except queue.Empty:
+                # 上游因錯誤停止時不會送出結束標記
+                if not encoder.is_alive():
+                    break
+                continue
+            if item is _END:
+                break
+            point_ids, vectors = item
+
+            write_started = time.perf_counter()
+            updated = 0
+            try:
+                with conn.cursor() as cursor:
+                    if vectors is not None:
+                        updated = bulk_update_knowledge_point_embeddings(point_ids, vectors, conn=conn)
+                    _save_checkpoint(cursor, job_name, point_ids[-1])
+                conn.commit()
+            except Exception as e:
+                logger.error(f"寫入知識點 {point_ids[0]}~{point_ids[-1]} 向量失敗: {e}")
+                conn.rollback()
+                with conn.cursor() as cursor:
+                    _save_checkpoint(cursor, job_name, point_ids[-1])
+                conn.commit()
+            write_stats.add(len(point_ids), time.perf_counter() - write_started)
+
+            result["processed"] += len(point_ids)
+            result["success"] += updated
+            result["failed"] += len(point_ids) - updated
+            result["last_point_id"] = point_ids[-1]
+            logger.info(f"已處理 {result['processed']} 個知識點（成功 {result['success']}）")
+
+            if progress_callback:
+                progress_callback(dict(result))
+    finally:
+        # 寫入階段提前結束時通知上游停止
+        stop_event.set()
+        conn.close()
+        fetcher.join()
+        encoder.join()
+
+    elapsed = time.perf_counter() - started
+    result["elapsed_seconds"] = round(elapsed, 3)
+    result["items_per_second"] = round(result["processed"] / elapsed, 1) if elapsed else 0.0
+    result["stages"] = {
+        stats.name: stats.to_dict() for stats in (fetch_stats, encode_stats, write_stats)
+    }
+
+    if fetch_errors:
+        raise fetch_errors[0]
+
+    # 完整掃描結束後清除檢查點，讓先前失敗的知識點下次能被重新處理
+    if limit is None or result["processed"] < limit:
+        clear_checkpoint(job_name)
+
+    return result
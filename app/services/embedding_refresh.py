@@ -0,0 +1,167 @@
+# app/services/embedding_refresh.py
+"""
+知識點內容修改後的增量重新向量化
+
+update_knowledge_point_details 只在向量文本的欄位實際改變時設定 embedding_dirty_at。
+背景執行緒定期處理「最後一次修改已超過防抖時間」的知識點：批次重新生成向量，
+刪除這些知識點原有的語義關聯，再只為它們重新建立關聯，不需要全表重建。
+
+多個 worker 同時啟動時，以 PostgreSQL advisory lock 確保同一時間只有一個在處理。
+有進行中的向量模型遷移時，同一個執行緒也會分段推進遷移（見 embedding_migration）。
+"""
+
+import os
+import time
+import threading
+import logging
+from typing import Dict, Optional
+
+from app.services.database import get_db_connection
+from app.services.embedding_service import (
+    create_knowledge_text, batch_generate_embeddings, bulk_update_knowledge_point_embeddings,
+    link_knowledge_points, get_migration_target
+)
+from app.services.embedding_migration import dual_write_embeddings, run_migration, MIGRATION_TIME_BUDGET_SECONDS
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL_SECONDS = int(os.environ.get('EMBEDDING_REFRESH_INTERVAL', 60))   # 0 = 不啟動背景執行緒
+REFRESH_DEBOUNCE_SECONDS = int(os.environ.get('EMBEDDING_REFRESH_DEBOUNCE', 30))
+REFRESH_BATCH_SIZE = 200
+
+# advisory lock 的識別值（任意固定整數）
+_REFRESH_LOCK_KEY = 72033001
+
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+def refresh_dirty_embeddings(
+    debounce_seconds: int = REFRESH_DEBOUNCE_SECONDS,
+    batch_size: int = REFRESH_BATCH_SIZE,
+    similarity_threshold: float = 0.8,
+    max_links: int = 5
+) -> Dict:
+    """
+    重新向量化已修改的知識點並更新它們的關聯
+
+    Args:
+        debounce_seconds: 最後一次修改後至少經過的秒數，避免連續編輯時重複計算
+        batch_size: 每批處理的知識點數量
+
+    Returns:
+        {'refreshed', 'links_removed', 'links_created', 'skipped'}
+    """
+    result = {'refreshed': 0, 'links_removed': 0, 'links_created': 0, 'skipped': False}
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s) AS locked", (_REFRESH_LOCK_KEY,))
+            locked = cursor.fetchone()['locked']
+        conn.commit()
+        if not locked:
+            result['skipped'] = True
+            return result
+
+        try:
+            while True:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        """
+                        SELECT id, category, subcategory, correct_phrase, explanation,
+                               user_context_sentence, incorrect_phrase_in_context, key_point_summary,
+                               embedding_dirty_at
+                        FROM knowledge_points
+                        WHERE embedding_dirty_at IS NOT NULL
+                          AND embedding_dirty_at <= NOW() - make_interval(secs => %s)
+                          AND is_archived = FALSE
+                        ORDER BY embedding_dirty_at
+                        LIMIT %s
+                        """,
+                        (debounce_seconds, batch_size)
+                    )
+                    rows = cursor.fetchall()
+                conn.commit()
+                if not rows:
+                    break
+
+                point_ids = [row['id'] for row in rows]
+                # 生成向量時不持有任何交易或鎖，期間的編輯不會被擋住
+                vectors = batch_generate_embeddings([create_knowledge_text(row) for row in rows])
+                dual_write_embeddings(rows)
+
+                with conn.cursor() as cursor:
+                    bulk_update_knowledge_point_embeddings(point_ids, vectors, conn=conn)
+
+                    # 生成向量期間又被修改的知識點維持待處理狀態，下一輪再處理
+                    cursor.execute(
+                        """
+                        UPDATE knowledge_points kp
+                        SET embedding_dirty_at = NULL
+                        FROM unnest(%s::integer[], %s::timestamptz[]) AS d(id, dirty_at)
+                        WHERE kp.id = d.id AND kp.embedding_dirty_at = d.dirty_at
+                        """,
+                        (point_ids, [row['embedding_dirty_at'] for row in rows])
+                    )
+
+                    cursor.execute(
+                        """
+                        DELETE FROM knowledge_links
+                        WHERE link_type = 'semantic_similarity'
+                          AND (source_point_id = ANY(%s) OR target_point_id = ANY(%s))
+                        """,
+                        (point_ids, point_ids)
+                    )
+                    result['links_removed'] += cursor.rowcount
+                    result['links_created'] += link_knowledge_points(
+                        cursor, point_ids, similarity_threshold, max_links
+                    )
+                conn.commit()
+                result['refreshed'] += len(point_ids)
+
+                if len(rows) < batch_size:
+                    break
+        finally:
+            conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (_REFRESH_LOCK_KEY,))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"重新向量化已修改的知識點時發生錯誤: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if result['refreshed']:
+        logger.info(
+            f"✅ 已重新向量化 {result['refreshed']} 個知識點"
+            f"（移除 {result['links_removed']} 條、建立 {result['links_created']} 條關聯）"
+        )
+    return result
+
+def _run_worker(interval: int):
+    while True:
+        time.sleep(interval)
+        try:
+            refresh_dirty_embeddings()
+            # 有進行中的模型遷移時，每輪只花有限的時間重新向量化，避免佔用線上流量的資源
+            if get_migration_target():
+                run_migration(time_budget=MIGRATION_TIME_BUDGET_SECONDS)
+        except Exception:
+            # 錯誤已記錄，下一輪再試
+            pass
+
+def start_refresh_worker(interval: int = REFRESH_INTERVAL_SECONDS) -> bool:
+    """啟動背景重新向量化執行緒（每個程序只會啟動一次）"""
+    global _worker
+    if interval <= 0:
+        return False
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=_run_worker, args=(interval,), name='embedding-refresh', daemon=True
+            )
+            _worker.start()
+            logger.info(f"✅ 已啟動向量增量更新執行緒（每 {interval} 秒）")
+    return True
@@ -0,0 +1,220 @@
+# app/services/embedding_server.py
+"""
+本地向量服務程序
+
+模型只在這個程序內載入一次，並透過 Unix socket 對所有 web worker 提供服務。
+同時到達的請求會在短時間窗口內合併成一個批次，只執行一次模型前向運算，
+回傳的向量以原始 float32 緩衝區傳送，協定細節見 embedding_client。
+
+啟動方式:
+    EMBEDDING_SERVER_SOCKET=/tmp/ai_tutor_embedding.sock python -m app.services.embedding_server
+"""
+
+import os
+import time
+import queue
+import argparse
+import threading
+import socketserver
+import logging
+from concurrent.futures import Future
+from typing import Callable, List
+import numpy as np
+
+from app.services.embedding_client import (
+    COUNT_HEADER, RESPONSE_HEADER, VECTOR_DTYPE, DEFAULT_SOCKET_PATH,
+    MAX_TEXTS_PER_REQUEST, MAX_TEXT_BYTES, recv_exact, encode_hello
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class _PendingRequest:
+    __slots__ = ('texts', 'future')
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future = Future()
+
+class MicroBatcher:
+    """
+    動態微批次處理器
+
+    第一個請求到達後，最多再等待 max_wait_ms 毫秒或累積到 max_batch_size 個文本，
+    再把所有請求合併成一次 encode 呼叫。
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray],
+                 max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        request = _PendingRequest(texts)
+        self._queue.put(request)
+        return request.future
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            count = len(pending[0].texts)
+            deadline = time.monotonic() + self.max_wait
+
+            while count < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(request)
+                count += len(request.texts)
+
+            self._flush(pending)
+
+    def _flush(self, pending: List[_PendingRequest]):
+        texts = [text for request in pending for text in request.texts]
+        try:
+            vectors = np.ascontiguousarray(self.encode_fn(texts), dtype=VECTOR_DTYPE)
+        except Exception as e:
+            logger.error(f"批次向量推論失敗: {e}")
+            for request in pending:
+                request.future.set_exception(e)
+            return
+
+        offset = 0
+        for request in pending:
+            size = len(request.texts)
+            request.future.set_result(vectors[offset:offset + size])
+            offset += size
+
+class EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    """處理單一 worker 連線；同一條連線可連續送出多個請求"""
+
+    def _read_texts(self):
+        header = recv_exact(self.request, COUNT_HEADER.size)
+        if header is None:
+            return None
+        (count,) = COUNT_HEADER.unpack(header)
+        if count > MAX_TEXTS_PER_REQUEST:
+            raise ValueError(f"單次請求文本數量過多: {count}")
+
+        texts = []
+        for _ in range(count):
+            (length,) = COUNT_HEADER.unpack(recv_exact(self.request, COUNT_HEADER.size))
+            if length > MAX_TEXT_BYTES:
+                raise ValueError(f"文本長度超過上限: {length} bytes")
+            texts.append(bytes(recv_exact(self.request, length)).decode('utf-8'))
+        return texts
+
+    def _send_error(self, message: str) -> bool:
+        data = message.encode('utf-8')
+        try:
+            self.request.sendall(RESPONSE_HEADER.pack(-1, len(data)) + data)
+            return True
+        except OSError:
+            return False
+
+    def handle(self):
+        # 先告知客戶端載入的模型與維度，客戶端不一致時改用程序內的模型
+        try:
+            self.request.sendall(encode_hello(self.server.model_name, self.server.dimension))
+        except OSError:
+            return
+        while True:
+            try:
+                texts = self._read_texts()
+            except (ValueError, TypeError, UnicodeDecodeError) as e:
+                # 封包格式錯誤時無法再對齊後續資料，回報後直接關閉連線
+                self._send_error(str(e))
+                return
+            except OSError:
+                return
+            if texts is None:
+                return
+
+            try:
+                vectors = self.server.batcher.submit(texts).result() if texts else \
+                    np.empty((0, self.server.dimension), dtype=VECTOR_DTYPE)
+            except Exception as e:
+                if not self._send_error(f"向量推論失敗: {e}"):
+                    return
+                continue
+
+            count, dimension = vectors.shape
+            try:
+                self.request.sendall(RESPONSE_HEADER.pack(count, dimension))
+                # 直接傳送陣列底層記憶體，不轉成 bytes 物件
+                self.request.sendall(memoryview(vectors).cast('B'))
+            except OSError:
+                return
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, batcher: MicroBatcher, model_name: str, dimension: int):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, EmbeddingRequestHandler)
+        os.chmod(socket_path, 0o660)
+        self.batcher = batcher
+        self.model_name = model_name
+        self.dimension = dimension
+
+def create_server(socket_path: str, max_batch_size: int, max_wait_ms: float) -> EmbeddingServer:
+    """載入模型、預熱後建立向量服務"""
+    # 只有服務程序會載入 torch 與模型
+    from app.services.embedding_service import get_embedding_model, get_active_model
+    from app.services.embedding_autotune import load_encode_config, encode_texts, has_encode_config, autotune
+
+    model_name = get_active_model()[0]
+    # 向量服務是唯一執行推論的程序，在開始接受連線前調校，不會與 web worker 搶用核心
+    if os.environ.get('EMBEDDING_AUTOTUNE') == 'startup' and not has_encode_config(model_name):
+        try:
+            autotune(model_name)
+        except Exception as e:
+            logger.warning(f"推論設定調校失敗，使用預設值: {e}")
+
+    # 載入模型時已套用本機調校的執行緒數；微批次的大小由 max_batch_size 決定，
+    # 這裡只沿用調校得到的推論批次上限與長度排序
+    model = get_embedding_model(model_name)
+    config = load_encode_config(model_name)
+    encode_batch_size = min(max_batch_size, config['batch_size'])
+
+    def encode(texts: List[str]) -> np.ndarray:
+        return encode_texts(model, texts, encode_batch_size, sort_by_length=config['sort_by_length'])
+
+    warmup = encode(["warmup"])
+    dimension = int(warmup.shape[1])
+
+    batcher = MicroBatcher(encode, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    return EmbeddingServer(socket_path, batcher, model_name, dimension)
+
+def main():
+    parser = argparse.ArgumentParser(description="本地向量服務（Unix socket + 動態微批次）")
+    parser.add_argument('--socket', default=os.environ.get('EMBEDDING_SERVER_SOCKET', DEFAULT_SOCKET_PATH))
+    parser.add_argument('--max-batch', type=int, default=int(os.environ.get('EMBEDDING_SERVER_MAX_BATCH', 64)))
+    parser.add_argument('--max-wait-ms', type=float, default=float(os.environ.get('EMBEDDING_SERVER_MAX_WAIT_MS', 5)))
+    args = parser.parse_args()
+
+    server = create_server(args.socket, args.max_batch, args.max_wait_ms)
+    logger.info(
+        f"✅ 向量服務已啟動: {args.socket} "
+        f"(模型: {server.model_name}, 維度: {server.dimension}, 批次上限: {args.max_batch}, 等待窗口: {args.max_wait_ms}ms)"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("向量服務停止中...")
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+if __name__ == '__main__':
+    main()
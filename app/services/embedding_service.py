@@ -1,12 +1,16 @@
 # app/services/embedding_service.py
 
 import os
+import time
+import struct
 import numpy as np
-import psycopg2
 from typing import List, Dict, Optional, Tuple
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 from app.services.database import get_db_connection
+from app.services.embedding_client import get_embedding_client, EmbeddingModelMismatch
+from app.services.embedding_cache import get_embedding_cache, normalize_text
+from app.services.vector_index import get_vector_index, locked_vector_index
+from app.services import stats_service
+from app.services.embedding_autotune import load_encode_config, apply_thread_config, encode_texts
 import datetime
 import logging
 
@@ -14,26 +18,222 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# 全域變數儲存模型實例（延遲載入）
-_embedding_model = None
+# 已載入的模型實例（延遲載入，依模型名稱保存；模型遷移期間會同時載入新舊兩個模型）
+_embedding_models: Dict[str, object] = {}
+
+# 目前使用中的模型與維度。EMBEDDING_MODEL / EMBEDDING_DIMENSION 只在 embedding_models 登記表
+# 還沒有使用中的模型時作為初始值，之後以登記表為準（見 embedding_migration）
 _model_name = os.environ.get('EMBEDDING_MODEL', "paraphrase-multilingual-MiniLM-L12-v2")  # 384維，支援中英文混合
-_vector_dimension = 384
+_vector_dimension = int(os.environ.get('EMBEDDING_DIMENSION', 384))
+
+# 遷移中的新模型 (名稱, 維度)；沒有進行中的遷移時為 None
+_migration_target: Optional[Tuple[str, int]] = None
+
+# 重新讀取模型登記表的間隔（其他程序完成切換後，最多經過這段時間就會改用新模型）
+MODEL_REGISTRY_TTL_SECONDS = 60
+_registry_checked_at = 0.0
 
 # 生產環境最佳化設定
 _device = 'cpu'  # Render 通常沒有 GPU，強制使用 CPU
 
-def get_embedding_model():
-    """獲取 Sentence-BERT 模型實例（單例模式）"""
-    global _embedding_model
-    if _embedding_model is None:
-        logger.info(f"正在載入 Sentence-BERT 模型: {_model_name}")
+# 向量搜尋後端: 'auto'（自動偵測 pgvector）、'pgvector'、'local'（程序內向量索引）
+_vector_backend = os.environ.get('VECTOR_SEARCH_BACKEND', 'auto')
+_pgvector_available = None
+_pgvector_version = None
+
+# HNSW 搜尋時保留的候選數量（pgvector 預設 40；依用戶過濾時需要較大的值）
+HNSW_EF_SEARCH = int(os.environ.get('HNSW_EF_SEARCH', 100))
+
+# 向量索引的儲存模式: 'full'（vector）、'halfvec'（半精度）、'binary'（二元量化）
+# 量化模式先以量化欄位的 HNSW 索引粗篩候選，再以完整精度的 embedding_vector 重新排序
+VECTOR_STORAGE_MODE = os.environ.get('VECTOR_STORAGE_MODE', 'full')
+
+# 各模式的 (粗篩欄位, 距離運算子, 查詢向量的轉換)
+_COARSE_SEARCH = {
+    'full': ('embedding_vector', '<=>', '%(vector)s::vector'),
+    'halfvec': ('embedding_halfvec', '<=>', '%(vector)s::halfvec'),
+    'binary': ('embedding_binary', '<~>', 'binary_quantize(%(vector)s::vector)'),
+}
+
+# 粗篩候選數量 = 結果數量 × 倍數
+_RERANK_FACTORS = {'full': 1, 'halfvec': 2, 'binary': 10}
+
+# 批次寫入向量時，每次 COPY 送出的列數
+BULK_WRITE_CHUNK_SIZE = 5000
+
+# PostgreSQL COPY BINARY 格式的檔頭與結尾
+_COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+_COPY_BINARY_TRAILER = struct.pack('!h', -1)
+_FLOAT4_OID = 700
+
+def get_embedding_model(model_name: Optional[str] = None):
+    """
+    獲取 Sentence-BERT 模型實例（每個模型只載入一次）
+
+    sentence_transformers 延遲匯入：設定 EMBEDDING_SERVER_SOCKET 的 web worker
+    全程不會呼叫這個函式，因此不需要載入 torch。
+
+    Args:
+        model_name: 模型名稱（None = 目前使用中的模型）
+    """
+    model_name = model_name or get_active_model()[0]
+    model = _embedding_models.get(model_name)
+    if model is None:
+        logger.info(f"正在載入 Sentence-BERT 模型: {model_name}")
         try:
-            _embedding_model = SentenceTransformer(_model_name, device=_device)
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(model_name, device=_device)
+            _embedding_models[model_name] = model
             logger.info(f"✅ Sentence-BERT 模型載入成功 (設備: {_device})")
         except Exception as e:
             logger.error(f"❌ 模型載入失敗: {e}")
             raise
-    return _embedding_model
+        _apply_encode_config(model_name)
+    return model
+
+def _apply_encode_config(model_name: str):
+    """
+    套用本機的推論調校結果（執行緒數）
+
+    這裡只讀取已儲存的結果：模型可能在 web worker 處理請求時才載入，不能在請求中執行調校。
+    調校只在向量服務啟動時（EMBEDDING_AUTOTUNE=startup）或 autotune_embeddings.py 中執行。
+    """
+    try:
+        apply_thread_config(load_encode_config(model_name)['threads'])
+    except Exception as e:
+        logger.warning(f"套用推論調校設定失敗，使用預設值: {e}")
+
+def register_default_model():
+    """
+    登記表沒有使用中的模型時，以 EMBEDDING_MODEL / EMBEDDING_DIMENSION 登記為使用中
+
+    在啟動時（create_app）與開始遷移前呼叫；請求路徑上的 refresh_model_registry 只讀取登記表。
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO embedding_models (model_name, dimension, status, activated_at)
+                SELECT %s, %s, 'active', NOW()
+                WHERE NOT EXISTS (SELECT 1 FROM embedding_models WHERE status = 'active')
+                ON CONFLICT DO NOTHING
+                """,
+                (_model_name, _vector_dimension)
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    refresh_model_registry(force=True)
+
+def refresh_model_registry(force: bool = False):
+    """
+    從 embedding_models 登記表讀取使用中與遷移中的模型（只讀取，不寫入）
+
+    登記表沒有使用中的模型時沿用 EMBEDDING_MODEL / EMBEDDING_DIMENSION（見 register_default_model）。
+    讀取失敗（例如資料庫尚未初始化）時沿用目前的設定。
+    """
+    global _model_name, _vector_dimension, _migration_target, _registry_checked_at
+    now = time.monotonic()
+    if not force and now - _registry_checked_at < MODEL_REGISTRY_TTL_SECONDS:
+        return
+    _registry_checked_at = now
+
+    try:
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT model_name, dimension, status FROM embedding_models WHERE status IN ('active', 'migrating')"
+                )
+                rows = {row['status']: row for row in cursor.fetchall()}
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"讀取向量模型登記表失敗，沿用目前設定 ({_model_name}): {e}")
+        return
+
+    active = rows.get('active')
+    if active and (active['model_name'], active['dimension']) != (_model_name, _vector_dimension):
+        logger.info(f"使用中的向量模型: {active['model_name']} ({active['dimension']} 維)")
+        _model_name, _vector_dimension = active['model_name'], active['dimension']
+    target = rows.get('migrating')
+    _migration_target = (target['model_name'], target['dimension']) if target else None
+
+def get_active_model() -> Tuple[str, int]:
+    """目前用於寫入與查詢的模型 (名稱, 維度)"""
+    refresh_model_registry()
+    return _model_name, _vector_dimension
+
+def get_vector_dimension() -> int:
+    return get_active_model()[1]
+
+def get_migration_target() -> Optional[Tuple[str, int]]:
+    """遷移中的新模型 (名稱, 維度)；沒有進行中的遷移時為 None"""
+    refresh_model_registry()
+    return _migration_target
+
+_server_mismatch_logged = None
+
+def _encode_with_server(texts: List[str], model_name: str) -> Optional[np.ndarray]:
+    """
+    交由本地向量服務處理（與其他 worker 的請求合併成同一批次）
+
+    只在 model_name 是使用中的模型、且向量服務載入的也是這個模型與維度時使用；
+    否則（例如切換模型後服務尚未重新啟動）回傳 None，由呼叫端改用程序內的模型。
+    """
+    global _server_mismatch_logged
+    active_model, dimension = get_active_model()
+    client = get_embedding_client() if model_name == active_model else None
+    if client is None:
+        return None
+    try:
+        return client.encode(texts, model_name=active_model, dimension=dimension)
+    except EmbeddingModelMismatch as e:
+        if _server_mismatch_logged != str(e):
+            _server_mismatch_logged = str(e)
+            logger.warning(f"{e}；改用程序內的模型，請重新啟動向量服務")
+        return None
+
+def is_pgvector_available() -> bool:
+    """
+    判斷資料庫是否可使用 pgvector（已安裝擴展並執行過向量遷移）
+    
+    不可用時，向量的寫入與相似度搜尋改由程序內向量索引（vector_index）處理。
+    """
+    global _pgvector_available
+    if _vector_backend == 'pgvector':
+        return True
+    if _vector_backend == 'local':
+        return False
+    
+    if _pgvector_available is None:
+        try:
+            conn = get_db_connection()
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT EXISTS (
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'knowledge_points' AND column_name = 'embedding_vector'
+                    ) AS available
+                """)
+                _pgvector_available = cursor.fetchone()['available']
+            conn.close()
+            
+            if not _pgvector_available:
+                logger.warning("⚠️ 資料庫未啟用 pgvector，改用程序內向量索引")
+        except Exception as e:
+            # 偵測失敗時不快取結果，下次呼叫再試
+            logger.error(f"偵測 pgvector 時發生錯誤: {e}")
+            return False
+    
+    return _pgvector_available
+
+# create_knowledge_text 使用的欄位；這些欄位改變時向量需要重新生成
+EMBEDDING_TEXT_FIELDS = (
+    'correct_phrase', 'incorrect_phrase_in_context', 'key_point_summary', 'explanation',
+    'category', 'subcategory', 'user_context_sentence'
+)
 
 def create_knowledge_text(knowledge_point: Dict) -> str:
     """
@@ -76,52 +276,86 @@ def create_knowledge_text(knowledge_point: Dict) -> str:
     
     return " | ".join(components)
 
-def generate_embedding(text: str) -> np.ndarray:
+def generate_embedding(text: str, model_name: Optional[str] = None, use_cache: bool = True) -> np.ndarray:
     """
     生成單一文本的向量
     
+    文本先經過空白與 Unicode 正規化（與 batch_generate_embeddings 相同）。
+    查詢的結果會存入查詢向量快取，相同文本再次查詢時不需要推論。
+    
     Args:
         text: 要向量化的文本
+        model_name: 模型名稱（None = 目前使用中的模型）
+        use_cache: 是否使用查詢向量快取；知識點本身的文本只會向量化一次，
+                   傳入 False 以免把真正的查詢擠出快取
         
     Returns:
-        384維的 numpy 向量
+        numpy 向量（維度依模型而定）
     """
+    active_model = get_active_model()[0]
+    model_name = model_name or active_model
+    text = normalize_text(text)
+    cache = get_embedding_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(model_name, text)
+        if cached is not None:
+            return cached
+    
     try:
-        model = get_embedding_model()
-        embedding = model.encode(text, convert_to_numpy=True)
-        return embedding.astype(np.float32)
+        vectors = _encode_with_server([text], model_name)
+        if vectors is not None:
+            embedding = vectors[0]
+        else:
+            model = get_embedding_model(model_name)
+            # show_progress_bar 預設依日誌等級決定，INFO 時每次查詢都會輸出進度條
+            embedding = model.encode(text, convert_to_numpy=True, show_progress_bar=False).astype(np.float32)
+        
+        if cache is not None:
+            cache.put(model_name, text, embedding)
+        return embedding
     except Exception as e:
         logger.error(f"生成向量時發生錯誤: {e}")
         raise
 
-def batch_generate_embeddings(texts: List[str], batch_size: int = 32) -> List[np.ndarray]:
+def batch_generate_embeddings(
+    texts: List[str],
+    batch_size: Optional[int] = None,
+    model_name: Optional[str] = None
+) -> List[np.ndarray]:
     """
     批次生成多個文本的向量
     
+    批次大小與是否依長度排序預設採用本機的調校結果（見 embedding_autotune）。
+    文本與 generate_embedding 一樣先正規化；批次處理的是知識點文本，不經過查詢向量快取。
+    
     Args:
         texts: 文本列表
-        batch_size: 批次大小
+        batch_size: 批次大小（None = 調校結果）
+        model_name: 模型名稱（None = 目前使用中的模型）
         
     Returns:
         向量列表
     """
     if not texts:
         return []
+    texts = [normalize_text(text) for text in texts]
     
     try:
-        model = get_embedding_model()
+        model_name = model_name or get_active_model()[0]
+        vectors = _encode_with_server(texts, model_name)
+        if vectors is not None:
+            logger.info(f"透過向量服務批次生成 {len(texts)} 個向量")
+            return list(vectors)
+
+        model = get_embedding_model(model_name)
+        config = load_encode_config(model_name)
+        batch_size = batch_size or config['batch_size']
         logger.info(f"開始批次生成 {len(texts)} 個向量，批次大小: {batch_size}")
         
-        all_embeddings = []
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i+batch_size]
-            logger.info(f"處理批次 {i//batch_size + 1}/{(len(texts)-1)//batch_size + 1}")
-            
-            batch_embeddings = model.encode(batch, convert_to_numpy=True, show_progress_bar=True)
-            all_embeddings.extend([emb.astype(np.float32) for emb in batch_embeddings])
+        vectors = encode_texts(model, texts, batch_size, sort_by_length=config['sort_by_length'])
         
         logger.info("✅ 批次向量生成完成")
-        return all_embeddings
+        return list(vectors)
         
     except Exception as e:
         logger.error(f"批次生成向量時發生錯誤: {e}")
@@ -139,6 +373,9 @@ def update_knowledge_point_embedding(point_id: int, embedding_vector: np.ndarray
         更新是否成功
     """
     try:
+        if not is_pgvector_available():
+            return _store_in_local_index([point_id], [embedding_vector]) > 0
+        
         conn = get_db_connection()
         with conn.cursor() as cursor:
             # 將 numpy 陣列轉換為 PostgreSQL vector 格式
@@ -147,13 +384,15 @@ def update_knowledge_point_embedding(point_id: int, embedding_vector: np.ndarray
             cursor.execute(
                 """
                 UPDATE knowledge_points 
-                SET embedding_vector = %s::vector, embedding_updated_at = %s
+                SET embedding_vector = %s::vector, embedding_updated_at = %s, embedding_model = %s
                 WHERE id = %s
                 """,
-                (vector_str, datetime.datetime.now(datetime.timezone.utc), point_id)
+                (vector_str, datetime.datetime.now(datetime.timezone.utc), get_active_model()[0], point_id)
             )
             
             updated_rows = cursor.rowcount
+            if updated_rows:
+                _assign_clusters(cursor, [point_id], [embedding_vector])
             conn.commit()
         
         conn.close()
@@ -166,6 +405,234 @@ def update_knowledge_point_embedding(point_id: int, embedding_vector: np.ndarray
             conn.close()
         return False
 
+def _assign_clusters(cursor, point_ids: List[int], vectors):
+    """將新向量指派到最近的主題群組；失敗時只記錄，不影響向量本身的寫入"""
+    from app.services.clustering_service import assign_knowledge_points
+    try:
+        with cursor.connection.transaction():
+            assign_knowledge_points(cursor, point_ids, vectors)
+    except Exception as e:
+        logger.warning(f"指派 {len(point_ids)} 個知識點到主題群組時發生錯誤: {e}")
+
+def _store_in_local_index(point_ids: List[int], embeddings) -> int:
+    """將向量寫入程序內索引（沒有 pgvector 時使用），回傳寫入數量"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, user_id FROM knowledge_points WHERE id = ANY(%s)",
+                (list(point_ids),)
+            )
+            owners = {row['id']: row['user_id'] for row in cursor.fetchall()}
+        
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        keep = [i for i, point_id in enumerate(point_ids) if point_id in owners]
+        if not keep:
+            return 0
+        
+        kept_ids = [point_ids[i] for i in keep]
+        model_name, dimension = get_active_model()
+        with locked_vector_index(dimension) as index:
+            index.add(kept_ids, vectors[keep], [owners[point_id] for point_id in kept_ids])
+        
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE knowledge_points SET embedding_updated_at = NOW(), embedding_model = %s WHERE id = ANY(%s)",
+                (model_name, kept_ids)
+            )
+            _assign_clusters(cursor, kept_ids, vectors[keep])
+        conn.commit()
+        return len(kept_ids)
+    finally:
+        conn.close()
+
+def _copy_binary_row_dtype(dimension: int) -> np.dtype:
+    """
+    COPY BINARY 中一列 (id INTEGER, embedding REAL[]) 的位元組配置
+
+    每列長度固定，因此整批向量可以直接以 numpy 結構化陣列組成 COPY 資料流，
+    不需要逐一把浮點數轉成文字。
+    """
+    return np.dtype([
+        ('field_count', '>i2'),
+        ('id_length', '>i4'),
+        ('id', '>i4'),
+        ('array_length', '>i4'),
+        ('ndim', '>i4'),
+        ('has_nulls', '>i4'),
+        ('element_oid', '>i4'),
+        ('dim_size', '>i4'),
+        ('lower_bound', '>i4'),
+        ('elements', np.dtype([('length', '>i4'), ('value', '>f4')]), (dimension,)),
+    ])
+
+def _pack_copy_binary_rows(point_ids: List[int], vectors: np.ndarray) -> np.ndarray:
+    """將 ID 與向量矩陣打包成 COPY BINARY 的資料列"""
+    count, dimension = vectors.shape
+    rows = np.empty(count, dtype=_copy_binary_row_dtype(dimension))
+    rows['field_count'] = 2
+    rows['id_length'] = 4
+    rows['id'] = point_ids
+    # 陣列標頭 20 bytes + 每個元素 (長度 4 bytes + 數值 4 bytes)
+    rows['array_length'] = 20 + dimension * 8
+    rows['ndim'] = 1
+    rows['has_nulls'] = 0
+    rows['element_oid'] = _FLOAT4_OID
+    rows['dim_size'] = dimension
+    rows['lower_bound'] = 1
+    rows['elements']['length'] = 4
+    rows['elements']['value'] = vectors
+    return rows
+
+def bulk_update_knowledge_point_embeddings(
+    point_ids: List[int],
+    embeddings,
+    conn=None
+) -> int:
+    """
+    以 COPY BINARY 批次寫入多個知識點的向量
+
+    向量先以二進位格式 COPY 到暫存表，再用一次 UPDATE ... FROM 套用到
+    knowledge_points，整批只需要少數幾次往返。
+
+    Args:
+        point_ids: 知識點ID列表
+        embeddings: 與 point_ids 對應的向量（列表或二維陣列）
+        conn: 既有的資料庫連線；提供時由呼叫端負責 commit
+
+    Returns:
+        實際更新的知識點數量
+    """
+    if len(point_ids) == 0:
+        return 0
+
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if vectors.ndim != 2 or vectors.shape[0] != len(point_ids):
+        raise ValueError(f"向量形狀 {vectors.shape} 與知識點數量 {len(point_ids)} 不符")
+    
+    if not is_pgvector_available():
+        return _store_in_local_index(list(point_ids), vectors)
+
+    owns_connection = conn is None
+    if owns_connection:
+        conn = get_db_connection()
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS embedding_staging (
+                    id INTEGER NOT NULL,
+                    embedding REAL[] NOT NULL
+                ) ON COMMIT DROP
+            """)
+            cursor.execute("TRUNCATE embedding_staging")
+
+            with cursor.copy("COPY embedding_staging (id, embedding) FROM STDIN (FORMAT BINARY)") as copy:
+                copy.write(_COPY_BINARY_HEADER)
+                for start in range(0, len(point_ids), BULK_WRITE_CHUNK_SIZE):
+                    rows = _pack_copy_binary_rows(
+                        point_ids[start:start + BULK_WRITE_CHUNK_SIZE],
+                        vectors[start:start + BULK_WRITE_CHUNK_SIZE]
+                    )
+                    copy.write(memoryview(rows).cast('B'))
+                copy.write(_COPY_BINARY_TRAILER)
+
+            cursor.execute(
+                """
+                UPDATE knowledge_points kp
+                SET embedding_vector = s.embedding::vector, embedding_updated_at = %s, embedding_model = %s
+                FROM embedding_staging s
+                WHERE kp.id = s.id
+                """,
+                (datetime.datetime.now(datetime.timezone.utc), get_active_model()[0])
+            )
+            updated_rows = cursor.rowcount
+            _assign_clusters(cursor, list(point_ids), vectors)
+
+        if owns_connection:
+            conn.commit()
+        return updated_rows
+
+    except Exception as e:
+        logger.error(f"批次寫入 {len(point_ids)} 個知識點向量時發生錯誤: {e}")
+        if owns_connection:
+            conn.rollback()
+        raise
+    finally:
+        if owns_connection:
+            conn.close()
+
+def load_knowledge_point_embeddings(conn=None, user_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    載入所有未封存知識點的向量（提供 user_id 時只載入該用戶的知識點）
+
+    以 COPY ... TO STDOUT (FORMAT BINARY) 讀出，資料列與寫入時的位元組配置相同，
+    整個資料流直接以 numpy 結構化陣列解析。
+
+    Args:
+        conn: 既有的資料庫連線
+        user_id: 只載入該用戶的知識點（None = 全部用戶）
+
+    Returns:
+        (依ID排序的知識點ID陣列, 對應的 float32 向量矩陣)
+    """
+    user_id = int(user_id) if user_id is not None else None
+    if not is_pgvector_available():
+        index = get_vector_index(get_vector_dimension())
+        ids = index.ids.copy()
+        owns_connection = conn is None
+        if owns_connection:
+            conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT id FROM knowledge_points
+                    WHERE id = ANY(%s) AND is_archived = FALSE AND (%s::integer IS NULL OR user_id = %s::integer)
+                    """,
+                    (ids.tolist(), user_id, user_id)
+                )
+                active = np.array([row['id'] for row in cursor.fetchall()], dtype=np.int64)
+        finally:
+            if owns_connection:
+                conn.close()
+        rows = np.flatnonzero(np.isin(ids, active))
+        rows = rows[np.argsort(ids[rows], kind='stable')]
+        return ids[rows], np.array(index.vectors[rows], dtype=np.float32)
+
+    owns_connection = conn is None
+    if owns_connection:
+        conn = get_db_connection()
+
+    buffer = bytearray()
+    try:
+        with conn.cursor() as cursor:
+            with cursor.copy("""
+                COPY (
+                    SELECT id, embedding_vector::real[]
+                    FROM knowledge_points
+                    WHERE embedding_vector IS NOT NULL AND is_archived = FALSE
+                      AND (%(user_id)s::integer IS NULL OR user_id = %(user_id)s::integer)
+                    ORDER BY id
+                ) TO STDOUT (FORMAT BINARY)
+            """, {'user_id': user_id}) as copy:
+                for data in copy:
+                    buffer += data
+    finally:
+        if owns_connection:
+            conn.close()
+
+    payload = memoryview(buffer)[len(_COPY_BINARY_HEADER):len(buffer) - len(_COPY_BINARY_TRAILER)]
+    dimension = get_vector_dimension()
+    row_dtype = _copy_binary_row_dtype(dimension)
+    if len(payload) % row_dtype.itemsize:
+        raise ValueError(f"COPY 資料長度 {len(payload)} 與 {dimension} 維向量的資料列不符")
+
+    rows = np.frombuffer(payload, dtype=row_dtype)
+    ids = rows['id'].astype(np.int64)
+    vectors = rows['elements']['value'].astype(np.float32)
+    return ids, vectors
+
 def generate_and_store_embedding_for_point(knowledge_point: Dict) -> bool:
     """
     為單一知識點生成並儲存向量
@@ -182,7 +649,7 @@ def generate_and_store_embedding_for_point(knowledge_point: Dict) -> bool:
         logger.info(f"生成向量文本: {text[:100]}...")
         
         # 生成向量
-        embedding = generate_embedding(text)
+        embedding = generate_embedding(text, use_cache=False)
         
         # 儲存到資料庫
         point_id = knowledge_point.get('id')
@@ -190,6 +657,9 @@ def generate_and_store_embedding_for_point(knowledge_point: Dict) -> bool:
             success = update_knowledge_point_embedding(point_id, embedding)
             if success:
                 logger.info(f"✅ 知識點 {point_id} 向量生成並儲存成功")
+                # 模型遷移期間同時寫入新模型的向量
+                from app.services.embedding_migration import dual_write_embeddings
+                dual_write_embeddings([knowledge_point])
             return success
         else:
             logger.error("知識點缺少 ID，無法儲存向量")
@@ -199,109 +669,198 @@ def generate_and_store_embedding_for_point(knowledge_point: Dict) -> bool:
         logger.error(f"為知識點生成向量時發生錯誤: {e}")
         return False
 
-def batch_process_knowledge_points(limit: Optional[int] = None) -> Dict[str, int]:
+def batch_process_knowledge_points(
+    limit: Optional[int] = None,
+    resume: bool = True,
+    progress_callback=None
+) -> Dict:
     """
     批次處理資料庫中沒有向量的知識點
     
+    以串流管線執行（見 embedding_pipeline）：讀取、向量化與寫入三階段重疊進行，
+    中斷後再次呼叫會從檢查點繼續。
+    
     Args:
         limit: 處理數量限制（None = 全部處理）
+        resume: 是否從上次中斷的檢查點繼續
+        progress_callback: 每寫入一段後以目前統計呼叫
         
     Returns:
-        處理結果統計
+        處理結果統計，包含各階段的吞吐量
     """
+    from app.services.embedding_pipeline import run_backfill
+    
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            # 查詢沒有向量的知識點
-            query = """
-                SELECT id, category, subcategory, correct_phrase, explanation,
-                       user_context_sentence, incorrect_phrase_in_context, key_point_summary
-                FROM knowledge_points 
-                WHERE embedding_vector IS NULL AND is_archived = FALSE
-                ORDER BY id
-            """
-            
-            if limit:
-                query += f" LIMIT {limit}"
-            
-            cursor.execute(query)
-            knowledge_points = cursor.fetchall()
-        
-        conn.close()
+        result = run_backfill(limit=limit, resume=resume, progress_callback=progress_callback)
         
-        if not knowledge_points:
+        if result["processed"] == 0:
             logger.info("所有知識點都已有向量")
-            return {"processed": 0, "success": 0, "failed": 0}
-        
-        logger.info(f"找到 {len(knowledge_points)} 個需要生成向量的知識點")
-        
-        # 準備批次處理
-        texts = []
-        point_data = []
-        
-        for point in knowledge_points:
-            point_dict = {
-                'id': point[0],
-                'category': point[1],
-                'subcategory': point[2],
-                'correct_phrase': point[3],
-                'explanation': point[4],
-                'user_context_sentence': point[5],
-                'incorrect_phrase_in_context': point[6],
-                'key_point_summary': point[7]
-            }
-            
-            text = create_knowledge_text(point_dict)
-            texts.append(text)
-            point_data.append(point_dict)
-        
-        # 批次生成向量
-        embeddings = batch_generate_embeddings(texts)
-        
-        # 逐一儲存到資料庫
-        success_count = 0
-        failed_count = 0
-        
-        for i, (point, embedding) in enumerate(zip(point_data, embeddings)):
-            try:
-                if update_knowledge_point_embedding(point['id'], embedding):
-                    success_count += 1
-                else:
-                    failed_count += 1
-                    
-                # 每處理100個顯示進度
-                if (i + 1) % 100 == 0:
-                    logger.info(f"已處理 {i + 1}/{len(point_data)} 個知識點")
-                    
-            except Exception as e:
-                logger.error(f"儲存知識點 {point['id']} 向量失敗: {e}")
-                failed_count += 1
-        
-        result = {
-            "processed": len(knowledge_points),
-            "success": success_count,
-            "failed": failed_count
-        }
-        
-        logger.info(f"✅ 批次處理完成: {result}")
+        else:
+            logger.info(f"✅ 批次處理完成: {result}")
         return result
         
     except Exception as e:
         logger.error(f"批次處理知識點時發生錯誤: {e}")
         return {"processed": 0, "success": 0, "failed": 0}
 
+def _search_local_index(
+    query_vector: np.ndarray,
+    similarity_threshold: float,
+    max_results: int,
+    user_id: Optional[int] = None,
+    exclude_ids: Optional[List[int]] = None
+) -> List[Dict]:
+    """在程序內向量索引中搜尋，並從資料庫補上知識點內容"""
+    index = get_vector_index(get_vector_dimension())
+    # 多取一些候選，排除已封存的知識點後仍有足夠結果
+    candidates = index.search(
+        query_vector,
+        k=max_results * 2,
+        threshold=similarity_threshold,
+        user_id=user_id,
+        exclude_ids=exclude_ids
+    )
+    if not candidates:
+        return []
+    
+    conn = get_db_connection()
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT id, correct_phrase, key_point_summary
+            FROM knowledge_points
+            WHERE id = ANY(%s) AND is_archived = FALSE
+            """,
+            ([point_id for point_id, _ in candidates],)
+        )
+        details = {row['id']: row for row in cursor.fetchall()}
+    conn.close()
+    
+    results = []
+    for point_id, score in candidates:
+        if point_id in details:
+            results.append({
+                'point_id': point_id,
+                'similarity_score': score,
+                'correct_phrase': details[point_id]['correct_phrase'],
+                'key_point_summary': details[point_id]['key_point_summary']
+            })
+            if len(results) >= max_results:
+                break
+    return results
+
+def _pgvector_supports_iterative_scan(cursor) -> bool:
+    """pgvector 0.8 起支援 hnsw.iterative_scan"""
+    global _pgvector_version
+    if _pgvector_version is None:
+        cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = cursor.fetchone()
+        _pgvector_version = tuple(int(part) for part in row['extversion'].split('.')[:2]) if row else (0, 0)
+    return _pgvector_version >= (0, 8)
+
+def configure_hnsw_scan(cursor, max_results: int):
+    """
+    設定目前交易的 HNSW 搜尋參數
+    
+    依用戶過濾是在索引掃描之後進行，ef_search 太小時過濾後的結果會不足；
+    pgvector 0.8 以上另外開啟 iterative scan，結果不足時會繼續掃描索引。
+    """
+    ef_search = min(max(HNSW_EF_SEARCH, max_results), 1000)
+    cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(ef_search),))
+    if _pgvector_supports_iterative_scan(cursor):
+        cursor.execute("SELECT set_config('hnsw.iterative_scan', 'relaxed_order', true)")
+
+def _storage_mode() -> str:
+    if VECTOR_STORAGE_MODE not in _COARSE_SEARCH:
+        logger.warning(f"未知的 VECTOR_STORAGE_MODE: {VECTOR_STORAGE_MODE}，改用 full")
+        return 'full'
+    return VECTOR_STORAGE_MODE
+
+def _rerank_candidates(max_results: int) -> int:
+    """量化模式下粗篩階段要取出的候選數量"""
+    factor = int(os.environ.get('VECTOR_RERANK_FACTOR', _RERANK_FACTORS[_storage_mode()]))
+    return max_results * max(factor, 1)
+
+def _search_pgvector(
+    cursor,
+    vector_str: str,
+    similarity_threshold: float,
+    max_results: int,
+    user_id: Optional[int] = None,
+    exclude_point_id: Optional[int] = None
+) -> List[Dict]:
+    """
+    以 HNSW 索引搜尋最近的知識點
+    
+    最內層子查詢只做「ORDER BY 距離 LIMIT k」，讓索引直接產生排序結果；
+    量化模式下這一層在量化欄位上取出較多候選，再以完整精度向量重新排序。
+    相似度閾值放在最外層過濾，不會打斷索引掃描。
+    """
+    column, operator, query_expr = _COARSE_SEARCH[_storage_mode()]
+    candidates = _rerank_candidates(max_results)
+    
+    filters = ""
+    if user_id is not None:
+        filters += " AND user_id = %(user_id)s"
+    if exclude_point_id is not None:
+        filters += " AND id != %(exclude_point_id)s"
+    
+    configure_hnsw_scan(cursor, candidates)
+    cursor.execute(
+        f"""
+        SELECT id, correct_phrase, key_point_summary, 1 - distance AS similarity
+        FROM (
+            SELECT id, correct_phrase, key_point_summary,
+                   embedding_vector <=> %(vector)s::vector AS distance
+            FROM (
+                SELECT id, correct_phrase, key_point_summary, embedding_vector
+                FROM knowledge_points
+                WHERE {column} IS NOT NULL AND is_archived = FALSE{filters}
+                ORDER BY {column} {operator} {query_expr}
+                LIMIT %(candidates)s
+            ) coarse
+            ORDER BY distance
+            LIMIT %(max_results)s
+        ) candidates
+        WHERE 1 - distance >= %(threshold)s
+        ORDER BY distance
+        """,
+        {
+            'vector': vector_str,
+            'candidates': candidates,
+            'max_results': max_results,
+            'threshold': similarity_threshold,
+            'user_id': user_id,
+            'exclude_point_id': exclude_point_id
+        }
+    )
+    
+    return [
+        {
+            'point_id': row['id'],
+            'correct_phrase': row['correct_phrase'],
+            'key_point_summary': row['key_point_summary'],
+            'similarity_score': float(row['similarity'])
+        }
+        for row in cursor.fetchall()
+    ]
+
 def find_similar_knowledge_points(
     target_point_id: int,
     similarity_threshold: float = 0.75,
-    max_results: int = 10
+    max_results: int = 10,
+    user_id: Optional[int] = None
 ) -> List[Dict]:
     """
     尋找與目標知識點相似的其他知識點
     
+    只會在目標知識點擁有者的知識點中搜尋。
+    
     Args:
         target_point_id: 目標知識點ID
         similarity_threshold: 相似度閾值（0-1）
         max_results: 最大結果數量
+        user_id: 發出請求的用戶；提供時目標知識點必須屬於該用戶
         
     Returns:
         相似知識點列表，包含相似度分數
@@ -309,48 +868,91 @@ def find_similar_knowledge_points(
     try:
         conn = get_db_connection()
         with conn.cursor() as cursor:
-            # 獲取目標知識點的向量
-            cursor.execute(
-                "SELECT embedding_vector FROM knowledge_points WHERE id = %s AND embedding_vector IS NOT NULL",
-                (target_point_id,)
-            )
-            target_result = cursor.fetchone()
+            if is_pgvector_available():
+                cursor.execute(
+                    """
+                    SELECT user_id, embedding_vector FROM knowledge_points
+                    WHERE id = %s AND embedding_vector IS NOT NULL
+                    """,
+                    (target_point_id,)
+                )
+            else:
+                cursor.execute("SELECT user_id FROM knowledge_points WHERE id = %s", (target_point_id,))
+            target = cursor.fetchone()
             
-            if not target_result:
+            if not target:
                 logger.warning(f"知識點 {target_point_id} 沒有向量或不存在")
+                conn.close()
                 return []
             
-            target_vector = target_result[0]
-            
-            # 使用資料庫函數查詢相似知識點
-            cursor.execute(
-                """
-                SELECT * FROM find_similar_knowledge_points(%s::vector, %s, %s, %s)
-                """,
-                (str(target_vector), similarity_threshold, max_results, target_point_id)
-            )
+            owner_id = target['user_id']
+            if user_id is not None and str(owner_id) != str(user_id):
+                logger.warning(f"用戶 {user_id} 無權查詢知識點 {target_point_id}")
+                conn.close()
+                return []
             
-            similar_points = cursor.fetchall()
-        
+            if is_pgvector_available():
+                results = _search_pgvector(
+                    cursor, str(target['embedding_vector']), similarity_threshold, max_results,
+                    user_id=owner_id, exclude_point_id=target_point_id
+                )
         conn.close()
         
-        # 格式化結果
-        results = []
-        for point in similar_points:
-            results.append({
-                'point_id': point[0],
-                'similarity_score': float(point[1]),
-                'correct_phrase': point[2],
-                'key_point_summary': point[3]
-            })
+        if not is_pgvector_available():
+            target_vector = get_vector_index(get_vector_dimension()).get_vector(target_point_id)
+            if target_vector is None:
+                logger.warning(f"知識點 {target_point_id} 沒有向量或不存在")
+                return []
+            results = _search_local_index(
+                target_vector, similarity_threshold, max_results,
+                user_id=owner_id, exclude_ids=[target_point_id]
+            )
         
         logger.info(f"找到 {len(results)} 個相似知識點（閾值: {similarity_threshold}）")
         return results
         
     except Exception as e:
         logger.error(f"搜尋相似知識點時發生錯誤: {e}")
+        if 'conn' in locals():
+            conn.close()
         return []
 
+def search_knowledge_points_by_vector(
+    query_vector: np.ndarray,
+    similarity_threshold: float = 0.7,
+    max_results: int = 10,
+    user_id: Optional[int] = None,
+    conn=None
+) -> List[Dict]:
+    """
+    以查詢向量搜尋相似的知識點
+    
+    Args:
+        query_vector: 查詢向量
+        similarity_threshold: 相似度閾值（0-1）
+        max_results: 最大結果數量
+        user_id: 只搜尋該用戶的知識點（None = 所有用戶，僅供管理工具使用）
+        conn: 既有的資料庫連線
+        
+    Returns:
+        相似知識點列表，包含相似度分數
+    """
+    if not is_pgvector_available():
+        return _search_local_index(query_vector, similarity_threshold, max_results, user_id=user_id)
+    
+    owns_connection = conn is None
+    if owns_connection:
+        conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            search_vector_str = '[' + ','.join(map(str, np.asarray(query_vector).tolist())) + ']'
+            return _search_pgvector(
+                cursor, search_vector_str, similarity_threshold, max_results, user_id=user_id
+            )
+    finally:
+        if owns_connection:
+            conn.close()
+
 def create_knowledge_link(
     source_point_id: int,
     target_point_id: int,
@@ -405,76 +1007,136 @@ def create_knowledge_link(
             conn.close()
         return False
 
-def auto_link_knowledge_point(point_id: int, similarity_threshold: float = 0.8) -> int:
+def insert_semantic_links(cursor, source_ids, target_ids, scores) -> int:
+    """
+    以一條 INSERT 寫入多條語義關聯，已存在的關聯保持不變
+
+    Returns:
+        實際新增的關聯數量
+    """
+    if len(source_ids) == 0:
+        return 0
+    cursor.execute(
+        """
+        INSERT INTO knowledge_links (source_point_id, target_point_id, similarity_score, link_type)
+        SELECT source_id, target_id, LEAST(score, 1.0), 'semantic_similarity'
+        FROM unnest(%s::integer[], %s::integer[], %s::real[]) AS l(source_id, target_id, score)
+        ON CONFLICT (source_point_id, target_point_id) DO NOTHING
+        """,
+        ([int(i) for i in source_ids], [int(i) for i in target_ids], [float(v) for v in scores])
+    )
+    return cursor.rowcount
+
+def link_knowledge_points(
+    cursor,
+    point_ids: List[int],
+    similarity_threshold: float = 0.8,
+    max_links: int = 5
+) -> int:
+    """
+    為多個知識點建立與同一用戶知識點的雙向語義關聯（由呼叫端負責交易）
+    
+    使用 pgvector 時，搜尋相似知識點與寫入雙向關聯在同一條 SQL 中完成。
+    
+    Returns:
+        新建立的關聯數量
+    """
+    if not point_ids:
+        return 0
+    
+    if not is_pgvector_available():
+        sources, targets, scores = [], [], []
+        for point_id in point_ids:
+            for similar_point in find_similar_knowledge_points(
+                point_id, similarity_threshold=similarity_threshold, max_results=max_links
+            ):
+                sources += [point_id, similar_point['point_id']]
+                targets += [similar_point['point_id'], point_id]
+                scores += [similar_point['similarity_score']] * 2
+        return insert_semantic_links(cursor, sources, targets, scores)
+    
+    column, operator, _ = _COARSE_SEARCH[_storage_mode()]
+    candidates = _rerank_candidates(max_links)
+    
+    configure_hnsw_scan(cursor, candidates)
+    cursor.execute(
+        f"""
+        WITH target AS (
+            SELECT *
+            FROM knowledge_points
+            WHERE id = ANY(%s) AND {column} IS NOT NULL
+        ),
+        neighbours AS (
+            SELECT t.id AS source_id, n.id AS target_id, LEAST(n.similarity, 1.0) AS similarity
+            FROM target t
+            CROSS JOIN LATERAL (
+                SELECT c.id, 1 - (c.embedding_vector <=> t.embedding_vector) AS similarity
+                FROM (
+                    SELECT kp.id, kp.embedding_vector
+                    FROM knowledge_points kp
+                    WHERE kp.{column} IS NOT NULL
+                      AND kp.is_archived = FALSE
+                      AND kp.user_id = t.user_id
+                      AND kp.id != t.id
+                    ORDER BY kp.{column} {operator} t.{column}
+                    LIMIT %s
+                ) c
+                ORDER BY c.embedding_vector <=> t.embedding_vector
+                LIMIT %s
+            ) n
+            WHERE n.similarity >= %s
+        )
+        INSERT INTO knowledge_links (source_point_id, target_point_id, similarity_score, link_type)
+        SELECT source_id, target_id, similarity, 'semantic_similarity' FROM neighbours
+        UNION ALL
+        SELECT target_id, source_id, similarity, 'semantic_similarity' FROM neighbours
+        ON CONFLICT (source_point_id, target_point_id) DO NOTHING
+        """,
+        (list(point_ids), candidates, max_links, similarity_threshold)
+    )
+    return cursor.rowcount
+
+def auto_link_knowledge_point(point_id: int, similarity_threshold: float = 0.8, max_links: int = 5) -> int:
     """
-    自動為知識點建立關聯
+    自動為知識點建立關聯（只與同一用戶的知識點建立）
     
     Args:
         point_id: 知識點ID
         similarity_threshold: 相似度閾值
+        max_links: 最多關聯的相似知識點數量（避免過多連結）
         
     Returns:
-        建立的關聯數量
+        新建立的關聯數量
     """
     try:
-        # 尋找相似知識點
-        similar_points = find_similar_knowledge_points(
-            point_id, 
-            similarity_threshold=similarity_threshold,
-            max_results=5  # 限制關聯數量避免過多連結
-        )
-        
-        created_links = 0
-        
-        for similar_point in similar_points:
-            # 建立雙向關聯
-            if create_knowledge_link(
-                point_id, 
-                similar_point['point_id'], 
-                similar_point['similarity_score']
-            ):
-                created_links += 1
-            
-            if create_knowledge_link(
-                similar_point['point_id'], 
-                point_id, 
-                similar_point['similarity_score']
-            ):
-                created_links += 1
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            created_links = link_knowledge_points(cursor, [point_id], similarity_threshold, max_links)
+        conn.commit()
+        conn.close()
         
         logger.info(f"為知識點 {point_id} 建立了 {created_links} 個關聯")
         return created_links
         
     except Exception as e:
         logger.error(f"自動建立知識點關聯時發生錯誤: {e}")
+        if 'conn' in locals():
+            conn.rollback()
+            conn.close()
         return 0
 
-def get_embedding_statistics() -> Dict:
+def get_embedding_statistics(user_id: Optional[int] = None) -> Dict:
     """
-    獲取向量化功能的統計資訊
+    獲取向量化功能的統計資訊（由 stats_service 維護的計數器讀取，不掃描資料表）
+    
+    Args:
+        user_id: 只統計該用戶的知識點與關聯（None = 全部用戶）
     
     Returns:
         統計資訊字典
     """
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT * FROM knowledge_linking_stats")
-            stats = cursor.fetchone()
-        
-        conn.close()
-        
-        if stats:
-            return {
-                'points_with_vectors': stats[0],
-                'points_without_vectors': stats[1],
-                'active_links': stats[2],
-                'avg_similarity_score': float(stats[3]) if stats[3] else 0.0,
-                'last_embedding_update': stats[4].isoformat() if stats[4] else None
-            }
-        else:
-            return {}
-            
+        return stats_service.get_statistics(user_id)
     except Exception as e:
         logger.error(f"獲取統計資訊時發生錯誤: {e}")
         return {}
@@ -489,8 +1151,8 @@ def cleanup_knowledge_links() -> int:
     try:
         conn = get_db_connection()
         with conn.cursor() as cursor:
-            cursor.execute("SELECT cleanup_invalid_links()")
-            deleted_count = cursor.fetchone()[0]
+            cursor.execute("SELECT cleanup_invalid_links() AS deleted_count")
+            deleted_count = cursor.fetchone()['deleted_count']
             conn.commit()
         
         conn.close()
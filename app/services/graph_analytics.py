@@ -0,0 +1,298 @@
+# app/services/graph_analytics.py
+"""
+知識點網絡的圖分析
+
+把有效的 knowledge_links 載入為 SciPy 稀疏鄰接矩陣（無向、以相似度加權），批次計算：
+
+- 連通分量：每個知識點所屬的分量與分量大小（分量 0 為最大的分量）
+- PageRank：以相似度加權的隨機漫步，冪迭代求解
+- 度數：關聯數與相似度加權度數
+- 介數中心性：以隨機抽樣的起點執行 Brandes 演算法估計（不加權的最短路徑），
+  多個起點以稠密矩陣一起做 BFS，每層只需要一次稀疏矩陣乘法
+
+結果存入 knowledge_point_graph_metrics。複習排程與網絡檢視直接讀取預先計算的分數，
+例如「PageRank 高但熟練度低」的弱點樞紐，不需要在查詢時執行遞迴查詢。
+"""
+
+import time
+import logging
+from typing import Dict, List, Optional
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from app.services.database import get_db_connection
+from app.services.graph_layout import load_graph
+
+logger = logging.getLogger(__name__)
+
+PAGERANK_DAMPING = 0.85
+PAGERANK_TOLERANCE = 1e-10
+PAGERANK_MAX_ITERATIONS = 200
+BETWEENNESS_SAMPLES = 64     # 估計介數中心性的起點數（節點數在此以下時為精確值）
+BETWEENNESS_CHUNK = 32       # 同時做 BFS 的起點數
+MAX_MASTERY = 5.0
+
+# advisory lock 的識別值（任意固定整數）
+_ANALYTICS_LOCK_KEY = 72043001
+
+def build_adjacency(n: int, sources: np.ndarray, targets: np.ndarray, weights: np.ndarray) -> sparse.csr_matrix:
+    """無向邊 → 對稱的 CSR 鄰接矩陣"""
+    return sparse.coo_matrix(
+        (np.concatenate([weights, weights]), (np.concatenate([sources, targets]), np.concatenate([targets, sources]))),
+        shape=(n, n)
+    ).tocsr()
+
+def pagerank(
+    adjacency: sparse.csr_matrix,
+    damping: float = PAGERANK_DAMPING,
+    tolerance: float = PAGERANK_TOLERANCE,
+    max_iterations: int = PAGERANK_MAX_ITERATIONS
+) -> np.ndarray:
+    """加權 PageRank（冪迭代；沒有關聯的節點把分數平均分給所有節點）"""
+    n = adjacency.shape[0]
+    if n == 0:
+        return np.empty(0)
+    out_weight = np.asarray(adjacency.sum(axis=1)).ravel()
+    dangling = out_weight == 0
+    inverse = np.divide(1.0, out_weight, out=np.zeros(n), where=~dangling)
+    transposed = adjacency.T.tocsr()
+
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iterations):
+        spread = transposed @ (rank * inverse)
+        updated = damping * (spread + rank[dangling].sum() / n) + (1 - damping) / n
+        converged = np.abs(updated - rank).sum() < tolerance
+        rank = updated
+        if converged:
+            break
+    return rank / rank.sum()
+
+def approximate_betweenness(
+    adjacency: sparse.csr_matrix,
+    samples: int = BETWEENNESS_SAMPLES,
+    chunk_size: int = BETWEENNESS_CHUNK,
+    seed: int = 0
+) -> np.ndarray:
+    """
+    以抽樣起點的 Brandes 演算法估計正規化的介數中心性（不加權）
+
+    每批起點各佔稠密矩陣的一欄：正向逐層 BFS 累計最短路徑數，
+    反向逐層累加依賴值，每層都是一次稀疏矩陣乘法。
+    """
+    n = adjacency.shape[0]
+    if n < 3:
+        return np.zeros(n)
+    binary = adjacency.copy()
+    binary.data = np.ones_like(binary.data)
+
+    rng = np.random.default_rng(seed)
+    pivots = rng.permutation(n)[:min(samples, n)]
+    centrality = np.zeros(n)
+
+    for start in range(0, len(pivots), chunk_size):
+        chunk = pivots[start:start + chunk_size]
+        columns = np.arange(len(chunk))
+        paths = np.zeros((n, len(chunk)))
+        paths[chunk, columns] = 1.0
+        depth = np.full((n, len(chunk)), -1, dtype=np.int32)
+        depth[chunk, columns] = 0
+
+        frontier = paths.copy()
+        level = 0
+        while frontier.any():
+            reached = binary @ frontier
+            new = (depth < 0) & (reached > 0)
+            if not new.any():
+                break
+            level += 1
+            depth[new] = level
+            paths[new] = reached[new]
+            frontier = np.where(new, paths, 0.0)
+
+        dependency = np.zeros((n, len(chunk)))
+        safe_paths = np.where(paths > 0, paths, 1.0)
+        for current in range(level, 0, -1):
+            coefficient = np.where(depth == current, (1.0 + dependency) / safe_paths, 0.0)
+            dependency += np.where(depth == current - 1, paths * (binary @ coefficient), 0.0)
+
+        dependency[chunk, columns] = 0.0
+        centrality += dependency.sum(axis=1)
+
+    # 抽樣外推到全部起點；無向圖每對節點計算了兩次；正規化到 [0, 1]
+    centrality *= n / len(pivots) / 2.0
+    return centrality / ((n - 1) * (n - 2) / 2.0)
+
+def compute_graph_metrics(
+    n: int,
+    sources: np.ndarray,
+    targets: np.ndarray,
+    weights: np.ndarray,
+    samples: int = BETWEENNESS_SAMPLES,
+    seed: int = 0
+) -> Dict[str, np.ndarray]:
+    """
+    計算各節點的圖指標
+
+    Returns:
+        {'component_id', 'component_size', 'degree', 'weighted_degree', 'pagerank', 'betweenness'}
+    """
+    adjacency = build_adjacency(n, sources, targets, weights)
+
+    _, labels = connected_components(adjacency, directed=False)
+    sizes = np.bincount(labels)
+    # 依分量大小重新編號，0 為最大的分量
+    order = np.argsort(-sizes, kind='stable')
+    relabel = np.empty_like(order)
+    relabel[order] = np.arange(len(order))
+
+    return {
+        'component_id': relabel[labels],
+        'component_size': sizes[labels],
+        'degree': np.diff(adjacency.indptr),
+        'weighted_degree': np.asarray(adjacency.sum(axis=1)).ravel(),
+        'pagerank': pagerank(adjacency),
+        'betweenness': approximate_betweenness(adjacency, samples=samples, seed=seed),
+    }
+
+def run_graph_analytics(samples: int = BETWEENNESS_SAMPLES, wait: bool = False) -> Dict:
+    """
+    依目前的有效關聯重新計算所有知識點的圖指標並寫入資料庫
+
+    Args:
+        samples: 估計介數中心性的起點數
+        wait: 另一個程序正在計算時等待它完成（否則直接回傳 skipped）
+
+    Returns:
+        {'nodes', 'links', 'components', 'largest_component', 'seconds', 'skipped'}
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            if wait:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_ANALYTICS_LOCK_KEY,))
+            else:
+                cursor.execute("SELECT pg_try_advisory_xact_lock(%s) AS locked", (_ANALYTICS_LOCK_KEY,))
+                if not cursor.fetchone()['locked']:
+                    conn.rollback()
+                    return {'nodes': 0, 'links': 0, 'components': 0, 'largest_component': 0,
+                            'seconds': 0.0, 'skipped': True}
+
+            started = time.perf_counter()
+            point_ids, sources, targets, weights = load_graph(cursor)
+            metrics = compute_graph_metrics(len(point_ids), sources, targets, weights, samples=samples)
+
+            cursor.execute("DELETE FROM knowledge_point_graph_metrics WHERE point_id <> ALL(%s)", (point_ids.tolist(),))
+            cursor.execute(
+                """
+                INSERT INTO knowledge_point_graph_metrics
+                    (point_id, component_id, component_size, degree, weighted_degree, pagerank, betweenness, computed_at)
+                SELECT m.*, NOW()
+                FROM unnest(%s::integer[], %s::integer[], %s::integer[], %s::integer[],
+                            %s::real[], %s::double precision[], %s::double precision[])
+                     AS m(point_id, component_id, component_size, degree, weighted_degree, pagerank, betweenness)
+                ON CONFLICT (point_id) DO UPDATE
+                SET component_id = EXCLUDED.component_id, component_size = EXCLUDED.component_size,
+                    degree = EXCLUDED.degree, weighted_degree = EXCLUDED.weighted_degree,
+                    pagerank = EXCLUDED.pagerank, betweenness = EXCLUDED.betweenness,
+                    computed_at = EXCLUDED.computed_at
+                """,
+                (
+                    point_ids.tolist(),
+                    metrics['component_id'].tolist(), metrics['component_size'].tolist(),
+                    metrics['degree'].tolist(), metrics['weighted_degree'].tolist(),
+                    metrics['pagerank'].tolist(), metrics['betweenness'].tolist()
+                )
+            )
+        conn.commit()
+    except Exception as e:
+        logger.error(f"分析知識點網絡時發生錯誤: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    sizes = metrics['component_size']
+    result = {
+        'nodes': len(point_ids),
+        'links': len(sources),
+        'components': int(metrics['component_id'].max()) + 1 if len(point_ids) else 0,
+        'largest_component': int(sizes.max()) if len(point_ids) else 0,
+        'seconds': round(time.perf_counter() - started, 3),
+        'skipped': False
+    }
+    logger.info(f"✅ 知識點網絡分析完成: {result}")
+    return result
+
+def _serialize(row: Dict) -> Dict:
+    metrics = dict(row)
+    if metrics.get('computed_at'):
+        metrics['computed_at'] = metrics['computed_at'].isoformat()
+    return metrics
+
+def get_point_metrics(point_id: int, user_id: Optional[int] = None) -> Optional[Dict]:
+    """
+    單一知識點的圖指標與 PageRank 名次；不在網絡中（沒有有效關聯）時為 None
+
+    Args:
+        user_id: 只查詢該用戶的知識點，不屬於該用戶時為 None（None = 不限制）
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT m.*,
+                       (SELECT COUNT(*) FROM knowledge_point_graph_metrics o WHERE o.pagerank > m.pagerank) + 1
+                           AS pagerank_rank,
+                       (SELECT COUNT(*) FROM knowledge_point_graph_metrics) AS total_nodes
+                FROM knowledge_point_graph_metrics m
+                JOIN knowledge_points kp ON kp.id = m.point_id
+                WHERE m.point_id = %s
+                  AND (%s::integer IS NULL OR kp.user_id = %s::integer)
+                """,
+                (point_id, user_id, user_id)
+            )
+            row = cursor.fetchone()
+    finally:
+        conn.close()
+    return _serialize(row) if row else None
+
+def get_hub_points(user_id: Optional[int] = None, limit: int = 20, weak_only: bool = False) -> List[Dict]:
+    """
+    網絡中的樞紐知識點（依 PageRank 排序）
+
+    Args:
+        user_id: 只列出該用戶的知識點（None = 全部）
+        weak_only: 改以 PageRank × (1 - 熟練度/5) 排序，即影響範圍大但尚未熟練的弱點
+    """
+    order = "m.pagerank * (1 - LEAST(kp.mastery_level, %(max_mastery)s) / %(max_mastery)s)" if weak_only else "m.pagerank"
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT kp.id, kp.correct_phrase, kp.key_point_summary, kp.category, kp.subcategory,
+                       kp.mastery_level, kp.next_review_date,
+                       m.component_id, m.component_size, m.degree, m.weighted_degree,
+                       m.pagerank, m.betweenness, {order} AS hub_score
+                FROM knowledge_point_graph_metrics m
+                JOIN knowledge_points kp ON kp.id = m.point_id
+                WHERE kp.is_archived = FALSE
+                  AND (%(user_id)s::integer IS NULL OR kp.user_id = %(user_id)s::integer)
+                ORDER BY hub_score DESC, kp.id
+                LIMIT %(limit)s
+                """,
+                {'user_id': user_id, 'limit': limit, 'max_mastery': MAX_MASTERY}
+            )
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    hubs = []
+    for row in rows:
+        hub = dict(row)
+        if hub.get('next_review_date'):
+            hub['next_review_date'] = hub['next_review_date'].isoformat()
+        hubs.append(hub)
+    return hubs
@@ -0,0 +1,580 @@
+# app/services/graph_layout.py
+"""
+知識點網絡的伺服器端布局
+
+以 knowledge_links 的有效關聯為圖，計算每個知識點的平面座標並存入 knowledge_graph_layout，
+管理介面只需要依視窗範圍取回可見的節點，不必在瀏覽器執行力模擬。
+
+- 完整計算：以譜嵌入（隨機漫步矩陣的前兩個非平凡特徵向量）作為初始位置，
+  再以向量化的 Fruchterman-Reingold 迭代調整。節點很多時，斥力以隨機抽樣的節點近似。
+- 增量更新：圖只新增少量節點時，既有節點固定不動，新節點從已放置鄰居的加權平均位置開始，
+  只對新節點進行少量迭代，使用者看到的整體布局不會跳動。
+- 快取：布局依「圖版本」（有效關聯的數量與 (ID, 相似度) 雜湊總和、封存知識點）快取在資料庫與程序內，
+  圖沒有變化時不會重新計算；多個 worker 以 advisory lock 確保同一時間只有一個在計算。
+- 背景更新：讀取時發現圖已變化，只提交 network_layout_rebuild 背景工作（見 job_runner），
+  本次請求先回傳既有的布局，不在 HTTP 請求中計算。
+- 細節層級：視窗查詢只回傳範圍內加權度數最高的節點，縮小檢視時只顯示重要節點，放大後才顯示細節。
+"""
+
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from app.services.database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_EXTENT = 1000.0            # 完整計算後座標縮放到 [0, LAYOUT_EXTENT]
+LAYOUT_ITERATIONS = 150
+INCREMENTAL_ITERATIONS = 60
+INCREMENTAL_MAX_FRACTION = 0.2    # 新節點超過此比例時改為完整計算
+EXACT_REPULSION_LIMIT = 2000      # 節點數在此以下時計算所有節點對之間的斥力
+REPULSION_SAMPLE_SIZE = 500       # 超過時每輪抽樣的節點數
+GRAVITY = 0.05                    # 往中心的拉力，避免不相連的子圖無限遠離
+REBUILD_RETRY_SECONDS = 60        # 同一程序提交背景更新的最短間隔（工作失敗時避免每次讀取都重新提交）
+
+# advisory lock 的識別值（任意固定整數）
+_LAYOUT_LOCK_KEY = 72040001
+
+# 程序內快取：最近一次載入的布局（整個字典一次替換，讀取端不需要加鎖）
+_cached_layout: Optional[Dict] = None
+_cache_lock = threading.Lock()
+_last_rebuild_request = 0.0
+
+def _symmetric_edges(
+    sources: np.ndarray,
+    targets: np.ndarray,
+    weights: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """雙向的關聯合併成一條無向邊（保留較高的相似度），並移除自我關聯"""
+    lo, hi = np.minimum(sources, targets), np.maximum(sources, targets)
+    keep = lo != hi
+    lo, hi, weights = lo[keep], hi[keep], weights[keep]
+    if len(lo) == 0:
+        return lo, hi, weights
+    order = np.lexsort((-weights, hi, lo))
+    lo, hi, weights = lo[order], hi[order], weights[order]
+    first = np.ones(len(lo), dtype=bool)
+    first[1:] = (lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1])
+    return lo[first], hi[first], weights[first]
+
+def _weighted_degree(n: int, sources: np.ndarray, targets: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    return (np.bincount(sources, weights, minlength=n) + np.bincount(targets, weights, minlength=n))
+
+def spectral_layout(
+    n: int,
+    sources: np.ndarray,
+    targets: np.ndarray,
+    weights: np.ndarray,
+    iterations: int = 100,
+    seed: int = 0
+) -> np.ndarray:
+    """
+    譜嵌入：以 lazy random walk 的冪次迭代求隨機漫步矩陣最大的兩個非平凡特徵向量
+
+    Returns:
+        (n, 2) 座標（未縮放）
+    """
+    rng = np.random.default_rng(seed)
+    degree = _weighted_degree(n, sources, targets, weights)
+    degree[degree == 0] = 1.0
+    sqrt_degree = np.sqrt(degree)
+
+    # 在對稱正規化矩陣 D^-1/2 A D^-1/2 上迭代，平凡特徵向量為 sqrt(D)
+    trivial = sqrt_degree / np.linalg.norm(sqrt_degree)
+    basis = rng.standard_normal((n, 2))
+    for _ in range(iterations):
+        scaled = basis / sqrt_degree[:, None]
+        product = np.empty_like(basis)
+        for column in range(2):
+            product[:, column] = (
+                np.bincount(sources, weights * scaled[targets, column], minlength=n)
+                + np.bincount(targets, weights * scaled[sources, column], minlength=n)
+            )
+        basis = 0.5 * (basis + product / sqrt_degree[:, None])
+        basis -= np.outer(trivial, trivial @ basis)
+        basis, _ = np.linalg.qr(basis)
+    return basis / sqrt_degree[:, None]
+
+def _repulsion(positions: np.ndarray, rows: np.ndarray, k: float, rng: np.random.Generator) -> np.ndarray:
+    """rows 中每個節點受到的斥力 (k² / 距離)，節點很多時以抽樣近似"""
+    n = len(positions)
+    if n <= EXACT_REPULSION_LIMIT:
+        others, scale = positions, 1.0
+    else:
+        others = positions[rng.choice(n, REPULSION_SAMPLE_SIZE, replace=False)]
+        scale = n / REPULSION_SAMPLE_SIZE
+
+    force = np.empty((len(rows), 2))
+    other_x = others[:, 0].astype(np.float32)
+    other_y = others[:, 1].astype(np.float32)
+    block_size = max(1, 2_000_000 // len(others))
+    for start in range(0, len(rows), block_size):
+        block = positions[rows[start:start + block_size]].astype(np.float32)
+        dx = block[:, 0, None] - other_x[None, :]
+        dy = block[:, 1, None] - other_y[None, :]
+        distance2 = dx * dx + dy * dy
+        distance2[distance2 < 1e-9] = np.inf   # 自身（或完全重疊）不產生斥力
+        np.reciprocal(distance2, out=distance2)
+        force[start:start + block_size, 0] = (dx * distance2).sum(axis=1)
+        force[start:start + block_size, 1] = (dy * distance2).sum(axis=1)
+    return force * (k * k * scale)
+
+def force_directed_layout(
+    n: int,
+    sources: np.ndarray,
+    targets: np.ndarray,
+    weights: np.ndarray,
+    initial: np.ndarray,
+    movable: Optional[np.ndarray] = None,
+    iterations: int = LAYOUT_ITERATIONS,
+    temperature: Optional[float] = None,
+    seed: int = 0
+) -> np.ndarray:
+    """
+    向量化的 Fruchterman-Reingold 迭代
+
+    Args:
+        initial: (n, 2) 初始座標
+        movable: 可移動的節點（布林遮罩；None = 全部），其餘節點固定
+        temperature: 每輪最大位移的初始值（None = 布局範圍的十分之一），線性遞減到 0
+
+    Returns:
+        (n, 2) 座標
+    """
+    rng = np.random.default_rng(seed)
+    positions = np.array(initial, dtype=np.float64)
+    rows = np.arange(n) if movable is None else np.flatnonzero(movable)
+    if len(rows) == 0:
+        return positions
+
+    span = float(np.ptp(positions, axis=0).max()) or LAYOUT_EXTENT
+    k = span / np.sqrt(n)
+    temperature = span / 10 if temperature is None else temperature
+    center = positions.mean(axis=0)
+
+    for step in range(iterations):
+        displacement = np.zeros((n, 2))
+        displacement[rows] = _repulsion(positions, rows, k, rng)
+
+        # 引力沿關聯作用（距離² / k，以相似度加權）
+        delta = positions[sources] - positions[targets]
+        distance = np.maximum(np.linalg.norm(delta, axis=1), 1e-9)
+        pull = delta * (distance * weights / k)[:, None]
+        for column in range(2):
+            displacement[:, column] -= np.bincount(sources, pull[:, column], minlength=n)
+            displacement[:, column] += np.bincount(targets, pull[:, column], minlength=n)
+
+        displacement[rows] -= GRAVITY * (positions[rows] - center)
+
+        length = np.maximum(np.linalg.norm(displacement[rows], axis=1), 1e-9)
+        limit = temperature * (1 - step / iterations)
+        positions[rows] += displacement[rows] * (np.minimum(length, limit) / length)[:, None]
+
+    return positions
+
+def _place_new_nodes(
+    positions: np.ndarray,
+    placed: np.ndarray,
+    sources: np.ndarray,
+    targets: np.ndarray,
+    weights: np.ndarray,
+    rng: np.random.Generator,
+    rounds: int = 5
+) -> np.ndarray:
+    """新節點放在已放置鄰居的加權平均位置（逐輪往外擴散），沒有已放置鄰居的放在中心附近"""
+    n = len(positions)
+    placed = placed.copy()
+    jitter = float(np.ptp(positions[placed], axis=0).max()) / 100 if placed.any() else 1.0
+    for _ in range(rounds):
+        pending = ~placed
+        if not pending.any():
+            break
+        sums, totals = np.zeros((n, 2)), np.zeros(n)
+        for a, b in ((sources, targets), (targets, sources)):
+            mask = placed[b] & pending[a]
+            totals += np.bincount(a[mask], weights[mask], minlength=n)
+            for column in range(2):
+                sums[:, column] += np.bincount(a[mask], weights[mask] * positions[b[mask], column], minlength=n)
+        reached = pending & (totals > 0)
+        if not reached.any():
+            break
+        positions[reached] = sums[reached] / totals[reached, None] + rng.normal(0, jitter, (reached.sum(), 2))
+        placed |= reached
+
+    if (~placed).any():
+        center = positions[placed].mean(axis=0) if placed.any() else np.full(2, LAYOUT_EXTENT / 2)
+        positions[~placed] = center + rng.normal(0, jitter * 10, ((~placed).sum(), 2))
+    return positions
+
+def compute_layout(
+    n: int,
+    sources: np.ndarray,
+    targets: np.ndarray,
+    weights: np.ndarray,
+    previous: Optional[np.ndarray] = None,
+    seed: int = 0
+) -> Tuple[np.ndarray, str]:
+    """
+    計算布局
+
+    Args:
+        previous: (n, 2) 既有座標，尚未放置的節點為 NaN（None = 完整計算）
+
+    Returns:
+        (座標, 'full' | 'incremental')
+    """
+    rng = np.random.default_rng(seed)
+    if previous is not None:
+        placed = ~np.isnan(previous).any(axis=1)
+        if placed.sum() >= 2 and (~placed).mean() <= INCREMENTAL_MAX_FRACTION:
+            positions = _place_new_nodes(previous.copy(), placed, sources, targets, weights, rng)
+            if placed.all():
+                return positions, 'incremental'
+            span = float(np.ptp(positions[placed], axis=0).max()) or LAYOUT_EXTENT
+            positions = force_directed_layout(
+                n, sources, targets, weights, positions, movable=~placed,
+                iterations=INCREMENTAL_ITERATIONS, temperature=span / 50, seed=seed
+            )
+            return positions, 'incremental'
+
+    initial = spectral_layout(n, sources, targets, weights, seed=seed)
+    initial = _rescale(initial + rng.normal(0, 1e-3 * (np.ptp(initial) or 1.0), initial.shape))
+    positions = force_directed_layout(n, sources, targets, weights, initial, seed=seed)
+    return _rescale(positions), 'full'
+
+def _rescale(positions: np.ndarray) -> np.ndarray:
+    """等比例縮放到 [0, LAYOUT_EXTENT]"""
+    low = positions.min(axis=0)
+    span = float((positions.max(axis=0) - low).max()) or 1.0
+    return (positions - low) * (LAYOUT_EXTENT / span)
+
+def _graph_version(cursor) -> str:
+    """
+    以有效關聯的數量與 (ID, 相似度) 的雜湊總和、封存知識點的數量與 ID 總和代表圖的版本
+
+    雜湊包含相似度，只更新 similarity_score 的關聯也會讓布局失效。
+    """
+    cursor.execute(
+        """
+        SELECT l.links, l.checksum, p.archived, p.archived_sum
+        FROM (
+            SELECT COUNT(*) AS links,
+                   COALESCE(SUM(hashtext(id::text || ':' || similarity_score::text)), 0) AS checksum
+            FROM knowledge_links WHERE is_active = TRUE
+        ) l, (
+            SELECT COUNT(*) AS archived, COALESCE(SUM(id), 0) AS archived_sum
+            FROM knowledge_points WHERE is_archived = TRUE
+        ) p
+        """
+    )
+    row = cursor.fetchone()
+    return f"{row['links']}:{row['checksum']}:{row['archived']}:{row['archived_sum']}"
+
+def load_graph(cursor) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """讀取有效關聯，回傳 (節點ID, 來源索引, 目標索引, 相似度)"""
+    cursor.execute(
+        """
+        SELECT kl.source_point_id, kl.target_point_id, kl.similarity_score
+        FROM knowledge_links kl
+        JOIN knowledge_points s ON s.id = kl.source_point_id AND s.is_archived = FALSE
+        JOIN knowledge_points t ON t.id = kl.target_point_id AND t.is_archived = FALSE
+        WHERE kl.is_active = TRUE
+        """
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, np.empty(0)
+    raw_sources = np.array([row['source_point_id'] for row in rows], dtype=np.int64)
+    raw_targets = np.array([row['target_point_id'] for row in rows], dtype=np.int64)
+    weights = np.array([row['similarity_score'] for row in rows], dtype=np.float64)
+    point_ids, inverse = np.unique(np.concatenate([raw_sources, raw_targets]), return_inverse=True)
+    sources, targets, weights = _symmetric_edges(inverse[:len(rows)], inverse[len(rows):], weights)
+    return point_ids, sources, targets, weights
+
+def _load_stored_layout(cursor) -> Dict:
+    cursor.execute(
+        "SELECT point_id, x, y, weight FROM knowledge_graph_layout ORDER BY weight DESC, point_id"
+    )
+    rows = cursor.fetchall()
+    return {
+        'ids': np.array([row['point_id'] for row in rows], dtype=np.int64),
+        'x': np.array([row['x'] for row in rows], dtype=np.float64),
+        'y': np.array([row['y'] for row in rows], dtype=np.float64),
+        'weight': np.array([row['weight'] for row in rows], dtype=np.float64),
+    }
+
+def _stored_state(cursor) -> Tuple[Optional[str], Optional[object]]:
+    """資料庫中布局對應的 (圖版本, 計算時間)；尚未計算時為 (None, None)"""
+    cursor.execute("SELECT graph_version, computed_at FROM knowledge_graph_layout_state WHERE id = TRUE")
+    row = cursor.fetchone()
+    return (row['graph_version'], row['computed_at']) if row else (None, None)
+
+def rebuild_layout(force_full: bool = False, wait: bool = False) -> Dict:
+    """
+    依目前的關聯重新計算布局並寫入資料庫（圖沒有變化且非 force_full 時不計算）
+
+    Args:
+        force_full: 忽略既有座標，完整重新計算
+        wait: 另一個程序正在計算時等待它完成（否則直接回傳 skipped）
+
+    Returns:
+        {'nodes', 'links', 'mode': 'full' | 'incremental' | 'unchanged', 'seconds', 'skipped'}
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            if wait:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_LAYOUT_LOCK_KEY,))
+            else:
+                cursor.execute("SELECT pg_try_advisory_xact_lock(%s) AS locked", (_LAYOUT_LOCK_KEY,))
+                if not cursor.fetchone()['locked']:
+                    conn.rollback()
+                    return {'nodes': 0, 'links': 0, 'mode': None, 'seconds': 0.0, 'skipped': True}
+
+            version = _graph_version(cursor)
+            if not force_full and _stored_state(cursor)[0] == version:
+                conn.rollback()
+                return {'nodes': 0, 'links': 0, 'mode': 'unchanged', 'seconds': 0.0, 'skipped': False}
+
+            started = time.perf_counter()
+            point_ids, sources, targets, weights = load_graph(cursor)
+            n = len(point_ids)
+
+            previous = None
+            if not force_full and n:
+                stored = _load_stored_layout(cursor)
+                previous = np.full((n, 2), np.nan)
+                if len(stored['ids']):
+                    order = np.argsort(stored['ids'])
+                    position = np.minimum(np.searchsorted(stored['ids'][order], point_ids), len(order) - 1)
+                    found = stored['ids'][order[position]] == point_ids
+                    previous[found, 0] = stored['x'][order[position[found]]]
+                    previous[found, 1] = stored['y'][order[position[found]]]
+
+            if n:
+                positions, mode = compute_layout(n, sources, targets, weights, previous)
+                degree = _weighted_degree(n, sources, targets, weights)
+            else:
+                positions, mode, degree = np.empty((0, 2)), 'full', np.empty(0)
+
+            cursor.execute(
+                "DELETE FROM knowledge_graph_layout WHERE point_id <> ALL(%s)", (point_ids.tolist(),)
+            )
+            cursor.execute(
+                """
+                INSERT INTO knowledge_graph_layout (point_id, x, y, weight, updated_at)
+                SELECT l.point_id, l.x, l.y, l.weight, NOW()
+                FROM unnest(%s::integer[], %s::real[], %s::real[], %s::real[]) AS l(point_id, x, y, weight)
+                ON CONFLICT (point_id) DO UPDATE
+                SET x = EXCLUDED.x, y = EXCLUDED.y, weight = EXCLUDED.weight,
+                    updated_at = CASE
+                        WHEN (knowledge_graph_layout.x, knowledge_graph_layout.y) = (EXCLUDED.x, EXCLUDED.y)
+                        THEN knowledge_graph_layout.updated_at ELSE NOW() END
+                """,
+                (point_ids.tolist(), positions[:, 0].tolist(), positions[:, 1].tolist(), degree.tolist())
+            )
+            cursor.execute(
+                """
+                INSERT INTO knowledge_graph_layout_state (id, graph_version, node_count, mode, computed_at)
+                VALUES (TRUE, %s, %s, %s, NOW())
+                ON CONFLICT (id) DO UPDATE
+                SET graph_version = EXCLUDED.graph_version, node_count = EXCLUDED.node_count,
+                    mode = EXCLUDED.mode, computed_at = EXCLUDED.computed_at
+                """,
+                (version, n, mode)
+            )
+        conn.commit()
+    except Exception as e:
+        logger.error(f"計算網絡布局時發生錯誤: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    result = {
+        'nodes': n,
+        'links': len(sources),
+        'mode': mode,
+        'seconds': round(time.perf_counter() - started, 3),
+        'skipped': False
+    }
+    logger.info(f"✅ 網絡布局已更新: {result}")
+    return result
+
+def request_rebuild() -> bool:
+    """
+    提交背景工作更新布局（同類型的工作已在執行中時不重複提交）
+
+    Returns:
+        是否提交了新的工作
+    """
+    global _last_rebuild_request
+    from app.services.job_runner import submit_job, JobConflictError
+
+    now = time.monotonic()
+    if now - _last_rebuild_request < REBUILD_RETRY_SECONDS:
+        return False
+    _last_rebuild_request = now
+    try:
+        submit_job('network_layout_rebuild')
+        return True
+    except JobConflictError:
+        return False
+    except Exception as e:
+        logger.warning(f"提交網絡布局更新工作失敗: {e}")
+        return False
+
+def get_layout() -> Dict:
+    """
+    取得目前的布局（依圖版本與計算時間快取）
+
+    圖有變化時提交背景工作更新布局，本次先回傳資料庫中既有的布局（尚未計算過時為空）。
+    其他程序更新或完整重新計算後（計算時間改變）會重新載入。
+
+    Returns:
+        {'version', 'computed_at', 'stale', 'ids', 'x', 'y', 'weight'}，依 weight 由高到低排序
+    """
+    global _cached_layout
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            version = _graph_version(cursor)
+            stored_version, computed_at = _stored_state(cursor)
+    finally:
+        conn.close()
+
+    stale = stored_version != version
+    if stale:
+        request_rebuild()
+
+    cached = _cached_layout
+    if cached is not None and (cached['version'], cached['computed_at']) == (stored_version, computed_at):
+        return dict(cached, stale=stale)
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            stored_version, computed_at = _stored_state(cursor)
+            layout = _load_stored_layout(cursor)
+    finally:
+        conn.close()
+
+    layout['version'] = stored_version
+    layout['computed_at'] = computed_at
+    with _cache_lock:
+        _cached_layout = layout
+    return dict(layout, stale=stored_version != version)
+
+def query_viewport(
+    x_min: Optional[float] = None,
+    y_min: Optional[float] = None,
+    x_max: Optional[float] = None,
+    y_max: Optional[float] = None,
+    max_nodes: int = 300,
+    min_similarity: float = 0.0
+) -> Dict:
+    """
+    取得視窗範圍內的節點與其間的關聯
+
+    範圍內的節點超過 max_nodes 時只回傳加權度數最高的節點（細節層級）。
+    未指定的邊界視為不限制。
+
+    Returns:
+        {'nodes', 'links', 'stats': {'node_count', 'link_count', 'visible_total', 'total_nodes', 'bounds', 'version', 'stale'}}
+        stale 為 True 時布局正在背景更新，回傳的是上一版的座標
+    """
+    layout = get_layout()
+    xs, ys = layout['x'], layout['y']
+    inside = np.ones(len(xs), dtype=bool)
+    if x_min is not None:
+        inside &= xs >= x_min
+    if x_max is not None:
+        inside &= xs <= x_max
+    if y_min is not None:
+        inside &= ys >= y_min
+    if y_max is not None:
+        inside &= ys <= y_max
+
+    # 布局已依 weight 排序，取前 max_nodes 個即為最重要的節點
+    visible = np.flatnonzero(inside)
+    selected = visible[:max_nodes]
+    point_ids = layout['ids'][selected].tolist()
+
+    nodes: List[Dict] = []
+    links: List[Dict] = []
+    if point_ids:
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT kp.id, kp.correct_phrase, kp.key_point_summary, kp.category, kp.subcategory,
+                           kp.cluster_id, m.pagerank, m.component_id
+                    FROM knowledge_points kp
+                    LEFT JOIN knowledge_point_graph_metrics m ON m.point_id = kp.id
+                    WHERE kp.id = ANY(%s) AND kp.is_archived = FALSE
+                    """,
+                    (point_ids,)
+                )
+                details = {row['id']: row for row in cursor.fetchall()}
+                cursor.execute(
+                    """
+                    SELECT source_point_id, target_point_id, similarity_score
+                    FROM knowledge_links
+                    WHERE source_point_id = ANY(%(ids)s)
+                      AND target_point_id = ANY(%(ids)s)
+                      AND similarity_score >= %(min_similarity)s
+                      AND is_active = TRUE
+                    ORDER BY similarity_score DESC
+                    """,
+                    {'ids': point_ids, 'min_similarity': min_similarity}
+                )
+                link_rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        for index in selected:
+            point_id = int(layout['ids'][index])
+            detail = details.get(point_id)
+            if detail is None:
+                continue
+            nodes.append({
+                'id': point_id,
+                'label': detail['correct_phrase'] or f"Point {point_id}",
+                'title': detail['key_point_summary'] or "無摘要",
+                'group': detail['category'] or "未分類",
+                'subcategory': detail['subcategory'] or "未分類",
+                'cluster': detail['cluster_id'],
+                'pagerank': detail['pagerank'],
+                'component': detail['component_id'],
+                'x': round(float(layout['x'][index]), 2),
+                'y': round(float(layout['y'][index]), 2),
+                'weight': round(float(layout['weight'][index]), 3)
+            })
+        links = [
+            {'source': row['source_point_id'], 'target': row['target_point_id'], 'weight': float(row['similarity_score'])}
+            for row in link_rows
+            if row['source_point_id'] in details and row['target_point_id'] in details
+        ]
+
+    bounds = None
+    if len(xs):
+        bounds = {'x_min': float(xs.min()), 'y_min': float(ys.min()), 'x_max': float(xs.max()), 'y_max': float(ys.max())}
+    return {
+        'nodes': nodes,
+        'links': links,
+        'stats': {
+            'node_count': len(nodes),
+            'link_count': len(links),
+            'visible_total': int(len(visible)),
+            'total_nodes': int(len(xs)),
+            'min_similarity': min_similarity,
+            'bounds': bounds,
+            'version': layout['version'],
+            'stale': layout['stale']
+        }
+    }
@@ -0,0 +1,153 @@
+# app/services/hybrid_search.py
+"""
+知識點的混合搜尋（文字 + 向量）
+
+1. 文字搜尋：片語完全比對、全文檢索（tsvector）與 pg_trgm 模糊比對，全部走索引。
+2. 若查詢與某個知識點的 correct_phrase 完全相同，直接回傳文字結果，不需要模型推論。
+3. 否則再執行向量搜尋，兩份排名以 reciprocal rank fusion (RRF) 合併：
+       score = Σ 1 / (RRF_K + 名次)
+   RRF 只看名次，不需要校正文字分數與餘弦相似度之間的尺度。
+"""
+
+import logging
+from typing import Dict, List, Optional
+
+from app.services.database import get_db_connection, KNOWLEDGE_SEARCH_TSV
+from app.services.embedding_service import generate_embedding, search_knowledge_points_by_vector
+
+logger = logging.getLogger(__name__)
+
+RRF_K = 60
+LEXICAL_CANDIDATES = 20   # 文字搜尋取出的候選數量
+
+_pg_trgm_available = None
+
+def _trigram_available(cursor) -> bool:
+    global _pg_trgm_available
+    if _pg_trgm_available is None:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') AS available")
+        _pg_trgm_available = cursor.fetchone()['available']
+    return _pg_trgm_available
+
+def lexical_search(query: str, user_id: int, limit: int = LEXICAL_CANDIDATES) -> List[Dict]:
+    """
+    以文字索引搜尋用戶的知識點
+
+    Returns:
+        依「完全比對 → 相關程度」排序的結果，每筆含 exact_match 旗標
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            if _trigram_available(cursor):
+                trigram_score = """GREATEST(
+                    similarity(correct_phrase, %(query)s),
+                    similarity(coalesce(key_point_summary, ''), %(query)s),
+                    similarity(coalesce(incorrect_phrase_in_context, ''), %(query)s)
+                )"""
+                trigram_match = """
+                    OR correct_phrase %% %(query)s
+                    OR key_point_summary %% %(query)s
+                    OR incorrect_phrase_in_context %% %(query)s"""
+            else:
+                trigram_score, trigram_match = "0", ""
+
+            cursor.execute(
+                f"""
+                SELECT id, correct_phrase, key_point_summary,
+                       lower(correct_phrase) = lower(%(query)s) AS exact_match,
+                       {trigram_score} AS trigram_score,
+                       ts_rank({KNOWLEDGE_SEARCH_TSV}, plainto_tsquery('simple', %(query)s)) AS text_rank
+                FROM knowledge_points
+                WHERE user_id = %(user_id)s
+                  AND is_archived = FALSE
+                  AND (
+                    lower(correct_phrase) = lower(%(query)s)
+                    OR {KNOWLEDGE_SEARCH_TSV} @@ plainto_tsquery('simple', %(query)s)
+                    {trigram_match}
+                  )
+                ORDER BY exact_match DESC, trigram_score DESC, text_rank DESC
+                LIMIT %(limit)s
+                """,
+                {'query': query, 'user_id': user_id, 'limit': limit}
+            )
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    return [
+        {
+            'point_id': row['id'],
+            'correct_phrase': row['correct_phrase'],
+            'key_point_summary': row['key_point_summary'],
+            'exact_match': row['exact_match'],
+            'lexical_score': round(float(row['trigram_score']) + float(row['text_rank']), 4)
+        }
+        for row in rows
+    ]
+
+def _fuse(ranked_lists: List[List[Dict]], max_results: int) -> List[Dict]:
+    """以 reciprocal rank fusion 合併多份排名"""
+    fused: Dict[int, Dict] = {}
+    for results in ranked_lists:
+        for rank, item in enumerate(results, start=1):
+            entry = fused.setdefault(item['point_id'], {
+                'point_id': item['point_id'],
+                'correct_phrase': item['correct_phrase'],
+                'key_point_summary': item['key_point_summary'],
+                'similarity_score': None,
+                'lexical_score': None,
+                'rrf_score': 0.0
+            })
+            entry['rrf_score'] += 1.0 / (RRF_K + rank)
+            if 'similarity_score' in item:
+                entry['similarity_score'] = item['similarity_score']
+            if 'lexical_score' in item:
+                entry['lexical_score'] = item['lexical_score']
+
+    ranked = sorted(fused.values(), key=lambda entry: entry['rrf_score'], reverse=True)
+    for entry in ranked:
+        entry['rrf_score'] = round(entry['rrf_score'], 6)
+    return ranked[:max_results]
+
+def hybrid_search(
+    query: str,
+    user_id: int,
+    similarity_threshold: float = 0.7,
+    max_results: int = 10
+) -> Dict:
+    """
+    混合搜尋用戶的知識點
+
+    Args:
+        query: 搜尋文字
+        user_id: 只搜尋該用戶的知識點
+        similarity_threshold: 向量結果的相似度閾值
+        max_results: 最大結果數量
+
+    Returns:
+        {'strategy': 'exact' | 'hybrid', 'results': [...]}
+    """
+    query = query.strip()
+    lexical_results = lexical_search(query, user_id, max(LEXICAL_CANDIDATES, max_results))
+
+    if lexical_results and lexical_results[0]['exact_match']:
+        logger.info(f"文字搜尋完全比對 '{query}'，略過向量推論")
+        return {
+            'strategy': 'exact',
+            'results': [
+                {**item, 'similarity_score': None, 'rrf_score': None}
+                for item in lexical_results[:max_results]
+            ]
+        }
+
+    vector_results = search_knowledge_points_by_vector(
+        generate_embedding(query),
+        similarity_threshold=similarity_threshold,
+        max_results=max(LEXICAL_CANDIDATES, max_results),
+        user_id=user_id
+    )
+    return {
+        'strategy': 'hybrid',
+        'results': _fuse([lexical_results, vector_results], max_results)
+    }
@@ -0,0 +1,393 @@
+# app/services/job_runner.py
+"""
+管理介面的背景工作
+
+長時間的批次處理（例如回填向量）不在 HTTP 請求中執行：提交後立即回傳工作ID，
+工作在提交請求的程序中以背景執行緒運行，進度寫入 admin_jobs，管理介面輪詢顯示。
+
+- 取消：把狀態改為 cancelling，執行中的工作在下一次回報進度時停止（可跨程序）。
+- 續跑：每個工作有自己的回填檢查點，取消、失敗或中斷的工作續跑時從檢查點繼續，計數累加。
+- 中斷偵測：執行中的工作每 HEARTBEAT_SECONDS 更新一次 updated_at；超過 JOB_STALE_SECONDS
+  沒有更新（例如 worker 被重新啟動）的工作標記為 interrupted，之後可以續跑。
+"""
+
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+from psycopg.types.json import Jsonb
+
+from app.services.database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+JOB_STALE_SECONDS = 120
+PROGRESS_INTERVAL_SECONDS = 1.0   # 寫入進度的最短間隔
+
+ACTIVE_STATUSES = ('queued', 'running', 'cancelling')
+RESUMABLE_STATUSES = ('cancelled', 'failed', 'interrupted')
+
+# advisory lock 的識別值（任意固定整數），避免同類型的工作同時提交
+_SUBMIT_LOCK_KEY = 72041001
+
+class JobCancelled(Exception):
+    """工作在執行中被取消"""
+
+class JobConflictError(Exception):
+    """同類型的工作已在執行中，或工作目前的狀態不允許該操作"""
+
+def _checkpoint_name(job_id: int) -> str:
+    return f"admin_job_{job_id}"
+
+def _count_embedding_backfill(params: Dict) -> int:
+    from app.services.embedding_pipeline import count_pending_points
+    pending = count_pending_points()
+    limit = params.get('limit')
+    return min(pending, limit) if limit else pending
+
+def _run_embedding_backfill(job: Dict, report: Callable[[int, int, int], None]) -> Dict:
+    from app.services.embedding_pipeline import run_backfill, clear_checkpoint
+
+    # 續跑時只處理尚未達到上限的數量
+    limit = job['params'].get('limit')
+    if limit:
+        limit = max(limit - job['processed'], 0)
+        if limit == 0:
+            return {'processed': 0, 'success': 0, 'failed': 0}
+
+    result = run_backfill(
+        limit=limit,
+        job_name=_checkpoint_name(job['id']),
+        resume=True,
+        progress_callback=lambda stats: report(stats['processed'], stats['success'], stats['failed'])
+    )
+    clear_checkpoint(_checkpoint_name(job['id']))
+    return result
+
+def _count_review_backlog(params: Dict) -> int:
+    from app.services.backlog_rebalancer import find_backlogged_users, REVIEW_DAILY_CAP
+    return len(find_backlogged_users(params.get('daily_cap') or REVIEW_DAILY_CAP))
+
+def _run_review_backlog(job: Dict, report: Callable[[int, int, int], None]) -> Dict:
+    from app.services.backlog_rebalancer import rebalance_all_backlogs, REVIEW_DAILY_CAP, VOCABULARY_DAILY_CAP
+
+    # 重新排程是冪等的，續跑時直接重新計算所有積壓的用戶
+    params = job['params']
+    return rebalance_all_backlogs(
+        daily_cap=params.get('daily_cap') or REVIEW_DAILY_CAP,
+        vocabulary_daily_cap=params.get('vocabulary_daily_cap', VOCABULARY_DAILY_CAP),
+        dry_run=bool(params.get('dry_run')),
+        progress_callback=report
+    )
+
+def _run_network_layout(job: Dict, report: Callable[[int, int, int], None]) -> Dict:
+    from app.services.graph_layout import rebuild_layout
+
+    # 讀取網絡資料時提交；等待其他程序的計算完成，之後圖沒有變化就不會重算
+    result = rebuild_layout(force_full=bool(job['params'].get('force_full')), wait=True)
+    return {'processed': 1, 'success': 1, 'failed': 0, **result}
+
+def _run_clustering(job: Dict, report: Callable[[int, int, int], None]) -> Dict:
+    from app.services.clustering_service import run_clustering
+
+    # 重新分群會改寫所有用戶的 cluster_id，不在 HTTP 請求中執行
+    n_clusters = job['params'].get('n_clusters')
+    result = run_clustering(n_clusters=int(n_clusters) if n_clusters else None)
+    return {'processed': 1, 'success': 1, 'failed': 0, **result}
+
+def _run_graph_analytics(job: Dict, report: Callable[[int, int, int], None]) -> Dict:
+    from app.services.graph_analytics import run_graph_analytics
+
+    # 讀取整個關聯圖並重寫所有知識點的圖指標；其他程序（例如批次腳本）正在計算時等待它完成
+    result = run_graph_analytics(wait=True)
+    return {'processed': 1, 'success': 1, 'failed': 0, **result}
+
+# 工作類型: (執行函式, 計算總數的函式)
+JOB_TYPES: Dict[str, tuple] = {
+    'embedding_backfill': (_run_embedding_backfill, _count_embedding_backfill),
+    'review_backlog_rebalance': (_run_review_backlog, _count_review_backlog),
+    'network_layout_rebuild': (_run_network_layout, lambda params: 1),
+    'knowledge_clustering': (_run_clustering, lambda params: 1),
+    'graph_analytics': (_run_graph_analytics, lambda params: 1),
+}
+
+def _serialize(row: Dict) -> Dict:
+    job = dict(row)
+    for key in ('created_at', 'started_at', 'updated_at', 'finished_at'):
+        if job.get(key):
+            job[key] = job[key].isoformat()
+
+    rate = job.get('items_per_second') or 0.0
+    remaining = max((job['total'] or 0) - job['processed'], 0)
+    job['progress'] = round(job['processed'] / job['total'], 4) if job['total'] else None
+    job['eta_seconds'] = round(remaining / rate, 1) if job['status'] == 'running' and rate > 0 else None
+    return job
+
+def _mark_stale_jobs(cursor):
+    cursor.execute(
+        """
+        UPDATE admin_jobs
+        SET status = 'interrupted', finished_at = NOW(), error = '工作執行程序已停止'
+        WHERE status = ANY(%s) AND updated_at < NOW() - make_interval(secs => %s)
+        """,
+        (list(ACTIVE_STATUSES), JOB_STALE_SECONDS)
+    )
+
+def _ensure_no_active_job(cursor, job_type: str, exclude_id: Optional[int] = None):
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_SUBMIT_LOCK_KEY,))
+    _mark_stale_jobs(cursor)
+    cursor.execute(
+        """
+        SELECT id FROM admin_jobs
+        WHERE job_type = %s AND status = ANY(%s) AND id IS DISTINCT FROM %s
+        LIMIT 1
+        """,
+        (job_type, list(ACTIVE_STATUSES), exclude_id)
+    )
+    active = cursor.fetchone()
+    if active:
+        raise JobConflictError(f"已有執行中的 {job_type} 工作 (ID: {active['id']})")
+
+def submit_job(job_type: str, params: Optional[Dict] = None, user_id: Optional[int] = None) -> Dict:
+    """
+    提交背景工作並立即回傳
+
+    Raises:
+        ValueError: 未知的工作類型
+        JobConflictError: 同類型的工作已在執行中
+    """
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"未知的工作類型: {job_type}")
+    params = params or {}
+    total = JOB_TYPES[job_type][1](params)
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            _ensure_no_active_job(cursor, job_type)
+            cursor.execute(
+                """
+                INSERT INTO admin_jobs (job_type, params, status, total, created_by)
+                VALUES (%s, %s, 'queued', %s, %s)
+                RETURNING *
+                """,
+                (job_type, Jsonb(params), total, user_id)
+            )
+            job = cursor.fetchone()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    _start(job['id'])
+    logger.info(f"已提交背景工作 {job['id']} ({job_type}, 共 {total} 筆)")
+    return _serialize(job)
+
+def resume_job(job_id: int) -> Dict:
+    """
+    續跑已取消、失敗或中斷的工作（從該工作的檢查點繼續）
+
+    Raises:
+        LookupError: 工作不存在
+        JobConflictError: 工作狀態不允許續跑，或同類型的工作已在執行中
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT job_type FROM admin_jobs WHERE id = %s", (job_id,))
+            row = cursor.fetchone()
+            if not row:
+                raise LookupError(f"工作 {job_id} 不存在")
+            _ensure_no_active_job(cursor, row['job_type'], exclude_id=job_id)
+            cursor.execute(
+                """
+                UPDATE admin_jobs
+                SET status = 'queued', error = NULL, finished_at = NULL, updated_at = NOW()
+                WHERE id = %s AND status = ANY(%s)
+                RETURNING *
+                """,
+                (job_id, list(RESUMABLE_STATUSES))
+            )
+            job = cursor.fetchone()
+            if not job:
+                raise JobConflictError(f"工作 {job_id} 目前的狀態無法續跑")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    _start(job_id)
+    return _serialize(job)
+
+def cancel_job(job_id: int) -> Optional[Dict]:
+    """
+    取消工作：排隊中的直接取消，執行中的在下一次回報進度時停止
+
+    Returns:
+        更新後的工作；工作不存在或已結束時為 None
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            _mark_stale_jobs(cursor)
+            cursor.execute(
+                """
+                UPDATE admin_jobs
+                SET status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE 'cancelling' END,
+                    finished_at = CASE WHEN status = 'queued' THEN NOW() ELSE finished_at END,
+                    updated_at = NOW()
+                WHERE id = %s AND status IN ('queued', 'running')
+                RETURNING *
+                """,
+                (job_id,)
+            )
+            job = cursor.fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    return _serialize(job) if job else None
+
+def get_job(job_id: int) -> Optional[Dict]:
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            _mark_stale_jobs(cursor)
+            cursor.execute("SELECT * FROM admin_jobs WHERE id = %s", (job_id,))
+            job = cursor.fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    return _serialize(job) if job else None
+
+def list_jobs(job_type: Optional[str] = None, limit: int = 20) -> List[Dict]:
+    """最近的工作，新到舊"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            _mark_stale_jobs(cursor)
+            cursor.execute(
+                """
+                SELECT * FROM admin_jobs
+                WHERE %(job_type)s::text IS NULL OR job_type = %(job_type)s::text
+                ORDER BY id DESC
+                LIMIT %(limit)s
+                """,
+                {'job_type': job_type, 'limit': limit}
+            )
+            jobs = cursor.fetchall()
+        conn.commit()
+    finally:
+        conn.close()
+    return [_serialize(job) for job in jobs]
+
+def _start(job_id: int):
+    threading.Thread(target=_execute, args=(job_id,), name=f'admin-job-{job_id}', daemon=True).start()
+
+def _finish(job_id: int, status: str, result: Optional[Dict] = None, error: Optional[str] = None):
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE admin_jobs
+                SET status = %s, result = %s, error = %s, finished_at = NOW(), updated_at = NOW()
+                WHERE id = %s
+                """,
+                (status, Jsonb(result) if result is not None else None, error, job_id)
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+def _execute(job_id: int):
+    """在背景執行緒中執行工作"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE admin_jobs
+                SET status = 'running', started_at = COALESCE(started_at, NOW()), updated_at = NOW()
+                WHERE id = %s AND status = 'queued'
+                RETURNING *
+                """,
+                (job_id,)
+            )
+            job = cursor.fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    if not job:
+        return
+
+    # 續跑時從既有的計數累加
+    base = (job['processed'], job['succeeded'], job['failed'])
+    started = time.monotonic()
+    last_report = 0.0
+    stop_heartbeat = threading.Event()
+
+    def report(processed: int, succeeded: int, failed: int):
+        nonlocal last_report
+        now = time.monotonic()
+        if now - last_report < PROGRESS_INTERVAL_SECONDS:
+            return
+        last_report = now
+        report_conn = get_db_connection()
+        try:
+            with report_conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    UPDATE admin_jobs
+                    SET processed = %s, succeeded = %s, failed = %s, items_per_second = %s, updated_at = NOW()
+                    WHERE id = %s
+                    RETURNING status
+                    """,
+                    (
+                        base[0] + processed, base[1] + succeeded, base[2] + failed,
+                        round(processed / max(now - started, 1e-6), 1), job_id
+                    )
+                )
+                status = cursor.fetchone()['status']
+            report_conn.commit()
+        finally:
+            report_conn.close()
+        if status == 'cancelling':
+            raise JobCancelled()
+
+    def heartbeat():
+        while not stop_heartbeat.wait(HEARTBEAT_SECONDS):
+            try:
+                heartbeat_conn = get_db_connection()
+                try:
+                    with heartbeat_conn.cursor() as cursor:
+                        cursor.execute("UPDATE admin_jobs SET updated_at = NOW() WHERE id = %s", (job_id,))
+                    heartbeat_conn.commit()
+                finally:
+                    heartbeat_conn.close()
+            except Exception as e:
+                logger.warning(f"更新工作 {job_id} 心跳失敗: {e}")
+
+    threading.Thread(target=heartbeat, name=f'admin-job-{job_id}-heartbeat', daemon=True).start()
+    handler = JOB_TYPES[job['job_type']][0]
+    try:
+        result = handler(job, report)
+        last_report = 0.0
+        try:
+            report(result.get('processed', 0), result.get('success', 0), result.get('failed', 0))
+        except JobCancelled:
+            pass   # 已經全部完成，取消請求沒有作用
+        _finish(job_id, 'succeeded', result=result)
+        logger.info(f"✅ 背景工作 {job_id} 完成: {result}")
+    except JobCancelled:
+        _finish(job_id, 'cancelled')
+        logger.info(f"背景工作 {job_id} 已取消，可從檢查點續跑")
+    except Exception as e:
+        logger.error(f"背景工作 {job_id} 失敗: {e}")
+        _finish(job_id, 'failed', error=str(e))
+    finally:
+        stop_heartbeat.set()
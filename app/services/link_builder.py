@@ -0,0 +1,219 @@
+# app/services/link_builder.py
+"""
+以相似度矩陣重建整個知識點關聯表
+
+所有向量一次載入為正規化的 float32 矩陣，分塊計算「區塊 × 全部」的相似度，
+每塊以 np.argpartition 取出各列的前 k 名，記憶體用量受 BLOCK_MEMORY_BYTES 限制。
+不同用戶的知識點之間不建立關聯。
+得到的雙向關聯以 COPY BINARY 寫入暫存表，再用一條 INSERT 取代原有的語義關聯；
+手動建立的關聯不受影響。
+"""
+
+import time
+import logging
+from typing import Dict, Iterator, Optional, Tuple
+import numpy as np
+
+from app.services.database import get_db_connection
+from app.services.embedding_service import (
+    load_knowledge_point_embeddings, _COPY_BINARY_HEADER, _COPY_BINARY_TRAILER
+)
+
+logger = logging.getLogger(__name__)
+
+# 單一區塊相似度矩陣的記憶體上限
+BLOCK_MEMORY_BYTES = 64 * 1024 * 1024
+
+# COPY BINARY 中一列 (source INTEGER, target INTEGER, score REAL) 的位元組配置
+_LINK_ROW_DTYPE = np.dtype([
+    ('field_count', '>i2'),
+    ('source_length', '>i4'),
+    ('source', '>i4'),
+    ('target_length', '>i4'),
+    ('target', '>i4'),
+    ('score_length', '>i4'),
+    ('score', '>f4'),
+])
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def iter_topk_neighbours(
+    vectors: np.ndarray,
+    k: int,
+    threshold: float,
+    block_size: Optional[int] = None,
+    groups: Optional[np.ndarray] = None
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    分塊計算每個向量的前 k 個最相似向量（不含自己）
+
+    Args:
+        vectors: 向量矩陣 (n, 維度)
+        k: 每個向量最多取幾個鄰居
+        threshold: 相似度閾值
+        block_size: 每塊列數（None = 依 BLOCK_MEMORY_BYTES 決定）
+        groups: 每個向量所屬的群組（用戶），只在同群組內找鄰居
+
+    Yields:
+        每塊的 (來源列號, 目標列號, 相似度)，已套用閾值
+    """
+    count = vectors.shape[0]
+    k = min(k, count - 1)
+    if k <= 0:
+        return
+
+    matrix = _normalize_rows(np.ascontiguousarray(vectors, dtype=np.float32))
+    if block_size is None:
+        block_size = max(1, BLOCK_MEMORY_BYTES // (count * 4))
+
+    for start in range(0, count, block_size):
+        stop = min(start + block_size, count)
+        scores = matrix[start:stop] @ matrix.T
+        local_rows = np.arange(stop - start)
+        scores[local_rows, local_rows + start] = -np.inf
+        if groups is not None:
+            scores[groups[start:stop, None] != groups[None, :]] = -np.inf
+
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        keep = top_scores >= threshold
+
+        sources = np.broadcast_to((local_rows + start)[:, None], top.shape)
+        yield sources[keep], top[keep], top_scores[keep]
+
+def compute_link_pairs(
+    point_ids: np.ndarray,
+    vectors: np.ndarray,
+    k: int = 5,
+    threshold: float = 0.8,
+    block_size: Optional[int] = None,
+    user_ids: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    計算所有知識點的雙向關聯
+
+    與 auto_link_knowledge_point 相同：每個知識點連到自己的前 k 名，並補上反向關聯。
+
+    Returns:
+        去除重複後的 (來源ID, 目標ID, 相似度)
+    """
+    blocks = list(iter_topk_neighbours(vectors, k, threshold, block_size, groups=user_ids))
+    if not blocks:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=np.float32)
+
+    sources = np.concatenate([b[0] for b in blocks])
+    targets = np.concatenate([b[1] for b in blocks])
+    scores = np.concatenate([b[2] for b in blocks]).astype(np.float32)
+
+    # 補上反向關聯，並以 (來源, 目標) 去除重複
+    sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+    scores = np.concatenate([scores, scores])
+    keys = sources.astype(np.int64) * vectors.shape[0] + targets
+    _, unique_rows = np.unique(keys, return_index=True)
+
+    ids = np.asarray(point_ids, dtype=np.int64)
+    return ids[sources[unique_rows]], ids[targets[unique_rows]], np.minimum(scores[unique_rows], 1.0)
+
+def _load_point_owners(conn, point_ids: np.ndarray) -> np.ndarray:
+    """依 point_ids 的順序回傳擁有者ID；沒有擁有者的知識點為 -1"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT id, user_id FROM knowledge_points WHERE id = ANY(%s)",
+            (point_ids.tolist(),)
+        )
+        owners = {row['id']: row['user_id'] for row in cursor.fetchall()}
+    return np.array([owners.get(int(pid)) or -1 for pid in point_ids], dtype=np.int64)
+
+def _pack_link_rows(sources: np.ndarray, targets: np.ndarray, scores: np.ndarray) -> np.ndarray:
+    rows = np.empty(len(sources), dtype=_LINK_ROW_DTYPE)
+    rows['field_count'] = 3
+    rows['source_length'] = 4
+    rows['source'] = sources
+    rows['target_length'] = 4
+    rows['target'] = targets
+    rows['score_length'] = 4
+    rows['score'] = scores
+    return rows
+
+def rebuild_semantic_links(
+    similarity_threshold: float = 0.8,
+    max_links: int = 5,
+    block_size: Optional[int] = None
+) -> Dict:
+    """
+    重新計算並寫入所有語義關聯
+
+    Args:
+        similarity_threshold: 相似度閾值
+        max_links: 每個知識點最多關聯的相似知識點數量
+        block_size: 相似度矩陣每塊的列數（None = 自動）
+
+    Returns:
+        {'points', 'deleted', 'created', 'compute_seconds', 'write_seconds'}
+    """
+    conn = get_db_connection()
+    try:
+        started = time.perf_counter()
+        point_ids, vectors = load_knowledge_point_embeddings(conn)
+        user_ids = _load_point_owners(conn, point_ids)
+        # 沒有擁有者的知識點不參與關聯
+        owned = user_ids >= 0
+        point_ids, vectors, user_ids = point_ids[owned], vectors[owned], user_ids[owned]
+        sources, targets, scores = compute_link_pairs(
+            point_ids, vectors, k=max_links, threshold=similarity_threshold,
+            block_size=block_size, user_ids=user_ids
+        )
+        compute_seconds = time.perf_counter() - started
+        logger.info(f"已計算 {len(point_ids)} 個知識點的 {len(sources)} 條關聯（{compute_seconds:.2f} 秒）")
+
+        started = time.perf_counter()
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS link_staging (
+                    source_point_id INTEGER NOT NULL,
+                    target_point_id INTEGER NOT NULL,
+                    similarity_score REAL NOT NULL
+                ) ON COMMIT DROP
+            """)
+            cursor.execute("TRUNCATE link_staging")
+
+            with cursor.copy(
+                "COPY link_staging (source_point_id, target_point_id, similarity_score) FROM STDIN (FORMAT BINARY)"
+            ) as copy:
+                copy.write(_COPY_BINARY_HEADER)
+                if len(sources):
+                    copy.write(memoryview(_pack_link_rows(sources, targets, scores)).cast('B'))
+                copy.write(_COPY_BINARY_TRAILER)
+
+            cursor.execute("DELETE FROM knowledge_links WHERE link_type = 'semantic_similarity'")
+            deleted = cursor.rowcount
+
+            cursor.execute("""
+                INSERT INTO knowledge_links (source_point_id, target_point_id, similarity_score, link_type)
+                SELECT source_point_id, target_point_id, similarity_score, 'semantic_similarity'
+                FROM link_staging
+                ON CONFLICT (source_point_id, target_point_id) DO NOTHING
+            """)
+            created = cursor.rowcount
+
+        conn.commit()
+        write_seconds = time.perf_counter() - started
+    except Exception as e:
+        logger.error(f"重建知識點關聯時發生錯誤: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    logger.info(f"✅ 重建關聯完成: 刪除 {deleted} 條，建立 {created} 條")
+    return {
+        'points': len(point_ids),
+        'deleted': deleted,
+        'created': created,
+        'compute_seconds': round(compute_seconds, 3),
+        'write_seconds': round(write_seconds, 3)
+    }
@@ -0,0 +1,343 @@
+# app/services/neighborhood_service.py
+"""
+知識點的 k 跳鄰域
+
+從一個或多個起點沿有效關聯（不分方向）擴展 k 跳，回傳鄰域中的知識點與其間的關聯，
+用於「複習這個知識點與相關概念」之類的組合，不必逐一呼叫單跳的關聯查詢。
+
+- 查詢：一個遞迴 CTE 完成。每一輪是一整層的 BFS（以陣列保存該層節點與分數、已拜訪節點），
+  同一個節點只保留第一次到達的一層，不會因為多條路徑而展開成大量的列；
+  每層最多保留 MAX_FRONTIER 個分數最高的節點，避免經過樞紐節點時爆量。
+- 分數：起點為 1，每跳乘上關聯的相似度與衰減係數，同一層有多個來源時取最高。
+- 快取：結果依 (起點, k, 閾值, 衰減, 數量上限, 用戶) 快取在程序內。
+  觸發器把關聯有變動的兩端知識點、封存或內容變動的知識點寫入 knowledge_graph_changes，
+  讀取前先取出新的變動，只移除受影響的快取項目（跨程序一致）。
+  快取項目記錄擴展時拜訪過的所有知識點（包含因 max_nodes 沒有回傳的），
+  任一端已拜訪的關聯變動、或已拜訪的知識點變動都會讓它失效。
+  這不是精確的失效：某一層超過 MAX_FRONTIER 而被捨棄的候選知識點沒有被記錄，
+  它們被封存或改變擁有者時，被捨棄的名額可能改由其他知識點遞補，這類變動只能等 CACHE_TTL_SECONDS 過期；
+  變動紀錄的序號順序與交易提交順序不一致時也可能漏掉少數變動，同樣由 CACHE_TTL_SECONDS 兜底。
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.services.database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+MAX_HOPS = 4
+MAX_FRONTIER = 500           # 每層最多保留的節點數
+DEFAULT_DECAY = 0.7
+CACHE_SIZE = 512
+CACHE_TTL_SECONDS = 600      # 快取項目的最長存活時間（也保證不會錯過已清除的變動紀錄）
+CHANGE_RETENTION = '1 day'
+PRUNE_INTERVAL_SECONDS = 3600
+
+_cache: "OrderedDict[tuple, Dict]" = OrderedDict()
+_cache_lock = threading.Lock()
+_last_change_id: Optional[int] = None
+_last_sync = 0.0
+_last_prune = 0.0
+_triggers_installed = False
+
+def _install_triggers(cursor):
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION knowledge_graph_log_link_changes() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO knowledge_graph_changes (point_id)
+            SELECT DISTINCT point_id FROM (
+                SELECT source_point_id FROM new_rows UNION SELECT target_point_id FROM new_rows
+            ) AS touched(point_id);
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            INSERT INTO knowledge_graph_changes (point_id)
+            SELECT DISTINCT point_id FROM (
+                SELECT source_point_id FROM old_rows UNION SELECT target_point_id FROM old_rows
+            ) AS touched(point_id);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION knowledge_graph_log_point_changes() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO knowledge_graph_changes (point_id) SELECT id FROM old_rows;
+        ELSE
+            -- 只記錄會影響鄰域結果的欄位變動
+            INSERT INTO knowledge_graph_changes (point_id)
+            SELECT n.id FROM new_rows n JOIN old_rows o ON o.id = n.id
+            WHERE (n.is_archived, n.correct_phrase, n.key_point_summary, n.category, n.mastery_level)
+                  IS DISTINCT FROM (o.is_archived, o.correct_phrase, o.key_point_summary, o.category, o.mastery_level);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    for operation, transitions in (
+        ('INSERT', 'NEW TABLE AS new_rows'),
+        ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+        ('DELETE', 'OLD TABLE AS old_rows'),
+    ):
+        trigger = f"trg_knowledge_graph_links_{operation.lower()}"
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger} ON knowledge_links")
+        cursor.execute(f"""
+        CREATE TRIGGER {trigger}
+        AFTER {operation} ON knowledge_links
+        REFERENCING {transitions}
+        FOR EACH STATEMENT EXECUTE FUNCTION knowledge_graph_log_link_changes()
+        """)
+    for operation, transitions in (
+        ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+        ('DELETE', 'OLD TABLE AS old_rows'),
+    ):
+        trigger = f"trg_knowledge_graph_points_{operation.lower()}"
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger} ON knowledge_points")
+        cursor.execute(f"""
+        CREATE TRIGGER {trigger}
+        AFTER {operation} ON knowledge_points
+        REFERENCING {transitions}
+        FOR EACH STATEMENT EXECUTE FUNCTION knowledge_graph_log_point_changes()
+        """)
+
+def ensure_installed() -> bool:
+    """建立記錄圖變動的觸發器（每個程序檢查一次；knowledge_links 由向量遷移腳本建立）"""
+    global _triggers_installed
+    if _triggers_installed:
+        return False
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT to_regclass('knowledge_links') IS NOT NULL AS has_links,
+                       to_regproc('knowledge_graph_log_point_changes') IS NOT NULL AS installed
+                """
+            )
+            row = cursor.fetchone()
+            if not row['has_links']:
+                return False
+            if not row['installed']:
+                _install_triggers(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    _triggers_installed = True
+    if not row['installed']:
+        logger.info("✅ 已安裝知識點網絡變動紀錄的觸發器")
+    return not row['installed']
+
+def invalidate_points(point_ids: Iterable[int]) -> int:
+    """移除包含任一知識點的快取項目，回傳移除的數量"""
+    touched = set(point_ids)
+    if not touched:
+        return 0
+    with _cache_lock:
+        stale = [key for key, entry in _cache.items() if not touched.isdisjoint(entry['point_ids'])]
+        for key in stale:
+            del _cache[key]
+    return len(stale)
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+def _sync_changes(cursor):
+    """取出其他連線寫入的變動並移除受影響的快取項目"""
+    global _last_change_id, _last_sync, _last_prune
+    now = time.monotonic()
+
+    if _last_change_id is None or now - _last_sync > CACHE_TTL_SECONDS:
+        # 第一次讀取或太久沒有同步：可能錯過已清除的變動紀錄，整個快取重來
+        cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM knowledge_graph_changes")
+        _last_change_id = cursor.fetchone()['max_id']
+        clear_cache()
+    else:
+        cursor.execute(
+            "SELECT id, point_id FROM knowledge_graph_changes WHERE id > %s ORDER BY id",
+            (_last_change_id,)
+        )
+        changes = cursor.fetchall()
+        if changes:
+            _last_change_id = changes[-1]['id']
+            invalidate_points(change['point_id'] for change in changes)
+    _last_sync = now
+
+    if now - _last_prune > PRUNE_INTERVAL_SECONDS:
+        cursor.execute(
+            f"DELETE FROM knowledge_graph_changes WHERE changed_at < NOW() - INTERVAL '{CHANGE_RETENTION}'"
+        )
+        _last_prune = now
+
+def _query_neighborhood(
+    cursor,
+    seed_ids: List[int],
+    k: int,
+    threshold: float,
+    decay: float,
+    max_nodes: int,
+    user_id: Optional[int]
+) -> Tuple[Dict, frozenset]:
+    """回傳 (鄰域結果, 擴展時拜訪過的所有知識點ID)"""
+    params = {
+        'seeds': seed_ids, 'k': k, 'threshold': threshold, 'decay': decay,
+        'frontier': MAX_FRONTIER, 'max_nodes': max_nodes, 'user_id': user_id
+    }
+    cursor.execute(
+        """
+        WITH RECURSIVE hop(depth, ids, scores, visited) AS (
+            SELECT 0, s.ids, array_fill(1.0::double precision, ARRAY[cardinality(s.ids)]), s.ids
+            FROM (
+                SELECT COALESCE(array_agg(kp.id), '{}') AS ids
+                FROM knowledge_points kp
+                WHERE kp.id = ANY(%(seeds)s::integer[]) AND kp.is_archived = FALSE
+                  AND (%(user_id)s::integer IS NULL OR kp.user_id = %(user_id)s::integer)
+            ) s
+            UNION ALL
+            SELECT h.depth + 1, n.ids, n.scores, h.visited || n.ids
+            FROM hop h
+            CROSS JOIN LATERAL (
+                SELECT array_agg(best.id ORDER BY best.score DESC) AS ids,
+                       array_agg(best.score ORDER BY best.score DESC) AS scores
+                FROM (
+                    SELECT e.neighbor AS id, MAX(f.score * e.similarity * %(decay)s) AS score
+                    FROM unnest(h.ids, h.scores) AS f(id, score)
+                    CROSS JOIN LATERAL (
+                        SELECT target_point_id AS neighbor, similarity_score AS similarity
+                        FROM knowledge_links
+                        WHERE source_point_id = f.id AND is_active = TRUE AND similarity_score >= %(threshold)s
+                        UNION ALL
+                        SELECT source_point_id, similarity_score
+                        FROM knowledge_links
+                        WHERE target_point_id = f.id AND is_active = TRUE AND similarity_score >= %(threshold)s
+                    ) e
+                    JOIN knowledge_points kp ON kp.id = e.neighbor AND kp.is_archived = FALSE
+                    WHERE e.neighbor <> ALL(h.visited)
+                      AND (%(user_id)s::integer IS NULL OR kp.user_id = %(user_id)s::integer)
+                    GROUP BY e.neighbor
+                    ORDER BY score DESC
+                    LIMIT %(frontier)s
+                ) best
+            ) n
+            WHERE h.depth < %(k)s AND n.ids IS NOT NULL
+        ),
+        reached AS (
+            SELECT f.id, h.depth, f.score,
+                   ROW_NUMBER() OVER (ORDER BY h.depth = 0 DESC, f.score DESC, f.id) AS position
+            FROM hop h, unnest(h.ids, h.scores) AS f(id, score)
+        )
+        SELECT r.id, r.depth, r.score, r.position <= %(max_nodes)s AS included,
+               kp.correct_phrase, kp.key_point_summary, kp.category,
+               kp.subcategory, kp.mastery_level, kp.next_review_date
+        FROM reached r
+        JOIN knowledge_points kp ON kp.id = r.id
+        ORDER BY r.depth, r.score DESC, r.id
+        """,
+        params
+    )
+    rows = cursor.fetchall()
+    explored = frozenset(row['id'] for row in rows)
+    nodes = []
+    for row in rows:
+        if not row['included']:
+            continue
+        node = dict(row)
+        del node['included']
+        node['score'] = round(float(node['score']), 6)
+        if node.get('next_review_date'):
+            node['next_review_date'] = node['next_review_date'].isoformat()
+        nodes.append(node)
+
+    point_ids = [node['id'] for node in nodes]
+    links = []
+    if len(point_ids) > 1:
+        cursor.execute(
+            """
+            SELECT source_point_id, target_point_id, similarity_score, link_type
+            FROM knowledge_links
+            WHERE source_point_id = ANY(%(ids)s) AND target_point_id = ANY(%(ids)s)
+              AND is_active = TRUE AND similarity_score >= %(threshold)s
+            ORDER BY similarity_score DESC
+            """,
+            {'ids': point_ids, 'threshold': threshold}
+        )
+        links = [
+            {
+                'source': row['source_point_id'],
+                'target': row['target_point_id'],
+                'similarity_score': float(row['similarity_score']),
+                'link_type': row['link_type']
+            }
+            for row in cursor.fetchall()
+        ]
+
+    return {'nodes': nodes, 'links': links}, explored
+
+def get_neighborhood(
+    seed_ids: Iterable[int],
+    k: int = 2,
+    threshold: float = 0.0,
+    decay: float = DEFAULT_DECAY,
+    max_nodes: int = 100,
+    user_id: Optional[int] = None
+) -> Dict:
+    """
+    起點周圍 k 跳內的知識點與其間的關聯
+
+    Args:
+        seed_ids: 起點知識點ID（封存或不屬於該用戶的起點會被忽略）
+        k: 最多擴展的跳數（1 到 MAX_HOPS）
+        threshold: 只沿相似度不低於此值的關聯擴展
+        decay: 每跳的衰減係數
+        max_nodes: 回傳的知識點上限（起點一定包含在內，其餘依分數）
+        user_id: 只擴展到該用戶的知識點（None = 不限制）
+
+    Returns:
+        {'nodes': [{'id', 'depth', 'score', ...}], 'links', 'cached'}
+    """
+    seeds = sorted({int(point_id) for point_id in seed_ids})
+    if not seeds:
+        raise ValueError("至少需要一個起點知識點")
+    if not 1 <= k <= MAX_HOPS:
+        raise ValueError(f"k 必須介於 1 與 {MAX_HOPS} 之間")
+
+    key = (tuple(seeds), k, round(threshold, 4), round(decay, 4), max_nodes, user_id)
+    ensure_installed()
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            _sync_changes(cursor)
+            # 先提交清理的變更紀錄：命中快取時直接回傳，不會執行後面的 commit
+            conn.commit()
+            with _cache_lock:
+                entry = _cache.get(key)
+                if entry and time.monotonic() - entry['cached_at'] < CACHE_TTL_SECONDS:
+                    _cache.move_to_end(key)
+                    return {**entry['result'], 'cached': True}
+
+            result, explored = _query_neighborhood(cursor, seeds, k, threshold, decay, max_nodes, user_id)
+        conn.commit()
+    finally:
+        conn.close()
+
+    with _cache_lock:
+        _cache[key] = {
+            'cached_at': time.monotonic(),
+            'result': result,
+            'point_ids': explored | frozenset(seeds)
+        }
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return {**result, 'cached': False}
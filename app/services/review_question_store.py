@@ -0,0 +1,360 @@
+# app/services/review_question_store.py
+"""
+知識點複習題的預先生成與輪替
+
+原本每次開始學習都把所有到期的弱點塞進一個大 prompt 即時出題，再依回傳順序對應回知識點。
+改為每個知識點在背景預先生成 VARIANTS_PER_POINT 題（依知識點 ID 對應），存在 review_question_variants：
+
+- 出題：一次 UPDATE ... RETURNING 為每個知識點挑出被出過最少次（其次最久沒出過）的題目並累加次數，
+  同一個知識點的題目輪流出現。大多數的學習回合不需要呼叫 LLM。
+- 即時生成：只有完全沒有可用題目的知識點才即時生成（一次呼叫、每個知識點一題），
+  生成的題目同樣存入題庫，並喚醒背景執行緒補齊其餘的題目。
+- 驗證：題目必須含中文、長度合理、不能直接寫出正確用法的英文，同一知識點內不重複。
+- 過期：題目記錄生成時的 correct_phrase（source_phrase），知識點的正確用法被修改後舊題目不再使用，
+  背景補題時刪除。知識點被刪除時題目一併刪除（ON DELETE CASCADE）。
+- 背景補題：依到期日挑選 REVIEW_VARIANT_HORIZON_DAYS 天內到期、題目不足的知識點，
+  每次 LLM 呼叫處理 FILL_BATCH_POINTS 個；多個 worker 以 advisory lock 確保同一時間只有一個在補題。
+  生成失敗（或驗證後沒有可用題目）的知識點在 FILL_RETRY_SECONDS 內不會重試。
+"""
+
+import os
+import re
+import time
+import logging
+import datetime
+import threading
+from typing import Dict, List, Optional
+
+from app.services.database import get_db_connection
+from app.services import ai_service as ai
+from app.services import due_queue
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_PER_POINT = int(os.environ.get('REVIEW_VARIANTS_PER_POINT', 3))
+FILL_INTERVAL_SECONDS = int(os.environ.get('REVIEW_VARIANT_FILL_INTERVAL', 120))   # 0 = 不啟動背景執行緒
+FILL_HORIZON_DAYS = int(os.environ.get('REVIEW_VARIANT_HORIZON_DAYS', 7))
+FILL_MODEL = os.environ.get('REVIEW_VARIANT_MODEL') or None
+FILL_BATCH_POINTS = 5          # 每次 LLM 呼叫的知識點數
+FILL_MAX_POINTS = 40           # 每輪最多補題的知識點數
+FILL_RETRY_SECONDS = 3600
+MIN_SENTENCE_CHARS = 4
+MAX_SENTENCE_CHARS = 200
+
+# advisory lock 的識別值（任意固定整數）
+_FILL_LOCK_KEY = 72048001
+
+_CJK = re.compile(r'[一-鿿]')
+_NORMALIZE = re.compile(r'[\W_]+', re.UNICODE)
+
+_failed_attempts: Dict[int, float] = {}
+_metrics = {'served_cached': 0, 'served_live': 0, 'live_failures': 0, 'variants_generated': 0, 'variants_rejected': 0}
+_metrics_lock = threading.Lock()
+_wake = threading.Event()
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+def _count(key: str, amount: int = 1):
+    with _metrics_lock:
+        _metrics[key] += amount
+
+def get_metrics() -> Dict:
+    """本程序的出題統計（快取命中、即時生成、驗證淘汰的題數）"""
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    served = metrics['served_cached'] + metrics['served_live']
+    metrics['cache_hit_rate'] = round(metrics['served_cached'] / served, 4) if served else None
+    return metrics
+
+# ---------------------------------------------------------------------------
+# 驗證與儲存
+# ---------------------------------------------------------------------------
+
+def validate_variants(point: Dict, questions: List[Dict], existing: Optional[List[str]] = None) -> List[Dict]:
+    """
+    過濾 LLM 生成的題目
+
+    Args:
+        point: 知識點（需要 correct_phrase）
+        existing: 該知識點已有的題目句子，用於去除重複
+    """
+    phrase = (point.get('correct_phrase') or '').strip().lower()
+    seen = {_NORMALIZE.sub('', sentence) for sentence in existing or []}
+    valid = []
+    for question in questions:
+        sentence = (question.get('new_sentence') or '').strip()
+        key = _NORMALIZE.sub('', sentence)
+        if (
+            not MIN_SENTENCE_CHARS <= len(sentence) <= MAX_SENTENCE_CHARS
+            or not _CJK.search(sentence)
+            or (phrase and phrase in sentence.lower())
+            or key in seen
+        ):
+            _count('variants_rejected')
+            continue
+        seen.add(key)
+        hint = (question.get('hint_text') or '').strip() or None
+        valid.append({'new_sentence': sentence, 'hint_text': hint})
+    return valid
+
+def store_variants(cursor, point: Dict, questions: List[Dict], model_name: Optional[str], served: bool = False) -> List[Dict]:
+    """
+    把已驗證的題目存入題庫
+
+    Args:
+        served: 題目已在這次回合出題（即時生成），times_served 從 1 開始
+
+    Returns:
+        實際新增的題目（含 id）
+    """
+    if not questions:
+        return []
+    cursor.execute(
+        """
+        INSERT INTO review_question_variants
+            (knowledge_point_id, source_phrase, new_sentence, hint_text, model_name, times_served, last_served_at)
+        SELECT %s, %s, q.new_sentence, q.hint_text, %s, %s, CASE WHEN %s THEN NOW() END
+        FROM unnest(%s::text[], %s::text[]) AS q(new_sentence, hint_text)
+        ON CONFLICT (knowledge_point_id, new_sentence) DO UPDATE
+        SET source_phrase = EXCLUDED.source_phrase, hint_text = EXCLUDED.hint_text, model_name = EXCLUDED.model_name,
+            times_served = EXCLUDED.times_served, last_served_at = EXCLUDED.last_served_at, created_at = NOW()
+        WHERE review_question_variants.source_phrase <> EXCLUDED.source_phrase   -- 只接手過期的同句題目
+        RETURNING id, new_sentence, hint_text
+        """,
+        (
+            point['id'], point['correct_phrase'], model_name, 1 if served else 0, served,
+            [q['new_sentence'] for q in questions], [q['hint_text'] for q in questions]
+        )
+    )
+    inserted = cursor.fetchall()
+    _count('variants_generated', len(inserted))
+    return inserted
+
+def take_variants(cursor, point_ids: List[int]) -> Dict[int, Dict]:
+    """為每個知識點挑出下一題（被出過最少次、最久沒出過）並累加出題次數"""
+    if not point_ids:
+        return {}
+    cursor.execute(
+        """
+        WITH picked AS (
+            SELECT DISTINCT ON (v.knowledge_point_id) v.id
+            FROM review_question_variants v
+            JOIN knowledge_points kp ON kp.id = v.knowledge_point_id AND kp.correct_phrase = v.source_phrase
+            WHERE v.knowledge_point_id = ANY(%s)
+            ORDER BY v.knowledge_point_id, v.times_served, v.last_served_at NULLS FIRST, v.id
+        )
+        UPDATE review_question_variants v
+        SET times_served = v.times_served + 1, last_served_at = NOW()
+        FROM picked
+        WHERE v.id = picked.id
+        RETURNING v.knowledge_point_id, v.id, v.new_sentence, v.hint_text
+        """,
+        (point_ids,)
+    )
+    return {row['knowledge_point_id']: row for row in cursor.fetchall()}
+
+# ---------------------------------------------------------------------------
+# 出題
+# ---------------------------------------------------------------------------
+
+def get_review_questions(points: List[Dict], model_name: Optional[str] = None) -> List[Dict]:
+    """
+    為到期的知識點取得複習題（依 points 的順序，沒有題目的知識點會被略過）
+
+    Args:
+        points: 知識點（需要 id、correct_phrase、mastery_level 以及生成題目用的欄位）
+        model_name: 沒有可用題目時即時生成使用的模型
+
+    Returns:
+        題目列表：{'new_sentence', 'hint_text', 'type': 'review', 'knowledge_point_id', 'mastery_level', 'variant_id'}
+        資料庫或即時生成發生錯誤時只記錄錯誤，回傳已取得的題目，不讓開始學習的請求失敗
+    """
+    if not points:
+        return []
+    point_ids = [point['id'] for point in points]
+
+    chosen: Dict[int, Dict] = {}
+    try:
+        conn = get_db_connection()
+    except Exception as e:
+        logger.error(f"取得複習題時無法連接資料庫: {e}")
+        return []
+    try:
+        with conn.cursor() as cursor:
+            chosen = take_variants(cursor, point_ids)
+        conn.commit()
+        _count('served_cached', len(chosen))
+
+        missing = [point for point in points if point['id'] not in chosen]
+        if missing:
+            print(f"[ReviewQuestions] {len(missing)} 個知識點沒有預先生成的題目，即時生成...")
+            generated = ai.generate_review_question_variants(missing, 1, model_name=model_name)
+            live = {}
+            with conn.cursor() as cursor:
+                for point in missing:
+                    valid = validate_variants(point, generated.get(point['id'], []))
+                    inserted = store_variants(cursor, point, valid[:1], model_name or ai.DEFAULT_GENERATION_MODEL, served=True)
+                    if inserted:
+                        live[point['id']] = inserted[0]
+            conn.commit()
+            # 提交後才加入，儲存失敗時不會回傳已被回滾的題目
+            chosen.update(live)
+            _count('served_live', len(live))
+            _count('live_failures', len(missing) - len(live))
+            request_fill()
+    except Exception as e:
+        conn.rollback()
+        missing_count = len(points) - len(chosen)
+        _count('live_failures', missing_count)
+        logger.error(f"取得複習題時發生錯誤，{missing_count} 個知識點本回合沒有題目: {e}")
+    finally:
+        conn.close()
+
+    questions = []
+    for point in points:
+        variant = chosen.get(point['id'])
+        if not variant:
+            continue
+        questions.append({
+            'new_sentence': variant['new_sentence'],
+            'hint_text': variant['hint_text'],
+            'type': 'review',
+            'knowledge_point_id': point['id'],
+            'mastery_level': point['mastery_level'],
+            'variant_id': variant['id'],
+        })
+    return questions
+
+# ---------------------------------------------------------------------------
+# 背景補題
+# ---------------------------------------------------------------------------
+
+def fill_missing_variants(
+    max_points: int = FILL_MAX_POINTS,
+    variants_per_point: int = VARIANTS_PER_POINT,
+    horizon_days: int = FILL_HORIZON_DAYS,
+    model_name: Optional[str] = FILL_MODEL
+) -> Dict:
+    """
+    為即將到期、題目不足的知識點補齊題目
+
+    Returns:
+        {'points', 'generated', 'stale_removed', 'failed', 'skipped'}
+    """
+    result = {'points': 0, 'generated': 0, 'stale_removed': 0, 'failed': 0, 'skipped': False}
+    now = time.monotonic()
+    retry_after = [point_id for point_id, failed_at in _failed_attempts.items() if now - failed_at < FILL_RETRY_SECONDS]
+    horizon = due_queue.taipei_today() + datetime.timedelta(days=horizon_days)
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s) AS locked", (_FILL_LOCK_KEY,))
+            locked = cursor.fetchone()['locked']
+        conn.commit()
+        if not locked:
+            result['skipped'] = True
+            return result
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT kp.id, kp.category, kp.subcategory, kp.correct_phrase, kp.explanation, kp.key_point_summary,
+                           COALESCE(array_agg(v.new_sentence) FILTER (WHERE v.id IS NOT NULL), '{}') AS sentences
+                    FROM knowledge_points kp
+                    LEFT JOIN review_question_variants v
+                      ON v.knowledge_point_id = kp.id AND v.source_phrase = kp.correct_phrase
+                    WHERE kp.is_archived = FALSE AND kp.next_review_date <= %s AND NOT (kp.id = ANY(%s))
+                    GROUP BY kp.id
+                    HAVING COUNT(v.id) < %s
+                    ORDER BY kp.next_review_date, kp.id
+                    LIMIT %s
+                    """,
+                    (horizon, retry_after, variants_per_point, max_points)
+                )
+                points = cursor.fetchall()
+                if points:
+                    # 正確用法被修改過的知識點，舊題目已經不適用
+                    cursor.execute(
+                        """
+                        DELETE FROM review_question_variants v
+                        USING knowledge_points kp
+                        WHERE v.knowledge_point_id = kp.id AND kp.id = ANY(%s) AND v.source_phrase <> kp.correct_phrase
+                        """,
+                        ([point['id'] for point in points],)
+                    )
+                    result['stale_removed'] = cursor.rowcount
+            conn.commit()
+
+            for start in range(0, len(points), FILL_BATCH_POINTS):
+                batch = points[start:start + FILL_BATCH_POINTS]
+                # LLM 呼叫期間不持有交易
+                generated = ai.generate_review_question_variants(batch, variants_per_point, model_name=model_name)
+                with conn.cursor() as cursor:
+                    for point in batch:
+                        needed = variants_per_point - len(point['sentences'])
+                        valid = validate_variants(point, generated.get(point['id'], []), point['sentences'])
+                        inserted = store_variants(cursor, point, valid[:needed], model_name or ai.DEFAULT_GENERATION_MODEL)
+                        if inserted:
+                            result['generated'] += len(inserted)
+                            _failed_attempts.pop(point['id'], None)
+                        else:
+                            result['failed'] += 1
+                            _failed_attempts[point['id']] = time.monotonic()
+                conn.commit()
+                result['points'] += len(batch)
+        finally:
+            conn.rollback()
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (_FILL_LOCK_KEY,))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"補齊複習題時發生錯誤: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    # 過期的失敗紀錄不需要保留
+    for point_id in [pid for pid, failed_at in _failed_attempts.items() if now - failed_at >= FILL_RETRY_SECONDS]:
+        _failed_attempts.pop(point_id, None)
+
+    if result['generated'] or result['failed']:
+        logger.info(
+            f"✅ 已為 {result['points']} 個知識點補題 {result['generated']} 題"
+            f"（失敗 {result['failed']}、移除過期 {result['stale_removed']}）"
+        )
+    return result
+
+def request_fill():
+    """喚醒背景執行緒立即補題（例如剛即時生成過題目或新增了知識點）"""
+    _wake.set()
+
+def _run_worker(interval: int):
+    while True:
+        _wake.wait(interval)
+        _wake.clear()
+        try:
+            # 一輪補滿上限且有成功生成時，可能還有待補的知識點，繼續下一輪
+            while True:
+                result = fill_missing_variants()
+                if result['points'] < FILL_MAX_POINTS or not result['generated']:
+                    break
+        except Exception:
+            # 錯誤已記錄，下一輪再試
+            pass
+
+def start_variant_worker(interval: int = FILL_INTERVAL_SECONDS) -> bool:
+    """啟動背景補題執行緒（每個程序只會啟動一次）"""
+    global _worker
+    if interval <= 0:
+        return False
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=_run_worker, args=(interval,), name='review-question-variants', daemon=True
+            )
+            _worker.start()
+            logger.info(f"✅ 已啟動複習題預先生成執行緒（每 {interval} 秒）")
+    return True
@@ -0,0 +1,452 @@
+# app/services/review_scheduler.py
+"""
+知識點複習排程（FSRS 記憶模型）
+
+原本的排程每次答對熟練度 +0.25、間隔 2^熟練度 天，與實際遺忘速度無關。
+改以 FSRS（Free Spaced Repetition Scheduler, v4.5）的記憶模型：
+
+- 每個知識點有穩定度 S（可提取率降到 90% 所需的天數）與難度 D（1–10）。
+- 經過 t 天後的可提取率 R = (1 + FACTOR·t/S)^DECAY。
+- 每次複習依評分（1 忘記、2 困難、3 良好、4 容易）與當下的 R 更新 S 與 D，
+  下次複習安排在 R 降到目標保留率（DESIRED_RETENTION）的那天。
+  穩定的知識點間隔快速拉長，需要的複習次數（與 LLM 出題次數）比固定倍數少。
+- 17 個模型參數有預設值，也可以依各用戶的 learning_events 複習紀錄擬合：
+  所有知識點的複習序列補齊成矩陣後逐步同時計算預測的 R 與對數損失，
+  多組參數（中心差分所需的 2×17 組）在同一次向量化計算中評估，以 Adam 最佳化。
+
+mastery_level 仍然保留（介面與排序都在使用），換算為 log2(穩定度)，與舊排程「間隔 2^熟練度 天」的意義一致。
+"""
+
+import os
+import time
+import logging
+import datetime
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from app.services.database import get_db_connection
+from app.services import due_queue
+
+logger = logging.getLogger(__name__)
+
+GRADE_AGAIN, GRADE_HARD, GRADE_GOOD, GRADE_EASY = 1, 2, 3, 4
+
+DECAY = -0.5
+FACTOR = 19.0 / 81.0          # 使 R(S, S) = 0.9
+DESIRED_RETENTION = float(os.environ.get('REVIEW_TARGET_RETENTION', 0.9))
+MAX_INTERVAL_DAYS = 365
+MAX_MASTERY = 5.0
+
+# FSRS v4.5 的預設參數
+DEFAULT_WEIGHTS = np.array([
+    0.4872, 1.4003, 3.7145, 13.8206, 5.1618, 1.2298, 0.8975, 0.031, 1.6474,
+    0.1367, 1.0461, 2.1072, 0.0793, 0.3246, 1.587, 0.2272, 2.8755
+])
+WEIGHT_BOUNDS = np.array([
+    (0.1, 100.0), (0.1, 100.0), (0.1, 100.0), (0.1, 100.0), (1.0, 10.0), (0.1, 5.0), (0.1, 5.0),
+    (0.0, 0.75), (0.0, 4.0), (0.0, 0.8), (0.01, 3.0), (0.5, 5.0), (0.01, 0.2), (0.01, 0.9),
+    (0.01, 3.0), (0.0, 1.0), (1.0, 6.0)
+])
+
+MIN_FIT_REVIEWS = 50          # 擬合所需的最少複習次數（不含每個知識點的第一次）
+FIT_ITERATIONS = 300
+FIT_LEARNING_RATE = 0.02
+FIT_REGULARIZATION = 0.05     # 往預設參數收縮，資料少時不會過度擬合
+WEIGHTS_CACHE_SECONDS = 300
+
+_weights_cache: Dict[int, Tuple[float, np.ndarray]] = {}
+_weights_lock = threading.Lock()
+
+# ---------------------------------------------------------------------------
+# 記憶模型（參數可以是一維，也可以是 (P, 1) 的多組參數，與狀態陣列廣播）
+# ---------------------------------------------------------------------------
+
+def retrievability(elapsed_days, stability):
+    return np.power(1.0 + FACTOR * np.asarray(elapsed_days) / stability, DECAY)
+
+def _w(weights: np.ndarray, index: int):
+    return weights[..., index:index + 1] if weights.ndim > 1 else weights[index]
+
+def initial_stability(grade, weights: np.ndarray = DEFAULT_WEIGHTS):
+    grade = np.asarray(grade)
+    if weights.ndim > 1:
+        return weights[:, grade - 1]
+    return weights[grade - 1]
+
+def initial_difficulty(grade, weights: np.ndarray = DEFAULT_WEIGHTS):
+    # v4.5: D0(G) = w4 - (G - 3)·w5（FSRS-5 的指數形式需要搭配 v5 的參數）
+    difficulty = _w(weights, 4) - (np.asarray(grade) - 3) * _w(weights, 5)
+    return np.clip(difficulty, 1.0, 10.0)
+
+def next_difficulty(difficulty, grade, weights: np.ndarray = DEFAULT_WEIGHTS):
+    updated = difficulty - _w(weights, 6) * (np.asarray(grade) - 3)
+    # 往「良好」的初始難度 D0(3) 回歸，避免難度只升不降
+    reverted = _w(weights, 7) * initial_difficulty(GRADE_GOOD, weights) + (1 - _w(weights, 7)) * updated
+    return np.clip(reverted, 1.0, 10.0)
+
+def next_stability(stability, difficulty, elapsed_days, grade, weights: np.ndarray = DEFAULT_WEIGHTS):
+    grade = np.asarray(grade)
+    recall = retrievability(elapsed_days, stability)
+
+    hard_penalty = np.where(grade == GRADE_HARD, _w(weights, 15), 1.0)
+    easy_bonus = np.where(grade == GRADE_EASY, _w(weights, 16), 1.0)
+    success = stability * (
+        1 + np.exp(_w(weights, 8)) * (11 - difficulty) * np.power(stability, -_w(weights, 9))
+        * (np.exp(_w(weights, 10) * (1 - recall)) - 1) * hard_penalty * easy_bonus
+    )
+    lapse = (
+        _w(weights, 11) * np.power(difficulty, -_w(weights, 12))
+        * (np.power(stability + 1, _w(weights, 13)) - 1) * np.exp(_w(weights, 14) * (1 - recall))
+    )
+    lapse = np.minimum(lapse, stability)
+    return np.maximum(np.where(grade == GRADE_AGAIN, lapse, success), 0.01)
+
+def next_interval(stability: float, retention: float = DESIRED_RETENTION) -> int:
+    """可提取率降到 retention 所需的天數（1 到 MAX_INTERVAL_DAYS）"""
+    days = stability / FACTOR * (retention ** (1 / DECAY) - 1)
+    return int(min(MAX_INTERVAL_DAYS, max(1, round(days))))
+
+def stability_to_mastery(stability: float) -> float:
+    return float(min(MAX_MASTERY, max(0.0, np.log2(max(stability, 1.0)))))
+
+# ---------------------------------------------------------------------------
+# 排程
+# ---------------------------------------------------------------------------
+
+def get_user_weights(user_id: Optional[int]) -> np.ndarray:
+    """用戶擬合的參數（沒有時為預設值），程序內快取 WEIGHTS_CACHE_SECONDS 秒"""
+    if not user_id:
+        return DEFAULT_WEIGHTS
+    now = time.monotonic()
+    cached = _weights_cache.get(user_id)
+    if cached and now - cached[0] < WEIGHTS_CACHE_SECONDS:
+        return cached[1]
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT weights FROM review_scheduler_params WHERE user_id = %s", (user_id,))
+            row = cursor.fetchone()
+    finally:
+        conn.close()
+
+    weights = np.array(row['weights'], dtype=np.float64) if row else DEFAULT_WEIGHTS
+    with _weights_lock:
+        _weights_cache[user_id] = (now, weights)
+    return weights
+
+def schedule_review(
+    point: Dict,
+    grade: int,
+    reviewed_at: Optional[datetime.datetime] = None,
+    weights: np.ndarray = DEFAULT_WEIGHTS,
+    retention: float = DESIRED_RETENTION
+) -> Dict:
+    """
+    依一次複習的評分計算知識點的新狀態
+
+    Args:
+        point: 至少包含 memory_stability、memory_difficulty、last_reviewed_on、mastery_level
+               （新知識點的穩定度為 None）
+
+    Returns:
+        {'memory_stability', 'memory_difficulty', 'mastery_level', 'next_review_date', 'interval_days', 'retrievability'}
+    """
+    reviewed_at = reviewed_at or datetime.datetime.now(datetime.timezone.utc)
+    stability = point.get('memory_stability')
+    difficulty = point.get('memory_difficulty')
+
+    if stability is None and point.get('last_reviewed_on') is None:
+        # 第一次學習
+        recall = None
+        new_stability = float(initial_stability(grade, weights))
+        new_difficulty = float(initial_difficulty(grade, weights))
+    else:
+        if stability is None:
+            # 舊排程的知識點：以原本的間隔 2^熟練度 作為穩定度，難度取中間值
+            stability = float(2 ** (point.get('mastery_level') or 0.0))
+            difficulty = 5.0
+        last = point.get('last_reviewed_on') or reviewed_at
+        elapsed = max((reviewed_at - last).total_seconds() / 86400.0, 0.0)
+        recall = float(retrievability(elapsed, stability))
+        new_stability = float(next_stability(stability, difficulty, elapsed, grade, weights))
+        new_difficulty = float(next_difficulty(difficulty, grade, weights))
+
+    interval = next_interval(new_stability, retention)
+    return {
+        'memory_stability': new_stability,
+        'memory_difficulty': new_difficulty,
+        'mastery_level': stability_to_mastery(new_stability),
+        'next_review_date': due_queue.taipei_today(reviewed_at) + datetime.timedelta(days=interval),
+        'interval_days': interval,
+        'retrievability': recall
+    }
+
+def apply_review(cursor, point_id: int, grade: int, user_id: Optional[int] = None, event: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    在既有的交易中更新知識點的記憶狀態，並記錄到 learning_events
+
+    Args:
+        user_id: 提供時只更新該用戶的知識點
+        event: 要寫入 learning_events 的題目資訊（chinese_sentence、user_answer、question_type 等）；
+               None 時不新增事件（呼叫端自行記錄）
+
+    Returns:
+        schedule_review 的結果；知識點不存在（或不屬於 user_id）時為 None
+    """
+    user_id = int(user_id) if user_id is not None else None
+    cursor.execute(
+        """
+        SELECT id, user_id, mastery_level, last_reviewed_on, memory_stability, memory_difficulty
+        FROM knowledge_points WHERE id = %s AND (%s::integer IS NULL OR user_id = %s) FOR UPDATE
+        """,
+        (point_id, user_id, user_id)
+    )
+    point = cursor.fetchone()
+    if not point:
+        return None
+
+    reviewed_at = datetime.datetime.now(datetime.timezone.utc)
+    state = schedule_review(point, grade, reviewed_at, get_user_weights(user_id or point['user_id']))
+    cursor.execute(
+        """
+        UPDATE knowledge_points
+        SET memory_stability = %s, memory_difficulty = %s, mastery_level = %s,
+            next_review_date = %s, last_reviewed_on = %s,
+            correct_count = correct_count + %s
+        WHERE id = %s
+        """,
+        (
+            state['memory_stability'], state['memory_difficulty'], state['mastery_level'],
+            state['next_review_date'], reviewed_at, 1 if grade >= GRADE_GOOD else 0, point_id
+        )
+    )
+    if event is not None:
+        cursor.execute(
+            """
+            INSERT INTO learning_events
+            (user_id, question_type, chinese_sentence, user_answer, is_correct, knowledge_point_id, review_grade,
+             difficulty, stability, next_review_date, timestamp)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            (
+                user_id or point['user_id'], event.get('question_type', 'review'),
+                event.get('chinese_sentence') or '（題目文字遺失）', event.get('user_answer'),
+                grade >= GRADE_GOOD, point_id, grade,
+                state['memory_difficulty'], state['memory_stability'], state['next_review_date'], reviewed_at
+            )
+        )
+    return state
+
+def record_review(point_id: int, grade: int, user_id: Optional[int] = None, event: Optional[Dict] = None) -> Optional[Dict]:
+    """apply_review 的獨立交易版本"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            state = apply_review(cursor, point_id, grade, user_id=user_id, event=event)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if state:
+        due_queue.refresh_points([point_id])
+    return state
+
+# ---------------------------------------------------------------------------
+# 參數擬合
+# ---------------------------------------------------------------------------
+
+def _review_sequences(rows: List[Dict]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    依知識點分組的複習紀錄 → (評分, 距上次複習的天數)，形狀 (知識點數, 最長序列)，不足補 0
+
+    rows 必須依 (knowledge_point_id, timestamp) 排序。
+    """
+    sequences: List[Tuple[List[int], List[float]]] = []
+    previous_id, previous_time = None, None
+    for row in rows:
+        if row['knowledge_point_id'] != previous_id:
+            sequences.append(([], []))
+            previous_id, previous_time = row['knowledge_point_id'], row['timestamp']
+        grades, elapsed = sequences[-1]
+        grades.append(int(row['review_grade']))
+        elapsed.append(max((row['timestamp'] - previous_time).total_seconds() / 86400.0, 0.0))
+        previous_time = row['timestamp']
+
+    sequences = [sequence for sequence in sequences if len(sequence[0]) > 1]
+    length = max((len(grades) for grades, _ in sequences), default=0)
+    grade_matrix = np.zeros((len(sequences), length), dtype=np.int64)
+    elapsed_matrix = np.zeros((len(sequences), length))
+    for index, (grades, elapsed) in enumerate(sequences):
+        grade_matrix[index, :len(grades)] = grades
+        elapsed_matrix[index, :len(elapsed)] = elapsed
+    return grade_matrix, elapsed_matrix
+
+def batch_log_loss(weights: np.ndarray, grades: np.ndarray, elapsed: np.ndarray) -> np.ndarray:
+    """
+    多組參數的平均對數損失
+
+    Args:
+        weights: (P, 17)
+        grades, elapsed: (N, L)，每列為一個知識點的複習序列（第一欄為初次學習）
+
+    Returns:
+        (P,)
+    """
+    stability = initial_stability(grades[:, 0], weights)
+    difficulty = initial_difficulty(grades[:, 0][None, :], weights)
+    total = np.zeros(len(weights))
+    count = 0
+    for step in range(1, grades.shape[1]):
+        grade = grades[:, step]
+        mask = grade > 0
+        if not mask.any():
+            break
+        recall = np.clip(retrievability(elapsed[:, step], stability), 1e-6, 1 - 1e-6)
+        remembered = grade > GRADE_AGAIN
+        step_loss = -np.where(remembered, np.log(recall), np.log(1 - recall))
+        total += (step_loss * mask).sum(axis=1)
+        count += int(mask.sum())
+
+        safe_grade = np.where(mask, grade, GRADE_GOOD)
+        stability = np.where(mask, next_stability(stability, difficulty, elapsed[:, step], safe_grade, weights), stability)
+        difficulty = np.where(mask, next_difficulty(difficulty, safe_grade, weights), difficulty)
+    return total / max(count, 1)
+
+def fit_weights(
+    grades: np.ndarray,
+    elapsed: np.ndarray,
+    initial: np.ndarray = DEFAULT_WEIGHTS,
+    iterations: int = FIT_ITERATIONS,
+    learning_rate: float = FIT_LEARNING_RATE,
+    regularization: float = FIT_REGULARIZATION
+) -> Tuple[np.ndarray, float]:
+    """
+    以 Adam 最小化對數損失 + 往預設參數收縮的 L2 懲罰
+
+    梯度以中心差分估計：每一步把目前參數與 2×17 組擾動後的參數疊成一個矩陣，
+    一次向量化計算出全部的損失。參數以各自的範圍正規化後再更新。
+
+    Returns:
+        (擬合的參數, 擬合後的對數損失（不含懲罰）)
+    """
+    low, high = WEIGHT_BOUNDS[:, 0], WEIGHT_BOUNDS[:, 1]
+    scale = high - low
+    dimensions = len(initial)
+    step = 1e-3
+    perturbation = np.vstack([np.eye(dimensions), -np.eye(dimensions)]) * step
+
+    def objective(normalized_batch: np.ndarray) -> np.ndarray:
+        batch = low + np.clip(normalized_batch, 0.0, 1.0) * scale
+        penalty = regularization * (((batch - DEFAULT_WEIGHTS) / scale) ** 2).sum(axis=1)
+        return batch_log_loss(batch, grades, elapsed) + penalty
+
+    position = (np.clip(initial, low, high) - low) / scale
+    moment = np.zeros(dimensions)
+    velocity = np.zeros(dimensions)
+    for iteration in range(1, iterations + 1):
+        losses = objective(position + perturbation)
+        gradient = (losses[:dimensions] - losses[dimensions:]) / (2 * step)
+        moment = 0.9 * moment + 0.1 * gradient
+        velocity = 0.999 * velocity + 0.001 * gradient ** 2
+        update = learning_rate * (moment / (1 - 0.9 ** iteration)) / (np.sqrt(velocity / (1 - 0.999 ** iteration)) + 1e-8)
+        position = np.clip(position - update, 0.0, 1.0)
+
+    weights = low + position * scale
+    return weights, float(batch_log_loss(weights[None, :], grades, elapsed)[0])
+
+def fit_user_parameters(user_id: int, save: bool = True, min_reviews: int = MIN_FIT_REVIEWS) -> Dict:
+    """
+    依用戶的複習紀錄擬合排程參數
+
+    只有擬合後的對數損失低於預設參數時才會儲存。
+
+    Returns:
+        {'user_id', 'reviews', 'points', 'log_loss', 'default_log_loss', 'saved', 'weights'}
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT knowledge_point_id, review_grade, timestamp
+                FROM learning_events
+                WHERE user_id = %s AND knowledge_point_id IS NOT NULL AND review_grade IS NOT NULL
+                ORDER BY knowledge_point_id, timestamp
+                """,
+                (user_id,)
+            )
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    grades, elapsed = _review_sequences(rows)
+    reviews = int((grades[:, 1:] > 0).sum()) if grades.size else 0
+    result = {
+        'user_id': user_id, 'reviews': reviews, 'points': len(grades),
+        'log_loss': None, 'default_log_loss': None, 'saved': False, 'weights': None
+    }
+    if reviews < min_reviews:
+        return result
+
+    started = time.perf_counter()
+    default_loss = float(batch_log_loss(DEFAULT_WEIGHTS[None, :], grades, elapsed)[0])
+    weights, loss = fit_weights(grades, elapsed)
+    result.update({
+        'log_loss': round(loss, 5),
+        'default_log_loss': round(default_loss, 5),
+        'weights': [round(float(value), 4) for value in weights],
+        'seconds': round(time.perf_counter() - started, 2)
+    })
+
+    if save and loss < default_loss:
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    INSERT INTO review_scheduler_params (user_id, weights, review_count, log_loss, default_log_loss, fitted_at)
+                    VALUES (%s, %s, %s, %s, %s, NOW())
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET weights = EXCLUDED.weights, review_count = EXCLUDED.review_count,
+                        log_loss = EXCLUDED.log_loss, default_log_loss = EXCLUDED.default_log_loss,
+                        fitted_at = EXCLUDED.fitted_at
+                    """,
+                    (user_id, result['weights'], reviews, loss, default_loss)
+                )
+            conn.commit()
+        finally:
+            conn.close()
+        with _weights_lock:
+            _weights_cache.pop(user_id, None)
+        result['saved'] = True
+    return result
+
+def fit_all_users(min_reviews: int = MIN_FIT_REVIEWS, save: bool = True) -> List[Dict]:
+    """為複習紀錄足夠的每個用戶擬合參數"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT user_id FROM learning_events
+                WHERE knowledge_point_id IS NOT NULL AND review_grade IS NOT NULL
+                GROUP BY user_id
+                HAVING COUNT(*) >= %s
+                """,
+                (min_reviews,)
+            )
+            user_ids = [row['user_id'] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+    results = []
+    for user_id in user_ids:
+        try:
+            results.append(fit_user_parameters(user_id, save=save, min_reviews=min_reviews))
+        except Exception as e:
+            logger.error(f"擬合用戶 {user_id} 的排程參數時發生錯誤: {e}")
+    return results
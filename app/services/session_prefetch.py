@@ -0,0 +1,246 @@
+# app/services/session_prefetch.py
+"""
+預先生成下一回合的題目
+
+用戶完成一回合後，下一次 start_session 的參數幾乎一定相同，但原本總是在用戶等待時才開始出題。
+這裡在回合的最後一題送出（或客戶端明確提示）時，在背景先生成下一回合的「全新挑戰題」，
+存在 session_prefetch（每位用戶一列，跨程序共用），下一次 start_session 參數相同且未過期時直接使用。
+
+- 只預先生成全新挑戰題：這部分每題都要呼叫一次 LLM，是等待時間的主要來源。
+  複習題在開始時才依當下到期的知識點挑選（到期的知識點在兩個回合之間會改變），
+  而且已經由 review_question_store 預先生成，預先生成時只喚醒其背景補題。
+- 參數：num_new、difficulty、length、generation_model 完全相同才使用。每次 start_session 都會記錄參數，
+  之後的預先生成沿用最近一次的參數。
+- 一致性：每次預先生成遞增 generation_id；start_session 取用（或放棄）後狀態回到 idle，
+  較晚完成的背景生成只會寫入仍在等待它的那一列，不會覆蓋新的狀態。
+- 統計（本程序）：命中率 = 命中 / (命中 + 未命中)；浪費的生成 = 參數不符、過期、被取代或完成時已不需要的預先生成。
+"""
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from psycopg.types.json import Jsonb
+
+from app.services.database import get_db_connection
+from app.services import ai_service as ai
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.environ.get('SESSION_PREFETCH_ENABLED', 'true').lower() == 'true'
+PREFETCH_TTL_SECONDS = int(os.environ.get('SESSION_PREFETCH_TTL', 6 * 3600))
+PREFETCH_WORKERS = int(os.environ.get('SESSION_PREFETCH_WORKERS', 2))
+GENERATION_TIMEOUT_SECONDS = 300   # 超過這個時間仍在 generating 的預先生成視為中斷，可以重新開始
+
+_metrics = {
+    'requested': 0, 'started': 0, 'generated': 0, 'failed': 0,
+    'hits': 0, 'misses': 0, 'mismatched': 0, 'expired': 0, 'replaced': 0, 'superseded': 0,
+}
+_metrics_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _count(key: str, amount: int = 1):
+    with _metrics_lock:
+        _metrics[key] += amount
+
+def get_metrics() -> Dict:
+    """本程序的預先生成統計"""
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    lookups = metrics['hits'] + metrics['misses']
+    metrics['hit_rate'] = round(metrics['hits'] / lookups, 4) if lookups else None
+    metrics['wasted'] = metrics['mismatched'] + metrics['expired'] + metrics['replaced'] + metrics['superseded']
+    return metrics
+
+def session_params(num_new: int, difficulty: int, length: str, generation_model: Optional[str]) -> Dict:
+    """start_session 中決定全新挑戰題內容的參數"""
+    return {
+        'num_new': int(num_new),
+        'difficulty': int(difficulty),
+        'length': length,
+        'generation_model': generation_model or None,
+    }
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='session-prefetch')
+        return _executor
+
+# ---------------------------------------------------------------------------
+# 取用
+# ---------------------------------------------------------------------------
+
+def take_prefetched(user_id: int, params: Dict) -> Optional[List[Dict]]:
+    """
+    開始新回合時呼叫：參數相同且未過期時取走預先生成的全新挑戰題，並記錄這次的參數
+
+    Returns:
+        題目列表；沒有可用的預先生成時為 None
+    """
+    if not PREFETCH_ENABLED:
+        return None
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT params, status, questions, expires_at > NOW() AS fresh
+                FROM session_prefetch WHERE user_id = %s FOR UPDATE
+                """,
+                (user_id,)
+            )
+            row = cursor.fetchone()
+            cursor.execute(
+                """
+                INSERT INTO session_prefetch (user_id, params) VALUES (%s, %s)
+                ON CONFLICT (user_id) DO UPDATE
+                SET params = EXCLUDED.params, status = 'idle', questions = NULL, expires_at = NULL, updated_at = NOW()
+                """,
+                (user_id, Jsonb(params))
+            )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"讀取用戶 {user_id} 的預先生成題目失敗: {e}")
+        return None
+    finally:
+        conn.close()
+
+    if row and row['status'] == 'ready':
+        if row['params'] == params and row['fresh']:
+            _count('hits')
+            logger.info(f"用戶 {user_id} 使用預先生成的 {len(row['questions'] or [])} 題全新挑戰題")
+            return row['questions'] or []
+        _count('mismatched' if row['fresh'] else 'expired')
+    elif row and row['status'] == 'generating':
+        # 還沒生成完：這次即時生成，背景的結果完成時會被捨棄
+        _count('superseded')
+    _count('misses')
+    return None
+
+# ---------------------------------------------------------------------------
+# 預先生成
+# ---------------------------------------------------------------------------
+
+def start_prefetch(user_id: int, params: Optional[Dict] = None) -> str:
+    """
+    在背景預先生成下一回合的全新挑戰題
+
+    Args:
+        params: session_params 的結果；None 時使用該用戶最近一次 start_session 的參數
+
+    Returns:
+        'started'、'ready'（已有相同參數的結果）、'in_progress'、'no_params'、'nothing_to_prefetch' 或 'disabled'
+    """
+    if not PREFETCH_ENABLED:
+        return 'disabled'
+    _count('requested')
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT params, status, expires_at > NOW() AS fresh,
+                       updated_at > NOW() - make_interval(secs => %s) AS recent
+                FROM session_prefetch WHERE user_id = %s FOR UPDATE
+                """,
+                (GENERATION_TIMEOUT_SECONDS, user_id)
+            )
+            row = cursor.fetchone()
+            target = params or (row['params'] if row else None)
+            if not target:
+                conn.rollback()
+                return 'no_params'
+            if target['num_new'] <= 0:
+                conn.rollback()
+                return 'nothing_to_prefetch'
+            if row and row['params'] == target:
+                if row['status'] == 'ready' and row['fresh']:
+                    conn.rollback()
+                    return 'ready'
+                if row['status'] == 'generating' and row['recent']:
+                    conn.rollback()
+                    return 'in_progress'
+            if row and row['status'] == 'ready':
+                _count('replaced')
+
+            cursor.execute(
+                """
+                INSERT INTO session_prefetch (user_id, params, status, generation_id) VALUES (%s, %s, 'generating', 1)
+                ON CONFLICT (user_id) DO UPDATE
+                SET params = EXCLUDED.params, status = 'generating', generation_id = session_prefetch.generation_id + 1,
+                    questions = NULL, expires_at = NULL, updated_at = NOW()
+                RETURNING generation_id
+                """,
+                (user_id, Jsonb(target))
+            )
+            generation_id = cursor.fetchone()['generation_id']
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"開始預先生成用戶 {user_id} 的題目失敗: {e}")
+        raise
+    finally:
+        conn.close()
+
+    _count('started')
+    _get_executor().submit(_generate, user_id, generation_id, target)
+    return 'started'
+
+def _generate(user_id: int, generation_id: int, params: Dict):
+    """背景執行緒：生成題目並寫入（只有仍在等待這次生成時才寫入）"""
+    try:
+        # 下一回合的複習題由預先生成的題庫提供，順便喚醒補題
+        from app.services import review_question_store
+        review_question_store.request_fill()
+
+        questions = ai.generate_new_question_batch(
+            params['num_new'], params['difficulty'], params['length'], model_name=params['generation_model']
+        )
+    except Exception as e:
+        logger.error(f"預先生成用戶 {user_id} 的題目時發生錯誤: {e}")
+        questions = []
+
+    try:
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                if questions:
+                    cursor.execute(
+                        """
+                        UPDATE session_prefetch
+                        SET status = 'ready', questions = %s,
+                            expires_at = NOW() + make_interval(secs => %s), updated_at = NOW()
+                        WHERE user_id = %s AND generation_id = %s AND status = 'generating'
+                        """,
+                        (Jsonb(questions), PREFETCH_TTL_SECONDS, user_id, generation_id)
+                    )
+                else:
+                    cursor.execute(
+                        """
+                        UPDATE session_prefetch SET status = 'idle', updated_at = NOW()
+                        WHERE user_id = %s AND generation_id = %s AND status = 'generating'
+                        """,
+                        (user_id, generation_id)
+                    )
+                stored = cursor.rowcount > 0
+            conn.commit()
+        finally:
+            conn.close()
+
+        if not questions:
+            _count('failed')
+        elif stored:
+            _count('generated')
+            logger.info(f"✅ 已為用戶 {user_id} 預先生成 {len(questions)} 題全新挑戰題")
+        # 已被 start_session 取代的生成在 take_prefetched 中計為 superseded
+    except Exception as e:
+        _count('failed')
+        logger.error(f"儲存用戶 {user_id} 的預先生成題目時發生錯誤: {e}")
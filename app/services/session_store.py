@@ -0,0 +1,224 @@
+# app/services/session_store.py
+"""
+伺服器端的學習回合狀態
+
+原本 submit_answer 每題都要以客戶端回傳的 knowledge_point_id 查詢一次知識點片語，
+熟練度也依客戶端回傳的 mastery_level 計算。改為 start_session 建立回合並回傳 session_id，
+伺服器保存每題的題目、知識點 ID、片語與開始時的熟練度快照：
+
+- 儲存：UNLOGGED 表格 learning_sessions（跨程序共用，當機後清空，回合本來就是短期資料），
+  建立回合的程序另外保留在記憶體（LRU），同一程序收到的作答不需要任何額外的查詢。
+- 作答：題目內容與知識點一律以伺服器保存的為準，客戶端只需要回傳 session_id 與 question_id。
+  標記已作答與更新熟練度在同一個交易中完成，熟練度依資料庫目前的值（SELECT ... FOR UPDATE）計算；
+  重送同一題不會重複更新熟練度。
+- 回合的所有題目都作答後，觸發下一回合的預先生成（session_prefetch）。
+- 回合在 LEARNING_SESSION_TTL 秒後過期，過期的列定期刪除。
+"""
+
+import os
+import time
+import secrets
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from psycopg.types.json import Jsonb
+
+from app.services.database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL_SECONDS = int(os.environ.get('LEARNING_SESSION_TTL', 24 * 3600))
+LOCAL_CACHE_SIZE = 1024
+CLEANUP_INTERVAL_SECONDS = 600
+
+# 每題在伺服器端保存的欄位（題目內容以外的欄位都不回傳給客戶端也無妨）
+QUESTION_FIELDS = ('type', 'new_sentence', 'hint_text', 'knowledge_point_id', 'phrase', 'mastery_level')
+
+_local: "OrderedDict[str, Dict]" = OrderedDict()
+_local_lock = threading.Lock()
+_last_cleanup = 0.0
+
+def _normalize_user(user_id) -> Optional[int]:
+    return int(user_id) if user_id is not None else None
+
+def _remember(session_id: str, session: Dict):
+    with _local_lock:
+        _local[session_id] = session
+        _local.move_to_end(session_id)
+        while len(_local) > LOCAL_CACHE_SIZE:
+            _local.popitem(last=False)
+
+def _cleanup_expired(cursor):
+    global _last_cleanup
+    now = time.monotonic()
+    if now - _last_cleanup < CLEANUP_INTERVAL_SECONDS:
+        return
+    _last_cleanup = now
+    cursor.execute("DELETE FROM learning_sessions WHERE expires_at < NOW()")
+    if cursor.rowcount:
+        logger.info(f"已刪除 {cursor.rowcount} 個過期的學習回合")
+
+def create_session(user_id, questions: List[Dict], phrases: Optional[Dict[int, str]] = None) -> str:
+    """
+    建立學習回合，並在每題加上 question_id（直接修改 questions）
+
+    Args:
+        questions: start_session 要回傳的題目
+        phrases: {知識點ID: correct_phrase}，複習題批改時的核心觀念
+
+    Returns:
+        session_id
+    """
+    user_id = _normalize_user(user_id)
+    phrases = phrases or {}
+    stored = []
+    for index, question in enumerate(questions):
+        question['question_id'] = index
+        record = {field: question.get(field) for field in QUESTION_FIELDS}
+        if record['knowledge_point_id'] is not None:
+            record['phrase'] = phrases.get(record['knowledge_point_id'])
+        stored.append(record)
+
+    session_id = secrets.token_urlsafe(16)
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            _cleanup_expired(cursor)
+            cursor.execute(
+                """
+                INSERT INTO learning_sessions (id, user_id, questions, expires_at)
+                VALUES (%s, %s, %s, NOW() + make_interval(secs => %s))
+                """,
+                (session_id, user_id, Jsonb(stored), SESSION_TTL_SECONDS)
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+    _remember(session_id, {
+        'user_id': user_id, 'questions': stored,
+        'expires_at': time.monotonic() + SESSION_TTL_SECONDS
+    })
+    return session_id
+
+def get_question(session_id: str, question_id, user_id) -> Optional[Dict]:
+    """
+    取得回合中的一題（記憶體中沒有時查詢 learning_sessions）
+
+    Returns:
+        題目紀錄；回合不存在、已過期、不屬於該用戶或題號無效時為 None
+    """
+    user_id = _normalize_user(user_id)
+    try:
+        question_id = int(question_id)
+    except (TypeError, ValueError):
+        return None
+
+    with _local_lock:
+        session = _local.get(session_id)
+        if session is not None and session['expires_at'] < time.monotonic():
+            _local.pop(session_id, None)
+            session = None
+
+    if session is None:
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT user_id, questions, EXTRACT(EPOCH FROM expires_at - NOW()) AS remaining
+                    FROM learning_sessions WHERE id = %s AND expires_at > NOW()
+                    """,
+                    (session_id,)
+                )
+                row = cursor.fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        session = {
+            'user_id': row['user_id'], 'questions': row['questions'],
+            'expires_at': time.monotonic() + float(row['remaining'])
+        }
+        _remember(session_id, session)
+
+    if session['user_id'] != user_id or not 0 <= question_id < len(session['questions']):
+        return None
+    return session['questions'][question_id]
+
+def record_answer(
+    session_id: str,
+    question_id,
+    user_id,
+    mastered: bool,
+    event: Optional[Dict] = None
+) -> Dict:
+    """
+    記錄一次作答：標記題目已作答；複習題答對核心觀念時，在同一個交易中更新知識點的記憶狀態
+
+    同一題的熟練度只更新一次（重送或重答不會重複計算），並依資料庫目前的值計算。
+
+    Returns:
+        {'answered', 'total', 'completed', 'review_state'}；
+        completed 只在這次作答讓回合的所有題目都作答完時為 True
+    """
+    from app.services import review_scheduler, due_queue
+
+    user_id = _normalize_user(user_id)
+    question = get_question(session_id, question_id, user_id)
+    if question is None:
+        raise LookupError("學習回合不存在或已過期")
+    question_id = int(question_id)
+    point_id = question.get('knowledge_point_id')
+    # 訪客的回合沒有複習題；即使有也不更新任何知識點
+    credit = bool(mastered) and question.get('type') == 'review' and point_id is not None and user_id is not None
+
+    review_state = None
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT %s = ANY(answered) AS was_answered, %s = ANY(credited) AS was_credited
+                FROM learning_sessions WHERE id = %s AND expires_at > NOW() FOR UPDATE
+                """,
+                (question_id, question_id, session_id)
+            )
+            before = cursor.fetchone()
+            if before is None:
+                raise LookupError("學習回合不存在或已過期")
+            credit = credit and not before['was_credited']
+
+            cursor.execute(
+                """
+                UPDATE learning_sessions
+                SET answered = CASE WHEN %s THEN answered ELSE array_append(answered, %s::smallint) END,
+                    credited = CASE WHEN %s THEN array_append(credited, %s::smallint) ELSE credited END
+                WHERE id = %s
+                RETURNING cardinality(answered) AS answered, jsonb_array_length(questions) AS total
+                """,
+                (before['was_answered'], question_id, credit, question_id, session_id)
+            )
+            counts = cursor.fetchone()
+
+            if credit:
+                review_state = review_scheduler.apply_review(
+                    cursor, int(point_id), review_scheduler.GRADE_GOOD, user_id=user_id, event=event
+                )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if review_state:
+        due_queue.refresh_points([int(point_id)])
+    return {
+        'answered': counts['answered'],
+        'total': counts['total'],
+        'completed': not before['was_answered'] and counts['answered'] == counts['total'],
+        'review_state': review_state,
+    }
@@ -0,0 +1,440 @@
+# app/services/stats_service.py
+"""
+向量化統計的計數器
+
+原本的 knowledge_linking_stats 視圖每次讀取都對 knowledge_points 與 knowledge_links 做多次全表掃描。
+改為維護計數器：
+
+- 觸發器：knowledge_points 與 knowledge_links 的陳述式層級觸發器以 transition table 計算本次陳述式的增減，
+  每個用戶一列寫入 embedding_stat_deltas（只新增，不更新共用的列，寫入之間沒有鎖競爭）。
+- 彙整：背景執行緒每 STATS_FOLD_INTERVAL 秒把增量併入 embedding_stat_counters
+  （user_id = 0 為全部用戶，其餘為各用戶），讀取時 = 計數器 + 尚未彙整的少量增量。
+- 校正：每 STATS_RECONCILE_INTERVAL 秒從資料表重新計算一次，修正漂移
+  （例如刪除知識點時連帶刪除的關聯無法歸屬到用戶）。
+- 快取：讀取結果在程序內快取 STATS_CACHE_TTL_SECONDS 秒。
+
+「已有向量」在 pgvector 模式為 embedding_vector IS NOT NULL，程序內索引模式為 embedding_updated_at IS NOT NULL。
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, Optional
+
+from app.services.database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+STATS_CACHE_TTL_SECONDS = float(os.environ.get('STATS_CACHE_TTL', 10))
+STATS_FOLD_INTERVAL = int(os.environ.get('STATS_FOLD_INTERVAL', 60))              # 0 = 不啟動背景執行緒
+STATS_RECONCILE_INTERVAL = int(os.environ.get('STATS_RECONCILE_INTERVAL', 3600))
+
+GLOBAL_SCOPE = 0
+
+# advisory lock 的識別值（任意固定整數）
+_STATS_LOCK_KEY = 72042001
+
+_cache: Dict[int, tuple] = {}
+_cache_lock = threading.Lock()
+_installed_predicate: Optional[str] = None
+_install_lock = threading.Lock()
+
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+_COUNTER_COLUMNS = ('points_with_vectors', 'points_without_vectors', 'active_links', 'similarity_sum')
+
+def _has_vector_predicate(cursor) -> str:
+    cursor.execute(
+        """
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'knowledge_points' AND column_name = 'embedding_vector'
+        ) AS has_column
+        """
+    )
+    return "embedding_vector IS NOT NULL" if cursor.fetchone()['has_column'] else "embedding_updated_at IS NOT NULL"
+
+def _point_contribution(alias: str, has_vector: str) -> str:
+    """單一知識點對 (有向量, 待處理) 計數的貢獻"""
+    has_vector = has_vector.replace('embedding_', f'{alias}.embedding_')
+    return (
+        f"({has_vector})::int, "
+        f"(NOT ({has_vector}) AND {alias}.is_archived IS FALSE)::int"
+    )
+
+def _install_triggers(cursor, has_vector: str):
+    """建立（或依目前的向量欄位重建）維護增量的觸發器"""
+    cursor.execute(f"""
+    CREATE OR REPLACE FUNCTION embedding_stats_points_insert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO embedding_stat_deltas (user_id, points_with_vectors, points_without_vectors, last_embedding_update)
+        SELECT user_id, SUM(w), SUM(wo), MAX(updated)
+        FROM (SELECT n.user_id, {_point_contribution('n', has_vector)}, n.embedding_updated_at FROM new_rows n)
+             AS d(user_id, w, wo, updated)
+        GROUP BY user_id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cursor.execute(f"""
+    CREATE OR REPLACE FUNCTION embedding_stats_points_update() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO embedding_stat_deltas (user_id, points_with_vectors, points_without_vectors, last_embedding_update)
+        SELECT user_id, SUM(nw - ow), SUM(nwo - owo), MAX(updated)
+        FROM (
+            SELECT n.user_id, {_point_contribution('n', has_vector)}, {_point_contribution('o', has_vector)},
+                   CASE WHEN n.embedding_updated_at IS DISTINCT FROM o.embedding_updated_at
+                        THEN n.embedding_updated_at END
+            FROM new_rows n JOIN old_rows o ON o.id = n.id
+        ) AS d(user_id, nw, nwo, ow, owo, updated)
+        GROUP BY user_id
+        HAVING SUM(nw - ow) <> 0 OR SUM(nwo - owo) <> 0 OR MAX(updated) IS NOT NULL;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+    cursor.execute(f"""
+    CREATE OR REPLACE FUNCTION embedding_stats_points_delete() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO embedding_stat_deltas (user_id, points_with_vectors, points_without_vectors)
+        SELECT user_id, -SUM(w), -SUM(wo)
+        FROM (SELECT o.user_id, {_point_contribution('o', has_vector)} FROM old_rows o) AS d(user_id, w, wo)
+        GROUP BY user_id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """)
+
+    # 關聯歸屬於來源知識點的用戶；來源知識點已被刪除（連帶刪除）時只計入全部用戶
+    link_functions = {
+        'INSERT': "SELECT l.source_point_id, 1, l.similarity_score FROM new_rows l WHERE l.is_active",
+        'UPDATE': """
+            SELECT l.source_point_id, 1, l.similarity_score FROM new_rows l WHERE l.is_active
+            UNION ALL
+            SELECT l.source_point_id, -1, -l.similarity_score FROM old_rows l WHERE l.is_active
+        """,
+        'DELETE': "SELECT l.source_point_id, -1, -l.similarity_score FROM old_rows l WHERE l.is_active",
+    }
+    for operation, changes in link_functions.items():
+        cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION embedding_stats_links_{operation.lower()}() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO embedding_stat_deltas (user_id, active_links, similarity_sum)
+            SELECT kp.user_id, SUM(c.links), SUM(c.similarity)
+            FROM ({changes}) AS c(source_point_id, links, similarity)
+            LEFT JOIN knowledge_points kp ON kp.id = c.source_point_id
+            GROUP BY kp.user_id
+            HAVING SUM(c.links) <> 0 OR SUM(c.similarity) <> 0;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """)
+
+    for table, prefix in (('knowledge_points', 'points'), ('knowledge_links', 'links')):
+        for operation, transitions in (
+            ('INSERT', 'NEW TABLE AS new_rows'),
+            ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+            ('DELETE', 'OLD TABLE AS old_rows'),
+        ):
+            trigger = f"trg_embedding_stats_{prefix}_{operation.lower()}"
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger} ON {table}")
+            cursor.execute(f"""
+            CREATE TRIGGER {trigger}
+            AFTER {operation} ON {table}
+            REFERENCING {transitions}
+            FOR EACH STATEMENT EXECUTE FUNCTION embedding_stats_{prefix}_{operation.lower()}()
+            """)
+
+def ensure_installed(force: bool = False) -> bool:
+    """
+    確認觸發器與目前的向量欄位一致（每個程序檢查一次；pgvector 欄位新增後 force 重建）
+
+    觸發器新建或重建時會立即校正一次計數器。
+
+    Returns:
+        是否（重新）安裝了觸發器
+    """
+    global _installed_predicate
+    if _installed_predicate is not None and not force:
+        return False
+
+    with _install_lock:
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT to_regclass('knowledge_links') IS NOT NULL AS has_links")
+                if not cursor.fetchone()['has_links']:
+                    return False
+                has_vector = _has_vector_predicate(cursor)
+                cursor.execute(
+                    "SELECT obj_description(to_regproc('embedding_stats_points_insert'), 'pg_proc') AS predicate"
+                )
+                if cursor.fetchone()['predicate'] == has_vector:
+                    _installed_predicate = has_vector
+                    return False
+
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_STATS_LOCK_KEY,))
+                _install_triggers(cursor, has_vector)
+                # 記錄觸發器使用的判斷式，向量欄位改變時才需要重建
+                cursor.execute(f"COMMENT ON FUNCTION embedding_stats_points_insert() IS '{has_vector}'")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        _installed_predicate = has_vector
+    logger.info(f"✅ 已安裝統計計數器觸發器（{has_vector}）")
+    reconcile_statistics()
+    return True
+
+def fold_deltas() -> int:
+    """
+    把累積的增量併入計數器
+
+    Returns:
+        併入的增量列數
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            # 與校正互斥：校正會清空計數器與增量，兩者交錯時增量可能被重複計入或遺失
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_STATS_LOCK_KEY,))
+            cursor.execute(
+                """
+                WITH moved AS (
+                    DELETE FROM embedding_stat_deltas RETURNING *
+                ),
+                per_scope AS (
+                    SELECT user_id AS scope, SUM(points_with_vectors) AS pw, SUM(points_without_vectors) AS pwo,
+                           SUM(active_links) AS al, SUM(similarity_sum) AS ss,
+                           MAX(last_embedding_update) AS last_update, COUNT(*) AS deltas
+                    FROM moved WHERE user_id IS NOT NULL GROUP BY user_id
+                    UNION ALL
+                    SELECT 0, SUM(points_with_vectors), SUM(points_without_vectors),
+                           SUM(active_links), SUM(similarity_sum), MAX(last_embedding_update), COUNT(*)
+                    FROM moved HAVING COUNT(*) > 0
+                ),
+                applied AS (
+                    INSERT INTO embedding_stat_counters AS c
+                        (user_id, points_with_vectors, points_without_vectors, active_links, similarity_sum,
+                         last_embedding_update, updated_at)
+                    SELECT scope, pw, pwo, al, ss, last_update, NOW() FROM per_scope
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET points_with_vectors = c.points_with_vectors + EXCLUDED.points_with_vectors,
+                        points_without_vectors = c.points_without_vectors + EXCLUDED.points_without_vectors,
+                        active_links = c.active_links + EXCLUDED.active_links,
+                        similarity_sum = c.similarity_sum + EXCLUDED.similarity_sum,
+                        last_embedding_update = GREATEST(c.last_embedding_update, EXCLUDED.last_embedding_update),
+                        updated_at = NOW()
+                )
+                SELECT COALESCE(MAX(deltas) FILTER (WHERE scope = 0), 0) AS folded FROM per_scope
+                """
+            )
+            folded = cursor.fetchone()['folded']
+        conn.commit()
+    except Exception as e:
+        logger.error(f"彙整統計增量時發生錯誤: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return folded
+
+def reconcile_statistics() -> Dict:
+    """
+    從資料表重新計算所有計數器，修正漂移
+
+    以 REPEATABLE READ 在同一個快照中重新計算並刪除已包含在快照中的增量；
+    同時進行中、尚未提交的寫入所產生的增量不在快照中，提交後仍會正確累加。
+
+    Returns:
+        {'users', 'drift': 全部用戶計數器與實際值的差異}
+    """
+    conn = get_db_connection()
+    try:
+        # 快照在交易的第一個查詢建立，取得交易層級鎖的查詢本身也會建立快照，
+        # 因此在交易開始前先取得連線層級的鎖，快照一定包含先前已提交的彙整（關閉連線時釋放）
+        conn.execute("SELECT pg_advisory_lock(%s)", (_STATS_LOCK_KEY,))
+        conn.commit()
+        conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        with conn.cursor() as cursor:
+            has_vector = _has_vector_predicate(cursor)
+            before = _read_counters(cursor, GLOBAL_SCOPE)
+
+            cursor.execute("DELETE FROM embedding_stat_deltas")
+            cursor.execute("DELETE FROM embedding_stat_counters")
+            cursor.execute(
+                f"""
+                WITH points AS (
+                    SELECT user_id,
+                           COUNT(*) FILTER (WHERE {has_vector}) AS pw,
+                           COUNT(*) FILTER (WHERE NOT ({has_vector}) AND is_archived IS FALSE) AS pwo,
+                           MAX(embedding_updated_at) AS last_update
+                    FROM knowledge_points GROUP BY user_id
+                ),
+                links AS (
+                    SELECT kp.user_id, COUNT(*) AS al, SUM(kl.similarity_score) AS ss
+                    FROM knowledge_links kl
+                    JOIN knowledge_points kp ON kp.id = kl.source_point_id
+                    WHERE kl.is_active = TRUE
+                    GROUP BY kp.user_id
+                ),
+                per_user AS (
+                    SELECT COALESCE(p.user_id, l.user_id) AS user_id,
+                           COALESCE(p.pw, 0) AS pw, COALESCE(p.pwo, 0) AS pwo,
+                           COALESCE(l.al, 0) AS al, COALESCE(l.ss, 0) AS ss, p.last_update
+                    FROM points p FULL JOIN links l ON l.user_id = p.user_id
+                    WHERE COALESCE(p.user_id, l.user_id) IS NOT NULL
+                )
+                INSERT INTO embedding_stat_counters
+                    (user_id, points_with_vectors, points_without_vectors, active_links, similarity_sum,
+                     last_embedding_update, updated_at, reconciled_at)
+                SELECT user_id, pw, pwo, al, ss, last_update, NOW(), NOW() FROM per_user
+                UNION ALL
+                SELECT 0,
+                       (SELECT COALESCE(SUM(pw), 0) FROM points),
+                       (SELECT COALESCE(SUM(pwo), 0) FROM points),
+                       (SELECT COUNT(*) FROM knowledge_links WHERE is_active = TRUE),
+                       (SELECT COALESCE(SUM(similarity_score), 0) FROM knowledge_links WHERE is_active = TRUE),
+                       (SELECT MAX(last_update) FROM points),
+                       NOW(), NOW()
+                """
+            )
+            users = cursor.rowcount - 1
+            after = _read_counters(cursor, GLOBAL_SCOPE)
+        conn.commit()
+    except Exception as e:
+        logger.error(f"校正統計計數器時發生錯誤: {e}")
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    invalidate_cache()
+    drift = {key: after[key] - before[key] for key in _COUNTER_COLUMNS} if before else None
+    if drift and any(abs(value) > 1e-3 for value in drift.values()):
+        logger.warning(f"統計計數器漂移已校正: {drift}")
+    return {'users': users, 'drift': drift}
+
+def _read_counters(cursor, scope: int) -> Optional[Dict]:
+    """計數器 + 尚未彙整的增量"""
+    cursor.execute(
+        """
+        SELECT c.points_with_vectors + COALESCE(d.pw, 0) AS points_with_vectors,
+               c.points_without_vectors + COALESCE(d.pwo, 0) AS points_without_vectors,
+               c.active_links + COALESCE(d.al, 0) AS active_links,
+               c.similarity_sum + COALESCE(d.ss, 0) AS similarity_sum,
+               GREATEST(c.last_embedding_update, d.last_update) AS last_embedding_update,
+               c.reconciled_at
+        FROM embedding_stat_counters c
+        LEFT JOIN (
+            SELECT SUM(points_with_vectors)::bigint AS pw, SUM(points_without_vectors)::bigint AS pwo,
+                   SUM(active_links)::bigint AS al, SUM(similarity_sum) AS ss,
+                   MAX(last_embedding_update) AS last_update
+            FROM embedding_stat_deltas
+            WHERE %(scope)s = 0 OR user_id = %(scope)s
+        ) d ON TRUE
+        WHERE c.user_id = %(scope)s
+        """,
+        {'scope': scope}
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return {**row, 'similarity_sum': float(row['similarity_sum'])}
+
+def invalidate_cache():
+    with _cache_lock:
+        _cache.clear()
+
+def get_statistics(user_id: Optional[int] = None) -> Dict:
+    """
+    讀取向量化統計（與原 knowledge_linking_stats 相同的欄位）
+
+    Args:
+        user_id: 只統計該用戶（None = 全部用戶）
+    """
+    scope = int(user_id) if user_id is not None else GLOBAL_SCOPE
+    now = time.monotonic()
+    cached = _cache.get(scope)
+    if cached and now - cached[0] < STATS_CACHE_TTL_SECONDS:
+        return dict(cached[1])
+
+    ensure_installed()
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            counters = _read_counters(cursor, scope)
+    finally:
+        conn.close()
+
+    if counters is None:
+        counters = {
+            'points_with_vectors': 0, 'points_without_vectors': 0, 'active_links': 0,
+            'similarity_sum': 0.0, 'last_embedding_update': None, 'reconciled_at': None
+        }
+    stats = {
+        'points_with_vectors': int(counters['points_with_vectors']),
+        'points_without_vectors': int(counters['points_without_vectors']),
+        'active_links': int(counters['active_links']),
+        'avg_similarity_score': (
+            counters['similarity_sum'] / counters['active_links'] if counters['active_links'] else 0.0
+        ),
+        'last_embedding_update': (
+            counters['last_embedding_update'].isoformat() if counters['last_embedding_update'] else None
+        ),
+        'reconciled_at': counters['reconciled_at'].isoformat() if counters['reconciled_at'] else None
+    }
+    with _cache_lock:
+        _cache[scope] = (now, stats)
+    return dict(stats)
+
+def _run_worker(fold_interval: int, reconcile_interval: int):
+    last_reconcile = time.monotonic()
+    while True:
+        time.sleep(fold_interval)
+        try:
+            ensure_installed()
+            fold_deltas()
+            if reconcile_interval > 0 and time.monotonic() - last_reconcile >= reconcile_interval:
+                # 多個 worker 程序時，其他程序剛校正過就跳過
+                conn = get_db_connection()
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute(
+                            """
+                            SELECT COALESCE(MIN(reconciled_at) < NOW() - make_interval(secs => %s), TRUE) AS due
+                            FROM embedding_stat_counters WHERE user_id = 0
+                            """,
+                            (reconcile_interval,)
+                        )
+                        due = cursor.fetchone()['due']
+                finally:
+                    conn.close()
+                if due:
+                    reconcile_statistics()
+                last_reconcile = time.monotonic()
+        except Exception as e:
+            logger.error(f"統計計數器背景更新失敗，下一輪再試: {e}")
+
+def start_stats_worker(
+    fold_interval: int = STATS_FOLD_INTERVAL,
+    reconcile_interval: int = STATS_RECONCILE_INTERVAL
+) -> bool:
+    """啟動統計增量彙整與定期校正的背景執行緒（每個程序只會啟動一次）"""
+    global _worker
+    if fold_interval <= 0:
+        return False
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=_run_worker, args=(fold_interval, reconcile_interval),
+                name='embedding-stats', daemon=True
+            )
+            _worker.start()
+            logger.info(f"✅ 已啟動統計計數器彙整執行緒（每 {fold_interval} 秒）")
+    return True
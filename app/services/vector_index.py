@@ -0,0 +1,290 @@
+# app/services/vector_index.py
+"""
+程序內向量索引
+
+在沒有 pgvector 的環境（本地開發、測試）中提供相似度搜尋。
+所有向量以正規化後的 float32 連續矩陣保存，查詢時以一次矩陣乘法計算
+餘弦相似度，再用 np.argpartition 取出前 k 名。
+
+索引可寫入快照檔，載入時以 memory map（copy-on-write）開啟，
+不需要先把整個檔案讀進記憶體。
+"""
+
+import os
+import fcntl
+import struct
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT_PATH = os.path.join('instance', 'vector_index.bin')
+
+# 快照格式: [魔術字串 8 bytes][維度 uint32][保留 uint32][數量 uint64]
+#           + ids (int64 x n) + user_ids (int64 x n) + vectors (float32 x n x 維度)
+_SNAPSHOT_MAGIC = b'AITVIDX1'
+_SNAPSHOT_HEADER = struct.Struct('<8sIIQ')
+_NO_USER = -1
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class VectorIndex:
+    """
+    支援增量新增/移除與依用戶過濾的向量索引
+
+    移除時把最後一列搬到被移除的位置，矩陣始終保持連續、沒有空洞。
+    """
+
+    def __init__(self, dimension: int = 384, capacity: int = 1024):
+        self.dimension = dimension
+        self._vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._user_ids = np.full(capacity, _NO_USER, dtype=np.int64)
+        self._size = 0
+        self._positions: Dict[int, int] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, point_id: int) -> bool:
+        return int(point_id) in self._positions
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    @property
+    def user_ids(self) -> np.ndarray:
+        return self._user_ids[:self._size]
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """正規化後的向量矩陣（唯讀視圖）"""
+        view = self._vectors[:self._size]
+        view.flags.writeable = False
+        return view
+
+    def _ensure_capacity(self, required: int):
+        capacity = self._vectors.shape[0]
+        if required <= capacity and self._vectors.flags.writeable:
+            return
+        new_capacity = max(required, capacity * 2, 1024)
+        vectors = np.zeros((new_capacity, self.dimension), dtype=np.float32)
+        ids = np.zeros(new_capacity, dtype=np.int64)
+        user_ids = np.full(new_capacity, _NO_USER, dtype=np.int64)
+        vectors[:self._size] = self._vectors[:self._size]
+        ids[:self._size] = self._ids[:self._size]
+        user_ids[:self._size] = self._user_ids[:self._size]
+        self._vectors, self._ids, self._user_ids = vectors, ids, user_ids
+
+    def add(self, point_ids: Iterable[int], vectors, user_ids: Optional[Iterable[Optional[int]]] = None):
+        """
+        新增或覆寫向量
+
+        Args:
+            point_ids: 知識點ID
+            vectors: 對應的向量（會自動正規化）
+            user_ids: 知識點所屬用戶，用於依用戶過濾
+        """
+        point_ids = [int(pid) for pid in point_ids]
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(point_ids), self.dimension)
+        matrix = _normalize_rows(matrix)
+        owners = list(user_ids) if user_ids is not None else [None] * len(point_ids)
+
+        with self._lock:
+            self._ensure_capacity(self._size + len(point_ids))
+            for point_id, vector, owner in zip(point_ids, matrix, owners):
+                row = self._positions.get(point_id)
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._positions[point_id] = row
+                    self._ids[row] = point_id
+                self._vectors[row] = vector
+                self._user_ids[row] = _NO_USER if owner is None else int(owner)
+
+    def remove(self, point_ids: Iterable[int]) -> int:
+        """移除向量，回傳實際移除的數量"""
+        removed = 0
+        with self._lock:
+            for point_id in point_ids:
+                row = self._positions.pop(int(point_id), None)
+                if row is None:
+                    continue
+                last = self._size - 1
+                if row != last:
+                    moved_id = int(self._ids[last])
+                    self._vectors[row] = self._vectors[last]
+                    self._ids[row] = moved_id
+                    self._user_ids[row] = self._user_ids[last]
+                    self._positions[moved_id] = row
+                self._size = last
+                removed += 1
+        return removed
+
+    def get_vector(self, point_id: int) -> Optional[np.ndarray]:
+        """取得已正規化的向量"""
+        row = self._positions.get(int(point_id))
+        return None if row is None else self._vectors[row].copy()
+
+    def search(
+        self,
+        query,
+        k: int = 10,
+        threshold: Optional[float] = None,
+        user_id: Optional[int] = None,
+        exclude_ids: Optional[Iterable[int]] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        以餘弦相似度搜尋最相近的向量
+
+        Args:
+            query: 查詢向量
+            k: 最大結果數量
+            threshold: 相似度閾值（None = 不過濾）
+            user_id: 只搜尋該用戶的向量（None = 全部）
+            exclude_ids: 要排除的知識點ID
+
+        Returns:
+            依相似度遞減排序的 (知識點ID, 相似度) 列表
+        """
+        q = np.asarray(query, dtype=np.float32).reshape(self.dimension)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return []
+        q = q / norm
+
+        with self._lock:
+            size = self._size
+            if size == 0 or k <= 0:
+                return []
+            scores = self._vectors[:size] @ q
+            ids = self._ids[:size].copy()
+
+            if user_id is not None:
+                scores[self._user_ids[:size] != int(user_id)] = -np.inf
+            if exclude_ids:
+                for point_id in exclude_ids:
+                    row = self._positions.get(int(point_id))
+                    if row is not None:
+                        scores[row] = -np.inf
+
+        if k < size:
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(size)
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+        results = []
+        for row in candidates:
+            score = float(scores[row])
+            if score == -np.inf or (threshold is not None and score < threshold):
+                break
+            results.append((int(ids[row]), score))
+        return results
+
+    def save(self, path: str):
+        """寫入快照檔（先寫暫存檔再替換，避免讀到寫到一半的檔案）"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with self._lock:
+            size = self._size
+            with open(tmp_path, 'wb') as f:
+                f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, self.dimension, 0, size))
+                f.write(np.ascontiguousarray(self._ids[:size], dtype='<i8').tobytes())
+                f.write(np.ascontiguousarray(self._user_ids[:size], dtype='<i8').tobytes())
+                f.write(np.ascontiguousarray(self._vectors[:size], dtype='<f4').tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'VectorIndex':
+        """以 memory map 載入快照；修改時採 copy-on-write，不會改動檔案"""
+        with open(path, 'rb') as f:
+            magic, dimension, _, size = _SNAPSHOT_HEADER.unpack(f.read(_SNAPSHOT_HEADER.size))
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError(f"無效的向量索引快照: {path}")
+
+        index = cls(dimension=dimension, capacity=0)
+        if size:
+            offset = _SNAPSHOT_HEADER.size
+            ids = np.memmap(path, dtype='<i8', mode='c', offset=offset, shape=(size,))
+            offset += size * 8
+            user_ids = np.memmap(path, dtype='<i8', mode='c', offset=offset, shape=(size,))
+            offset += size * 8
+            vectors = np.memmap(path, dtype='<f4', mode='c', offset=offset, shape=(size, dimension))
+            index._ids, index._user_ids, index._vectors = ids, user_ids, vectors
+            index._size = size
+            index._positions = {int(point_id): row for row, point_id in enumerate(ids)}
+        return index
+
+# --- 共用索引實例 ---
+
+_index: Optional[VectorIndex] = None
+_index_mtime: Optional[float] = None
+_index_lock = threading.Lock()
+
+def get_snapshot_path() -> str:
+    return os.environ.get('VECTOR_INDEX_PATH', DEFAULT_SNAPSHOT_PATH)
+
+def get_vector_index(dimension: int = 384) -> VectorIndex:
+    """
+    取得共用索引；快照檔被其他 worker 更新時自動重新載入
+    """
+    global _index, _index_mtime
+    path = get_snapshot_path()
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+
+    with _index_lock:
+        if _index is None or (mtime is not None and mtime != _index_mtime):
+            if mtime is not None:
+                _index = VectorIndex.load(path)
+                logger.info(f"✅ 已載入向量索引快照: {path} ({len(_index)} 個向量)")
+            elif _index is None:
+                _index = VectorIndex(dimension=dimension)
+            _index_mtime = mtime
+        return _index
+
+def replace_vector_index(index: VectorIndex):
+    """以新的索引取代共用索引（例如切換向量模型後），需在 locked_vector_index 內呼叫以寫回快照"""
+    global _index
+    with _index_lock:
+        _index = index
+
+def persist_vector_index():
+    """將共用索引寫回快照檔"""
+    global _index_mtime
+    with _index_lock:
+        if _index is None:
+            return
+        path = get_snapshot_path()
+        _index.save(path)
+        _index_mtime = os.path.getmtime(path)
+
+@contextmanager
+def locked_vector_index(dimension: int = 384):
+    """
+    以檔案鎖保護「重新載入 → 修改 → 寫回快照」，避免多個 worker 互相覆蓋
+    """
+    path = get_snapshot_path()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(f"{path}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield get_vector_index(dimension)
+            persist_vector_index()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
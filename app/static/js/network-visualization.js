@@ -3,12 +3,15 @@
 class KnowledgeNetworkVisualizer {
     constructor() {
         this.svg = null;
-        this.simulation = null;
         this.nodes = [];
         this.links = [];
         this.width = 0;
         this.height = 600;
         this.zoom = null;
+        this.transform = d3.zoomIdentity;
+        this.bounds = null;
+        this.viewportTimer = null;
+        this.fitting = false;
         this.selectedNode = null;
         this.colorScale = null;
         
@@ -33,11 +36,16 @@ class KnowledgeNetworkVisualizer {
             .attr('width', this.width)
             .attr('height', this.height);
             
-        // 設定縮放
+        // 設定縮放：座標由伺服器計算，縮放或平移結束後只載入視窗內的節點
         this.zoom = d3.zoom()
-            .scaleExtent([0.1, 10])
+            .scaleExtent([0.05, 40])
             .on('zoom', (event) => {
+                this.transform = event.transform;
                 this.svg.select('.graph-container').attr('transform', event.transform);
+                this.applyScreenSizes();
+            })
+            .on('end', () => {
+                if (!this.fitting) this.scheduleViewportLoad();
             });
             
         this.svg.call(this.zoom);
@@ -49,14 +57,35 @@ class KnowledgeNetworkVisualizer {
         this.loadNetworkData();
     }
     
-    async loadNetworkData() {
+    // 目前視窗對應的布局座標範圍
+    currentViewport() {
+        const t = this.transform;
+        return {
+            x_min: (0 - t.x) / t.k,
+            y_min: (0 - t.y) / t.k,
+            x_max: (this.width - t.x) / t.k,
+            y_max: (this.height - t.y) / t.k
+        };
+    }
+    
+    scheduleViewportLoad() {
+        clearTimeout(this.viewportTimer);
+        this.viewportTimer = setTimeout(() => this.loadNetworkData(this.currentViewport()), 250);
+    }
+    
+    async loadNetworkData(viewport = null) {
         try {
             this.showLoading(true);
             
-            const limit = document.getElementById('nodeLimit').value;
-            const threshold = document.getElementById('similarityThreshold').value;
+            const params = new URLSearchParams({
+                limit: document.getElementById('nodeLimit').value,
+                min_similarity: document.getElementById('similarityThreshold').value
+            });
+            if (viewport) {
+                Object.entries(viewport).forEach(([key, value]) => params.set(key, value.toFixed(2)));
+            }
             
-            const response = await fetch(`/admin/api/network-data?limit=${limit}&min_similarity=${threshold}`, {
+            const response = await fetch(`/admin/api/network-data?${params}`, {
                 headers: {
                     'Authorization': 'Bearer ' + localStorage.getItem('jwt_token')
                 }
@@ -69,6 +98,7 @@ class KnowledgeNetworkVisualizer {
             const data = await response.json();
             this.nodes = data.nodes;
             this.links = data.links;
+            this.bounds = data.stats.bounds;
             
             // 計算節點度數
             this.calculateNodeDegrees();
@@ -79,6 +109,11 @@ class KnowledgeNetworkVisualizer {
             // 繪製網絡
             this.renderNetwork();
             
+            // 第一次載入時把整個布局縮放到畫面內
+            if (!viewport) {
+                this.fitToBounds();
+            }
+            
             // 更新圖例
             this.updateLegend();
             
@@ -90,37 +125,56 @@ class KnowledgeNetworkVisualizer {
         }
     }
     
+    fitToBounds() {
+        if (!this.bounds) return;
+        const spanX = Math.max(this.bounds.x_max - this.bounds.x_min, 1);
+        const spanY = Math.max(this.bounds.y_max - this.bounds.y_min, 1);
+        const scale = 0.9 * Math.min(this.width / spanX, this.height / spanY);
+        const transform = d3.zoomIdentity
+            .translate(
+                this.width / 2 - scale * (this.bounds.x_min + spanX / 2),
+                this.height / 2 - scale * (this.bounds.y_min + spanY / 2)
+            )
+            .scale(scale);
+        // 直接套用，不觸發視窗重新載入（目前已載入整個範圍）
+        this.fitting = true;
+        this.svg.call(this.zoom.transform, transform);
+        this.fitting = false;
+        this.applyScreenSizes();
+    }
+    
     calculateNodeDegrees() {
+        const nodeById = new Map(this.nodes.map(node => [node.id, node]));
+        
         // 初始化度數
         this.nodes.forEach(node => {
             node.degree = 0;
             node.connections = [];
         });
         
-        // 計算每個節點的連接數
+        // 計算每個節點在可見範圍內的連接數，並把連結端點換成節點物件
         this.links.forEach(link => {
-            const sourceNode = this.nodes.find(n => n.id === link.source);
-            const targetNode = this.nodes.find(n => n.id === link.target);
+            const sourceNode = nodeById.get(link.source);
+            const targetNode = nodeById.get(link.target);
             
             if (sourceNode && targetNode) {
+                link.source = sourceNode;
+                link.target = targetNode;
                 sourceNode.degree++;
                 targetNode.degree++;
                 sourceNode.connections.push(targetNode);
                 targetNode.connections.push(sourceNode);
             }
         });
+        this.links = this.links.filter(link => typeof link.source === 'object');
     }
     
     renderNetwork() {
-        const layoutType = document.getElementById('layoutType').value;
         const colorBy = document.getElementById('colorBy').value;
         
         // 清除現有圖表
         this.svg.select('.graph-container').selectAll('*').remove();
         
-        // 設定力模擬
-        this.setupSimulation(layoutType);
-        
         // 繪製連結
         this.renderLinks();
         
@@ -130,59 +184,18 @@ class KnowledgeNetworkVisualizer {
         // 繪製標籤
         this.renderLabels();
         
-        // 啟動模擬
-        this.simulation.restart();
-    }
-    
-    setupSimulation(layoutType) {
-        this.simulation = d3.forceSimulation(this.nodes);
-        
-        switch (layoutType) {
-            case 'force':
-                this.simulation
-                    .force('link', d3.forceLink(this.links)
-                        .id(d => d.id)
-                        .distance(d => 100 - (d.weight * 50))
-                        .strength(d => d.weight))
-                    .force('charge', d3.forceManyBody().strength(-300))
-                    .force('center', d3.forceCenter(this.width / 2, this.height / 2))
-                    .force('collision', d3.forceCollide().radius(25));
-                break;
-                
-            case 'circular':
-                this.simulation
-                    .force('link', d3.forceLink(this.links)
-                        .id(d => d.id)
-                        .distance(80)
-                        .strength(0.1))
-                    .force('charge', d3.forceManyBody().strength(-100))
-                    .force('center', d3.forceCenter(this.width / 2, this.height / 2))
-                    .force('radial', d3.forceRadial(200, this.width / 2, this.height / 2).strength(0.8));
-                break;
-                
-            case 'tree':
-                this.simulation
-                    .force('link', d3.forceLink(this.links)
-                        .id(d => d.id)
-                        .distance(100)
-                        .strength(0.8))
-                    .force('charge', d3.forceManyBody().strength(-200))
-                    .force('center', d3.forceCenter(this.width / 2, this.height / 2))
-                    .force('y', d3.forceY().strength(0.1));
-                break;
-        }
-        
-        this.simulation.on('tick', () => this.tick());
+        // 座標已由伺服器計算，直接定位
+        this.tick();
+        this.applyScreenSizes();
     }
     
     renderLinks() {
         const container = this.svg.select('.graph-container');
         
-        const links = container.selectAll('.link')
+        container.selectAll('.link')
             .data(this.links)
             .enter().append('line')
             .attr('class', 'link')
-            .style('stroke-width', d => Math.sqrt(d.weight * 5))
             .style('stroke-opacity', d => Math.max(0.2, d.weight));
     }
     
@@ -192,30 +205,41 @@ class KnowledgeNetworkVisualizer {
         // 設定顏色比例
         this.setColorScale(colorBy);
         
-        const nodes = container.selectAll('.node')
+        container.selectAll('.node')
             .data(this.nodes)
             .enter().append('circle')
             .attr('class', 'node')
-            .attr('r', d => Math.max(8, Math.sqrt(d.degree) * 3))
             .style('fill', d => this.getNodeColor(d, colorBy))
             .on('mouseover', (event, d) => this.showTooltip(event, d))
             .on('mouseout', () => this.hideTooltip())
             .on('click', (event, d) => this.selectNode(d))
             .call(d3.drag()
-                .on('start', (event, d) => this.dragStarted(event, d))
-                .on('drag', (event, d) => this.dragged(event, d))
-                .on('end', (event, d) => this.dragEnded(event, d)));
+                .on('drag', (event, d) => this.dragged(event, d)));
     }
     
     renderLabels() {
         const container = this.svg.select('.graph-container');
         
-        const labels = container.selectAll('.node-label')
+        container.selectAll('.node-label')
             .data(this.nodes)
             .enter().append('text')
             .attr('class', 'node-label')
-            .text(d => d.label.length > 15 ? d.label.substring(0, 15) + '...' : d.label)
-            .style('font-size', d => Math.max(8, Math.sqrt(d.degree) + 8) + 'px');
+            .text(d => d.label.length > 15 ? d.label.substring(0, 15) + '...' : d.label);
+    }
+    
+    // 節點大小、標籤與連結寬度以螢幕像素為準，不隨縮放改變
+    applyScreenSizes() {
+        if (!this.svg) return;
+        const k = this.transform.k;
+        
+        this.svg.selectAll('.node')
+            .attr('r', d => Math.max(6, Math.sqrt(d.weight || d.degree) * 3) / k)
+            .style('stroke-width', 2 / k);
+        this.svg.selectAll('.node-label')
+            .style('font-size', d => (Math.max(8, Math.sqrt(d.degree) + 8) / k) + 'px')
+            .attr('y', d => d.y + 20 / k);
+        this.svg.selectAll('.link')
+            .style('stroke-width', d => Math.sqrt(d.weight * 5) / k);
     }
     
     setColorScale(colorBy) {
@@ -262,7 +286,7 @@ class KnowledgeNetworkVisualizer {
         // 更新標籤位置
         this.svg.selectAll('.node-label')
             .attr('x', d => d.x)
-            .attr('y', d => d.y + 30);
+            .attr('y', d => d.y + 20 / this.transform.k);
     }
     
     showTooltip(event, node) {
@@ -384,22 +408,11 @@ class KnowledgeNetworkVisualizer {
         legendContent.innerHTML = legendHTML;
     }
     
-    // 拖拽事件處理
-    dragStarted(event, d) {
-        if (!event.active) this.simulation.alphaTarget(0.3).restart();
-        d.fx = d.x;
-        d.fy = d.y;
-    }
-    
+    // 拖拽只在畫面上移動節點，不會寫回伺服器的布局
     dragged(event, d) {
-        d.fx = event.x;
-        d.fy = event.y;
-    }
-    
-    dragEnded(event, d) {
-        if (!event.active) this.simulation.alphaTarget(0);
-        d.fx = null;
-        d.fy = null;
+        d.x = event.x;
+        d.y = event.y;
+        this.tick();
     }
     
     // 縮放控制
@@ -412,7 +425,7 @@ class KnowledgeNetworkVisualizer {
     }
     
     resetZoom() {
-        this.svg.transition().call(this.zoom.transform, d3.zoomIdentity);
+        this.loadNetworkData();
     }
     
     // 搜尋功能
@@ -480,7 +493,43 @@ function initializeNetwork() {
 // 更新網絡
 function updateNetwork() {
     if (networkVisualizer) {
-        networkVisualizer.loadNetworkData();
+        networkVisualizer.loadNetworkData(networkVisualizer.currentViewport());
+    }
+}
+
+// 完整重新計算伺服器端布局（背景工作，完成後重新載入）
+async function rebuildLayout() {
+    const headers = {
+        'Authorization': 'Bearer ' + localStorage.getItem('jwt_token')
+    };
+    try {
+        const response = await fetch('/admin/api/network-layout/rebuild', {
+            method: 'POST',
+            headers
+        });
+        const data = await response.json();
+        if (response.status === 409) {
+            networkVisualizer.showError('布局正在重新計算中，請稍後再試');
+            return;
+        }
+        if (!response.ok) {
+            throw new Error(data.error || '重新計算布局失敗');
+        }
+
+        let job = data.job;
+        while (['queued', 'running', 'cancelling'].includes(job.status)) {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            const poll = await fetch(`/admin/api/jobs/${job.id}`, { headers });
+            job = (await poll.json()).job;
+            if (!job) throw new Error('無法取得工作狀態');
+        }
+        if (job.status !== 'succeeded') {
+            throw new Error(job.error || `工作狀態: ${job.status}`);
+        }
+        if (networkVisualizer) networkVisualizer.loadNetworkData();
+    } catch (error) {
+        console.error('重新計算布局錯誤:', error);
+        networkVisualizer.showError('重新計算布局時發生錯誤');
     }
 }
 
@@ -543,10 +592,11 @@ function selectSearchResult(nodeId) {
 // 居中顯示節點
 function centerOnNode(nodeId) {
     const node = networkVisualizer.nodes.find(n => n.id === nodeId);
-    if (node && node.x && node.y) {
+    if (node && node.x !== undefined && node.y !== undefined) {
+        const scale = Math.max(networkVisualizer.transform.k, 1.5);
         const transform = d3.zoomIdentity
-            .translate(networkVisualizer.width / 2 - node.x, networkVisualizer.height / 2 - node.y)
-            .scale(1.5);
+            .translate(networkVisualizer.width / 2 - scale * node.x, networkVisualizer.height / 2 - scale * node.y)
+            .scale(scale);
         
         networkVisualizer.svg.transition()
             .duration(750)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# autotune_embeddings.py
+# 測試 SentenceTransformer 推論的批次大小、長度排序與 CPU 執行緒數，儲存本機的最佳設定
+#
+#   python autotune_embeddings.py [--model 名稱] [--samples N] [--batch-sizes 8,16,32,64] [--threads 1,2,4]
+#
+# 結果依「主機名稱 + 核心數 + 模型」存入 EMBEDDING_TUNING_PATH（預設 instance/embedding_tuning.json），
+# 之後載入模型的程序（向量服務、批次處理、背景工作）都會自動套用。
+# 請在部署的主機上、沒有其他大量推論工作時執行。
+
+import os
+import sys
+import argparse
+import logging
+
+# 設定路徑以便匯入模組
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import database as db
+from app.services import embedding_autotune
+
+# 設定日誌
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+def parse_int_list(value: str):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="向量推論設定自動調校")
+    parser.add_argument('--model', help="模型名稱（預設為使用中的模型）")
+    parser.add_argument('--samples', type=int, default=embedding_autotune.SAMPLE_SIZE, help="從資料庫取樣的知識點數量")
+    parser.add_argument('--batch-sizes', type=parse_int_list,
+                        default=list(embedding_autotune.BATCH_SIZE_CANDIDATES), help="逗號分隔的批次大小")
+    parser.add_argument('--threads', type=parse_int_list, help="逗號分隔的執行緒數（預設 1, 2, 4, ... 核心數）")
+    parser.add_argument('--repeats', type=int, default=2, help="每個組合重複次數（取最快的一次）")
+    parser.add_argument('--dry-run', action='store_true', help="只顯示結果，不儲存")
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        print("❌ 錯誤: 未設定 DATABASE_URL 環境變數")
+        sys.exit(1)
+    db.init_app(None)
+
+    texts = embedding_autotune.load_sample_texts(args.samples)
+    if not texts:
+        print("❌ 資料庫中沒有知識點可作為調校樣本")
+        sys.exit(1)
+
+    result = embedding_autotune.autotune(
+        model_name=args.model,
+        texts=texts,
+        batch_sizes=args.batch_sizes,
+        thread_options=args.threads,
+        repeats=args.repeats,
+        save=not args.dry_run
+    )
+
+    print(f"\n📊 調校結果（{len(texts)} 個樣本）:")
+    print(f"   {'執行緒':>6} {'排序':>4} {'批次':>6} {'文本/秒':>10}")
+    for row in sorted(result['results'], key=lambda r: -r['texts_per_second']):
+        print(f"   {row['threads']:>6} {'是' if row['sort_by_length'] else '否':>4} "
+              f"{row['batch_size']:>6} {row['texts_per_second']:>10.1f}")
+
+    print(f"\n✅ 最佳設定: 執行緒 {result['threads']}、批次 {result['batch_size']}、"
+          f"{'依長度排序' if result['sort_by_length'] else '不排序'}（{result['texts_per_second']:.1f} 文本/秒）")
+    if args.dry_run:
+        print("   (--dry-run，未儲存)")
+    else:
+        print(f"   已儲存到 {embedding_autotune.get_tuning_path()}")
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,11 @@ from datetime import datetime
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app.services import embedding_service as embedding
+from app.services import link_builder
+from app.services import embedding_refresh
+from app.services import clustering_service
+from app.services import dedup_service
+from app.services import graph_analytics
 from app.services import database as db
 
 # 設定日誌
@@ -83,6 +88,9 @@ def main():
         print(f"      - 成功: {result['success']}")
         print(f"      - 失敗: {result['failed']}")
         
+        for stage_name, stage in result.get('stages', {}).items():
+            print(f"      - {stage_name}: {stage['items']} 筆, {stage['items_per_second']:.1f} 筆/秒")
+        
         if result['failed'] > 0:
             print(f"   ⚠️ 有 {result['failed']} 個知識點處理失敗，請檢查日誌")
         
@@ -132,7 +140,7 @@ def create_links_for_recent_points(limit=100):
                 LIMIT %s
             """, (limit,))
             
-            point_ids = [row[0] for row in cursor.fetchall()]
+            point_ids = [row['id'] for row in cursor.fetchall()]
         
         conn.close()
         
@@ -161,47 +169,43 @@ def rebuild_all_links():
     print("\n🔄 重建所有知識點關聯...")
     
     try:
-        # 先清除現有關聯
-        conn = db.get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM knowledge_links")
-            deleted_count = cursor.rowcount
-            conn.commit()
-        conn.close()
+        result = link_builder.rebuild_semantic_links(similarity_threshold=0.8, max_links=5)
         
-        print(f"   清除了 {deleted_count} 個現有關聯")
+        print(f"   清除了 {result['deleted']} 個現有語義關聯（手動關聯保留）")
+        print(f"   為 {result['points']} 個知識點計算相似度矩陣: {result['compute_seconds']:.1f} 秒")
+        print(f"   批次寫入關聯: {result['write_seconds']:.1f} 秒")
+        print(f"   ✅ 重建完成，總共建立了 {result['created']} 個關聯")
         
-        # 獲取所有有向量的知識點
-        conn = db.get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                SELECT id FROM knowledge_points 
-                WHERE embedding_vector IS NOT NULL 
-                  AND is_archived = FALSE
-                ORDER BY id
-            """)
-            point_ids = [row[0] for row in cursor.fetchall()]
-        conn.close()
+    except Exception as e:
+        print(f"   ❌ 重建關聯失敗: {e}")
+        logger.exception("重建關聯失敗")
+
+def merge_duplicates():
+    """找出並合併重複的知識點（先預覽，確認後才寫入）"""
+    print("\n🔍 尋找重複的知識點...")
+    
+    try:
+        preview = dedup_service.merge_duplicate_points(dry_run=True)
+        if not preview['groups']:
+            print("   ✅ 沒有重複的知識點")
+            return
         
-        print(f"   為 {len(point_ids)} 個知識點重建關聯...")
+        for group in preview['details'][:20]:
+            print(f"   保留 {group['keep']}，合併 {group['merged']}: {' / '.join(group['phrases'])}")
+        if preview['groups'] > 20:
+            print(f"   ... 其餘 {preview['groups'] - 20} 組")
         
-        total_links = 0
-        for i, point_id in enumerate(point_ids):
-            try:
-                link_count = embedding.auto_link_knowledge_point(point_id, similarity_threshold=0.8)
-                total_links += link_count
-                
-                if (i + 1) % 50 == 0:
-                    print(f"      已處理 {i + 1}/{len(point_ids)} 個知識點")
-                    
-            except Exception as e:
-                logger.error(f"為知識點 {point_id} 重建關聯失敗: {e}")
-                continue
+        confirm = input(f"\n合併這 {preview['groups']} 組（共 {preview['merged']} 個知識點）? (y/N): ")
+        if confirm.lower() != 'y':
+            print("   已取消")
+            return
         
-        print(f"   ✅ 重建完成，總共建立了 {total_links} 個關聯")
+        result = dedup_service.merge_duplicate_points()
+        print(f"   ✅ 合併完成，移除了 {result['merged']} 個重複知識點")
         
     except Exception as e:
-        print(f"   ❌ 重建關聯失敗: {e}")
+        print(f"   ❌ 合併失敗: {e}")
+        logger.exception("合併重複知識點失敗")
 
 def test_model_loading():
     """測試模型載入"""
@@ -234,8 +238,12 @@ if __name__ == "__main__":
     print("2. 批次處理知識點向量")
     print("3. 重建所有關聯")
     print("4. 查看統計資訊")
+    print("5. 重新向量化已修改的知識點")
+    print("6. 重新對知識點分群")
+    print("7. 合併重複的知識點")
+    print("8. 分析知識點網絡（連通分量、PageRank）")
     
-    choice = input("\n請輸入選項 (1-4): ").strip()
+    choice = input("\n請輸入選項 (1-8): ").strip()
     
     if choice == "1":
         test_model_loading()
@@ -251,5 +259,31 @@ if __name__ == "__main__":
                 print(f"   {key}: {value}")
         except Exception as e:
             print(f"❌ 獲取統計失敗: {e}")
+    elif choice == "5":
+        try:
+            result = embedding_refresh.refresh_dirty_embeddings(debounce_seconds=0)
+            print(f"\n✅ 重新向量化 {result['refreshed']} 個知識點")
+            print(f"   移除 {result['links_removed']} 條、建立 {result['links_created']} 條關聯")
+        except Exception as e:
+            print(f"❌ 重新向量化失敗: {e}")
+    elif choice == "6":
+        try:
+            result = clustering_service.run_clustering()
+            print(f"\n✅ {result['points']} 個知識點分為 {result['clusters']} 群")
+            print(f"   計算時間 {result['fit_seconds']:.1f} 秒，與中心的平均相似度 {result['mean_similarity']:.3f}")
+        except Exception as e:
+            print(f"❌ 分群失敗: {e}")
+    elif choice == "7":
+        merge_duplicates()
+    elif choice == "8":
+        try:
+            result = graph_analytics.run_graph_analytics(wait=True)
+            print(f"\n✅ {result['nodes']} 個知識點、{result['links']} 條關聯，"
+                  f"共 {result['components']} 個連通分量（最大 {result['largest_component']} 個知識點）")
+            print(f"   計算時間 {result['seconds']:.1f} 秒")
+            for hub in graph_analytics.get_hub_points(limit=10):
+                print(f"   {hub['pagerank']:.4f}  {hub['correct_phrase']}")
+        except Exception as e:
+            print(f"❌ 網絡分析失敗: {e}")
     else:
         print("無效選項")
\ No newline at end of file
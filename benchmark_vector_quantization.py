@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# benchmark_vector_quantization.py
+# 比較 full / halfvec / binary 三種向量儲存模式的索引大小、建立時間、查詢延遲與 recall@10
+#
+# 需要先執行 database_migration_vector_quantization.sql（pgvector 0.7.0 以上）。
+# 所有測試資料都在同一個交易中建立，結束後回滾；期間會暫時移除既有的 HNSW 索引
+# 並鎖住 knowledge_points，請只在測試資料庫上執行。
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+# 設定路徑以便匯入模組
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import database as db
+from app.services import embedding_service as embedding
+from benchmark_vector_search import DIMENSION, create_user_points, exact_top_k
+
+# 各模式對應的索引定義
+INDEXES = {
+    'full': ('idx_knowledge_points_embedding_hnsw', 'embedding_vector vector_cosine_ops'),
+    'halfvec': ('idx_knowledge_points_embedding_halfvec_hnsw', 'embedding_halfvec halfvec_cosine_ops'),
+    'binary': ('idx_knowledge_points_embedding_binary_hnsw', 'embedding_binary bit_hamming_ops'),
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="向量量化儲存模式比較")
+    parser.add_argument('--rows', type=int, default=100000, help="測試的知識點數量")
+    parser.add_argument('--queries', type=int, default=100, help="查詢次數")
+    parser.add_argument('--k', type=int, default=10, help="每次查詢的結果數量")
+    parser.add_argument('--modes', default='full,halfvec,binary', help="要比較的儲存模式（逗號分隔）")
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        print("❌ 錯誤: 未設定 DATABASE_URL 環境變數")
+        sys.exit(1)
+
+    db.init_app(None)
+    modes = args.modes.split(',')
+    rng = np.random.default_rng(42)
+
+    conn = db.get_db_connection()
+    rows = []
+    try:
+        with conn.cursor() as cursor:
+            for index_name, _ in INDEXES.values():
+                cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+            print(f"   建立 {args.rows} 個知識點...")
+            user_id, point_ids, vectors = create_user_points(cursor, 'quantization', args.rows, rng)
+            # 量化欄位由 trg_sync_quantized_embeddings 觸發器同步寫入
+            embedding.bulk_update_knowledge_point_embeddings(point_ids.tolist(), vectors, conn=conn)
+            cursor.execute("ANALYZE knowledge_points")
+
+            picks = rng.integers(0, args.rows, args.queries)
+            queries = vectors[picks] + 0.3 * rng.standard_normal((args.queries, DIMENSION)).astype(np.float32)
+            truths = [exact_top_k(point_ids, vectors, q, args.k) for q in queries]
+
+            for mode in modes:
+                index_name, definition = INDEXES[mode]
+                print(f"   建立 {mode} 索引...")
+                start = time.perf_counter()
+                cursor.execute(f"""
+                    CREATE INDEX {index_name} ON knowledge_points
+                    USING hnsw ({definition}) WITH (m = 16, ef_construction = 64)
+                """)
+                build_seconds = time.perf_counter() - start
+                cursor.execute("SELECT pg_relation_size(%s::regclass) AS size", (index_name,))
+                index_bytes = cursor.fetchone()['size']
+
+                embedding.VECTOR_STORAGE_MODE = mode
+                recalls, latencies = [], []
+                for q, truth in zip(queries, truths):
+                    start = time.perf_counter()
+                    results = embedding.search_knowledge_points_by_vector(
+                        q, similarity_threshold=-1.0, max_results=args.k, user_id=user_id, conn=conn
+                    )
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    recalls.append(len({r['point_id'] for r in results} & truth) / len(truth))
+                rows.append((mode, index_bytes, build_seconds, latencies, float(np.mean(recalls))))
+
+                # 移除索引，避免下一個模式的查詢計畫用到它
+                cursor.execute(f"DROP INDEX {index_name}")
+    finally:
+        # 所有測試資料與索引變更都在同一個交易中，直接回滾即可
+        conn.rollback()
+        conn.close()
+
+    print("=" * 76)
+    print(f"📊 向量儲存模式比較 ({args.rows} 筆, {DIMENSION} 維, k={args.k}, {args.queries} 次查詢)")
+    print("=" * 76)
+    print(f"   {'模式':<8} {'索引大小 (MB)':>14} {'建立 (秒)':>10} {'p50 (ms)':>10} {'p95 (ms)':>10} {'recall@k':>9}")
+    for mode, index_bytes, build_seconds, latencies, recall in rows:
+        print(f"   {mode:<8} {index_bytes / 1024 / 1024:>14.1f} {build_seconds:>10.1f} "
+              f"{np.percentile(latencies, 50):>10.2f} {np.percentile(latencies, 95):>10.2f} {recall:>9.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# benchmark_vector_search.py
+# 依用戶過濾的向量搜尋：比較 HNSW 與精確搜尋的召回率與延遲
+#
+# 所有測試資料都在同一個交易中建立，結束後回滾。
+# 為了加快載入，交易中會暫時移除並重建 HNSW 索引（期間鎖住 knowledge_points），
+# 請只在測試資料庫上執行。
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+# 設定路徑以便匯入模組
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import database as db
+from app.services import embedding_service as embedding
+
+DIMENSION = 384
+
+def create_user_points(cursor, label, count, rng, clusters=50):
+    """建立一個測試用戶與 count 個帶有分群向量的知識點"""
+    cursor.execute(
+        """
+        INSERT INTO users (username, email, password_hash)
+        VALUES (%s, %s, 'benchmark') RETURNING id
+        """,
+        (f"bench_{label}_{os.getpid()}", f"bench_{label}_{os.getpid()}@example.com")
+    )
+    user_id = cursor.fetchone()['id']
+
+    cursor.execute(
+        """
+        INSERT INTO knowledge_points (user_id, category, subcategory, correct_phrase)
+        SELECT %s, 'benchmark', 'benchmark', 'phrase ' || g
+        FROM generate_series(1, %s) AS g
+        RETURNING id
+        """,
+        (user_id, count)
+    )
+    point_ids = np.array([row['id'] for row in cursor.fetchall()], dtype=np.int64)
+
+    centers = rng.standard_normal((clusters, DIMENSION)).astype(np.float32)
+    assignments = rng.integers(0, clusters, count)
+    vectors = centers[assignments] + 0.6 * rng.standard_normal((count, DIMENSION)).astype(np.float32)
+    return user_id, point_ids, vectors
+
+def exact_top_k(point_ids, vectors, query, k):
+    """以 NumPy 暴力計算的正確答案"""
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    k = min(k, len(point_ids))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return set(point_ids[top].tolist())
+
+def timed_search(conn, query, k, user_id, exact=False):
+    """在子交易中執行一次搜尋，回傳 (結果ID集合, 毫秒)"""
+    with conn.transaction():
+        with conn.cursor() as cursor:
+            # 精確搜尋時停用索引掃描，強制走 user_id 索引 + 排序
+            cursor.execute(
+                "SELECT set_config('enable_indexscan', %s, true)",
+                ('off' if exact else 'on',)
+            )
+        start = time.perf_counter()
+        results = embedding.search_knowledge_points_by_vector(
+            query, similarity_threshold=-1.0, max_results=k, user_id=user_id, conn=conn
+        )
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    return {r['point_id'] for r in results}, elapsed_ms
+
+def main():
+    parser = argparse.ArgumentParser(description="依用戶過濾的向量搜尋召回率與延遲測試")
+    parser.add_argument('--sizes', default='100,10000,1000000', help="各測試用戶的知識點數量（逗號分隔）")
+    parser.add_argument('--background', type=int, default=20000, help="其他用戶的知識點數量")
+    parser.add_argument('--queries', type=int, default=50, help="每個用戶的查詢次數")
+    parser.add_argument('--k', type=int, default=10, help="每次查詢的結果數量")
+    parser.add_argument('--ef-search', default='40,100,200', help="要比較的 hnsw.ef_search 值（逗號分隔）")
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        print("❌ 錯誤: 未設定 DATABASE_URL 環境變數")
+        sys.exit(1)
+
+    db.init_app(None)
+    if not embedding.is_pgvector_available():
+        print("❌ 錯誤: 資料庫未啟用 pgvector")
+        sys.exit(1)
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    ef_values = [int(s) for s in args.ef_search.split(',')]
+    rng = np.random.default_rng(42)
+
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DROP INDEX IF EXISTS idx_knowledge_points_embedding_hnsw")
+
+            users = []
+            for label, count in [('background', args.background)] + [(str(size), size) for size in sizes]:
+                if count <= 0:
+                    continue
+                print(f"   建立 {count} 個知識點（{label}）...")
+                user_id, point_ids, vectors = create_user_points(cursor, label, count, rng)
+                embedding.bulk_update_knowledge_point_embeddings(point_ids.tolist(), vectors, conn=conn)
+                if label != 'background':
+                    users.append((count, user_id, point_ids, vectors))
+
+            print("   建立 HNSW 索引...")
+            cursor.execute("""
+                CREATE INDEX idx_knowledge_points_embedding_hnsw
+                ON knowledge_points USING hnsw (embedding_vector vector_cosine_ops)
+                WITH (m = 16, ef_construction = 64)
+            """)
+            cursor.execute("ANALYZE knowledge_points")
+
+        rows = []
+        for count, user_id, point_ids, vectors in users:
+            picks = rng.integers(0, count, args.queries)
+            queries = vectors[picks] + 0.3 * rng.standard_normal((args.queries, DIMENSION)).astype(np.float32)
+            truths = [exact_top_k(point_ids, vectors, q, args.k) for q in queries]
+
+            for method, ef, exact in [('exact', None, True)] + [(f"hnsw ef={ef}", ef, False) for ef in ef_values]:
+                if ef is not None:
+                    embedding.HNSW_EF_SEARCH = ef
+                recalls, latencies = [], []
+                for q, truth in zip(queries, truths):
+                    found, ms = timed_search(conn, q, args.k, user_id, exact=exact)
+                    recalls.append(len(found & truth) / len(truth))
+                    latencies.append(ms)
+                rows.append((count, method, float(np.mean(recalls)), latencies))
+    finally:
+        # 所有測試資料與索引變更都在同一個交易中，直接回滾即可
+        conn.rollback()
+        conn.close()
+
+    print("=" * 72)
+    print(f"📊 依用戶過濾的向量搜尋（背景資料 {args.background} 筆, k={args.k}, 每組 {args.queries} 次查詢）")
+    print("=" * 72)
+    print(f"   {'用戶知識點數':>12}  {'方法':<14} {'recall@k':>9} {'p50 (ms)':>10} {'p95 (ms)':>10}")
+    for count, method, recall, latencies in rows:
+        print(f"   {count:>12}  {method:<14} {recall:>9.3f} "
+              f"{np.percentile(latencies, 50):>10.2f} {np.percentile(latencies, 95):>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# benchmark_vector_writes.py
+# 比較逐筆 UPDATE 與 COPY BINARY 批次寫入向量的吞吐量
+
+import os
+import sys
+import time
+import argparse
+import datetime
+import numpy as np
+
+# 設定路徑以便匯入模組
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import database as db
+from app.services import embedding_service as embedding
+
+def create_synthetic_points(cursor, count):
+    """在交易中建立測試用戶與知識點，結束後整個交易會被回滾"""
+    cursor.execute(
+        """
+        INSERT INTO users (username, email, password_hash)
+        VALUES (%s, %s, 'benchmark') RETURNING id
+        """,
+        (f"bench_{os.getpid()}", f"bench_{os.getpid()}@example.com")
+    )
+    user_id = cursor.fetchone()['id']
+
+    cursor.execute(
+        """
+        INSERT INTO knowledge_points (user_id, category, subcategory, correct_phrase)
+        SELECT %s, 'benchmark', 'benchmark', 'phrase ' || g
+        FROM generate_series(1, %s) AS g
+        RETURNING id
+        """,
+        (user_id, count)
+    )
+    return [row['id'] for row in cursor.fetchall()]
+
+def run_row_by_row(cursor, point_ids, vectors):
+    """舊寫法：每個向量轉成文字，逐筆 UPDATE（不含每筆重新連線的成本）"""
+    start = time.perf_counter()
+    for point_id, vector in zip(point_ids, vectors):
+        vector_str = '[' + ','.join(map(str, vector.tolist())) + ']'
+        cursor.execute(
+            """
+            UPDATE knowledge_points
+            SET embedding_vector = %s::vector, embedding_updated_at = %s
+            WHERE id = %s
+            """,
+            (vector_str, datetime.datetime.now(datetime.timezone.utc), point_id)
+        )
+    return time.perf_counter() - start
+
+def run_bulk(conn, point_ids, vectors):
+    """新寫法：COPY BINARY 到暫存表 + 一次 UPDATE ... FROM"""
+    start = time.perf_counter()
+    updated = embedding.bulk_update_knowledge_point_embeddings(point_ids, vectors, conn=conn)
+    elapsed = time.perf_counter() - start
+    assert updated == len(point_ids), f"預期更新 {len(point_ids)} 筆，實際 {updated} 筆"
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="向量批次寫入吞吐量測試")
+    parser.add_argument('--rows', type=int, default=5000, help="測試的知識點數量")
+    parser.add_argument('--dimension', type=int, default=384, help="向量維度")
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        print("❌ 錯誤: 未設定 DATABASE_URL 環境變數")
+        sys.exit(1)
+
+    db.init_app(None)
+    rng = np.random.default_rng(42)
+    vectors = rng.standard_normal((args.rows, args.dimension)).astype(np.float32)
+
+    conn = db.get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            point_ids = create_synthetic_points(cursor, args.rows)
+            row_seconds = run_row_by_row(cursor, point_ids, vectors)
+        bulk_seconds = run_bulk(conn, point_ids, vectors)
+    finally:
+        # 所有測試資料都在同一個交易中，直接回滾即可
+        conn.rollback()
+        conn.close()
+
+    print("=" * 60)
+    print(f"📊 向量寫入測試 ({args.rows} 筆, {args.dimension} 維)")
+    print("=" * 60)
+    print(f"   逐筆 UPDATE:      {row_seconds:8.2f} 秒  ({args.rows / row_seconds:10.0f} 筆/秒)")
+    print(f"   COPY BINARY 批次: {bulk_seconds:8.2f} 秒  ({args.rows / bulk_seconds:10.0f} 筆/秒)")
+    print(f"   加速倍數: {row_seconds / bulk_seconds:.1f}x")
+
+if __name__ == "__main__":
+    main()
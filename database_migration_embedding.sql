@@ -59,6 +59,11 @@ CREATE INDEX IF NOT EXISTS idx_knowledge_points_embedding_updated
 ON knowledge_points(embedding_updated_at) 
 WHERE embedding_vector IS NOT NULL;
 
+-- 依用戶過濾的向量搜尋：知識點少的用戶可直接走這個索引做精確搜尋
+CREATE INDEX IF NOT EXISTS idx_knowledge_points_user_embedded
+ON knowledge_points(user_id)
+WHERE embedding_vector IS NOT NULL AND is_archived = FALSE;
+
 CREATE INDEX IF NOT EXISTS idx_knowledge_links_source_point 
 ON knowledge_links(source_point_id, similarity_score DESC);
 
@@ -70,11 +75,16 @@ ON knowledge_links(is_active, similarity_score DESC)
 WHERE is_active = TRUE;
 
 -- 6. 建立用於向量搜尋的便利函數
+-- 子查詢只做 ORDER BY 距離 + LIMIT，讓 HNSW 索引直接產生排序結果；
+-- 相似度閾值在外層過濾，避免破壞索引掃描。filter_user_id 限定只搜尋該用戶的知識點。
+DROP FUNCTION IF EXISTS find_similar_knowledge_points(vector, REAL, INTEGER, INTEGER);
+
 CREATE OR REPLACE FUNCTION find_similar_knowledge_points(
     target_vector vector(384),
     similarity_threshold REAL DEFAULT 0.75,
     max_results INTEGER DEFAULT 10,
-    exclude_point_id INTEGER DEFAULT NULL
+    exclude_point_id INTEGER DEFAULT NULL,
+    filter_user_id INTEGER DEFAULT NULL
 )
 RETURNS TABLE (
     point_id INTEGER,
@@ -85,17 +95,23 @@ RETURNS TABLE (
 BEGIN
     RETURN QUERY
     SELECT 
-        kp.id,
-        1 - (kp.embedding_vector <=> target_vector) AS similarity,
-        kp.correct_phrase,
-        kp.key_point_summary
-    FROM knowledge_points kp
-    WHERE kp.embedding_vector IS NOT NULL
-        AND kp.is_archived = FALSE
-        AND (exclude_point_id IS NULL OR kp.id != exclude_point_id)
-        AND (1 - (kp.embedding_vector <=> target_vector)) >= similarity_threshold
-    ORDER BY kp.embedding_vector <=> target_vector
-    LIMIT max_results;
+        c.id,
+        (1 - c.distance)::REAL,
+        c.correct_phrase,
+        c.key_point_summary
+    FROM (
+        SELECT kp.id, kp.correct_phrase, kp.key_point_summary,
+               kp.embedding_vector <=> target_vector AS distance
+        FROM knowledge_points kp
+        WHERE kp.embedding_vector IS NOT NULL
+            AND kp.is_archived = FALSE
+            AND (exclude_point_id IS NULL OR kp.id != exclude_point_id)
+            AND (filter_user_id IS NULL OR kp.user_id = filter_user_id)
+        ORDER BY kp.embedding_vector <=> target_vector
+        LIMIT max_results
+    ) c
+    WHERE (1 - c.distance) >= similarity_threshold
+    ORDER BY c.distance;
 END;
 $$ LANGUAGE plpgsql;
 
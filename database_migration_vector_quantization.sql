@@ -0,0 +1,96 @@
+-- 向量量化儲存的資料庫遷移腳本
+-- 需要 pgvector 0.7.0 以上（halfvec、bit 索引與 binary_quantize）
+-- 執行前請先完成 database_migration_embedding.sql
+
+-- 1. 新增半精度與二元量化欄位
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name='knowledge_points' AND column_name='embedding_halfvec'
+    ) THEN
+        ALTER TABLE knowledge_points ADD COLUMN embedding_halfvec halfvec(384);
+        RAISE NOTICE '欄位 embedding_halfvec 已成功加入 knowledge_points 表格。';
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name='knowledge_points' AND column_name='embedding_binary'
+    ) THEN
+        ALTER TABLE knowledge_points ADD COLUMN embedding_binary bit(384);
+        RAISE NOTICE '欄位 embedding_binary 已成功加入 knowledge_points 表格。';
+    END IF;
+END $$;
+
+-- 2. 寫入 embedding_vector 時自動同步量化欄位
+CREATE OR REPLACE FUNCTION sync_quantized_embeddings()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.embedding_vector IS NULL THEN
+        NEW.embedding_halfvec := NULL;
+        NEW.embedding_binary := NULL;
+    ELSE
+        -- 不指定維度，切換到不同維度的向量模型後觸發器不需要修改
+        NEW.embedding_halfvec := NEW.embedding_vector::halfvec;
+        NEW.embedding_binary := binary_quantize(NEW.embedding_vector);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_sync_quantized_embeddings ON knowledge_points;
+CREATE TRIGGER trg_sync_quantized_embeddings
+BEFORE INSERT OR UPDATE OF embedding_vector ON knowledge_points
+FOR EACH ROW EXECUTE FUNCTION sync_quantized_embeddings();
+
+-- 3. 回填既有向量（分批提交，避免單一交易鎖住過多資料列）
+-- DO 區塊整體是一個交易，因此改用可以在迴圈中 COMMIT 的 PROCEDURE；
+-- CALL 不能在明確的交易區塊（BEGIN ... COMMIT）中執行，請以 psql 預設的自動提交模式執行本腳本
+CREATE OR REPLACE PROCEDURE backfill_quantized_embeddings(batch_size INTEGER DEFAULT 5000)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    batch_rows INTEGER;
+    total_rows INTEGER := 0;
+BEGIN
+    LOOP
+        UPDATE knowledge_points
+        SET embedding_halfvec = embedding_vector::halfvec,
+            embedding_binary = binary_quantize(embedding_vector)
+        WHERE id IN (
+            SELECT id FROM knowledge_points
+            WHERE embedding_vector IS NOT NULL AND embedding_halfvec IS NULL
+            LIMIT batch_size
+        );
+        GET DIAGNOSTICS batch_rows = ROW_COUNT;
+        EXIT WHEN batch_rows = 0;
+        total_rows := total_rows + batch_rows;
+        COMMIT;
+    END LOOP;
+    RAISE NOTICE '已回填 % 個知識點的量化向量。', total_rows;
+END;
+$$;
+
+CALL backfill_quantized_embeddings(5000);
+DROP PROCEDURE backfill_quantized_embeddings(INTEGER);
+
+-- 4. 量化欄位的 HNSW 索引
+-- 半精度：索引大小約為完整向量的一半，召回率幾乎不變
+CREATE INDEX IF NOT EXISTS idx_knowledge_points_embedding_halfvec_hnsw
+ON knowledge_points USING hnsw (embedding_halfvec halfvec_cosine_ops)
+WITH (m = 16, ef_construction = 64);
+
+-- 二元量化：每個維度 1 bit，以漢明距離粗篩後需要較多候選再重新排序
+CREATE INDEX IF NOT EXISTS idx_knowledge_points_embedding_binary_hnsw
+ON knowledge_points USING hnsw (embedding_binary bit_hamming_ops)
+WITH (m = 16, ef_construction = 64);
+
+-- 完成訊息
+DO $$
+BEGIN
+    RAISE NOTICE '=== 向量量化儲存遷移完成 ===';
+    RAISE NOTICE '設定 VECTOR_STORAGE_MODE=halfvec 或 binary 後重新啟動服務即可切換。';
+    RAISE NOTICE '確認切換後，可以刪除未使用的索引以釋放記憶體，例如:';
+    RAISE NOTICE '  DROP INDEX idx_knowledge_points_embedding_hnsw;';
+    RAISE NOTICE '  DROP INDEX idx_knowledge_points_embedding_binary_hnsw;';
+END $$;
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# fit_review_scheduler.py
+# 依 learning_events 的複習紀錄擬合各用戶的複習排程（FSRS）參數
+#
+#   python fit_review_scheduler.py [--user-id N] [--min-reviews 50] [--dry-run]
+#
+# 只有擬合後的對數損失低於預設參數時才會儲存到 review_scheduler_params，
+# 之後該用戶的複習排程自動使用擬合的參數。建議每週或每月以排程工作執行一次。
+
+import os
+import sys
+import argparse
+import logging
+
+# 設定路徑以便匯入模組
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import database as db
+from app.services import review_scheduler
+
+# 設定日誌
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+def main():
+    parser = argparse.ArgumentParser(description="複習排程參數擬合")
+    parser.add_argument('--user-id', type=int, help="只擬合該用戶（預設為所有複習紀錄足夠的用戶）")
+    parser.add_argument('--min-reviews', type=int, default=review_scheduler.MIN_FIT_REVIEWS,
+                        help="擬合所需的最少複習次數")
+    parser.add_argument('--dry-run', action='store_true', help="只顯示結果，不儲存")
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        print("❌ 錯誤: 未設定 DATABASE_URL 環境變數")
+        sys.exit(1)
+    db.init_app(None)
+
+    if args.user_id:
+        results = [review_scheduler.fit_user_parameters(
+            args.user_id, save=not args.dry_run, min_reviews=args.min_reviews
+        )]
+    else:
+        results = review_scheduler.fit_all_users(min_reviews=args.min_reviews, save=not args.dry_run)
+
+    if not results:
+        print("沒有複習紀錄足夠的用戶")
+        return
+
+    print(f"\n📊 擬合結果:")
+    print(f"   {'用戶':>6} {'複習數':>8} {'預設損失':>10} {'擬合損失':>10} {'已儲存':>6}")
+    for result in results:
+        if result['log_loss'] is None:
+            print(f"   {result['user_id']:>6} {result['reviews']:>8} {'(紀錄不足)':>10}")
+            continue
+        print(f"   {result['user_id']:>6} {result['reviews']:>8} {result['default_log_loss']:>10.4f} "
+              f"{result['log_loss']:>10.4f} {'是' if result['saved'] else '否':>6}")
+    if args.dry_run:
+        print("   (--dry-run，未儲存)")
+
+if __name__ == "__main__":
+    main()
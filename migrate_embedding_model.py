@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# migrate_embedding_model.py
+# 向量模型遷移：登記新模型、在背景重新向量化、涵蓋所有知識點後切換
+#
+#   python migrate_embedding_model.py start <模型名稱> [--dimension N]
+#   python migrate_embedding_model.py status
+#   python migrate_embedding_model.py run [--batch-size N] [--max-rate R] [--no-cutover]
+#   python migrate_embedding_model.py cutover
+#   python migrate_embedding_model.py abort
+#
+# 服務運行中時，背景執行緒（embedding_refresh）也會分段推進遷移；
+# 這個腳本適合在離峰時段以較高的速度一次完成。
+
+import os
+import sys
+import argparse
+import logging
+
+# 設定路徑以便匯入模組
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import database as db
+from app.services import embedding_migration as migration
+
+# 設定日誌
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+def print_status():
+    status = migration.get_migration_status()
+    print(f"📊 使用中的模型: {status['active_model']} ({status['active_dimension']} 維)")
+    if not status['target_model']:
+        print("   沒有進行中的遷移")
+        return
+    print(f"   遷移目標: {status['target_model']} ({status['target_dimension']} 維)")
+    print(f"   進度: {status['migrated']}/{status['total']} ({status['coverage']:.1%})，掃描位置 ID > {status['checkpoint']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="向量模型遷移")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    start_parser = subparsers.add_parser('start', help="開始遷移到新模型")
+    start_parser.add_argument('model', help="新模型名稱")
+    start_parser.add_argument('--dimension', type=int, help="向量維度（預設載入模型後自動判斷）")
+
+    subparsers.add_parser('status', help="查看遷移進度")
+
+    run_parser = subparsers.add_parser('run', help="推進遷移直到完成")
+    run_parser.add_argument('--batch-size', type=int, default=migration.MIGRATION_BATCH_SIZE)
+    run_parser.add_argument('--max-rate', type=float, default=migration.MIGRATION_MAX_RATE,
+                            help="每秒最多重新向量化的知識點數（0 = 不限制）")
+    run_parser.add_argument('--no-cutover', action='store_true', help="完成後不自動切換")
+
+    subparsers.add_parser('cutover', help="立即切換（新向量需涵蓋所有知識點）")
+    subparsers.add_parser('abort', help="取消遷移並刪除已生成的新向量")
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        print("❌ 錯誤: 未設定 DATABASE_URL 環境變數")
+        sys.exit(1)
+    db.init_app(None)
+
+    if args.command == 'start':
+        migration.start_migration(args.model, args.dimension)
+        print_status()
+    elif args.command == 'status':
+        print_status()
+    elif args.command == 'run':
+        while True:
+            result = migration.run_migration(
+                batch_size=args.batch_size, max_rate=args.max_rate, auto_cutover=not args.no_cutover
+            )
+            if result['skipped']:
+                print("⚠️ 另一個程序正在執行遷移")
+                break
+            print(f"   本輪掃描 {result['scanned']} 個、重新向量化 {result['embedded']} 個知識點")
+            # 本輪有重新向量化時再掃描一輪，確認期間沒有新的修改
+            if result['cutover'] or not result['embedded'] or args.no_cutover:
+                break
+        print_status()
+    elif args.command == 'cutover':
+        result = migration.cutover()
+        if result['cutover']:
+            print(f"✅ 已切換到 {result['model']}，請重新啟動向量服務並重建語義關聯與主題群組")
+        else:
+            print(f"❌ 無法切換: 仍有 {result['stale']} 個知識點沒有最新的新向量")
+    elif args.command == 'abort':
+        print("✅ 已取消遷移" if migration.abort_migration() else "沒有進行中的遷移")
+
+if __name__ == "__main__":
+    main()
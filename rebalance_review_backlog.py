@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# rebalance_review_backlog.py
+# 把積壓的到期知識點與單字分散到接下來的幾天（每晚以排程工作執行）
+#
+#   python rebalance_review_backlog.py [--user-id N] [--daily-cap 30] [--vocabulary-cap 50] [--skip-vocabulary] [--dry-run]
+#
+# 例如 crontab（台北時間每天 03:00）：
+#   0 19 * * * cd /path/to/ai-tutor && python rebalance_review_backlog.py
+
+import os
+import sys
+import argparse
+import logging
+
+# 設定路徑以便匯入模組
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import database as db
+from app.services import backlog_rebalancer
+
+# 設定日誌
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+def print_schedule(schedule):
+    for day, count in schedule.items():
+        print(f"     {day}: {count}")
+
+def main():
+    parser = argparse.ArgumentParser(description="複習積壓重新排程")
+    parser.add_argument('--user-id', type=int, help="只處理該用戶的知識點（預設為所有積壓超過上限的用戶與單字庫）")
+    parser.add_argument('--daily-cap', type=int, default=backlog_rebalancer.REVIEW_DAILY_CAP,
+                        help="每位用戶每天最多的知識點複習數")
+    parser.add_argument('--vocabulary-cap', type=int, default=backlog_rebalancer.VOCABULARY_DAILY_CAP,
+                        help="每天最多的單字複習數")
+    parser.add_argument('--skip-vocabulary', action='store_true', help="不處理單字")
+    parser.add_argument('--dry-run', action='store_true', help="只顯示結果，不儲存")
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        print("❌ 錯誤: 未設定 DATABASE_URL 環境變數")
+        sys.exit(1)
+    db.init_app(None)
+
+    if args.user_id:
+        result = backlog_rebalancer.rebalance_user_backlog(args.user_id, args.daily_cap, dry_run=args.dry_run)
+        print(f"\n📊 用戶 {args.user_id}: 到期 {result['backlog']} 個，延後 {result['rescheduled']} 個")
+        print_schedule(result['schedule'])
+    else:
+        summary = backlog_rebalancer.rebalance_all_backlogs(
+            daily_cap=args.daily_cap,
+            vocabulary_daily_cap=None if args.skip_vocabulary else args.vocabulary_cap,
+            dry_run=args.dry_run
+        )
+        print(f"\n📊 重新排程結果:")
+        print(f"   {'用戶':>6} {'到期數':>8} {'延後數':>8} {'排到':>12}")
+        for result in summary['users']:
+            print(f"   {result['user_id']:>6} {result['backlog']:>8} {result['rescheduled']:>8} {result['last_day'] or '-':>12}")
+        if not summary['users']:
+            print("   沒有積壓超過上限的用戶")
+        vocabulary = summary['vocabulary']
+        if vocabulary:
+            print(f"\n   單字: 到期 {vocabulary['backlog']} 個，延後 {vocabulary['rescheduled']} 個")
+            print_schedule(vocabulary['schedule'])
+
+    if args.dry_run:
+        print("   (--dry-run，未儲存)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# test_graph_analytics.py
+# 測試知識點網絡的圖指標計算（不需要資料庫）
+
+import os
+import sys
+import numpy as np
+
+# 設定路徑以便匯入模組
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.graph_analytics import build_adjacency, pagerank, approximate_betweenness, compute_graph_metrics
+
+try:
+    import networkx as nx
+except ImportError:
+    nx = None
+
+def _edges(pairs, weights=None):
+    sources = np.array([a for a, _ in pairs], dtype=np.int64)
+    targets = np.array([b for _, b in pairs], dtype=np.int64)
+    weights = np.ones(len(pairs)) if weights is None else np.asarray(weights, dtype=np.float64)
+    return sources, targets, weights
+
+def _random_graph(n=60, edges=150, seed=7):
+    """隨機的加權無向圖（不含自我關聯與重複的邊）"""
+    rng = np.random.default_rng(seed)
+    pairs = set()
+    while len(pairs) < edges:
+        a, b = rng.integers(0, n, 2)
+        if a != b:
+            pairs.add((min(a, b), max(a, b)))
+    pairs = sorted(pairs)
+    return pairs, rng.uniform(0.5, 1.0, len(pairs))
+
+def test_path_betweenness():
+    """路徑 0-1-2-3-4：樣本數不少於節點數時為精確值"""
+    sources, targets, weights = _edges([(0, 1), (1, 2), (2, 3), (3, 4)])
+    centrality = approximate_betweenness(build_adjacency(5, sources, targets, weights), samples=5)
+    assert np.allclose(centrality, [0.0, 0.5, 4 / 6, 0.5, 0.0])
+
+def test_star_betweenness():
+    """星狀圖：中心節點在所有最短路徑上，葉節點為 0"""
+    sources, targets, weights = _edges([(0, leaf) for leaf in range(1, 6)])
+    centrality = approximate_betweenness(build_adjacency(6, sources, targets, weights), samples=6)
+    assert np.allclose(centrality, [1.0, 0, 0, 0, 0, 0])
+
+def test_pagerank_symmetric_cycle():
+    """環狀圖的每個節點對稱，PageRank 相同且總和為 1"""
+    sources, targets, weights = _edges([(i, (i + 1) % 6) for i in range(6)])
+    rank = pagerank(build_adjacency(6, sources, targets, weights))
+    assert np.allclose(rank, 1 / 6)
+
+def test_components_and_degrees():
+    """兩個分量：較大的分量編號為 0；孤立節點自成一個分量"""
+    sources, targets, weights = _edges([(0, 1), (1, 2), (3, 4)], [0.9, 0.8, 0.7])
+    metrics = compute_graph_metrics(6, sources, targets, weights)
+    assert metrics['component_id'].tolist() == [0, 0, 0, 1, 1, 2]
+    assert metrics['component_size'].tolist() == [3, 3, 3, 2, 2, 1]
+    assert metrics['degree'].tolist() == [1, 2, 1, 1, 1, 0]
+    assert np.allclose(metrics['weighted_degree'], [0.9, 1.7, 0.8, 0.7, 0.7, 0.0])
+    assert np.isclose(metrics['pagerank'].sum(), 1.0)
+
+def test_pagerank_matches_networkx():
+    """加權 PageRank 與 networkx 一致（包含沒有關聯的節點）"""
+    if nx is None:
+        print("   ⚠️ 未安裝 networkx，略過")
+        return
+    pairs, weights = _random_graph()
+    n = 62   # 最後兩個節點沒有關聯
+    sources, targets, weights = _edges(pairs, weights)
+    rank = pagerank(build_adjacency(n, sources, targets, weights))
+
+    graph = nx.Graph()
+    graph.add_nodes_from(range(n))
+    graph.add_weighted_edges_from(zip(sources.tolist(), targets.tolist(), weights.tolist()))
+    expected = nx.pagerank(graph, alpha=0.85, weight='weight', tol=1e-12)
+    assert np.allclose(rank, [expected[i] for i in range(n)], atol=1e-8)
+
+def test_betweenness_matches_networkx():
+    """樣本數不少於節點數時，介數中心性與 networkx 的精確值（不加權、正規化）一致"""
+    if nx is None:
+        print("   ⚠️ 未安裝 networkx，略過")
+        return
+    pairs, weights = _random_graph()
+    sources, targets, weights = _edges(pairs, weights)
+    centrality = approximate_betweenness(build_adjacency(60, sources, targets, weights), samples=60)
+
+    graph = nx.Graph()
+    graph.add_nodes_from(range(60))
+    graph.add_edges_from(pairs)
+    expected = nx.betweenness_centrality(graph, normalized=True)
+    assert np.allclose(centrality, [expected[i] for i in range(60)], atol=1e-9)
+
+def test_sampled_betweenness_close_to_exact():
+    """抽樣估計與精確值的排序大致一致"""
+    pairs, weights = _random_graph(n=200, edges=600, seed=3)
+    sources, targets, weights = _edges(pairs, weights)
+    adjacency = build_adjacency(200, sources, targets, weights)
+    exact = approximate_betweenness(adjacency, samples=200)
+    sampled = approximate_betweenness(adjacency, samples=100, seed=1)
+    assert np.corrcoef(exact, sampled)[0, 1] > 0.9
+
+if __name__ == "__main__":
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_') and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
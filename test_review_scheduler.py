@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# test_review_scheduler.py
+# 測試 FSRS v4.5 複習排程的記憶模型（不需要資料庫）
+
+import os
+import sys
+import math
+import datetime
+import numpy as np
+
+# 設定路徑以便匯入模組
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services import review_scheduler as rs
+
+W = rs.DEFAULT_WEIGHTS.tolist()
+START = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+# ---------------------------------------------------------------------------
+# 依 FSRS v4.5 公式逐項寫出的參考實作（純量）
+# ---------------------------------------------------------------------------
+
+def _reference_d0(grade):
+    return min(max(W[4] - (grade - 3) * W[5], 1.0), 10.0)
+
+def _reference_difficulty(difficulty, grade):
+    updated = difficulty - W[6] * (grade - 3)
+    return min(max(W[7] * _reference_d0(3) + (1 - W[7]) * updated, 1.0), 10.0)
+
+def _reference_stability(stability, difficulty, elapsed, grade):
+    recall = (1 + 19 / 81 * elapsed / stability) ** -0.5
+    if grade == 1:
+        lapse = W[11] * difficulty ** -W[12] * ((stability + 1) ** W[13] - 1) * math.exp(W[14] * (1 - recall))
+        return min(lapse, stability)
+    factor = math.exp(W[8]) * (11 - difficulty) * stability ** -W[9] * (math.exp(W[10] * (1 - recall)) - 1)
+    factor *= W[15] if grade == 2 else W[16] if grade == 4 else 1.0
+    return stability * (1 + factor)
+
+def _review_sequence(grades):
+    """每次都在排定的日期複習，回傳每次複習後的狀態"""
+    point = {'memory_stability': None, 'memory_difficulty': None, 'last_reviewed_on': None, 'mastery_level': 0.0}
+    reviewed_at = START
+    states = []
+    for grade in grades:
+        state = rs.schedule_review(point, grade, reviewed_at=reviewed_at)
+        states.append(state)
+        point = {
+            'memory_stability': state['memory_stability'],
+            'memory_difficulty': state['memory_difficulty'],
+            'last_reviewed_on': reviewed_at,
+            'mastery_level': state['mastery_level']
+        }
+        reviewed_at += datetime.timedelta(days=state['interval_days'])
+    return states
+
+def test_initial_difficulty():
+    """D0(G) = w4 - (G - 3)·w5"""
+    expected = [7.6214, 6.3916, 5.1618, 3.932]
+    for grade, value in zip(range(1, 5), expected):
+        assert math.isclose(float(rs.initial_difficulty(grade)), value, abs_tol=1e-9)
+
+def test_first_review_intervals():
+    """第一次學習的間隔即初始穩定度 w0–w3（目標保留率 0.9）"""
+    intervals = [_review_sequence([grade])[0]['interval_days'] for grade in range(1, 5)]
+    assert intervals == [1, 1, 4, 14]
+
+def test_consecutive_good_intervals():
+    """連續評為良好：FSRS v4.5 預設參數的參考間隔約為 4/15/49/146 天，難度維持在 D0(3)"""
+    states = _review_sequence([3, 3, 3, 3])
+    assert [state['interval_days'] for state in states] == [4, 15, 49, 146]
+    assert all(math.isclose(state['memory_difficulty'], W[4]) for state in states)
+
+def test_next_review_date_uses_taipei_day():
+    """下次複習日期以台北日期起算：UTC 晚上八點已是台北的隔天"""
+    reviewed_at = datetime.datetime(2026, 1, 1, 20, 0, tzinfo=datetime.timezone.utc)
+    state = rs.schedule_review({'memory_stability': None, 'last_reviewed_on': None}, 3, reviewed_at=reviewed_at)
+    assert state['next_review_date'] == datetime.date(2026, 1, 2) + datetime.timedelta(days=state['interval_days'])
+
+def test_mean_reversion_toward_good():
+    """困難與容易的評分讓難度往相反方向移動，並往 D0(3) 回歸"""
+    assert math.isclose(float(rs.next_difficulty(W[4], 1)), _reference_difficulty(W[4], 1))
+    assert float(rs.next_difficulty(W[4], 1)) > W[4] > float(rs.next_difficulty(W[4], 4))
+    # 持續評為良好時，偏高的難度逐漸回到 D0(3)
+    difficulty = 9.0
+    for _ in range(200):
+        difficulty = float(rs.next_difficulty(difficulty, 3))
+    assert math.isclose(difficulty, W[4], abs_tol=1e-2)
+
+def test_mixed_sequence_matches_reference():
+    """混合評分的序列與參考實作逐步一致"""
+    grades = [3, 3, 1, 2, 3, 4, 3]
+    states = _review_sequence(grades)
+
+    stability, difficulty = W[2], _reference_d0(3)
+    assert math.isclose(states[0]['memory_stability'], stability)
+    for grade, previous, state in zip(grades[1:], states, states[1:]):
+        stability = _reference_stability(stability, difficulty, previous['interval_days'], grade)
+        difficulty = _reference_difficulty(difficulty, grade)
+        assert math.isclose(state['memory_stability'], stability, rel_tol=1e-9)
+        assert math.isclose(state['memory_difficulty'], difficulty, rel_tol=1e-9)
+
+def test_batch_loss_uses_same_model():
+    """擬合使用的向量化計算（多組參數）與單組參數的結果一致"""
+    grades = np.array([[3, 3, 1, 3], [4, 3, 3, 0]])
+    elapsed = np.array([[0.0, 4.0, 15.0, 2.0], [0.0, 14.0, 40.0, 0.0]])
+    single = rs.batch_log_loss(rs.DEFAULT_WEIGHTS[None, :], grades, elapsed)
+    stacked = rs.batch_log_loss(np.stack([rs.DEFAULT_WEIGHTS, rs.DEFAULT_WEIGHTS]), grades, elapsed)
+    assert np.allclose(stacked, single[0])
+
+    # 逐步以純量參考實作計算同一個對數損失
+    losses = []
+    for row_grades, row_elapsed in zip(grades, elapsed):
+        stability, difficulty = W[row_grades[0] - 1], _reference_d0(row_grades[0])
+        for grade, days in zip(row_grades[1:], row_elapsed[1:]):
+            if grade == 0:
+                break
+            recall = (1 + 19 / 81 * days / stability) ** -0.5
+            losses.append(-math.log(recall) if grade > 1 else -math.log(1 - recall))
+            stability = _reference_stability(stability, difficulty, days, grade)
+            difficulty = _reference_difficulty(difficulty, grade)
+    assert math.isclose(float(single[0]), sum(losses) / len(losses), rel_tol=1e-9)
+
+if __name__ == "__main__":
+    tests = [value for name, value in sorted(globals().items()) if name.startswith('test_') and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)